@@ -0,0 +1,121 @@
+"""
+Pub/sub backplane for fanning WebSocket broadcasts out across workers and hosts
+"""
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Called with (channel, message) for every message published on the backplane
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+
+class Backplane:
+    """Base class - publishes serialized messages and delivers them to every subscribed worker"""
+
+    async def start(self, handler: MessageHandler):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+
+class InMemoryBroker:
+    """In-process broker shared by several InMemoryBackplane instances (one per simulated worker)"""
+
+    def __init__(self):
+        self.subscribers: List[MessageHandler] = []
+
+    async def publish(self, channel: str, message: str):
+        for handler in list(self.subscribers):
+            try:
+                await handler(channel, message)
+            except Exception as e:
+                logger.error(f"Error delivering backplane message on {channel}: {e}")
+
+
+class InMemoryBackplane(Backplane):
+    """Backplane for a single worker, or for tests when several workers share one broker"""
+
+    def __init__(self, broker: Optional[InMemoryBroker] = None):
+        self.broker = broker or InMemoryBroker()
+        self._handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+        self.broker.subscribers.append(handler)
+
+    async def stop(self):
+        if self._handler in self.broker.subscribers:
+            self.broker.subscribers.remove(self._handler)
+        self._handler = None
+
+    async def publish(self, channel: str, message: str):
+        await self.broker.publish(channel, message)
+
+
+class RedisBackplane(Backplane):
+    """Redis pub/sub backplane - every worker pattern-subscribes to the shared channel prefix"""
+
+    RECONNECT_DELAY_SECONDS = 2.0
+
+    def __init__(self, url: str, prefix: str = "fleet-ws"):
+        # Lazy import so single-worker deployments don't need redis installed
+        import redis.asyncio as aioredis
+
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        self._task = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: MessageHandler):
+        pattern = f"{self.prefix}:*"
+        strip = len(self.prefix) + 1
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(pattern)
+                logger.info(f"Backplane subscribed to {pattern}")
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    try:
+                        await handler(item["channel"][strip:], item["data"])
+                    except Exception as e:
+                        logger.error(f"Error handling backplane message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane connection lost, reconnecting: {e}")
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._redis.aclose()
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(f"{self.prefix}:{channel}", message)
+
+
+def create_backplane(url: Optional[str] = None) -> Backplane:
+    """Build a backplane from a URL - redis://... for multi-worker, empty or memory:// for in-process"""
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    return InMemoryBackplane()
@@ -0,0 +1,62 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from typing import List
+
+from models import Booking
+from serialization import dumps, model_views
+
+BOOKING_COUNT = 10_000
+ROUNDS = 3
+
+def booking_doc(i):
+    created = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i)
+    return {
+        "id": str(uuid.uuid4()),
+        "order_number": f"ORD-{i:08d}",
+        "equipment_id": str(uuid.uuid4()),
+        "requester_id": "requester-1",
+        "equipment_owner_id": "owner-1",
+        "start_date": created,
+        "end_date": created + timedelta(days=2),
+        "pickup_location": "Dallas, TX",
+        "delivery_location": "Houston, TX",
+        "notes": "Liftgate required",
+        "total_cost": 1250.0 + i,
+        "status": "pending",
+        "created_at": created,
+    }
+
+def best_of(fn):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def run_benchmark():
+    docs = [booking_doc(i) for i in range(BOOKING_COUNT)]
+    adapter = TypeAdapter(List[Booking])
+
+    def before():
+        # Booking(**doc) per row, then what FastAPI does with response_model=List[Booking]:
+        # re-validate, serialize to JSON-compatible python, render with stdlib json
+        bookings = [Booking(**doc) for doc in docs]
+        validated = adapter.validate_python(bookings, from_attributes=True)
+        JSONResponse(adapter.dump_python(validated, mode="json")).body
+
+    def after():
+        dumps(model_views(Booking, docs))
+
+    before_seconds = best_of(before)
+    after_seconds = best_of(after)
+    print(f"✓ Before (validate + re-validate + json): {before_seconds * 1000:.0f} ms")
+    print(f"✓ After (model_views + orjson): {after_seconds * 1000:.0f} ms")
+    print(f"\n✓ {before_seconds / after_seconds:.1f}x faster for {BOOKING_COUNT} bookings")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,411 @@
+"""
+Content-addressed blob storage for uploaded files (load documents, receipts, company files)
+
+Blobs are raw bytes keyed by their SHA-256, so identical uploads are stored once and Mongo
+documents only carry metadata plus the hash.
+"""
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from typing import AsyncIterator, Optional, Tuple
+from pathlib import Path
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import urllib.parse
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_BLOB_DIR = os.environ.get("BLOB_STORE_DIR", str(ROOT_DIR / "blob_data"))
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobInfo(BaseModel):
+    sha256: str
+    size: int
+    # False when identical content was already stored - the blob may belong to other records too
+    created: bool = False
+
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and bool(SHA256_PATTERN.match(value))
+
+
+async def upload_chunks(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Read a FastAPI UploadFile in chunks instead of all at once"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+class BlobStore:
+    """Base class - subclasses implement put_stream, open, size and delete"""
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> BlobInfo:
+        """Store a stream of bytes, hashing as it goes - raises BlobTooLarge past max_bytes"""
+        raise NotImplementedError
+
+    async def put_bytes(self, data: bytes) -> BlobInfo:
+        return await self.put_stream(_single_chunk(data))
+
+    def open(self, sha256: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Async iterator over a blob's bytes (or a slice of them) - raises BlobNotFound on first read"""
+        raise NotImplementedError
+
+    async def size(self, sha256: str) -> Optional[int]:
+        """Blob size in bytes, or None if it isn't stored"""
+        raise NotImplementedError
+
+    async def exists(self, sha256: str) -> bool:
+        return await self.size(sha256) is not None
+
+    async def delete(self, sha256: str):
+        raise NotImplementedError
+
+    async def read(self, sha256: str) -> bytes:
+        """Whole blob in memory - only for small files or callers that need all the bytes anyway"""
+        return b"".join([chunk async for chunk in self.open(sha256)])
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/ab/cd/<sha256> - writes go to a temp file and are renamed into place"""
+
+    def __init__(self, root: str = DEFAULT_BLOB_DIR):
+        self.root = Path(root)
+
+    def _path(self, sha256: str) -> Path:
+        if not is_sha256(sha256):
+            raise BlobNotFound(sha256)
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> BlobInfo:
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(f"Upload exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+
+            sha256 = hasher.hexdigest()
+            path = self._path(sha256)
+            created = not path.exists()
+            if created:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, path)
+            else:
+                os.unlink(tmp_path)
+            return BlobInfo(sha256=sha256, size=size, created=created)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    async def open(self, sha256: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        try:
+            f = await asyncio.to_thread(open, self._path(sha256), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(sha256)
+        try:
+            if start:
+                f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                n = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                data = await asyncio.to_thread(f.read, n)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+        finally:
+            f.close()
+
+    async def size(self, sha256: str) -> Optional[int]:
+        try:
+            return self._path(sha256).stat().st_size
+        except (FileNotFoundError, BlobNotFound):
+            return None
+
+    async def delete(self, sha256: str):
+        try:
+            self._path(sha256).unlink()
+        except (FileNotFoundError, BlobNotFound):
+            pass
+
+
+class GridFSBlobStore(BlobStore):
+    """Blobs in a GridFS bucket, one file per hash (filename = sha256)"""
+
+    def __init__(self, db, bucket_name: str = "blobs"):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        self.files = db[f"{bucket_name}.files"]
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> BlobInfo:
+        # The hash is only known at the end, so upload under a temp name and rename (or drop a duplicate)
+        grid_in = self.bucket.open_upload_stream(f"tmp-{uuid.uuid4()}")
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await grid_in.write(chunk)
+            await grid_in.close()
+        except BaseException:
+            await grid_in.abort()
+            raise
+
+        sha256 = hasher.hexdigest()
+        created = not await self.files.find_one({"filename": sha256}, {"_id": 1})
+        if created:
+            await self.bucket.rename(grid_in._id, sha256)
+        else:
+            await self.bucket.delete(grid_in._id)
+        return BlobInfo(sha256=sha256, size=size, created=created)
+
+    async def open(self, sha256: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        from gridfs.errors import NoFile
+
+        try:
+            grid_out = await self.bucket.open_download_stream_by_name(sha256)
+        except NoFile:
+            raise BlobNotFound(sha256)
+        if start:
+            grid_out.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            data = await grid_out.read(n)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    async def size(self, sha256: str) -> Optional[int]:
+        doc = await self.files.find_one({"filename": sha256}, {"length": 1})
+        return doc["length"] if doc else None
+
+    async def delete(self, sha256: str):
+        async for doc in self.files.find({"filename": sha256}, {"_id": 1}):
+            await self.bucket.delete(doc["_id"])
+
+
+class S3BlobStore(BlobStore):
+    """Blobs in an S3-compatible bucket (AWS, or MinIO via S3_ENDPOINT_URL) - boto3 calls run in threads"""
+
+    # Uploads are hashed into a spooled temp file first - kept in memory up to this size, then on disk
+    SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", endpoint_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, sha256: str) -> str:
+        if not is_sha256(sha256):
+            raise BlobNotFound(sha256)
+        return f"{self.prefix}{sha256}"
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], max_bytes: Optional[int] = None) -> BlobInfo:
+        hasher = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MAX_BYTES) as spool:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+
+            sha256 = hasher.hexdigest()
+            created = await self.size(sha256) is None
+            if created:
+                spool.seek(0)
+                await asyncio.to_thread(self.client.upload_fileobj, spool, self.bucket, self._key(sha256))
+        return BlobInfo(sha256=sha256, size=size, created=created)
+
+    async def open(self, sha256: str, start: int = 0, length: Optional[int] = None) -> AsyncIterator[bytes]:
+        from botocore.exceptions import ClientError
+
+        params = {"Bucket": self.bucket, "Key": self._key(sha256)}
+        if start or length is not None:
+            end = "" if length is None else str(start + length - 1)
+            params["Range"] = f"bytes={start}-{end}"
+        try:
+            response = await asyncio.to_thread(self.client.get_object, **params)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise BlobNotFound(sha256)
+            raise
+        body = response["Body"]
+        try:
+            while True:
+                data = await asyncio.to_thread(body.read, CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            body.close()
+
+    async def size(self, sha256: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(sha256))
+        except BlobNotFound:
+            return None
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    async def delete(self, sha256: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(sha256))
+
+
+def create_blob_store(url: Optional[str] = None) -> BlobStore:
+    """
+    Build a blob store from a URL:
+    file:///var/lib/blobs (default: BLOB_STORE_DIR), gridfs://bucket, s3://bucket/prefix (S3_ENDPOINT_URL for MinIO)
+    """
+    if url and url.startswith("gridfs://"):
+        from database import db
+
+        return GridFSBlobStore(db, url[len("gridfs://"):] or "blobs")
+    if url and url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        prefix = prefix.rstrip("/") + "/" if prefix else "blobs/"
+        return S3BlobStore(bucket, prefix, endpoint_url=os.environ.get("S3_ENDPOINT_URL"))
+    if url and url.startswith("file://"):
+        return LocalBlobStore(url[len("file://"):])
+    return LocalBlobStore()
+
+
+# Shared store for the app - set BLOB_STORE_URL to switch backends
+blob_store = create_blob_store(os.environ.get("BLOB_STORE_URL"))
+
+# Blobs never change under a hash, but access is per-user - let the browser keep them, not shared caches
+BLOB_CACHE_CONTROL = "private, max-age=86400"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single 'bytes=' Range header into an inclusive (start, end).
+    Returns None to serve the whole body (no header, or multiple ranges); raises ValueError if unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range - the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def content_disposition(filename: str, disposition: str = "inline") -> str:
+    """
+    Content-Disposition for any filename - headers are latin-1, so non-ASCII names (e.g. "收据.jpg") go in
+    filename* (RFC 5987) with an ASCII fallback in filename for old clients
+    """
+    fallback = "".join(c for c in filename.encode("ascii", "replace").decode("ascii") if c.isprintable() and c not in '"\\')
+    value = f'{disposition}; filename="{fallback}"'
+    if fallback != filename:
+        value += f"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+    return value
+
+
+async def blob_response(
+    request: Request,
+    sha256: str,
+    content_type: str,
+    filename: Optional[str] = None,
+    store: Optional[BlobStore] = None
+) -> Response:
+    """Stream a blob with ETag/If-None-Match, single-range Range/If-Range and Cache-Control support"""
+    store = store or blob_store
+    size = await store.size(sha256)
+    if size is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Cache-Control": BLOB_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # If-Range: only honour the range if the client's copy is still current
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range") if not if_range or if_range == etag else None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(store.open(sha256), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        store.open(sha256, start=start, length=end - start + 1),
+        status_code=206,
+        media_type=content_type,
+        headers=headers
+    )
+
@@ -0,0 +1,249 @@
+"""
+Carrier authority monitoring - re-checks every carrier on an active booking against FMCSA
+
+Carriers are registered in carrier_watch from the bookings' carrier_dot_number/carrier_mc_number. Each
+one is re-checked every CARRIER_MONITOR_INTERVAL_SECONDS: workers claim due carriers with a conditional
+update (so a carrier is checked by one worker per cycle), look them up through the shared FMCSA client -
+which reuses a recent cache entry and otherwise revalidates with a conditional request under its rate
+limiter - and diff the parse_carrier_full snapshot against the stored one. Only changes to the watched
+fields raise a carrier_alerts entry and a push to the users on the affected bookings.
+"""
+from fastapi import HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+from database import db
+from fmcsa_client import parse_carrier_full
+from carrier_vetting import BASIC_THRESHOLDS, carrier_payload, parse_identifiers
+from load_messaging import publish
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CARRIER_MONITOR_ENABLED = os.environ.get("CARRIER_MONITOR_ENABLED", "true").lower() == "true"
+# How often each carrier is re-checked, and how old a cached FMCSA answer may be to count as a check
+CARRIER_MONITOR_INTERVAL_SECONDS = int(os.environ.get("CARRIER_MONITOR_INTERVAL_SECONDS", 6 * 3600))
+CARRIER_MONITOR_MAX_AGE_SECONDS = int(os.environ.get("CARRIER_MONITOR_MAX_AGE_SECONDS", 3600))
+# The scheduler wakes up this often and checks at most CARRIER_MONITOR_BATCH_SIZE due carriers per tick
+CARRIER_MONITOR_TICK_SECONDS = 60
+CARRIER_MONITOR_BATCH_SIZE = int(os.environ.get("CARRIER_MONITOR_BATCH_SIZE", 200))
+CARRIER_MONITOR_CONCURRENCY = 4
+# Active bookings are re-scanned for new carriers this often
+CARRIER_DISCOVERY_SECONDS = 15 * 60
+
+ACTIVE_BOOKING_STATUSES = ["pending", "planned", "in_transit_pickup", "at_pickup", "in_transit_delivery", "at_delivery"]
+
+SEVERITY_CRITICAL = "critical"
+SEVERITY_WARNING = "warning"
+
+# Snapshot fields that raise an alert when they change
+WATCHED_FIELDS = {
+    "found": SEVERITY_CRITICAL,
+    "allow_to_operate": SEVERITY_CRITICAL,
+    "out_of_service": SEVERITY_CRITICAL,
+    "operating_status": SEVERITY_CRITICAL,
+    "common_authority": SEVERITY_CRITICAL,
+    "contract_authority": SEVERITY_CRITICAL,
+    "broker_authority": SEVERITY_CRITICAL,
+    "insurance_bipd": SEVERITY_WARNING,
+    "insurance_cargo": SEVERITY_WARNING,
+    "safety_rating": SEVERITY_WARNING,
+    **{field: SEVERITY_WARNING for field in BASIC_THRESHOLDS},
+}
+
+
+def carrier_snapshot(payload: Optional[dict]) -> dict:
+    """What is stored and compared per check - the parse_carrier_full fields, or found=False"""
+    if payload is None:
+        return {"found": False}
+    return {"found": True, **parse_carrier_full(payload).dict(exclude_none=True)}
+
+
+def diff_snapshots(before: Optional[dict], after: dict) -> List[dict]:
+    """Watched fields that changed - the first snapshot of a carrier is a baseline, not a change"""
+    if before is None:
+        return []
+    changes = []
+    for field, severity in WATCHED_FIELDS.items():
+        if before.get(field) != after.get(field):
+            changes.append({"field": field, "before": before.get(field), "after": after.get(field), "severity": severity})
+    return changes
+
+
+async def active_carriers() -> Dict[str, dict]:
+    """Carriers on active bookings keyed like the FMCSA cache ("dot:123", "mc:456"), with the raw booking values"""
+    carriers: Dict[str, dict] = {}
+    for field, prefix in [("carrier_dot_number", ""), ("carrier_mc_number", "MC ")]:
+        query = {"status": {"$in": ACTIVE_BOOKING_STATUSES}, field: {"$nin": [None, ""]}}
+        if field == "carrier_mc_number":
+            # Loads that also have a DOT number are already watched by DOT
+            query["carrier_dot_number"] = {"$in": [None, ""]}
+        for value in await db.bookings.distinct(field, query):
+            for kind, number in parse_identifiers([f"{prefix}{value}"]):
+                carrier = carriers.setdefault(f"{kind}:{number}", {"kind": kind, "number": number, "booking_values": {}})
+                carrier["booking_values"].setdefault(field, []).append(value)
+    return carriers
+
+
+async def sync_watchlist(now: Optional[datetime] = None) -> int:
+    """Register carriers newly seen on active bookings and park the ones no longer on any"""
+    now = now or datetime.now(timezone.utc)
+    carriers = await active_carriers()
+    if carriers:
+        await db.carrier_watch.bulk_write([
+            UpdateOne(
+                {"key": key},
+                {
+                    "$set": {**carrier, "active": True},
+                    "$setOnInsert": {"next_check_at": now, "snapshot": None, "created_at": now}
+                },
+                upsert=True
+            )
+            for key, carrier in carriers.items()
+        ], ordered=False)
+    await db.carrier_watch.update_many(
+        {"active": True, "key": {"$nin": list(carriers)}},
+        {"$set": {"active": False}}
+    )
+    return len(carriers)
+
+
+async def claim_due(limit: int, now: Optional[datetime] = None) -> List[dict]:
+    """Due carriers, oldest first - claiming pushes next_check_at out so other workers skip them"""
+    now = now or datetime.now(timezone.utc)
+    claimed = []
+    while len(claimed) < limit:
+        watch = await db.carrier_watch.find_one_and_update(
+            {"active": True, "next_check_at": {"$lte": now}},
+            {"$set": {"next_check_at": now + timedelta(seconds=CARRIER_MONITOR_INTERVAL_SECONDS)}},
+            sort=[("next_check_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not watch:
+            break
+        claimed.append(watch)
+    return claimed
+
+
+async def alert_recipients(watch: dict) -> Tuple[List[str], List[str]]:
+    """(booking ids, user ids) for the active bookings that reference the carrier"""
+    clauses = [{field: {"$in": values}} for field, values in (watch.get("booking_values") or {}).items()]
+    if not clauses:
+        return [], []
+    bookings = await db.bookings.find(
+        {"status": {"$in": ACTIVE_BOOKING_STATUSES}, "$or": clauses},
+        {"_id": 0, "id": 1, "requester_id": 1, "equipment_owner_id": 1}
+    ).to_list(1000)
+    user_ids = [u for b in bookings for u in [b.get("requester_id"), b.get("equipment_owner_id")] if u]
+    return [b["id"] for b in bookings], list(dict.fromkeys(user_ids))
+
+
+async def raise_alert(watch: dict, snapshot: dict, changes: List[dict], now: datetime) -> dict:
+    booking_ids, user_ids = await alert_recipients(watch)
+    alert = {
+        "id": str(uuid.uuid4()),
+        "carrier_key": watch["key"],
+        "dot_number": snapshot.get("dot_number") or (watch["number"] if watch["kind"] == "dot" else None),
+        "mc_number": snapshot.get("mc_number") or (watch["number"] if watch["kind"] == "mc" else None),
+        "legal_name": snapshot.get("legal_name") or (watch.get("snapshot") or {}).get("legal_name"),
+        "severity": SEVERITY_CRITICAL if any(c["severity"] == SEVERITY_CRITICAL for c in changes) else SEVERITY_WARNING,
+        "changes": changes,
+        "booking_ids": booking_ids,
+        "user_ids": user_ids,
+        "acknowledged_by": [],
+        "created_at": now
+    }
+    await db.carrier_alerts.insert_one(dict(alert))
+    await publish(user_ids, "carrier_alert", {k: v for k, v in alert.items() if k not in ("user_ids", "acknowledged_by")})
+    return alert
+
+
+async def check_carrier(watch: dict) -> Optional[dict]:
+    """Re-check one carrier - returns the alert when something watched changed"""
+    now = datetime.now(timezone.utc)
+    try:
+        payload = await carrier_payload(watch["kind"], watch["number"], max_age=CARRIER_MONITOR_MAX_AGE_SECONDS)
+    except HTTPException as e:
+        error = e.detail
+    except Exception as e:
+        logger.error(f"Carrier monitor lookup failed for {watch['key']}: {e}")
+        error = str(e)
+    else:
+        snapshot = carrier_snapshot(payload)
+        changes = diff_snapshots(watch.get("snapshot"), snapshot)
+        update = {"snapshot": snapshot, "checked_at": now, "last_error": None}
+        if changes:
+            update["changed_at"] = now
+        await db.carrier_watch.update_one({"key": watch["key"]}, {"$set": update})
+        if changes:
+            return await raise_alert(watch, snapshot, changes, now)
+        return None
+
+    # Keep the last good snapshot so the next successful check still diffs against it
+    await db.carrier_watch.update_one({"key": watch["key"]}, {"$set": {"last_error": error, "last_error_at": now}})
+    return None
+
+
+class CarrierMonitor:
+    """Background scheduler - one per worker, coordinated through carrier_watch claims"""
+
+    def __init__(
+        self,
+        tick_seconds: float = CARRIER_MONITOR_TICK_SECONDS,
+        batch_size: int = CARRIER_MONITOR_BATCH_SIZE,
+        concurrency: int = CARRIER_MONITOR_CONCURRENCY
+    ):
+        self.tick_seconds = tick_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._synced_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> dict:
+        """One scheduler tick - sync the watchlist when due, then check a batch of due carriers"""
+        now = datetime.now(timezone.utc)
+        if self._synced_at is None or (now - self._synced_at).total_seconds() >= CARRIER_DISCOVERY_SECONDS:
+            await sync_watchlist(now)
+            self._synced_at = now
+
+        claimed = await claim_due(self.batch_size, now)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(watch):
+            async with semaphore:
+                return await check_carrier(watch)
+
+        alerts = [a for a in await asyncio.gather(*[check(w) for w in claimed]) if a]
+        return {"checked": len(claimed), "alerts": len(alerts)}
+
+    async def _run(self):
+        while True:
+            try:
+                stats = await self.run_once()
+                if stats["checked"]:
+                    logger.info(f"Carrier monitor checked {stats['checked']} carriers, {stats['alerts']} alerts")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Carrier monitor tick failed: {e}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+carrier_monitor = CarrierMonitor()
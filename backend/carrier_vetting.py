@@ -0,0 +1,163 @@
+"""
+Bulk carrier vetting against FMCSA
+
+A job takes a list of DOT/MC numbers and looks every carrier up through the cached FMCSA client with
+a fixed pool of workers, so concurrency is bounded and the client's rate limiter paces what actually
+goes upstream. Each carrier is parsed with parse_carrier_full and stored in vetting_results with its
+flags (authority, out-of-service, BASIC alerts); the job document carries progress counters for polling.
+Jobs run on job_runner, whose reaper fails the ones a restart left behind.
+"""
+from fastapi import HTTPException
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from database import db
+from fmcsa_client import fmcsa, clean_mc_number, parse_carrier_full
+from job_runner import create_job, job_reaper, run_job
+import asyncio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+VETTING_CONCURRENCY = int(os.environ.get("VETTING_CONCURRENCY", 8))
+VETTING_MAX_CARRIERS = 5000
+# Results are written, and progress published, this many carriers at a time
+VETTING_FLUSH_SIZE = 50
+# FMCSA throttling and outages are retried with backoff; other errors are reported as-is
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_DELAYS = [1, 4]
+
+# BASIC percentiles at or above these are FMCSA intervention thresholds for general freight carriers
+BASIC_THRESHOLDS = {
+    "unsafe_driving_basic": 65,
+    "hours_of_service_basic": 65,
+    "crash_indicator_basic": 65,
+    "driver_fitness_basic": 80,
+    "controlled_substances_basic": 80,
+    "vehicle_maintenance_basic": 80,
+    "hazmat_basic": 80,
+}
+
+RESULT_PASSED = "passed"
+RESULT_FLAGGED = "flagged"
+RESULT_NOT_FOUND = "not_found"
+RESULT_ERROR = "error"
+RESULT_STATUSES = [RESULT_PASSED, RESULT_FLAGGED, RESULT_NOT_FOUND, RESULT_ERROR]
+
+# Jobs a restart cut off are failed rather than left "running" forever
+job_reaper.register("vetting_jobs")
+
+
+def parse_identifiers(raw: List[str]) -> List[Tuple[str, str]]:
+    """
+    (type, number) pairs from free-form entries - "MC-123456", "MC 123456", "DOT 1234567", "1234567".
+    Bare numbers are DOT numbers. Duplicates are dropped, order is kept.
+    """
+    parsed = []
+    for entry in raw:
+        for token in re.split(r"[,;\n\r\t]+", entry or ""):
+            token = token.strip().upper()
+            if not token:
+                continue
+            if token.startswith("MC"):
+                number, kind = clean_mc_number(token), "mc"
+            else:
+                number, kind = re.sub(r"^(US)?DOT[\s#:-]*", "", token).strip(), "dot"
+            number = number.lstrip("#").strip()
+            if number.isdigit():
+                parsed.append((kind, number))
+    return list(dict.fromkeys(parsed))
+
+
+def basic_score(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def vetting_flags(carrier: dict) -> List[str]:
+    """Reasons a carrier needs a closer look - empty when it checks out"""
+    flags = []
+    if carrier.get("allow_to_operate") != "Y":
+        flags.append("not_allowed_to_operate")
+    if carrier.get("out_of_service"):
+        flags.append("out_of_service")
+    if carrier.get("operating_status") not in (None, "A"):
+        flags.append("inactive")
+    authorities = [carrier.get("common_authority"), carrier.get("contract_authority")]
+    if any(a is not None for a in authorities) and "A" not in authorities:
+        flags.append("no_active_authority")
+    if (carrier.get("safety_rating") or "").upper() in ("U", "UNSATISFACTORY"):
+        flags.append("unsatisfactory_rating")
+    for field, threshold in BASIC_THRESHOLDS.items():
+        score = basic_score(carrier.get(field))
+        if score is not None and score >= threshold:
+            flags.append(f"basic_alert:{field.replace('_basic', '')}")
+    return flags
+
+
+async def fetch_with_retry(lookup, *args, **kwargs) -> Optional[dict]:
+    for delay in RETRY_DELAYS + [None]:
+        try:
+            return await lookup(*args, **kwargs)
+        except HTTPException as e:
+            if e.status_code not in RETRY_STATUSES or delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+async def carrier_payload(kind: str, number: str, max_age: Optional[float] = None) -> Optional[dict]:
+    """Full FMCSA carrier payload for a DOT or MC number - MC numbers are resolved to their DOT first"""
+    if kind == "mc":
+        # The MC -> DOT mapping practically never changes - max_age only applies to the carrier record
+        docket = await fetch_with_retry(fmcsa.carrier_by_mc, number)
+        content = (docket or {}).get("content") or []
+        matches = content if isinstance(content, list) else [content]
+        dot_numbers = [m["carrier"]["dotNumber"] for m in matches if (m or {}).get("carrier", {}).get("dotNumber")]
+        if not dot_numbers:
+            return None
+        number = str(dot_numbers[0])
+    return await fetch_with_retry(fmcsa.carrier_by_dot, number, max_age=max_age)
+
+
+async def vet_carrier(kind: str, number: str) -> dict:
+    """One vetting result - never raises, errors are reported on the result"""
+    result = {"identifier_type": kind, "identifier": number, "flags": []}
+    try:
+        payload = await carrier_payload(kind, number)
+    except HTTPException as e:
+        return {**result, "status": RESULT_ERROR, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Vetting lookup failed for {kind} {number}: {e}")
+        return {**result, "status": RESULT_ERROR, "error": str(e)}
+
+    if payload is None:
+        return {**result, "status": RESULT_NOT_FOUND}
+    carrier = parse_carrier_full(payload).dict(exclude_none=True)
+    flags = vetting_flags(carrier)
+    return {**result, "status": RESULT_FLAGGED if flags else RESULT_PASSED, "flags": flags, "carrier": carrier}
+
+
+async def create_vetting_job(owner_id: str, identifiers: List[Tuple[str, str]]) -> dict:
+    if not identifiers:
+        raise HTTPException(status_code=400, detail="No DOT or MC numbers found")
+    if len(identifiers) > VETTING_MAX_CARRIERS:
+        raise HTTPException(status_code=400, detail=f"At most {VETTING_MAX_CARRIERS} carriers per job")
+    return await create_job(db.vetting_jobs, owner_id, len(identifiers), RESULT_STATUSES)
+
+
+async def run_vetting_job(job_id: str, identifiers: List[Tuple[str, str]], concurrency: int = VETTING_CONCURRENCY):
+    """Vet every carrier with `concurrency` workers, writing results and progress in batches"""
+    async def handle(identifier: Tuple[str, str]) -> dict:
+        return {**await vet_carrier(*identifier), "checked_at": datetime.now(timezone.utc)}
+
+    await run_job(db.vetting_jobs, db.vetting_results, job_id, identifiers, handle, concurrency, flush_size=VETTING_FLUSH_SIZE)
+
+
+async def get_vetting_job(job_id: str, owner_id: str) -> dict:
+    job = await db.vetting_jobs.find_one({"id": job_id, "owner_id": owner_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Vetting job not found")
+    return job
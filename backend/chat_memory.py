@@ -0,0 +1,153 @@
+"""
+Rolling-summary memory for TMS chat sessions
+
+A prompt carries the session's stored summary plus only the most recent turns, newest first while they fit
+the department's budget (CHAT_MEMORY_BUDGETS). After each reply, compact_memory folds the turns that no
+longer fit into the summary with one "chat_summary" call and records the last turn it covered, so older
+turns are never re-sent verbatim. The save is conditional on that marker, so two compactions of the same
+session can't overwrite each other's summary.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from database import db
+from llm_gateway import estimate_tokens, llm
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHAT_MEMORY_TOKEN_BUDGET = int(os.environ.get("CHAT_MEMORY_TOKEN_BUDGET", 1500))
+
+# History budget (summary + verbatim turns) per department - CHAT_MEMORY_BUDGET_<DEPARTMENT> overrides
+CHAT_MEMORY_BUDGETS: Dict[str, int] = {
+    context: int(os.environ.get(f"CHAT_MEMORY_BUDGET_{context.upper()}", default))
+    for context, default in {
+        "dispatch": 1500,
+        "accounting": 2000,
+        "sales": 1200,
+        "hr": 1200,
+        "maintenance": 1200,
+        "safety": 1200,
+        "general": CHAT_MEMORY_TOKEN_BUDGET,
+    }.items()
+}
+
+# Share of the budget the summary may grow to - the rest is for verbatim turns
+CHAT_SUMMARY_SHARE = 0.4
+
+# Unsummarized turns read per prompt - compaction keeps the backlog well below this
+CHAT_MEMORY_MAX_TURNS = 50
+
+SUMMARY_SYSTEM_MESSAGE = """You maintain the running summary of a conversation between a user of a transportation management system and its assistant.
+Keep what the assistant will need later: load and order numbers, customers, carriers, drivers, amounts, dates, decisions made and questions still open.
+Write plain sentences, no preamble, and drop small talk."""
+
+
+def memory_budget(context: Optional[str]) -> int:
+    return CHAT_MEMORY_BUDGETS.get(context or "general", CHAT_MEMORY_TOKEN_BUDGET)
+
+
+def turn_tokens(turn: dict) -> int:
+    return estimate_tokens(turn.get("user_message", ""), turn.get("assistant_response", ""))
+
+
+def split_turns(turns: List[dict], budget: int) -> Tuple[List[dict], List[dict]]:
+    """(older, recent) - recent is the newest turns that fit the budget, always at least the last one"""
+    recent = []
+    for turn in reversed(turns):
+        cost = turn_tokens(turn)
+        if recent and cost > budget:
+            break
+        recent.append(turn)
+        budget -= cost
+    recent.reverse()
+    return turns[:len(turns) - len(recent)], recent
+
+
+async def load_memory(user_id: str, session_id: str) -> Tuple[dict, List[dict]]:
+    """(stored memory, turns after it in chronological order)"""
+    memory = await db.tms_chat_memory.find_one({"user_id": user_id, "session_id": session_id}, {"_id": 0}) or {}
+    query = {"user_id": user_id, "session_id": session_id}
+    if memory.get("summarized_through"):
+        query["timestamp"] = {"$gt": memory["summarized_through"]}
+    turns = await db.tms_chat_history.find(
+        query,
+        {"_id": 0, "user_message": 1, "assistant_response": 1, "timestamp": 1}
+    ).sort("timestamp", -1).limit(CHAT_MEMORY_MAX_TURNS).to_list(CHAT_MEMORY_MAX_TURNS)
+    turns.reverse()
+    return memory, turns
+
+
+async def chat_memory(user_id: str, session_id: str, context: Optional[str]) -> Tuple[str, List[Dict[str, str]]]:
+    """(summary, recent turns as chat history) for the next prompt of a session"""
+    memory, turns = await load_memory(user_id, session_id)
+    summary = memory.get("summary") or ""
+    budget = memory_budget(context) - (estimate_tokens(summary) if summary else 0)
+    _, recent = split_turns(turns, budget)
+
+    history = []
+    for turn in recent:
+        history.append({"role": "user", "content": turn["user_message"]})
+        history.append({"role": "assistant", "content": turn["assistant_response"]})
+    return summary, history
+
+
+def summary_prompt(summary: str, turns: List[dict], max_tokens: int) -> str:
+    transcript = "\n".join(f"USER: {t['user_message']}\nASSISTANT: {t['assistant_response']}" for t in turns)
+    return (
+        f"Summary so far:\n{summary or '(none yet)'}\n\n"
+        f"Turns to add:\n{transcript}\n\n"
+        f"Write the updated summary in at most {max_tokens * 3 // 4} words."
+    )
+
+
+async def compact_memory(user_id: str, session_id: str, context: Optional[str], tenant_id: Optional[str] = None) -> bool:
+    """Fold the turns that no longer fit the budget into the summary - True when it was updated"""
+    memory, turns = await load_memory(user_id, session_id)
+    budget = memory_budget(context)
+    summary_budget = int(budget * CHAT_SUMMARY_SHARE)
+    older, _ = split_turns(turns, budget - summary_budget)
+    if not older:
+        return False
+
+    try:
+        result = await llm.complete(
+            "chat_summary",
+            summary_prompt(memory.get("summary") or "", older, summary_budget),
+            system=SUMMARY_SYSTEM_MESSAGE,
+            tenant_id=tenant_id,
+            user_id=user_id,
+            max_tokens=summary_budget
+        )
+    except Exception as e:
+        # The turns stay unsummarized and are retried after the next reply
+        logger.warning(f"Chat memory compaction failed for {session_id}: {e}")
+        return False
+
+    try:
+        await db.tms_chat_memory.update_one(
+            {"user_id": user_id, "session_id": session_id, "summarized_through": memory.get("summarized_through")},
+            {
+                "$set": {
+                    "summary": result.text.strip(),
+                    "summarized_through": older[-1]["timestamp"],
+                    "context": context,
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"turns_summarized": len(older)}
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another compaction of this session saved first - its summary wins
+        return False
+    return True
+
+
+async def clear_memory(user_id: str, context: Optional[str] = None):
+    """Drop stored summaries along with the history they came from"""
+    query = {"user_id": user_id}
+    if context:
+        query["context"] = context
+    await db.tms_chat_memory.delete_many(query)
@@ -10,3 +10,68 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
+
+async def ensure_indexes():
+    """Create the indexes the API relies on - safe to run on every startup"""
+    await db.equipment.create_index("owner_id")
+    await db.equipment.create_index([("current_position", "2dsphere")])
+    await db.users.create_index("id")
+    await db.users.create_index([("current_position", "2dsphere"), ("role", 1)])
+    await db.bookings.create_index([("equipment_id", 1), ("status", 1)])
+    # Geofence lookups - a driver's active loads
+    await db.loads.create_index([("assigned_driver_id", 1), ("status", 1)])
+    await db.bookings.create_index([("driver_id", 1), ("status", 1)])
+    # Driver app reads - one view document per driver and load
+    await db.driver_assignments.create_index([("driver_user_id", 1), ("key", 1)], unique=True)
+    await db.driver_assignments.create_index([("driver_user_id", 1), ("assigned_at", -1)])
+    await db.driver_assignments.create_index([("driver_user_id", 1), ("load_ids", 1)])
+    await db.driver_assignments.create_index([("driver_user_id", 1), ("status", 1)])
+    await db.driver_assignments.create_index([("key", 1), ("source", 1)])
+    await db.driver_loads.create_index("booking_id")
+    await db.driver_assignments.create_index("load_ids")
+    # Driver AI context - one rendered prompt context per driver, versioned for invalidation
+    await db.driver_contexts.create_index("driver_user_id", unique=True)
+    # TMS chat memory - recent turns per session and one rolling summary per session
+    await db.tms_chat_history.create_index([("user_id", 1), ("session_id", 1), ("timestamp", -1)])
+    await db.tms_chat_memory.create_index([("user_id", 1), ("session_id", 1)], unique=True)
+    # TMS assistant retrieval - one entry per record, synced per tenant by update time
+    await db.retrieval_index.create_index("key", unique=True)
+    await db.retrieval_index.create_index([("tenant_ids", 1), ("model", 1), ("updated_at", 1)])
+    # Load messaging - incremental history (after=) and per-driver unread counters
+    await db.load_messages.create_index([("load_id", 1), ("created_at", 1), ("id", 1)])
+    await db.load_messages.create_index("id")
+    await db.message_unread_counts.create_index([("user_id", 1), ("load_id", 1)], unique=True)
+    # Derived images (normalized photos, thumbnails, PDF bundles) keyed by source content hash
+    await db.blob_derivatives.create_index([("source_sha256", 1), ("variant", 1)], unique=True)
+    # Accounting lists and exports - a company's ledger in date order without an in-memory sort
+    await db.accounts_receivable.create_index([("company_id", 1), ("created_at", -1)])
+    await db.accounts_receivable.create_index([("company_id", 1), ("updated_at", -1)])
+    await db.accounts_payable.create_index([("company_id", 1), ("created_at", -1)])
+    await db.expenses.create_index([("company_id", 1), ("created_at", -1)])
+    # FMCSA carrier cache - one entry per lookup key, removed by Mongo once past its stale window
+    await db.fmcsa_cache.create_index("key", unique=True)
+    await db.fmcsa_cache.create_index("expires_at", expireAfterSeconds=0)
+    # Carrier vetting - jobs polled by id, report rows read back in input order
+    await db.vetting_jobs.create_index("id", unique=True)
+    await db.vetting_jobs.create_index([("owner_id", 1), ("created_at", -1)])
+    await db.vetting_jobs.create_index([("status", 1), ("heartbeat_at", 1)])
+    await db.vetting_results.create_index([("job_id", 1), ("position", 1)])
+    # Carrier monitor - watchlist claimed by due time, carriers found via active bookings, alerts per user
+    await db.carrier_watch.create_index("key", unique=True)
+    await db.carrier_watch.create_index([("active", 1), ("next_check_at", 1)])
+    await db.bookings.create_index([("status", 1), ("carrier_dot_number", 1)])
+    await db.bookings.create_index([("status", 1), ("carrier_mc_number", 1)])
+    await db.carrier_alerts.create_index([("user_ids", 1), ("created_at", -1)])
+    # LLM call ledger - usage per tenant and per feature over time
+    await db.llm_calls.create_index([("tenant_id", 1), ("created_at", -1)])
+    await db.llm_calls.create_index([("feature", 1), ("created_at", -1)])
+    # Document extraction cache - one entry per content/prompt/model, removed by Mongo past its TTL
+    await db.extraction_cache.create_index("key", unique=True)
+    await db.extraction_cache.create_index("expires_at", expireAfterSeconds=0)
+    await db.extraction_cache_stats.create_index([("feature", 1), ("day", 1)], unique=True)
+    await db.extraction_cache_stats.create_index("day")
+    # Batch extraction jobs - polled by id, results read back in upload order
+    await db.extraction_jobs.create_index("id", unique=True)
+    await db.extraction_jobs.create_index([("owner_id", 1), ("created_at", -1)])
+    await db.extraction_jobs.create_index([("status", 1), ("heartbeat_at", 1)])
+    await db.extraction_results.create_index([("job_id", 1), ("position", 1)])
@@ -0,0 +1,146 @@
+"""
+Repositories for stored files (load documents, receipt images)
+
+List and lookup methods never read payload bytes - legacy base64 fields are always projected away
+and file content is only reachable through the explicit open_stream().
+"""
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel, ConfigDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+from datetime import datetime
+from database import db
+from blob_store import blob_store, blob_response, BlobNotFound
+import base64
+
+
+class StoredFile(BaseModel):
+    """Metadata shared by every stored file - content lives in the blob store under blob_sha256"""
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    file_size: Optional[int] = None
+    blob_sha256: Optional[str] = None
+    thumbnail_sha256: Optional[str] = None
+
+
+class LoadDocument(StoredFile):
+    load_id: str
+    stop_id: Optional[str] = None
+    doc_type: Optional[str] = None
+    uploaded_by: Optional[str] = None
+    uploader_name: Optional[str] = None
+    uploaded_at: Optional[datetime] = None
+
+
+class ReceiptImage(StoredFile):
+    company_id: str
+    uploaded_by: Optional[str] = None
+    uploaded_at: Optional[str] = None
+
+
+class StoredFileRepository:
+    """Metadata-only access to a collection of stored files"""
+
+    model = StoredFile
+    # Inline payload fields from before the blob store - never returned by list/get
+    payload_fields: List[str] = []
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def projection(self, fields: Optional[List[str]] = None) -> Dict[str, int]:
+        """Mongo projection that can't include payload fields, whatever the caller asks for"""
+        if fields:
+            projection = {field: 1 for field in fields if field not in self.payload_fields}
+            projection["id"] = 1
+        else:
+            projection = {field: 0 for field in self.payload_fields}
+        projection["_id"] = 0
+        return projection
+
+    async def find(
+        self,
+        query: dict,
+        sort: Optional[List[tuple]] = None,
+        limit: int = 100,
+        fields: Optional[List[str]] = None
+    ) -> List[Any]:
+        cursor = self.collection.find(query, self.projection(fields))
+        if sort:
+            cursor = cursor.sort(sort)
+        return [self.model(**doc) for doc in await cursor.to_list(limit)]
+
+    async def get(self, query: Union[str, dict]) -> Optional[Any]:
+        if isinstance(query, str):
+            query = {"id": query}
+        doc = await self.collection.find_one(query, self.projection())
+        return self.model(**doc) if doc else None
+
+    async def insert(self, record: Any) -> Any:
+        data = record.dict(exclude_unset=True) if isinstance(record, BaseModel) else dict(record)
+        await self.collection.insert_one(dict(data))
+        data.pop("_id", None)
+        return self.model(**data)
+
+    async def set_thumbnail(self, file_id: str, sha256: str):
+        await self.collection.update_one({"id": file_id}, {"$set": {"thumbnail_sha256": sha256}})
+
+    async def _legacy_payload(self, file_id: str) -> Optional[bytes]:
+        if not self.payload_fields:
+            return None
+        doc = await self.collection.find_one({"id": file_id}, {"_id": 0, **{f: 1 for f in self.payload_fields}})
+        for field in self.payload_fields:
+            if doc and doc.get(field):
+                return base64.b64decode(doc[field])
+        return None
+
+    async def open_stream(self, record: Any) -> AsyncIterator[bytes]:
+        """The file's bytes - from the blob store, or the inline base64 field if not migrated yet"""
+        if record.blob_sha256:
+            async for chunk in blob_store.open(record.blob_sha256):
+                yield chunk
+            return
+        payload = await self._legacy_payload(record.id)
+        if payload is None:
+            raise BlobNotFound(record.id)
+        yield payload
+
+    async def read_base64(self, record: Any) -> str:
+        """Whole file as base64 - only for clients that still want it inline"""
+        content = b"".join([chunk async for chunk in self.open_stream(record)])
+        return base64.b64encode(content).decode('utf-8')
+
+
+class LoadDocumentRepository(StoredFileRepository):
+    model = LoadDocument
+    payload_fields = ["file_data"]
+
+    async def list_for_load(self, load_id: str, limit: int = 100) -> List[LoadDocument]:
+        return await self.find({"load_id": load_id}, sort=[("uploaded_at", -1)], limit=limit)
+
+
+class ReceiptImageRepository(StoredFileRepository):
+    model = ReceiptImage
+    payload_fields = ["image_base64"]
+
+    async def get_for_company(self, receipt_id: str, company_id: str) -> Optional[ReceiptImage]:
+        return await self.get({"id": receipt_id, "company_id": company_id})
+
+
+async def stored_file_response(request: Request, record: StoredFile, repository: StoredFileRepository, default_type: str = "application/octet-stream") -> Response:
+    """Serve a stored file - streamed with Range/ETag from the blob store, or whole if not migrated yet"""
+    content_type = record.content_type or default_type
+    if record.blob_sha256:
+        return await blob_response(request, record.blob_sha256, content_type, filename=record.filename)
+    try:
+        content = b"".join([chunk async for chunk in repository.open_stream(record)])
+    except BlobNotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+    return Response(content=content, media_type=content_type)
+
+
+load_documents = LoadDocumentRepository(db.load_documents)
+receipt_images = ReceiptImageRepository(db.receipt_images)
@@ -0,0 +1,272 @@
+"""
+Materialized driver_assignments view - one document per driver and load
+
+A load reaches a driver three ways: pushed from dispatch (driver_loads), assigned in the loads
+collection, or set on a booking (driver_id / assigned_driver_id). Writers call refresh_assignments()
+after changing any of those documents, so every driver-app read is one indexed query on
+driver_user_id instead of a three-collection merge.
+
+Dispatch works from the booking, so driver-side updates to a pushed record are also written through
+to its booking, translated to the booking's statuses and actual-time fields.
+"""
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from database import db
+from driver_context import invalidate_driver_context
+from retrieval import SOURCES, schedule_index
+import uuid
+
+# Which copy of a load the driver sees when several sources point at it - pushed records win
+SOURCE_PRIORITY = {"driver_loads": 0, "loads": 1, "bookings": 2}
+# Statuses that take a load off the driver's list
+REMOVED_STATUSES = ["rejected", "cancelled"]
+MAX_ASSIGNMENTS = 100
+
+# Driver-app statuses as the booking records them - assigned, loaded, problem and rejected leave it alone
+BOOKING_STATUSES = {
+    "en_route_pickup": "in_transit_pickup",
+    "arrived_pickup": "at_pickup",
+    "en_route_delivery": "in_transit_delivery",
+    "arrived_delivery": "at_delivery",
+    "delivered": "delivered",
+}
+# Driver-side timestamps and the booking's actual-time fields they fill
+BOOKING_TIME_FIELDS = {
+    "actual_pickup_arrival": "pickup_time_actual_in",
+    "actual_pickup_departure": "pickup_time_actual_out",
+    "actual_delivery_arrival": "delivery_time_actual_in",
+    "actual_delivery_time": "delivery_time_actual_out",
+}
+
+
+def split_location(location: Optional[str]) -> Tuple[str, str]:
+    """("Dallas", "TX") from "Dallas, TX" - computed once when the view is written"""
+    if not location:
+        return "", ""
+    parts = location.split(",")
+    return parts[0], parts[-1].strip()
+
+
+def as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        try:
+            return as_datetime(datetime.fromisoformat(value.replace('Z', '+00:00')))
+        except ValueError:
+            return None
+    return None
+
+
+def load_snapshot(source: str, doc: dict, booking: Optional[dict] = None) -> dict:
+    """The load as the driver app shows it - pushed records are layered over their booking"""
+    snapshot = {**(booking or {}), **doc}
+    snapshot.pop("_id", None)
+    if source != "loads":
+        # loads carry their own city/state fields, bookings and pushed records only have the address
+        snapshot["pickup_city"], snapshot["pickup_state"] = split_location(snapshot.get("pickup_location"))
+        snapshot["delivery_city"], snapshot["delivery_state"] = split_location(snapshot.get("delivery_location"))
+    return snapshot
+
+
+def assignment_key(source: str, doc: dict) -> str:
+    """Pushed records share their booking's key, so a booking and its push are one assignment"""
+    if source == "driver_loads":
+        return doc.get("booking_id") or doc["id"]
+    return doc["id"]
+
+
+async def resolve_driver(ref: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(user id, drivers record id) for a reference that may be either"""
+    driver = await db.drivers.find_one({"id": ref}, {"_id": 0, "id": 1, "user_id": 1, "email": 1})
+    if driver:
+        user_id = driver.get("user_id")
+        if not user_id and driver.get("email"):
+            user = await db.users.find_one({"email": driver["email"]}, {"_id": 0, "id": 1})
+            user_id = user["id"] if user else None
+        return (user_id, driver["id"]) if user_id else None
+
+    user = await db.users.find_one({"id": ref}, {"_id": 0, "id": 1, "email": 1})
+    if not user:
+        return None
+    driver = await db.drivers.find_one(
+        {"$or": [{"user_id": user["id"]}, {"email": user.get("email")}]},
+        {"_id": 0, "id": 1}
+    )
+    return user["id"], driver["id"] if driver else None
+
+
+async def driver_refs(source: str, doc: dict) -> List[Tuple[str, Optional[str]]]:
+    """Every (user id, drivers record id) the source document assigns the load to"""
+    if source == "driver_loads" and doc.get("driver_user_id"):
+        return [(doc["driver_user_id"], doc.get("driver_id"))]
+    if source == "driver_loads":
+        refs = [doc.get("driver_id")]
+    elif source == "loads":
+        refs = [doc.get("assigned_driver_id")]
+    else:
+        refs = [doc.get("driver_id"), doc.get("assigned_driver_id")]
+
+    resolved = []
+    for ref in refs:
+        if not ref:
+            continue
+        driver = await resolve_driver(ref)
+        if driver and driver[0] not in [r[0] for r in resolved]:
+            resolved.append(driver)
+    return resolved
+
+
+async def sync_source(source: str, doc: dict):
+    """Write the view documents for one source document and drop drivers it no longer points at"""
+    key = assignment_key(source, doc)
+    booking = None
+    if source == "driver_loads" and doc.get("booking_id"):
+        booking = await db.bookings.find_one({"id": doc["booking_id"]}, {"_id": 0})
+    snapshot = load_snapshot(source, doc, booking)
+    assigned_at = as_datetime(doc.get("assigned_at") or doc.get("dispatched_at") or doc.get("created_at"))
+
+    refs = [] if doc.get("status") in REMOVED_STATUSES else await driver_refs(source, doc)
+    user_ids = []
+    for driver_user_id, driver_id in refs:
+        user_ids.append(driver_user_id)
+        existing = await db.driver_assignments.find_one(
+            {"driver_user_id": driver_user_id, "key": key},
+            {"_id": 0, "source": 1}
+        )
+        if existing and SOURCE_PRIORITY[existing["source"]] < SOURCE_PRIORITY[source]:
+            continue
+        await db.driver_assignments.update_one(
+            {"driver_user_id": driver_user_id, "key": key},
+            {
+                "$set": {
+                    "driver_id": driver_id,
+                    "source": source,
+                    "load_id": doc["id"],
+                    "booking_id": doc.get("booking_id") or (doc["id"] if source == "bookings" else None),
+                    "load_ids": list(dict.fromkeys(i for i in [doc["id"], doc.get("booking_id")] if i)),
+                    "status": doc.get("status") or "assigned",
+                    "assigned_at": assigned_at,
+                    "load": snapshot,
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$setOnInsert": {"id": str(uuid.uuid4())}
+            },
+            upsert=True
+        )
+
+    dropped = await db.driver_assignments.find(
+        {"key": key, "source": source, "driver_user_id": {"$nin": user_ids}},
+        {"_id": 0, "driver_user_id": 1}
+    ).to_list(None)
+    await db.driver_assignments.delete_many({"key": key, "source": source, "driver_user_id": {"$nin": user_ids}})
+    await invalidate_driver_context(user_ids + [d["driver_user_id"] for d in dropped])
+
+
+async def refresh_assignments(collection: str, doc_id: str):
+    """Re-sync the view after a write to a load, booking or pushed record"""
+    doc = await db[collection].find_one({"id": doc_id}, {"_id": 0})
+    if doc:
+        await sync_source(collection, doc)
+    else:
+        dropped = await db.driver_assignments.find(
+            {"source": collection, "load_id": doc_id},
+            {"_id": 0, "driver_user_id": 1}
+        ).to_list(None)
+        await db.driver_assignments.delete_many({"source": collection, "load_id": doc_id})
+        await invalidate_driver_context(d["driver_user_id"] for d in dropped)
+
+    if collection == "bookings":
+        # Pushed records carry a copy of their booking - keep it current
+        pushed = await db.driver_loads.find({"booking_id": doc_id}, {"_id": 0}).to_list(MAX_ASSIGNMENTS)
+        for driver_load in pushed:
+            await sync_source("driver_loads", driver_load)
+
+
+async def list_driver_loads(driver_user_id: str, limit: int = MAX_ASSIGNMENTS) -> List[dict]:
+    """The driver's loads, newest assignment first"""
+    assignments = await db.driver_assignments.find(
+        {"driver_user_id": driver_user_id},
+        {"_id": 0, "load": 1}
+    ).sort("assigned_at", -1).to_list(limit)
+    return [a["load"] for a in assignments]
+
+
+async def get_assignment(driver_user_id: str, load_id: str) -> Optional[dict]:
+    """The driver's assignment for a load, by load, booking or pushed record id"""
+    return await db.driver_assignments.find_one(
+        {"driver_user_id": driver_user_id, "load_ids": load_id},
+        {"_id": 0}
+    )
+
+
+async def assigned_load_ids(driver_user_id: str) -> List[str]:
+    """Every id the driver's loads are known by - messages may be keyed on either"""
+    assignments = await db.driver_assignments.find(
+        {"driver_user_id": driver_user_id},
+        {"_id": 0, "load_ids": 1}
+    ).to_list(MAX_ASSIGNMENTS)
+    return [load_id for a in assignments for load_id in a.get("load_ids", [])]
+
+
+async def write_through_to_booking(collection: str, load_id: str, update_data: dict) -> Optional[dict]:
+    """Mirror a driver-side update of a pushed record onto its booking - returns the booking as it was, or None"""
+    if collection != "driver_loads":
+        return None
+    pushed = await db.driver_loads.find_one({"id": load_id}, {"_id": 0, "booking_id": 1})
+    if not pushed or not pushed.get("booking_id"):
+        return None
+
+    booking_update = {BOOKING_TIME_FIELDS[f]: v for f, v in update_data.items() if f in BOOKING_TIME_FIELDS}
+    if update_data.get("status") in BOOKING_STATUSES:
+        booking_update["status"] = BOOKING_STATUSES[update_data["status"]]
+    if not booking_update:
+        return None
+
+    booking = await db.bookings.find_one_and_update(
+        {"id": pushed["booking_id"]},
+        {"$set": booking_update},
+        projection={"_id": 0}
+    )
+    if booking is not None:
+        await refresh_assignments("bookings", booking["id"])
+        schedule_index("bookings", booking["id"])
+    return booking
+
+
+async def update_assigned_load(assignment: dict, update_data: dict, from_statuses: Optional[List[str]] = None) -> Optional[dict]:
+    """
+    Apply a driver-side update to the assignment's source document (and a pushed record's booking) and refresh
+    the view. With from_statuses the update is conditional. Returns {"status": <previous status>, "booking":
+    <booking before the write-through, if any>}, or None if nothing matched.
+    """
+    query = {"id": assignment["load_id"]}
+    if from_statuses is not None:
+        query["status"] = {"$in": from_statuses}
+    before = await db[assignment["source"]].find_one_and_update(
+        query,
+        {"$set": update_data},
+        projection={"_id": 0, "status": 1}
+    )
+    if before is None:
+        return None
+    await refresh_assignments(assignment["source"], assignment["load_id"])
+    if assignment["source"] in SOURCES:
+        schedule_index(assignment["source"], assignment["load_id"])
+    before["booking"] = await write_through_to_booking(assignment["source"], assignment["load_id"], update_data)
+    return before
+
+
+async def rebuild_assignments() -> int:
+    """Backfill the view from all three sources - for the migration script"""
+    count = 0
+    sources = [
+        ("driver_loads", {}),
+        ("loads", {"assigned_driver_id": {"$nin": [None, ""]}}),
+        ("bookings", {"$or": [{"driver_id": {"$nin": [None, ""]}}, {"assigned_driver_id": {"$nin": [None, ""]}}]})
+    ]
+    for collection, query in sources:
+        async for doc in db[collection].find(query, {"_id": 0}).batch_size(100):
+            await sync_source(collection, doc)
+            count += 1
+    return count
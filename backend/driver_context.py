@@ -0,0 +1,129 @@
+"""
+Driver context for the driver AI assistant - the driver's loads as text for the system prompt
+
+Rendering reads only the fields the prompt uses from driver_assignments and fits them into
+DRIVER_CONTEXT_TOKEN_BUDGET: loads still in progress get the full block, finished ones a one-line summary,
+and whatever doesn't fit is only counted. The text is kept in driver_contexts until the driver's assignments
+change - sync_source bumps the document's version, and a render is only saved if the version is still the
+one it started from, so a write racing a render can't leave stale text behind.
+"""
+from datetime import datetime, timezone
+from typing import Iterable, List
+from pymongo.errors import DuplicateKeyError
+from database import db
+from llm_gateway import CHARS_PER_TOKEN
+import os
+
+DRIVER_CONTEXT_TOKEN_BUDGET = int(os.environ.get("DRIVER_CONTEXT_TOKEN_BUDGET", 1500))
+DRIVER_CONTEXT_MAX_LOADS = 50
+
+# Loads in these statuses are summarized in one line
+FINISHED_STATUSES = ["delivered", "completed", "invoiced", "payment_overdue", "paid"]
+
+LOAD_FIELDS = [
+    "id", "order_number", "status",
+    "pickup_city", "pickup_state", "pickup_location",
+    "delivery_city", "delivery_state", "delivery_location",
+    "equipment_type", "weight", "commodity",
+    "pickup_time_planned", "delivery_time_planned",
+]
+CONTEXT_PROJECTION = {"_id": 0, **{f"load.{field}": 1 for field in LOAD_FIELDS}}
+
+
+def load_label(load: dict) -> str:
+    return load.get('order_number') or (load.get('id') or 'Unknown')[:8]
+
+
+def load_block(load: dict) -> str:
+    return f"""
+Load {load_label(load)}:
+- Status: {load.get('status', 'Unknown')}
+- Pickup: {load.get('pickup_city', 'N/A')}, {load.get('pickup_state', 'N/A')} - {load.get('pickup_location', 'N/A')}
+- Delivery: {load.get('delivery_city', 'N/A')}, {load.get('delivery_state', 'N/A')} - {load.get('delivery_location', 'N/A')}
+- Equipment: {load.get('equipment_type', 'N/A')}
+- Weight: {load.get('weight', 'N/A')} lbs
+- Commodity: {load.get('commodity', 'N/A')}
+- Pickup Time: {load.get('pickup_time_planned', 'TBD')}
+- Delivery Time: {load.get('delivery_time_planned', 'TBD')}
+"""
+
+
+def load_line(load: dict) -> str:
+    return (
+        f"- Load {load_label(load)}: {load.get('status', 'Unknown')}, "
+        f"{load.get('pickup_city', 'N/A')}, {load.get('pickup_state', 'N/A')} to "
+        f"{load.get('delivery_city', 'N/A')}, {load.get('delivery_state', 'N/A')}\n"
+    )
+
+
+def omitted_line(count: int) -> str:
+    return f"\n({count} older loads not shown)\n"
+
+
+def render_driver_context(loads: List[dict], budget: int = DRIVER_CONTEXT_TOKEN_BUDGET) -> str:
+    """Loads newest first - in-progress ones in full while the budget allows, then one line each"""
+    if not loads:
+        return "You have no loads currently assigned."
+
+    active = [load for load in loads if load.get("status") not in FINISHED_STATUSES]
+    finished = [load for load in loads if load.get("status") in FINISHED_STATUSES]
+    parts = ["Here are your current loads:\n\n"]
+    # Counted in characters, the same way tokens are estimated - room is kept for the "not shown" line
+    room = budget * CHARS_PER_TOKEN - len(parts[0]) - len(omitted_line(len(loads)))
+    omitted = 0
+
+    def add(text: str) -> bool:
+        nonlocal room
+        if len(text) > room:
+            return False
+        parts.append(text)
+        room -= len(text)
+        return True
+
+    for load in active:
+        if not add(load_block(load)) and not add(load_line(load)):
+            omitted += 1
+    if finished and add("\nRecently finished loads:\n"):
+        for load in finished:
+            if not add(load_line(load)):
+                omitted += 1
+    else:
+        omitted += len(finished)
+    if omitted:
+        parts.append(omitted_line(omitted))
+    return "".join(parts)
+
+
+async def driver_context(driver_user_id: str) -> str:
+    """The rendered context for a driver - from driver_contexts unless the assignments changed since"""
+    cached = await db.driver_contexts.find_one({"driver_user_id": driver_user_id}, {"_id": 0, "context": 1, "version": 1})
+    if cached and cached.get("context") is not None:
+        return cached["context"]
+
+    version = (cached or {}).get("version", 0)
+    assignments = await db.driver_assignments.find(
+        {"driver_user_id": driver_user_id},
+        CONTEXT_PROJECTION
+    ).sort("assigned_at", -1).to_list(DRIVER_CONTEXT_MAX_LOADS)
+    context = render_driver_context([a.get("load") or {} for a in assignments])
+    try:
+        await db.driver_contexts.update_one(
+            {"driver_user_id": driver_user_id, "version": version},
+            {"$set": {"context": context, "rendered_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Invalidated while rendering - this answer may be stale, the next message renders again
+        pass
+    return context
+
+
+async def invalidate_driver_context(driver_user_ids: Iterable[str]):
+    """Drop the cached text for drivers whose assignments changed"""
+    now = datetime.now(timezone.utc)
+    for driver_user_id in dict.fromkeys(driver_user_ids):
+        await db.driver_contexts.update_one(
+            {"driver_user_id": driver_user_id},
+            {"$inc": {"version": 1}, "$set": {"context": None, "invalidated_at": now}},
+            upsert=True
+        )
@@ -0,0 +1,113 @@
+"""
+Streaming exports - ?format=ndjson|csv on list endpoints
+
+Rows are read from a Motor cursor in bounded batches and written to a StreamingResponse as they
+arrive, so memory stays flat and the first bytes go out immediately however large the export is.
+"""
+from fastapi import Query
+from fastapi.responses import StreamingResponse
+from serialization import dumps
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+from datetime import date, datetime
+import csv
+import io
+import os
+
+EXPORT_FORMATS = ["ndjson", "csv"]
+# Documents per Motor batch, and rows per chunk written to the socket
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def export_format(
+    export: Optional[str] = Query(None, alias="format", pattern="^(ndjson|csv)$", description="Stream the full result as ndjson or csv")
+) -> Optional[str]:
+    """The requested export format, or None for the endpoint's normal JSON response"""
+    return export
+
+
+def csv_value(value: Any) -> Any:
+    """Scalars as-is, nested lists/dicts as JSON so every row stays one line"""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+async def iter_documents(
+    collection,
+    query: dict,
+    projection: Optional[dict] = None,
+    sort: Optional[List[Tuple[str, int]]] = None,
+    transform: Optional[Callable[[dict], dict]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[dict]:
+    """Documents from a Motor cursor, fetched batch_size at a time"""
+    cursor = collection.find(query, projection).batch_size(batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    async for doc in cursor:
+        doc.pop("_id", None)
+        yield transform(doc) if transform else doc
+
+
+async def batches(docs: AsyncIterator[dict], batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Group a document stream into lists of at most batch_size - for per-batch lookups"""
+    batch = []
+    async for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def ndjson_chunks(docs: AsyncIterator[dict], batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    lines = []
+    async for doc in docs:
+        lines.append(dumps(doc))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def csv_chunks(docs: AsyncIterator[dict], columns: Optional[List[str]] = None, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """CSV with a header row - columns default to the first document's fields"""
+    buffer = io.StringIO()
+    writer = None
+    rows = 0
+    async for doc in docs:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=columns or list(doc.keys()), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow({key: csv_value(doc.get(key)) for key in writer.fieldnames})
+        rows += 1
+        if rows >= batch_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if writer is None and columns:
+        csv.DictWriter(buffer, fieldnames=columns).writeheader()
+    if buffer.getvalue():
+        yield buffer.getvalue().encode()
+
+
+def export_response(docs: AsyncIterator[dict], export: str, filename: str, columns: Optional[List[str]] = None) -> StreamingResponse:
+    """Stream documents as an ndjson or csv attachment"""
+    body = csv_chunks(docs, columns) if export == "csv" else ndjson_chunks(docs)
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[export],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export}"'}
+    )
@@ -0,0 +1,138 @@
+"""
+Cache for document extractions (rate confirmations, receipts)
+
+Extracted fields are stored in extraction_cache keyed by the file's SHA-256, a hash of the prompt and system
+message (so editing a prompt invalidates its entries) and the model that ran it, and removed by Mongo's TTL
+index after EXTRACTION_CACHE_TTL_SECONDS. Only successfully parsed results are stored. Identical uploads
+arriving together in one worker share one in-flight extraction. Hits, misses and shared waits are counted per
+feature per day in extraction_cache_stats.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from database import db
+import asyncio
+import copy
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_TTL_SECONDS = int(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+HIT = "hit"
+MISS = "miss"
+JOINED = "joined"
+
+
+def prompt_version(*parts: str) -> str:
+    """Short hash of the prompt text - changes whenever the prompt does"""
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:12]
+
+
+def extraction_key(feature: str, content: bytes, model: str, version: str) -> Tuple[str, str]:
+    """(cache key, content hash)"""
+    content_sha256 = hashlib.sha256(content).hexdigest()
+    return f"{feature}:{model}:{version}:{content_sha256}", content_sha256
+
+
+class ExtractionCache:
+    def __init__(self, ttl_seconds: int = EXTRACTION_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def get_or_extract(
+        self,
+        feature: str,
+        content: bytes,
+        model: str,
+        version: str,
+        extract: Callable[[], Awaitable[dict]]
+    ) -> Tuple[dict, str]:
+        """(extracted fields, HIT | MISS | JOINED) - extract() only runs on a miss, and its errors aren't cached"""
+        key, content_sha256 = extraction_key(feature, content, model, version)
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            await self._count(feature, JOINED)
+            # Callers may edit what they get back, so waiters get their own copy
+            return copy.deepcopy(await asyncio.shield(future)), JOINED
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            doc = await db.extraction_cache.find_one({"key": key}, {"_id": 0, "result": 1})
+            if doc is not None:
+                future.set_result(doc["result"])
+                await self._count(feature, HIT)
+                return doc["result"], HIT
+
+            result = await extract()
+            await self._store(key, feature, model, version, content_sha256, result)
+            future.set_result(result)
+            await self._count(feature, MISS)
+            return result, MISS
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; mark it retrieved so an unawaited future doesn't log it
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _store(self, key: str, feature: str, model: str, version: str, content_sha256: str, result: dict):
+        now = datetime.now(timezone.utc)
+        try:
+            await db.extraction_cache.update_one(
+                {"key": key},
+                {"$set": {
+                    "key": key,
+                    "feature": feature,
+                    "model": model,
+                    "prompt_version": version,
+                    "content_sha256": content_sha256,
+                    "result": result,
+                    "created_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            # The extraction succeeded - a failed cache write only costs a repeat call later
+            logger.error(f"Failed to cache {feature} extraction: {e}")
+
+    async def _count(self, feature: str, outcome: str):
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        try:
+            await db.extraction_cache_stats.update_one(
+                {"feature": feature, "day": day},
+                {"$inc": {outcome: 1}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to count {feature} extraction {outcome}: {e}")
+
+
+async def extraction_stats(days: int = 7, now: Optional[datetime] = None) -> Dict[str, dict]:
+    """Per-feature hits/misses/joined over the last `days` days - hit_rate counts joined waits as hits"""
+    now = now or datetime.now(timezone.utc)
+    since = (now - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = await db.extraction_cache_stats.find({"day": {"$gte": since}}, {"_id": 0}).to_list(1000)
+
+    stats: Dict[str, dict] = {}
+    for row in rows:
+        totals = stats.setdefault(row["feature"], {HIT: 0, MISS: 0, JOINED: 0})
+        for outcome in (HIT, MISS, JOINED):
+            totals[outcome] += row.get(outcome, 0)
+    for totals in stats.values():
+        lookups = totals[HIT] + totals[MISS] + totals[JOINED]
+        totals["lookups"] = lookups
+        totals["hit_rate"] = round((totals[HIT] + totals[JOINED]) / lookups, 4) if lookups else 0.0
+    return stats
+
+
+# Shared cache for the app
+extractions = ExtractionCache()
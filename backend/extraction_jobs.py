@@ -0,0 +1,112 @@
+"""
+Batch document extraction - many receipts or rate confirmations per upload
+
+The upload request streams each file into the blob store, creates an extraction_jobs document that only
+carries the files' hashes and content types, and returns; the files are then read back one at a time and
+processed in the background by job_runner's fixed pool of workers (their model calls also queue on the LLM
+gateway's per-tenant slots, so several batches from one company don't multiply its concurrency). Each
+file's outcome is written to extraction_results as soon as it finishes and the job's progress counters are
+bumped with it, so clients can poll the job and page through results while the rest of the batch is still
+running.
+"""
+from fastapi import HTTPException, UploadFile
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List
+from database import db
+from blob_store import BlobTooLarge, blob_store, upload_chunks
+from job_runner import create_job, job_reaper, run_job
+from llm_gateway import Attachment
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_JOB_CONCURRENCY = int(os.environ.get("EXTRACTION_JOB_CONCURRENCY", 4))
+EXTRACTION_JOB_MAX_FILES = 100
+EXTRACTION_JOB_MAX_FILE_BYTES = 15 * 1024 * 1024
+
+JOB_RECEIPTS = "receipts"
+JOB_RATE_CONFIRMATIONS = "rate_confirmations"
+
+RESULT_SUCCEEDED = "succeeded"
+RESULT_FAILED = "failed"
+RESULT_STATUSES = [RESULT_SUCCEEDED, RESULT_FAILED]
+
+job_reaper.register("extraction_jobs")
+
+
+def check_batch(files: list):
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > EXTRACTION_JOB_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {EXTRACTION_JOB_MAX_FILES} files per batch")
+
+
+async def store_batch(files: List[UploadFile], default_type: str = "application/octet-stream") -> List[dict]:
+    """Stream each upload into the blob store - the job keeps {filename, content_type, sha256, size} per file"""
+    check_batch(files)
+    limit_mb = EXTRACTION_JOB_MAX_FILE_BYTES // (1024 * 1024)
+    # Multipart uploads know their size, so an oversized batch is refused before anything is written
+    too_large = [
+        upload.filename or f"file {i + 1}" for i, upload in enumerate(files)
+        if (getattr(upload, "size", None) or 0) > EXTRACTION_JOB_MAX_FILE_BYTES
+    ]
+    if too_large:
+        raise HTTPException(status_code=413, detail=f"Files over {limit_mb}MB: {', '.join(too_large)}")
+
+    stored, created = [], []
+    for i, upload in enumerate(files):
+        try:
+            blob = await blob_store.put_stream(upload_chunks(upload), max_bytes=EXTRACTION_JOB_MAX_FILE_BYTES)
+        except BlobTooLarge:
+            # Size wasn't known up front - drop what this batch added (blobs that already existed stay)
+            for sha256 in created:
+                await blob_store.delete(sha256)
+            raise HTTPException(status_code=413, detail=f"Files over {limit_mb}MB: {upload.filename or f'file {i + 1}'}")
+        if blob.created:
+            created.append(blob.sha256)
+        stored.append({
+            "filename": upload.filename,
+            "content_type": upload.content_type or default_type,
+            "sha256": blob.sha256,
+            "size": blob.size
+        })
+    return stored
+
+
+async def create_extraction_job(owner_id: str, kind: str, files: List[dict]) -> dict:
+    check_batch(files)
+    return await create_job(db.extraction_jobs, owner_id, len(files), RESULT_STATUSES, kind=kind, files=files)
+
+
+async def process_file(process: Callable[[Attachment], Awaitable[dict]], stored: dict) -> dict:
+    """One file's outcome - never raises, errors are reported on the result"""
+    try:
+        upload = Attachment(mime_type=stored["content_type"], data=await blob_store.read(stored["sha256"]), filename=stored["filename"])
+        return {"status": RESULT_SUCCEEDED, "result": await process(upload)}
+    except HTTPException as e:
+        return {"status": RESULT_FAILED, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Extraction of {stored['filename']} failed: {e}")
+        return {"status": RESULT_FAILED, "error": str(e)}
+
+
+async def run_extraction_job(
+    job_id: str,
+    files: List[dict],
+    process: Callable[[Attachment], Awaitable[dict]],
+    concurrency: int = EXTRACTION_JOB_CONCURRENCY
+):
+    """Run process() over every stored file with `concurrency` workers, saving each result as it completes"""
+    async def handle(stored: dict) -> dict:
+        outcome = await process_file(process, stored)
+        return {"filename": stored["filename"], **outcome, "completed_at": datetime.now(timezone.utc)}
+
+    await run_job(db.extraction_jobs, db.extraction_results, job_id, files, handle, concurrency)
+
+
+async def get_extraction_job(job_id: str, owner_id: str) -> dict:
+    job = await db.extraction_jobs.find_one({"id": job_id, "owner_id": owner_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Extraction job not found")
+    return job
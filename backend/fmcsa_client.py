@@ -0,0 +1,547 @@
+"""
+FMCSA QCMobile client - one pooled HTTP client and a two-level carrier cache
+
+Lookups go through an in-process LRU, then the fmcsa_cache collection (shared by every worker),
+and only then to FMCSA over a keep-alive (HTTP/2 when h2 is installed) connection pool. Cached
+carriers are served fresh for FMCSA_CACHE_TTL_SECONDS; after that they are still served while a
+background refresh runs (stale-while-revalidate) until Mongo's TTL index removes them. "Not found"
+answers are cached for a shorter time so typos don't hit FMCSA on every keystroke. Refreshes are
+conditional (If-None-Match / If-Modified-Since) when FMCSA sent validators, so an unchanged carrier
+costs a 304 instead of a full payload.
+"""
+from fastapi import HTTPException
+from pydantic import BaseModel
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from database import db
+import asyncio
+import httpx
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401 - httpx only needs it importable for http2=True
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+FMCSA_BASE_URL = os.environ.get("FMCSA_BASE_URL", "https://mobile.fmcsa.dot.gov/qc/services")
+FMCSA_API_KEY = os.environ.get("FMCSA_API_KEY", "")
+
+FMCSA_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+FMCSA_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+
+# Carrier data changes rarely - a day fresh, then served stale (and refreshed) for up to a week
+FMCSA_CACHE_TTL_SECONDS = int(os.environ.get("FMCSA_CACHE_TTL_SECONDS", 24 * 3600))
+FMCSA_STALE_SECONDS = int(os.environ.get("FMCSA_STALE_SECONDS", 7 * 24 * 3600))
+FMCSA_NEGATIVE_TTL_SECONDS = int(os.environ.get("FMCSA_NEGATIVE_TTL_SECONDS", 3600))
+FMCSA_LRU_SIZE = int(os.environ.get("FMCSA_LRU_SIZE", 2000))
+# Upstream requests per second across all lookups from this worker - cache hits don't count
+FMCSA_REQUESTS_PER_SECOND = float(os.environ.get("FMCSA_REQUESTS_PER_SECOND", 5))
+
+NOT_FOUND = "not_found"
+FOUND = "found"
+NOT_MODIFIED = "not_modified"
+
+
+class CacheEntry:
+    def __init__(
+        self,
+        status: str,
+        data: Optional[dict],
+        fresh_until: datetime,
+        expires_at: datetime,
+        fetched_at: Optional[datetime] = None,
+        validators: Optional[Dict[str, str]] = None
+    ):
+        self.status = status
+        self.data = data
+        self.fresh_until = fresh_until
+        self.expires_at = expires_at
+        self.fetched_at = fetched_at or datetime.now(timezone.utc)
+        # ETag / Last-Modified from the response, sent back on the next refresh
+        self.validators = validators or {}
+
+    def is_fresh(self, now: datetime) -> bool:
+        return now < self.fresh_until
+
+    def is_usable(self, now: datetime) -> bool:
+        return now < self.expires_at
+
+    def age(self, now: datetime) -> float:
+        return (now - self.fetched_at).total_seconds()
+
+
+def as_utc(value: datetime) -> datetime:
+    # Motor returns naive UTC datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class RateLimiter:
+    """Token bucket - allows short bursts up to `burst`, then `rate` acquisitions per second"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CarrierCache:
+    """In-memory LRU in front of the fmcsa_cache collection"""
+
+    def __init__(self, max_entries: int = FMCSA_LRU_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        now = datetime.now(timezone.utc)
+        entry = self.entries.get(key)
+        if entry is not None and entry.is_usable(now):
+            self.entries.move_to_end(key)
+            return entry
+
+        doc = await db.fmcsa_cache.find_one({"key": key}, {"_id": 0})
+        if not doc:
+            return None
+        entry = CacheEntry(
+            doc["status"],
+            doc.get("data"),
+            as_utc(doc["fresh_until"]),
+            as_utc(doc["expires_at"]),
+            as_utc(doc["fetched_at"]) if doc.get("fetched_at") else None,
+            doc.get("validators")
+        )
+        if not entry.is_usable(now):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    async def put(self, key: str, status: str, data: Optional[dict], validators: Optional[Dict[str, str]] = None) -> CacheEntry:
+        now = datetime.now(timezone.utc)
+        if status == FOUND:
+            fresh_until = now + timedelta(seconds=FMCSA_CACHE_TTL_SECONDS)
+            expires_at = fresh_until + timedelta(seconds=FMCSA_STALE_SECONDS)
+        else:
+            fresh_until = expires_at = now + timedelta(seconds=FMCSA_NEGATIVE_TTL_SECONDS)
+        entry = CacheEntry(status, data, fresh_until, expires_at, now, validators)
+        self._remember(key, entry)
+        await db.fmcsa_cache.update_one(
+            {"key": key},
+            {"$set": {
+                "key": key,
+                "status": status,
+                "data": data,
+                "fetched_at": now,
+                "fresh_until": fresh_until,
+                "expires_at": expires_at,
+                "validators": entry.validators
+            }},
+            upsert=True
+        )
+        return entry
+
+    def _remember(self, key: str, entry: CacheEntry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class FMCSAClient:
+    """Application-lifetime client - created on first use, closed on shutdown"""
+
+    def __init__(
+        self,
+        base_url: str = FMCSA_BASE_URL,
+        api_key: str = FMCSA_API_KEY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        requests_per_second: float = FMCSA_REQUESTS_PER_SECOND
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.transport = transport
+        self.cache = CarrierCache()
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self._client: Optional[httpx.AsyncClient] = None
+        # One upstream request per key, however many callers or refreshes want it at once
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._refreshes: Dict[str, asyncio.Task] = {}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=FMCSA_TIMEOUT,
+                limits=FMCSA_LIMITS,
+                http2=HTTP2_AVAILABLE and self.transport is None,
+                transport=self.transport
+            )
+        return self._client
+
+    async def close(self):
+        for task in self._refreshes.values():
+            task.cancel()
+        self._refreshes.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(
+        self,
+        path: str,
+        params: Optional[dict] = None,
+        validators: Optional[Dict[str, str]] = None
+    ) -> Tuple[str, Optional[dict], Dict[str, str]]:
+        """
+        (FOUND, payload, validators) or (NOT_FOUND, None, {}) straight from FMCSA - errors raise HTTPException.
+        With validators from an earlier response the request is conditional and may return (NOT_MODIFIED, None, ...).
+        """
+        if not self.configured:
+            raise HTTPException(status_code=500, detail="FMCSA API key not configured")
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        await self.rate_limiter.acquire()
+        try:
+            response = await self.client.get(path, params={"webKey": self.api_key, **(params or {})}, headers=headers)
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="FMCSA API timeout")
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=502, detail=f"Failed to connect to FMCSA API: {str(e)}")
+
+        if response.status_code == 304 and validators:
+            return NOT_MODIFIED, None, validators
+        if response.status_code == 404:
+            return NOT_FOUND, None, {}
+        if response.status_code == 401:
+            raise HTTPException(status_code=401, detail="Invalid FMCSA API key")
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="FMCSA API error")
+
+        data = response.json()
+        # A null content means no such carrier
+        if data.get("content") is None:
+            return NOT_FOUND, None, {}
+        received = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+        return FOUND, data, {k: v for k, v in received.items() if v}
+
+    async def cached(self, key: str, path: str, params: Optional[dict] = None, max_age: Optional[float] = None) -> Optional[dict]:
+        """
+        FMCSA payload for a lookup, or None when FMCSA has no such carrier.
+        With max_age, a cached copy older than that many seconds is revalidated before it is returned.
+        """
+        entry = await self.cache.get(key)
+        if entry is not None:
+            now = datetime.now(timezone.utc)
+            if max_age is not None and entry.age(now) > max_age:
+                entry = await self._load(key, path, params, entry)
+            elif not entry.is_fresh(now):
+                self._refresh_in_background(key, path, params, entry)
+            return entry.data
+        entry = await self._load(key, path, params)
+        return entry.data
+
+    async def _load(self, key: str, path: str, params: Optional[dict], previous: Optional[CacheEntry] = None) -> CacheEntry:
+        future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            validators = previous.validators if previous is not None and previous.status == FOUND else None
+            status, data, validators = await self.fetch(path, params, validators)
+            if status == NOT_MODIFIED:
+                status, data = previous.status, previous.data
+            entry = await self.cache.put(key, status, data, validators)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; mark it retrieved so an unawaited future doesn't log it
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def _refresh_in_background(self, key: str, path: str, params: Optional[dict], previous: Optional[CacheEntry] = None):
+        if key in self._refreshes or key in self._in_flight:
+            return
+
+        async def refresh():
+            try:
+                await self._load(key, path, params, previous)
+            except Exception as e:
+                # Keep serving the stale copy - the next request past fresh_until tries again
+                logger.warning(f"FMCSA refresh failed for {key}: {e}")
+            finally:
+                self._refreshes.pop(key, None)
+
+        self._refreshes[key] = asyncio.create_task(refresh())
+
+    async def carrier_by_dot(self, dot_number: str, max_age: Optional[float] = None) -> Optional[dict]:
+        dot_number = dot_number.strip()
+        return await self.cached(f"dot:{dot_number}", f"/carriers/{dot_number}", max_age=max_age)
+
+    async def carrier_by_mc(self, mc_number: str, max_age: Optional[float] = None) -> Optional[dict]:
+        clean_mc = clean_mc_number(mc_number)
+        return await self.cached(f"mc:{clean_mc}", f"/carriers/docket-number/{clean_mc}", max_age=max_age)
+
+    async def search_by_name(self, name: str, size: int) -> Optional[dict]:
+        return await self.cached(
+            f"name:{name.strip().lower()}:{size}",
+            f"/carriers/name/{name.strip()}",
+            {"start": 0, "size": size}
+        )
+
+
+def clean_mc_number(mc_number: str) -> str:
+    """Docket number without the MC/MC- prefix"""
+    return mc_number.upper().replace("MC-", "").replace("MC", "").strip()
+
+
+# Carrier models - what the routes and vetting read out of a QCMobile payload
+class CarrierBasicInfo(BaseModel):
+    dot_number: Optional[str] = None
+    mc_number: Optional[str] = None
+    legal_name: Optional[str] = None
+    dba_name: Optional[str] = None
+    physical_address: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    allow_to_operate: Optional[str] = None
+    out_of_service: Optional[bool] = None
+
+class CarrierFullInfo(CarrierBasicInfo):
+    # Company Details
+    entity_type: Optional[str] = None
+    operating_status: Optional[str] = None
+    mcs150_form_date: Optional[str] = None
+    
+    # Fleet Information
+    total_drivers: Optional[int] = None
+    total_power_units: Optional[int] = None
+    
+    # Safety Data
+    safety_rating: Optional[str] = None
+    safety_rating_date: Optional[str] = None
+    
+    # BASIC Scores (0-100 percentile, higher = worse)
+    unsafe_driving_basic: Optional[str] = None
+    hours_of_service_basic: Optional[str] = None
+    driver_fitness_basic: Optional[str] = None
+    controlled_substances_basic: Optional[str] = None
+    vehicle_maintenance_basic: Optional[str] = None
+    hazmat_basic: Optional[str] = None
+    crash_indicator_basic: Optional[str] = None
+    
+    # Crash Data
+    fatal_crashes: Optional[int] = None
+    injury_crashes: Optional[int] = None
+    tow_crashes: Optional[int] = None
+    total_crashes: Optional[int] = None
+    
+    # Inspection Data
+    vehicle_inspections: Optional[int] = None
+    driver_inspections: Optional[int] = None
+    vehicle_oos_rate: Optional[float] = None
+    driver_oos_rate: Optional[float] = None
+    
+    # Authority/Insurance
+    common_authority: Optional[str] = None
+    contract_authority: Optional[str] = None
+    broker_authority: Optional[str] = None
+    insurance_bipd: Optional[str] = None
+    insurance_cargo: Optional[str] = None
+    insurance_bond: Optional[str] = None
+    
+    # Cargo Types
+    cargo_carried: Optional[List[str]] = None
+    
+    # Additional Info
+    complaint_count: Optional[int] = None
+    mailing_address: Optional[str] = None
+
+
+def parse_carrier_basic(data: dict) -> CarrierBasicInfo:
+    """Parse FMCSA response into basic carrier info"""
+    # Handle null content
+    if data is None:
+        return CarrierBasicInfo()
+    
+    content = data.get("content")
+    if content is None:
+        return CarrierBasicInfo()
+    
+    carrier = content.get("carrier", {}) if isinstance(content, dict) else {}
+    if not carrier:
+        return CarrierBasicInfo()
+    
+    # Build physical address
+    phy_address_parts = [
+        carrier.get("phyStreet", ""),
+        carrier.get("phyCity", ""),
+        carrier.get("phyState", ""),
+        carrier.get("phyZipcode", "")
+    ]
+    physical_address = ", ".join([p for p in phy_address_parts if p])
+    
+    return CarrierBasicInfo(
+        dot_number=str(carrier.get("dotNumber", "")) if carrier.get("dotNumber") else None,
+        mc_number=str(carrier.get("mcNumber", "")) if carrier.get("mcNumber") else None,
+        legal_name=carrier.get("legalName"),
+        dba_name=carrier.get("dbaName"),
+        physical_address=physical_address or None,
+        phone=carrier.get("telephone"),
+        email=carrier.get("emailAddress"),
+        allow_to_operate=carrier.get("allowedToOperate"),
+        out_of_service=carrier.get("oosDate") is not None or carrier.get("outOfServiceDate") is not None
+    )
+
+
+def parse_carrier_full(data: dict) -> CarrierFullInfo:
+    """Parse FMCSA response into full carrier info"""
+    # Handle null content
+    if data is None:
+        return CarrierFullInfo()
+    
+    content = data.get("content")
+    if content is None:
+        return CarrierFullInfo()
+    
+    carrier = content.get("carrier", {}) if isinstance(content, dict) else {}
+    if not carrier:
+        return CarrierFullInfo()
+    
+    # Build addresses
+    phy_address_parts = [
+        carrier.get("phyStreet", ""),
+        carrier.get("phyCity", ""),
+        carrier.get("phyState", ""),
+        carrier.get("phyZipcode", "")
+    ]
+    physical_address = ", ".join([p for p in phy_address_parts if p])
+    
+    mail_address_parts = [
+        carrier.get("mailingStreet", ""),
+        carrier.get("mailingCity", ""),
+        carrier.get("mailingState", ""),
+        carrier.get("mailingZipcode", "")
+    ]
+    mailing_address = ", ".join([p for p in mail_address_parts if p])
+    
+    # Parse cargo types
+    cargo_carried = []
+    for i in range(1, 20):
+        cargo = carrier.get(f"cargoCarried{i}Desc")
+        if cargo:
+            cargo_carried.append(cargo)
+    
+    # Calculate total crashes - crashTotal might be an int or a dict
+    crash_total = carrier.get("crashTotal", {})
+    if isinstance(crash_total, dict):
+        fatal = crash_total.get("fatalCrash", 0) or 0
+        injury = crash_total.get("injCrash", 0) or 0
+        tow = crash_total.get("towawayCrash", 0) or 0
+    else:
+        # crashTotal is just an integer
+        fatal = carrier.get("fatalCrash", 0) or 0
+        injury = carrier.get("injCrash", 0) or 0
+        tow = carrier.get("towawayCrash", 0) or 0
+    
+    return CarrierFullInfo(
+        # Basic Info
+        dot_number=str(carrier.get("dotNumber", "")) if carrier.get("dotNumber") else None,
+        mc_number=str(carrier.get("mcNumber", "")) if carrier.get("mcNumber") else None,
+        legal_name=carrier.get("legalName"),
+        dba_name=carrier.get("dbaName"),
+        physical_address=physical_address or None,
+        phone=carrier.get("telephone"),
+        email=carrier.get("emailAddress"),
+        allow_to_operate=carrier.get("allowedToOperate"),
+        out_of_service=carrier.get("oosDate") is not None,
+        
+        # Company Details
+        entity_type=carrier.get("carrierOperation", {}).get("carrierOperationDesc") if isinstance(carrier.get("carrierOperation"), dict) else carrier.get("carrierOperationDesc"),
+        operating_status=carrier.get("statusCode"),
+        mcs150_form_date=carrier.get("mcs150FormDate"),
+        
+        # Fleet Information
+        total_drivers=carrier.get("totalDrivers"),
+        total_power_units=carrier.get("totalPowerUnits"),
+        
+        # Safety Data
+        safety_rating=carrier.get("safetyRating"),
+        safety_rating_date=carrier.get("safetyRatingDate"),
+        
+        # BASIC Scores
+        unsafe_driving_basic=carrier.get("unsafeDrivingBasic"),
+        hours_of_service_basic=carrier.get("hosBasic"),
+        driver_fitness_basic=carrier.get("driverFitnessBasic"),
+        controlled_substances_basic=carrier.get("controlledSubstanceBasic"),
+        vehicle_maintenance_basic=carrier.get("vehicleMaintenanceBasic"),
+        hazmat_basic=carrier.get("hazmatBasic"),
+        crash_indicator_basic=carrier.get("crashIndicatorBasic"),
+        
+        # Crash Data
+        fatal_crashes=fatal,
+        injury_crashes=injury,
+        tow_crashes=tow,
+        total_crashes=fatal + injury + tow,
+        
+        # Inspection Data
+        vehicle_inspections=carrier.get("vehicleInsp"),
+        driver_inspections=carrier.get("driverInsp"),
+        vehicle_oos_rate=carrier.get("vehicleOosRate"),
+        driver_oos_rate=carrier.get("driverOosRate"),
+        
+        # Authority/Insurance
+        common_authority=carrier.get("commonAuthorityStatus"),
+        contract_authority=carrier.get("contractAuthorityStatus"),
+        broker_authority=carrier.get("brokerAuthorityStatus"),
+        insurance_bipd=carrier.get("bipdInsuranceOnFile"),
+        insurance_cargo=carrier.get("cargoInsuranceOnFile"),
+        insurance_bond=carrier.get("bondInsuranceOnFile"),
+        
+        # Cargo Types
+        cargo_carried=cargo_carried if cargo_carried else None,
+        
+        # Additional Info
+        complaint_count=carrier.get("complaintCount"),
+        mailing_address=mailing_address or None
+    )
+
+
+fmcsa = FMCSAClient()
@@ -0,0 +1,78 @@
+"""
+Geospatial helpers - GeoJSON points for 2dsphere indexes and distance math
+"""
+from typing import List, Optional, Tuple
+import math
+
+EARTH_RADIUS_MILES = 3959.0
+METERS_PER_MILE = 1609.344
+
+# (min_lng, min_lat, max_lng, max_lat)
+BBox = Tuple[float, float, float, float]
+
+# Grid that positions are snapped to when they may only be disclosed approximately (about 7 x 5 miles in the US)
+COARSE_CELL_DEGREES = 0.1
+# Furthest a position can be from its cell's center
+COARSE_CELL_SLACK_MILES = math.hypot(COARSE_CELL_DEGREES / 2, COARSE_CELL_DEGREES / 2) * math.pi / 180 * EARTH_RADIUS_MILES
+
+
+def geo_point(lat, lng) -> Optional[dict]:
+    """GeoJSON Point for a lat/lng pair, or None if either coordinate is missing or out of range"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse 'min_lng,min_lat,max_lng,max_lat' - raises ValueError if malformed"""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must have 4 comma-separated numbers")
+    min_lng, min_lat, max_lng, max_lat = parts
+    if not (-180 <= min_lng < max_lng <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat within valid ranges")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def bbox_polygon(bbox: BBox) -> dict:
+    """GeoJSON Polygon covering a bounding box, for $geoWithin on a 2dsphere index"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    ring: List[List[float]] = [
+        [min_lng, min_lat],
+        [max_lng, min_lat],
+        [max_lng, max_lat],
+        [min_lng, max_lat],
+        [min_lng, min_lat],
+    ]
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def haversine_miles(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in miles"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def coarse_point(lat: float, lng: float) -> Tuple[float, float]:
+    """(lat, lng) of the center of the COARSE_CELL_DEGREES grid cell a position falls in"""
+    return tuple(
+        round((math.floor(value / COARSE_CELL_DEGREES) + 0.5) * COARSE_CELL_DEGREES, 6)
+        for value in (lat, lng)
+    )
+
+
+def geo_near_stage(lat: float, lng: float, radius_miles: float, query: Optional[dict] = None, key: str = "current_position") -> dict:
+    """$geoNear aggregation stage (must be first in the pipeline) - adds distance_meters to each result"""
+    return {"$geoNear": {
+        "near": {"type": "Point", "coordinates": [lng, lat]},
+        "key": key,
+        "distanceField": "distance_meters",
+        "maxDistance": radius_miles * METERS_PER_MILE,
+        "spherical": True,
+        "query": query or {}
+    }}
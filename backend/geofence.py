@@ -0,0 +1,297 @@
+"""
+Geofence engine - detects driver arrival at / departure from pickup and delivery locations
+
+Whether a driver is inside a fence is kept on their driver_assignments document (geofence_inside.<kind>).
+The engine's in-memory copy only decides which pings are worth a write: apply_geofence_event claims each
+crossing with a conditional update on that field, so a crossing seen by two workers, or replayed after a
+restart, is logged and broadcast once.
+"""
+from pydantic import BaseModel
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from database import db
+from driver_assignments import refresh_assignments, write_through_to_booking
+from retrieval import SOURCES, schedule_index
+from geo import haversine_miles, METERS_PER_MILE
+from websocket_manager import manager
+import logging
+import math
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Fence radius, and how far past it a driver must go before we count a departure (stops GPS jitter flapping)
+GEOFENCE_RADIUS_METERS = float(os.environ.get("GEOFENCE_RADIUS_METERS", 300))
+GEOFENCE_EXIT_FACTOR = 1.5
+# Pings less accurate than this are ignored - a 2km error circle can't place a truck at a dock
+GEOFENCE_MAX_ACCURACY_METERS = float(os.environ.get("GEOFENCE_MAX_ACCURACY_METERS", 500))
+# How long a driver's fences are cached before being rebuilt from the database
+GEOFENCE_CACHE_SECONDS = float(os.environ.get("GEOFENCE_CACHE_SECONDS", 60))
+# Upper bound on fences evaluated per ping - keeps the ping endpoint constant-time
+MAX_FENCES_PER_DRIVER = 20
+
+# Driver-app statuses, used by pushed records and the loads collection
+DRIVER_ACTIVE_STATUSES = ["assigned", "dispatched", "en_route_pickup", "arrived_pickup", "loaded", "en_route_delivery"]
+# (fence kind, event) -> (statuses the load may be in, status to move it to)
+DRIVER_TRANSITIONS: Dict[Tuple[str, str], Tuple[List[str], str]] = {
+    ("pickup", "arrival"): (["assigned", "dispatched", "en_route_pickup"], "arrived_pickup"),
+    ("pickup", "departure"): (["loaded"], "en_route_delivery"),
+    ("delivery", "arrival"): (["loaded", "en_route_delivery"], "arrived_delivery"),
+}
+# Bookings assigned to a driver directly have no "loaded" step - leaving the pickup fence puts them in transit
+BOOKING_ACTIVE_STATUSES = ["planned", "dispatched", "in_transit_pickup", "at_pickup", "in_transit_delivery"]
+BOOKING_TRANSITIONS: Dict[Tuple[str, str], Tuple[List[str], str]] = {
+    ("pickup", "arrival"): (["planned", "dispatched", "in_transit_pickup"], "at_pickup"),
+    ("pickup", "departure"): (["at_pickup"], "in_transit_delivery"),
+    ("delivery", "arrival"): (["at_pickup", "in_transit_delivery"], "at_delivery"),
+}
+
+# Per assignment source - statuses that still need fences, and the transitions a crossing makes
+ACTIVE_LOAD_STATUSES: Dict[str, List[str]] = {
+    "driver_loads": DRIVER_ACTIVE_STATUSES,
+    "loads": DRIVER_ACTIVE_STATUSES,
+    "bookings": BOOKING_ACTIVE_STATUSES,
+}
+GEOFENCE_TRANSITIONS: Dict[str, Dict[Tuple[str, str], Tuple[List[str], str]]] = {
+    "driver_loads": DRIVER_TRANSITIONS,
+    "loads": DRIVER_TRANSITIONS,
+    "bookings": BOOKING_TRANSITIONS,
+}
+
+# Timestamp written alongside each automatic status change - actual_pickup_departure belongs to "loaded",
+# which the driver sets, so leaving the pickup fence afterwards doesn't overwrite it
+STATUS_TIMESTAMP_FIELDS = {
+    "arrived_pickup": "actual_pickup_arrival",
+    "arrived_delivery": "actual_delivery_arrival",
+    "at_pickup": "pickup_time_actual_in",
+    "in_transit_delivery": "pickup_time_actual_out",
+    "at_delivery": "delivery_time_actual_in",
+}
+
+
+class Fence(BaseModel):
+    """Circle around a load's pickup or delivery point"""
+    load_id: str
+    collection: str = "loads"
+    kind: str  # pickup | delivery
+    lat: float
+    lng: float
+    radius_m: float = GEOFENCE_RADIUS_METERS
+    # Stored inside/outside state when the fence was loaded - None if unknown
+    inside: Optional[bool] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.load_id}:{self.kind}"
+
+
+class GeofenceEvent(BaseModel):
+    """Driver crossed a fence boundary"""
+    driver_id: str
+    fence: Fence
+    event: str  # arrival | departure
+    distance_m: float
+    lat: float
+    lng: float
+
+
+FenceLoader = Callable[[str], Awaitable[List[Fence]]]
+EventHandler = Callable[[GeofenceEvent], Awaitable[None]]
+
+
+def meters_between(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    return haversine_miles(lat1, lng1, lat2, lng2) * METERS_PER_MILE
+
+
+def fences_for_load(load: dict, collection: str, inside: Optional[Dict[str, bool]] = None) -> List[Fence]:
+    """Build pickup/delivery fences from a load document - loads without coordinates get none"""
+    fences = []
+    radius_m = load.get("geofence_radius_m") or GEOFENCE_RADIUS_METERS
+    for kind in ("pickup", "delivery"):
+        lat, lng = load.get(f"{kind}_lat"), load.get(f"{kind}_lng")
+        if lat is None or lng is None:
+            continue
+        fences.append(Fence(
+            load_id=load["id"], collection=collection, kind=kind, lat=lat, lng=lng, radius_m=radius_m,
+            inside=None if inside is None else bool(inside.get(kind))
+        ))
+    return fences
+
+
+class DriverFences:
+    """A driver's cached fences plus which of them the driver is currently inside"""
+
+    def __init__(self, fences: List[Fence]):
+        self.fences = fences[:MAX_FENCES_PER_DRIVER]
+        self.inside: Dict[str, bool] = {}
+        self.loaded_at = time.monotonic()
+
+
+class GeofenceEngine:
+    """
+    Evaluates each ping only against the pinging driver's own fences (a handful per active load),
+    so per-ping cost doesn't grow with the number of loads in the system.
+    """
+
+    def __init__(self, load_fences: FenceLoader, on_event: EventHandler, cache_seconds: float = GEOFENCE_CACHE_SECONDS):
+        self.load_fences = load_fences
+        self.on_event = on_event
+        self.cache_seconds = cache_seconds
+        self.drivers: Dict[str, DriverFences] = {}
+
+    def invalidate(self, driver_id: str):
+        """Rebuild a driver's fences on the next ping - call after assignment or status changes"""
+        cached = self.drivers.get(driver_id)
+        if cached is not None:
+            cached.loaded_at = float("-inf")
+
+    async def _driver_fences(self, driver_id: str) -> DriverFences:
+        cached = self.drivers.get(driver_id)
+        if cached is not None and time.monotonic() - cached.loaded_at < self.cache_seconds:
+            return cached
+        entry = DriverFences(await self.load_fences(driver_id))
+        # Stored state wins - it may have been changed by another worker - else keep ours across the refresh
+        previous = cached.inside if cached is not None else {}
+        entry.inside = {
+            f.key: f.inside if f.inside is not None else previous[f.key]
+            for f in entry.fences if f.inside is not None or f.key in previous
+        }
+        self.drivers[driver_id] = entry
+        return entry
+
+    async def process_ping(self, driver_id: str, lat, lng, accuracy_m=None) -> List[GeofenceEvent]:
+        """Check a ping against the driver's fences and dispatch any arrival/departure events"""
+        try:
+            lat, lng = float(lat), float(lng)
+        except (TypeError, ValueError):
+            return []
+        if accuracy_m is not None and accuracy_m > GEOFENCE_MAX_ACCURACY_METERS:
+            return []
+
+        entry = await self._driver_fences(driver_id)
+        events = []
+        for fence in entry.fences:
+            exit_m = fence.radius_m * GEOFENCE_EXIT_FACTOR
+            # Cheap degree box check before the trig - most fences are far away
+            lat_deg = exit_m / 111_320
+            lng_deg = lat_deg / max(math.cos(math.radians(fence.lat)), 0.01)
+            was_inside = entry.inside.get(fence.key, False)
+            if abs(lat - fence.lat) > lat_deg or abs(lng - fence.lng) > lng_deg:
+                if was_inside:
+                    entry.inside[fence.key] = False
+                    events.append(GeofenceEvent(driver_id=driver_id, fence=fence, event="departure", distance_m=meters_between(lat, lng, fence.lat, fence.lng), lat=lat, lng=lng))
+                continue
+
+            distance_m = meters_between(lat, lng, fence.lat, fence.lng)
+            if not was_inside and distance_m <= fence.radius_m:
+                entry.inside[fence.key] = True
+                events.append(GeofenceEvent(driver_id=driver_id, fence=fence, event="arrival", distance_m=distance_m, lat=lat, lng=lng))
+            elif was_inside and distance_m > exit_m:
+                entry.inside[fence.key] = False
+                events.append(GeofenceEvent(driver_id=driver_id, fence=fence, event="departure", distance_m=distance_m, lat=lat, lng=lng))
+
+        for event in events:
+            try:
+                await self.on_event(event)
+            except Exception as e:
+                logger.error(f"Error handling geofence {event.event} for load {event.fence.load_id}: {e}")
+        return events
+
+
+async def load_driver_fences(driver_id: str) -> List[Fence]:
+    """
+    Fences for every active load assigned to a driver, from the driver_assignments view - its load snapshot
+    carries the booking's stop coordinates, pushed records included
+    """
+    active = [{"source": source, "status": {"$in": statuses}} for source, statuses in ACTIVE_LOAD_STATUSES.items()]
+    assignments = await db.driver_assignments.find(
+        {"driver_user_id": driver_id, "$or": active},
+        {"_id": 0, "source": 1, "load_id": 1, "load.pickup_lat": 1, "load.pickup_lng": 1,
+         "load.delivery_lat": 1, "load.delivery_lng": 1, "load.geofence_radius_m": 1, "geofence_inside": 1}
+    ).to_list(MAX_FENCES_PER_DRIVER)
+    fences = []
+    for assignment in assignments:
+        fences.extend(fences_for_load(
+            {**assignment["load"], "id": assignment["load_id"]},
+            assignment["source"],
+            assignment.get("geofence_inside") or {}
+        ))
+    return fences
+
+
+async def apply_geofence_event(event: GeofenceEvent):
+    """Log the crossing, advance the load status when the workflow allows it, and tell the fleet dashboards"""
+    now = datetime.now(timezone.utc)
+    fence = event.fence
+    new_status = None
+    previous_status = None
+
+    # Claim the crossing - if another worker (or this one before a restart) already recorded it, nothing matches
+    arrived = event.event == "arrival"
+    state_field = f"geofence_inside.{fence.kind}"
+    claimed = await db.driver_assignments.update_one(
+        {"driver_user_id": event.driver_id, "load_id": fence.load_id, state_field: {"$ne": True} if arrived else True},
+        {"$set": {state_field: arrived}}
+    )
+    if not claimed.matched_count:
+        return
+
+    transition = GEOFENCE_TRANSITIONS.get(fence.collection, {}).get((fence.kind, event.event))
+    if transition:
+        from_statuses, to_status = transition
+        update_data = {
+            "status": to_status,
+            "last_status_update": now,
+            "last_status_note": f"Automatic - geofence {event.event} at {fence.kind}"
+        }
+        timestamp_field = STATUS_TIMESTAMP_FIELDS.get(to_status)
+        if timestamp_field:
+            update_data[timestamp_field] = now
+
+        # Conditional update - if another worker already applied this crossing, nothing matches
+        before = await db[fence.collection].find_one_and_update(
+            {"id": fence.load_id, "status": {"$in": from_statuses}},
+            {"$set": update_data},
+            projection={"_id": 0, "status": 1}
+        )
+        if before:
+            previous_status = before.get("status")
+            new_status = to_status
+            await refresh_assignments(fence.collection, fence.load_id)
+            if fence.collection in SOURCES:
+                schedule_index(fence.collection, fence.load_id)
+            await write_through_to_booking(fence.collection, fence.load_id, update_data)
+
+    await db.load_status_events.insert_one({
+        "id": str(uuid.uuid4()),
+        "load_id": fence.load_id,
+        "driver_id": event.driver_id,
+        "event_type": f"geofence_{fence.kind}_{event.event}",
+        "previous_status": previous_status,
+        "new_status": new_status,
+        "latitude": event.lat,
+        "longitude": event.lng,
+        "distance_m": round(event.distance_m, 1),
+        "source": "geofence",
+        "created_at": now
+    })
+
+    # Only the driver's own fleet's dashboards hear about it
+    driver = await db.users.find_one({"id": event.driver_id}, {"_id": 0, "fleet_owner_id": 1})
+    await manager.broadcast_status_update({
+        "type": "geofence",
+        "load_id": fence.load_id,
+        "driver_id": event.driver_id,
+        "fence": fence.kind,
+        "event": event.event,
+        "status": new_status,
+        "latitude": event.lat,
+        "longitude": event.lng,
+        "timestamp": now.isoformat()
+    }, (driver or {}).get("fleet_owner_id") or event.driver_id)
+
+
+# Shared engine for the app - status changes are conditional, so a crossing seen on two workers advances a load once
+geofence_engine = GeofenceEngine(load_driver_fences, apply_geofence_event)
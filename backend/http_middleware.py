@@ -0,0 +1,262 @@
+"""
+HTTP middleware - response compression and conditional GETs
+
+ConditionalGetMiddleware gives buffered GET responses a weak ETag and answers a matching
+If-None-Match with 304, so polling clients only download data that changed. CompressionMiddleware
+then compresses responses above a size threshold with brotli (when installed) or gzip; streamed
+bodies are compressed chunk by chunk, and server-sent events are left alone.
+
+Both are configurable per route with the http_cache decorator.
+"""
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Callable, List, Optional
+import hashlib
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+# Brotli quality 4 compresses better than gzip -6 at similar speed - higher levels are for static assets
+BROTLI_QUALITY = 4
+# Larger bodies go out without an ETag rather than being held in memory to hash
+ETAG_MAX_BYTES = int(os.environ.get("ETAG_MAX_BYTES", 10 * 1024 * 1024))
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+COMPRESSIBLE_TYPES = [
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/csv",
+    "text/html",
+    "text/plain",
+    "text/css",
+]
+
+
+class HttpCachePolicy:
+    def __init__(self, etag: bool = True, compress: bool = True, cache_control: Optional[str] = None):
+        self.etag = etag
+        self.compress = compress
+        self.cache_control = cache_control or DEFAULT_CACHE_CONTROL
+
+
+DEFAULT_POLICY = HttpCachePolicy()
+
+
+def http_cache(etag: bool = True, compress: bool = True, cache_control: Optional[str] = None) -> Callable:
+    """Per-route override - put it under the @router decorator"""
+    def decorate(endpoint: Callable) -> Callable:
+        endpoint.http_cache_policy = HttpCachePolicy(etag, compress, cache_control)
+        return endpoint
+    return decorate
+
+
+def route_policy(scope: Scope) -> HttpCachePolicy:
+    # The router puts the matched endpoint in scope before the response starts
+    return getattr(scope.get("endpoint"), "http_cache_policy", DEFAULT_POLICY)
+
+
+def weak_etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison - W/"x" and "x" are the same tag"""
+    if not header:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app: ASGIApp, max_body: int = ETAG_MAX_BYTES):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        buffering = False
+
+        async def send_with_etag(message: Message):
+            nonlocal start, buffering
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                length = headers.get("content-length")
+                buffering = (
+                    message["status"] == 200
+                    and "etag" not in headers
+                    and length is not None and int(length) <= self.max_body
+                    and route_policy(scope).etag
+                )
+                if buffering:
+                    start = message
+                else:
+                    await send(message)
+                return
+
+            if not buffering:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            policy = route_policy(scope)
+            etag = f'W/"{hashlib.md5(body).hexdigest()}"'
+            headers = MutableHeaders(raw=start["headers"])
+            headers["ETag"] = etag
+            headers.setdefault("Cache-Control", policy.cache_control)
+
+            if weak_etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                if "content-type" in headers:
+                    del headers["content-type"]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_with_etag)
+
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """br if the client takes it and brotli is installed, else gzip, else None"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        quality = params.strip()
+        try:
+            if quality.startswith("q=") and float(quality[2:]) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class Encoder:
+    """Incremental compressor - flush() after each streamed chunk so clients see data as it's sent"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            out = self.compressor.process(data)
+            return out + self.compressor.flush() if flush else out
+        out = self.compressor.compress(data)
+        return out + self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        encoder: Optional[Encoder] = None
+        # None until the response starts; then "buffer" (known length), "stream" or "skip"
+        mode = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, encoder, mode
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                length = headers.get("content-length")
+                if (
+                    message["status"] not in (200, 201, 203)
+                    or "content-encoding" in headers
+                    or not compressible(headers)
+                    or not route_policy(scope).compress
+                    or (length is not None and int(length) < self.minimum_size)
+                ):
+                    mode = "skip"
+                    await send(message)
+                    return
+                start = message
+                encoder = Encoder(encoding)
+                mode = "buffer" if length is not None else "stream"
+                if mode == "stream":
+                    await send(self._encoded_start(start, encoding, None))
+                return
+
+            if mode == "skip":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if mode == "buffer":
+                chunks.append(body)
+                if more_body:
+                    return
+                compressed = encoder.compress(b"".join(chunks)) + encoder.finish()
+                await send(self._encoded_start(start, encoding, len(compressed)))
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            # Streamed - flush each chunk so ndjson exports keep arriving incrementally
+            compressed = encoder.compress(body, flush=more_body)
+            if not more_body:
+                compressed += encoder.finish()
+            await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _encoded_start(start: Message, encoding: str, length: Optional[int]) -> Message:
+        headers = MutableHeaders(raw=list(start["headers"]))
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            if "content-length" in headers:
+                del headers["content-length"]
+        else:
+            headers["Content-Length"] = str(length)
+        return {**start, "headers": headers.raw}
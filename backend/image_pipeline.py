@@ -0,0 +1,245 @@
+"""
+Upload image processing - auto-orient, strip EXIF, recompress, thumbnails and PDF bundles
+
+Pillow work runs in a thread pool so the event loop keeps serving requests. Derived images are
+cached in the blob_derivatives collection keyed by the source content hash, so the same photo is
+only ever processed once.
+"""
+from fastapi import HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional
+from database import db
+from blob_store import blob_store, upload_chunks
+import asyncio
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# Long edge of stored photos - plenty for reading a BOL, a fraction of a 12MP phone shot
+NORMALIZED_MAX_DIMENSION = int(os.environ.get("NORMALIZED_MAX_DIMENSION", 2400))
+NORMALIZED_QUALITY = int(os.environ.get("NORMALIZED_QUALITY", 82))
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 70
+# Refuse to decode anything bigger than this - guards the pool against decompression bombs
+MAX_IMAGE_PIXELS = 60_000_000
+# PDF bundles decode every page before writing, so they are capped in pages and source bytes
+MAX_BUNDLE_PAGES = int(os.environ.get("MAX_BUNDLE_PAGES", 30))
+MAX_BUNDLE_BYTES = int(os.environ.get("MAX_BUNDLE_BYTES", 50 * 1024 * 1024))
+
+IMAGE_CONTENT_TYPES = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
+# Photos are decoded in memory, so they get a cap; other files stream straight to the blob store
+MAX_IMAGE_UPLOAD_BYTES = 25 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-pipeline")
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def is_image(content_type: Optional[str]) -> bool:
+    return (content_type or "").lower() in IMAGE_CONTENT_TYPES
+
+
+def stored_filename(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """The upload's filename with its extension matching the stored content type - PNGs re-encoded to JPEG become .jpg"""
+    if not filename or not content_type or mimetypes.guess_type(filename)[0] == content_type:
+        return filename
+    extension = mimetypes.guess_extension(content_type)
+    return f"{os.path.splitext(filename)[0]}{extension}" if extension else filename
+
+
+def _open_image(data: bytes, max_dimension: Optional[int] = None):
+    from PIL import Image, ImageOps
+
+    # open() only reads the header, so the size is known before any pixels are decoded
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"Image is {width}x{height} pixels, over the {MAX_IMAGE_PIXELS:,} pixel limit")
+    if max_dimension:
+        # JPEGs decode straight at a reduced scale (no smaller than max_dimension) instead of at full size
+        image.draft("RGB", (max_dimension, max_dimension))
+    # Apply the EXIF orientation to the pixels - the tag itself is dropped on save
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def _save_jpeg(image, quality: int) -> bytes:
+    out = io.BytesIO()
+    # No exif= argument, so GPS and camera metadata are not written
+    image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def normalize_image(data: bytes, max_dimension: int = NORMALIZED_MAX_DIMENSION, quality: int = NORMALIZED_QUALITY) -> bytes:
+    """Upright, EXIF-free JPEG no larger than max_dimension on its long edge"""
+    image = _open_image(data, max_dimension)
+    image.thumbnail((max_dimension, max_dimension))
+    return _save_jpeg(image, quality)
+
+
+def make_thumbnail(data: bytes, size: int = THUMBNAIL_SIZE) -> bytes:
+    image = _open_image(data, size)
+    image.thumbnail((size, size))
+    return _save_jpeg(image, THUMBNAIL_QUALITY)
+
+
+def bundle_pdf(images: List[bytes], max_dimension: int = NORMALIZED_MAX_DIMENSION) -> bytes:
+    """One PDF page per image, in order - pages are decoded downscaled like stored photos so memory stays bounded"""
+    pages = []
+    for data in images:
+        page = _open_image(data, max_dimension)
+        page.thumbnail((max_dimension, max_dimension))
+        pages.append(page)
+    out = io.BytesIO()
+    pages[0].save(out, format="PDF", save_all=True, append_images=pages[1:], resolution=150)
+    return out.getvalue()
+
+
+async def run_in_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def cached_derivative(source_sha256: str, variant: str) -> Optional[dict]:
+    return await db.blob_derivatives.find_one(
+        {"source_sha256": source_sha256, "variant": variant},
+        {"_id": 0}
+    )
+
+
+async def store_derivative(source_sha256: str, variant: str, data: bytes, content_type: str) -> dict:
+    blob = await blob_store.put_bytes(data)
+    derivative = {
+        "source_sha256": source_sha256,
+        "variant": variant,
+        "sha256": blob.sha256,
+        "size": blob.size,
+        "content_type": content_type,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.blob_derivatives.update_one(
+        {"source_sha256": source_sha256, "variant": variant},
+        {"$setOnInsert": derivative},
+        upsert=True
+    )
+    return derivative
+
+
+async def derive(source_sha256: str, variant: str, func, data: bytes, content_type: str = "image/jpeg") -> dict:
+    """Cached derivative of a blob - computed in the pool on first use"""
+    cached = await cached_derivative(source_sha256, variant)
+    if cached:
+        return cached
+    return await store_derivative(source_sha256, variant, await run_in_pool(func, data), content_type)
+
+
+async def process_image_upload(data: bytes) -> dict:
+    """
+    Normalize an uploaded photo and build its thumbnail.
+    Returns blob_sha256/file_size/content_type for the stored image plus thumbnail_sha256.
+    """
+    source_sha256 = hashlib.sha256(data).hexdigest()
+    normalized = await derive(source_sha256, "normalized", normalize_image, data)
+    thumbnail = await cached_derivative(source_sha256, f"thumb_{THUMBNAIL_SIZE}")
+    if not thumbnail:
+        # Thumbnail from the normalized image - already upright and a fraction of the pixels
+        normalized_data = await blob_store.read(normalized["sha256"])
+        thumbnail = await store_derivative(
+            source_sha256,
+            f"thumb_{THUMBNAIL_SIZE}",
+            await run_in_pool(make_thumbnail, normalized_data),
+            "image/jpeg"
+        )
+    return {
+        "blob_sha256": normalized["sha256"],
+        "file_size": normalized["size"],
+        "content_type": "image/jpeg",
+        "thumbnail_sha256": thumbnail["sha256"]
+    }
+
+
+async def thumbnail_for_blob(sha256: str) -> str:
+    """Thumbnail hash for an already-stored image blob (documents uploaded before the pipeline)"""
+    variant = f"thumb_{THUMBNAIL_SIZE}"
+    cached = await cached_derivative(sha256, variant)
+    if cached:
+        return cached["sha256"]
+    data = await blob_store.read(sha256)
+    try:
+        thumbnail = await run_in_pool(make_thumbnail, data)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return (await store_derivative(sha256, variant, thumbnail, "image/jpeg"))["sha256"]
+
+
+def has_thumbnail(record) -> bool:
+    """Whether a thumbnail exists or can be built for a stored document/receipt"""
+    return bool(record.thumbnail_sha256) or (bool(record.blob_sha256) and is_image(record.content_type))
+
+
+async def ensure_thumbnail(record, repository) -> Optional[str]:
+    """Thumbnail hash for a stored file, building and recording it on first request"""
+    if record.thumbnail_sha256:
+        return record.thumbnail_sha256
+    if not has_thumbnail(record):
+        return None
+    sha256 = await thumbnail_for_blob(record.blob_sha256)
+    await repository.set_thumbnail(record.id, sha256)
+    return sha256
+
+
+async def pdf_bundle_for_blobs(sha256s: List[str]) -> dict:
+    """PDF with one page per image blob - cached under a hash of the ordered source hashes"""
+    bundle_key = hashlib.sha256(",".join(sha256s).encode()).hexdigest()
+    cached = await cached_derivative(bundle_key, "pdf_bundle")
+    if cached:
+        return cached
+    if len(sha256s) > MAX_BUNDLE_PAGES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BUNDLE_PAGES} images per bundle - filter by document type")
+    total = sum([await blob_store.size(sha256) or 0 for sha256 in sha256s])
+    if total > MAX_BUNDLE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Images total over {MAX_BUNDLE_BYTES // (1024 * 1024)}MB - filter by document type")
+    images = [await blob_store.read(sha256) for sha256 in sha256s]
+    try:
+        pdf = await run_in_pool(bundle_pdf, images)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await store_derivative(bundle_key, "pdf_bundle", pdf, "application/pdf")
+
+
+async def store_upload_bytes(data: bytes, content_type: Optional[str], filename: Optional[str] = None) -> dict:
+    """
+    Store upload bytes - photos are normalized with a thumbnail, anything else is kept as-is.
+    The result carries the filename to record, its extension rewritten if the photo was re-encoded.
+    """
+    if is_image(content_type):
+        try:
+            stored = await process_image_upload(data)
+            if stored["content_type"] != content_type:
+                filename = stored_filename(filename, stored["content_type"])
+            return {**stored, "filename": filename}
+        except Exception as e:
+            # Corrupt or exotic images are still worth keeping - store the original untouched
+            logger.warning(f"Image normalization failed, storing original: {e}")
+    blob = await blob_store.put_bytes(data)
+    return {"blob_sha256": blob.sha256, "file_size": blob.size, "content_type": content_type, "filename": filename}
+
+
+async def store_upload(file) -> dict:
+    """Store a FastAPI UploadFile - photos go through the pipeline, other files stream in chunks"""
+    if is_image(file.content_type):
+        data = await file.read(MAX_IMAGE_UPLOAD_BYTES + 1)
+        if len(data) > MAX_IMAGE_UPLOAD_BYTES:
+            raise ValueError(f"Images must be under {MAX_IMAGE_UPLOAD_BYTES // (1024 * 1024)}MB")
+        return await store_upload_bytes(data, file.content_type, file.filename)
+    blob = await blob_store.put_stream(upload_chunks(file))
+    return {"blob_sha256": blob.sha256, "file_size": blob.size, "content_type": file.content_type, "filename": file.filename}
@@ -0,0 +1,189 @@
+"""
+Background batch jobs - one job document with progress counters, one result document per item
+
+create_job() stores a "queued" job and the request returns it; run_job() then works through the items in a
+BackgroundTask with a fixed pool of workers. Results are written in batches and each batch bumps the job's
+counters, so clients can poll progress and page through results while the rest is still running.
+
+Jobs run in the process that accepted them, so a restart or crash strands them. While a job runs its
+heartbeat_at is refreshed every JOB_HEARTBEAT_SECONDS; job_reaper marks jobs whose heartbeat has gone stale
+as failed - once at startup and then periodically, which also catches jobs of instances that went away.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from database import db
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_HEARTBEAT_SECONDS = int(os.environ.get("JOB_HEARTBEAT_SECONDS", 30))
+# A queued or running job whose heartbeat is older than this has lost its worker
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 4 * JOB_HEARTBEAT_SECONDS))
+
+ACTIVE_JOB_STATUSES = ["queued", "running"]
+INTERRUPTED_ERROR = "Interrupted before it finished - the server restarted. Please submit the batch again."
+
+
+async def create_job(jobs, owner_id: str, total: int, result_statuses: Sequence[str], **fields) -> dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "owner_id": owner_id,
+        **fields,
+        "status": "queued",
+        "total": total,
+        "processed": 0,
+        "counts": {status: 0 for status in result_statuses},
+        "created_at": now,
+        "heartbeat_at": now,
+        "started_at": None,
+        "completed_at": None
+    }
+    await jobs.insert_one(dict(job))
+    return job
+
+
+async def _heartbeat(jobs, job_id: str):
+    # A missed beat is logged and retried - if the loop died, the reaper would fail a job that is still running
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await jobs.update_one({"id": job_id}, {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logger.error(f"Heartbeat for job {job_id} failed: {e}")
+
+
+async def run_job(
+    jobs,
+    results,
+    job_id: str,
+    items: List[Any],
+    handle: Callable[[Any], Awaitable[dict]],
+    concurrency: int,
+    flush_size: int = 1
+):
+    """
+    Run handle() over every item with `concurrency` workers. handle returns the item's result document (with a
+    "status") and should not raise - if it does, the other workers are cancelled and the job is marked failed.
+    Results are saved with job_id and position every flush_size items.
+    """
+    await jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "running", "started_at": datetime.now(timezone.utc), "heartbeat_at": datetime.now(timezone.utc)}}
+    )
+    queue: asyncio.Queue = asyncio.Queue()
+    for position, item in enumerate(items):
+        queue.put_nowait((position, item))
+
+    pending: List[dict] = []
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        async with flush_lock:
+            if not pending:
+                return
+            batch = pending[:]
+            pending.clear()
+            await results.insert_many(batch)
+            counts: Dict[str, int] = {}
+            for result in batch:
+                counts[f"counts.{result['status']}"] = counts.get(f"counts.{result['status']}", 0) + 1
+            await jobs.update_one(
+                {"id": job_id},
+                {"$inc": {"processed": len(batch), **counts}, "$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+            )
+
+    async def worker():
+        while True:
+            try:
+                position, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = await handle(item)
+            pending.append({"job_id": job_id, "position": position, **result})
+            if len(pending) >= flush_size:
+                await flush()
+
+    heartbeat = asyncio.create_task(_heartbeat(jobs, job_id))
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)) or 1)]
+    try:
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # One worker failed - stop the rest before the job is marked failed, so nothing writes after that
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        await flush()
+        await jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}}
+        )
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        await jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "completed_at": datetime.now(timezone.utc)}}
+        )
+    finally:
+        heartbeat.cancel()
+
+
+async def fail_interrupted_jobs(jobs, now: Optional[datetime] = None) -> int:
+    """Mark queued/running jobs whose worker is gone as failed - returns how many"""
+    now = now or datetime.now(timezone.utc)
+    result = await jobs.update_many(
+        {"status": {"$in": ACTIVE_JOB_STATUSES}, "heartbeat_at": {"$lt": now - timedelta(seconds=JOB_STALE_SECONDS)}},
+        {"$set": {"status": "failed", "error": INTERRUPTED_ERROR, "completed_at": now}}
+    )
+    return result.modified_count
+
+
+class JobReaper:
+    """Periodically fails jobs stranded by a restart, for every registered jobs collection"""
+
+    def __init__(self):
+        self.collections: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, collection: str):
+        if collection not in self.collections:
+            self.collections.append(collection)
+
+    async def run_once(self) -> int:
+        count = 0
+        for collection in self.collections:
+            try:
+                failed = await fail_interrupted_jobs(db[collection])
+            except Exception as e:
+                logger.error(f"Job reaper failed for {collection}: {e}")
+                continue
+            if failed:
+                logger.warning(f"Marked {failed} interrupted job(s) in {collection} as failed")
+            count += failed
+        return count
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(JOB_STALE_SECONDS)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+job_reaper = JobReaper()
@@ -0,0 +1,774 @@
+"""
+LLM gateway - every model call in the API goes through here
+
+Routes name a feature ("receipt_parse", "tms_chat", ...) and LLM_PROFILES maps it to a provider, model and
+default parameters. The gateway keeps one long-lived client per provider, bounds concurrency globally and
+per tenant (callers queue up to LLM_QUEUE_TIMEOUT_SECONDS, then get a 503), puts a timeout on every attempt,
+retries throttling/timeouts/5xx with jittered exponential backoff, and writes one llm_calls document per
+call with token counts and latency.
+
+Chat features can also stream: `llm.stream(...)` yields text deltas as the provider sends them (retries only
+happen before the first token) and `chat_event_stream` forwards them as server-sent events. Closing a stream
+early closes the upstream response, so a client that goes away stops the generation it started.
+
+`llm.embed(...)` turns texts into vectors for retrieval, under the same slots, retries and accounting.
+
+Providers: "openai" (pooled AsyncOpenAI), "emergent" (the emergentintegrations universal key - the SDK has no
+client to pool, so only concurrency, timeouts and accounting apply), "local" (feature-hashing embeddings, no
+network) and "fake" (scripted, for offline tests). LLM_PROVIDER_OVERRIDE=fake routes every call to the fake
+provider.
+"""
+from fastapi import HTTPException
+from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from database import db
+import asyncio
+import base64
+import hashlib
+import httpx
+import json
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
+EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY", "")
+LLM_PROVIDER_OVERRIDE = os.environ.get("LLM_PROVIDER_OVERRIDE")
+
+# In-flight calls across the worker, and per tenant so one company's upload burst can't take every slot
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+LLM_TENANT_CONCURRENCY = int(os.environ.get("LLM_TENANT_CONCURRENCY", 4))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+# Per attempt - a retried call can take up to (LLM_MAX_RETRIES + 1) times this plus backoff
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 60))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_SECONDS = 0.5
+LLM_RETRY_MAX_SECONDS = 8.0
+# Rough chars-per-token for providers that don't report usage
+CHARS_PER_TOKEN = 4
+
+# "local" embeds with feature hashing - no API calls, lower recall than a trained model
+RETRIEVAL_EMBEDDING_PROVIDER = os.environ.get("RETRIEVAL_EMBEDDING_PROVIDER", "openai")
+LOCAL_EMBEDDING_DIMENSIONS = 384
+EMBEDDING_MODELS = {"openai": "text-embedding-3-small", "local": f"hashing-{LOCAL_EMBEDDING_DIMENSIONS}"}
+
+LLM_PROFILES: Dict[str, Dict[str, Any]] = {
+    "tms_chat": {"provider": "openai", "model": "gpt-4o", "temperature": 0.7, "max_tokens": 1000},
+    "chat_summary": {"provider": "openai", "model": "gpt-4o-mini", "temperature": 0.2, "max_tokens": 600},
+    "driver_assistant": {"provider": "emergent", "model": "openai/gpt-5.2"},
+    "rate_confirmation": {"provider": "emergent", "model": "gemini/gemini-2.0-flash"},
+    "receipt_parse": {"provider": "emergent", "model": "openai/gpt-4o"},
+    "retrieval_embedding": {"provider": RETRIEVAL_EMBEDDING_PROVIDER, "model": EMBEDDING_MODELS.get(RETRIEVAL_EMBEDDING_PROVIDER, EMBEDDING_MODELS["openai"])},
+}
+
+# Substrings of provider errors worth retrying when the SDK doesn't give us a status code
+TRANSIENT_ERROR_MARKERS = ["timeout", "timed out", "rate limit", "429", "500", "502", "503", "504", "overloaded", "connection"]
+
+
+class Attachment(BaseModel):
+    mime_type: str
+    data: bytes
+    filename: Optional[str] = None
+
+    @property
+    def is_image(self) -> bool:
+        return self.mime_type.startswith("image/")
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+
+class LLMRequest(BaseModel):
+    feature: str
+    provider: str
+    model: str
+    prompt: str
+    system: str = ""
+    # Earlier turns, oldest first - {"role": "user"|"assistant", "content": str}
+    history: List[Dict[str, str]] = []
+    attachments: List[Attachment] = []
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+
+class LLMResult(BaseModel):
+    text: str
+    provider: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    estimated_usage: bool = False
+    latency_ms: float
+    attempts: int
+    # Streamed calls only - what the user waits for before text starts appearing
+    first_token_ms: Optional[float] = None
+
+
+class LLMError(Exception):
+    """Provider failure - retryable errors are retried by the gateway, the rest surface as status_code"""
+
+    def __init__(self, message: str, retryable: bool = False, status_code: int = 502):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
+
+def is_transient(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+def estimate_tokens(*texts: str) -> int:
+    return max(1, sum(len(t or "") for t in texts) // CHARS_PER_TOKEN)
+
+
+# Words too common to say what a text is about
+STOPWORDS = frozenset(
+    "a an and are at be by can do does for from has have how i in is it me my of on or our the their this to "
+    "was we what when where which who why will with you your".split()
+)
+
+
+def hash_embedding(text: str, dimensions: int = LOCAL_EMBEDDING_DIMENSIONS) -> List[float]:
+    """Signed feature hashing of words and word pairs, unit length - texts sharing terms score high"""
+    words = [w for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if w not in STOPWORDS]
+    vector = [0.0] * dimensions
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        vector[value % dimensions] += 1.0 if value >> 63 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def llm_tenant(user) -> str:
+    """Tenant a user's calls count against - drivers share their fleet owner's budget"""
+    return getattr(user, "fleet_owner_id", None) or user.id
+
+
+# ==================== PROVIDERS ====================
+
+class OpenAIProvider:
+    """One AsyncOpenAI client (and connection pool) for the worker - retries are left to the gateway"""
+
+    name = "openai"
+
+    def __init__(self, api_key: str = OPENAI_API_KEY, base_url: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=LLM_TIMEOUT_SECONDS,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY),
+                    transport=self.transport
+                )
+            )
+        return self._client
+
+    def messages(self, request: LLMRequest) -> List[dict]:
+        messages = [{"role": "system", "content": request.system}] if request.system else []
+        messages.extend({"role": m["role"], "content": m["content"]} for m in request.history)
+        if not request.attachments:
+            messages.append({"role": "user", "content": request.prompt})
+            return messages
+        content: List[dict] = [{"type": "text", "text": request.prompt}]
+        for attachment in request.attachments:
+            data_url = f"data:{attachment.mime_type};base64,{attachment.base64()}"
+            if attachment.is_image:
+                content.append({"type": "image_url", "image_url": {"url": data_url}})
+            else:
+                content.append({"type": "file", "file": {"filename": attachment.filename or "document", "file_data": data_url}})
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def params(self, request: LLMRequest) -> Dict[str, Any]:
+        if not self.api_key:
+            raise LLMError("OpenAI API key not configured", status_code=500)
+        params: Dict[str, Any] = {"model": request.model, "messages": self.messages(request)}
+        if request.temperature is not None:
+            params["temperature"] = request.temperature
+        if request.max_tokens is not None:
+            params["max_tokens"] = request.max_tokens
+        return params
+
+    def error(self, e: Exception) -> LLMError:
+        import openai
+
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError)):
+            return LLMError(str(e), retryable=True, status_code=504)
+        if isinstance(e, openai.APIStatusError):
+            return LLMError(str(e), retryable=e.status_code == 429 or e.status_code >= 500, status_code=502)
+        return LLMError(str(e), retryable=is_transient(e))
+
+    async def complete(self, request: LLMRequest) -> Tuple[str, Optional[Tuple[int, int]]]:
+        import openai
+
+        try:
+            completion = await self.client.chat.completions.create(**self.params(request))
+        except (openai.APIError, httpx.TransportError) as e:
+            raise self.error(e)
+
+        usage = completion.usage
+        return completion.choices[0].message.content or "", (usage.prompt_tokens, usage.completion_tokens) if usage else None
+
+    async def stream(self, request: LLMRequest) -> AsyncIterator[Tuple[str, Optional[Tuple[int, int]]]]:
+        """(text delta, usage) pairs - usage arrives once, on the last chunk"""
+        import openai
+
+        try:
+            chunks = await self.client.chat.completions.create(**self.params(request), stream=True, stream_options={"include_usage": True})
+        except (openai.APIError, httpx.TransportError) as e:
+            raise self.error(e)
+        try:
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                usage = (chunk.usage.prompt_tokens, chunk.usage.completion_tokens) if chunk.usage else None
+                if delta or usage:
+                    yield delta or "", usage
+        except (openai.APIError, httpx.TransportError) as e:
+            raise self.error(e)
+        finally:
+            # Drops the connection when the caller stops early, which ends the generation upstream
+            await chunks.close()
+
+    async def embed(self, request: LLMRequest, texts: List[str]) -> Tuple[List[List[float]], Optional[int]]:
+        """(one vector per text, input tokens)"""
+        import openai
+
+        if not self.api_key:
+            raise LLMError("OpenAI API key not configured", status_code=500)
+        try:
+            response = await self.client.embeddings.create(model=request.model, input=texts)
+        except (openai.APIError, httpx.TransportError) as e:
+            raise self.error(e)
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        return vectors, response.usage.prompt_tokens if response.usage else None
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class EmergentProvider:
+    """emergentintegrations LlmChat - model is "<vendor>/<model>", e.g. "gemini/gemini-2.0-flash" """
+
+    name = "emergent"
+
+    def __init__(self, api_key: str = EMERGENT_LLM_KEY):
+        self.api_key = api_key
+
+    async def complete(self, request: LLMRequest) -> Tuple[str, Optional[Tuple[int, int]]]:
+        if not self.api_key:
+            raise LLMError("LLM API key not configured", status_code=500)
+        try:
+            from emergentintegrations.llm.chat import FileContentWithMimeType, ImageContent, LlmChat, UserMessage
+        except ImportError as e:
+            raise LLMError(f"AI integration not configured: {e}", status_code=500)
+
+        vendor, model = request.model.split("/", 1)
+        system = request.system
+        if request.history:
+            # LlmChat keeps history per instance - earlier turns ride along in the system message instead
+            transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in request.history)
+            system = f"{system}\n\nConversation so far:\n{transcript}"
+        chat = LlmChat(api_key=self.api_key, session_id=f"{request.feature}-{uuid.uuid4()}", system_message=system).with_model(vendor, model)
+
+        temp_paths = []
+        try:
+            file_contents = []
+            for attachment in request.attachments:
+                if attachment.is_image:
+                    file_contents.append(ImageContent(image_base64=attachment.base64()))
+                    continue
+                suffix = os.path.splitext(attachment.filename or "")[1]
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+                    temp_file.write(attachment.data)
+                    temp_paths.append(temp_file.name)
+                file_contents.append(FileContentWithMimeType(file_path=temp_file.name, mime_type=attachment.mime_type))
+
+            message = UserMessage(text=request.prompt, file_contents=file_contents) if file_contents else UserMessage(text=request.prompt)
+            try:
+                text = await chat.send_message(message)
+            except Exception as e:
+                raise LLMError(str(e), retryable=is_transient(e))
+            return text or "", None
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    async def stream(self, request: LLMRequest) -> AsyncIterator[Tuple[str, Optional[Tuple[int, int]]]]:
+        """LlmChat has no streaming API - the whole reply arrives as one delta"""
+        yield await self.complete(request)
+
+    async def embed(self, request: LLMRequest, texts: List[str]) -> Tuple[List[List[float]], Optional[int]]:
+        raise LLMError("Embeddings are not available through the universal key", status_code=500)
+
+    async def close(self):
+        pass
+
+
+class LocalProvider:
+    """Embeddings computed in-process with hash_embedding - for offline deployments and tests"""
+
+    name = "local"
+
+    async def complete(self, request: LLMRequest) -> Tuple[str, Optional[Tuple[int, int]]]:
+        raise LLMError("The local provider only embeds text", status_code=500)
+
+    async def stream(self, request: LLMRequest) -> AsyncIterator[Tuple[str, Optional[Tuple[int, int]]]]:
+        yield await self.complete(request)
+
+    async def embed(self, request: LLMRequest, texts: List[str]) -> Tuple[List[List[float]], Optional[int]]:
+        return [hash_embedding(text) for text in texts], None
+
+    async def close(self):
+        pass
+
+
+class FakeProvider:
+    """
+    Scripted provider for offline tests. Answers come from `responses` in order (then `default`), or from
+    `handler(request)`; queued `failures` are raised first. Every request is kept in `calls`. Streams send
+    the answer a word at a time, `chunk_delay` apart; streams closed before the end are counted in `aborted`.
+    Embeddings are hash_embedding vectors, and every embedded text is kept in `embedded`.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        responses: Optional[List[str]] = None,
+        handler: Optional[Callable[[LLMRequest], str]] = None,
+        default: str = "{}",
+        delay: float = 0.0,
+        chunk_delay: float = 0.0
+    ):
+        self.responses = list(responses or [])
+        self.handler = handler
+        self.default = default
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        self.failures: List[Exception] = []
+        self.calls: List[LLMRequest] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.aborted = 0
+        self.embedded: List[str] = []
+
+    async def _answer(self, request: LLMRequest) -> str:
+        self.calls.append(request)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            raise self.failures.pop(0)
+        if self.handler:
+            return self.handler(request)
+        return self.responses.pop(0) if self.responses else self.default
+
+    def _usage(self, request: LLMRequest, text: str) -> Tuple[int, int]:
+        return estimate_tokens(request.system, request.prompt), estimate_tokens(text)
+
+    async def complete(self, request: LLMRequest) -> Tuple[str, Optional[Tuple[int, int]]]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            text = await self._answer(request)
+            return text, self._usage(request, text)
+        finally:
+            self.in_flight -= 1
+
+    async def stream(self, request: LLMRequest) -> AsyncIterator[Tuple[str, Optional[Tuple[int, int]]]]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        text, finished = None, False
+        try:
+            text = await self._answer(request)
+            for word in re.findall(r"\s*\S+", text) or [text]:
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                yield word, None
+            yield "", self._usage(request, text)
+            finished = True
+        finally:
+            self.in_flight -= 1
+            if text is not None and not finished:
+                self.aborted += 1
+
+    async def embed(self, request: LLMRequest, texts: List[str]) -> Tuple[List[List[float]], Optional[int]]:
+        self.embedded.extend(texts)
+        if self.failures:
+            raise self.failures.pop(0)
+        return [hash_embedding(text) for text in texts], estimate_tokens(*texts)
+
+    async def close(self):
+        pass
+
+
+# ==================== GATEWAY ====================
+
+class LLMStream:
+    """
+    Text deltas from one streamed call - iterate it, then read `result`. Closing it before the end (the client
+    went away) closes the provider's response and records the call as cancelled.
+    """
+
+    def __init__(self, gateway: "LLMGateway", request: LLMRequest, provider, tenant_id: Optional[str], user_id: Optional[str], timeout: float):
+        self.gateway = gateway
+        self.request = request
+        self.provider = provider
+        self.tenant_id = tenant_id
+        self.user_id = user_id
+        self.timeout = timeout
+        self.result: Optional[LLMResult] = None
+        self._deltas = self._run()
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._deltas
+
+    async def aclose(self):
+        await self._deltas.aclose()
+
+    async def _run(self) -> AsyncIterator[str]:
+        gateway, request, provider = self.gateway, self.request, self.provider
+        queued_at = time.perf_counter()
+        async with gateway.slot(self.tenant_id):
+            started_at = time.perf_counter()
+            parts: List[str] = []
+            usage = None
+            first_token_at = None
+            attempts = 0
+            try:
+                while True:
+                    attempts += 1
+                    chunks = provider.stream(request)
+                    error = None
+                    try:
+                        while True:
+                            # The timeout applies to each wait for the next chunk, the first one included
+                            try:
+                                async with asyncio.timeout(self.timeout):
+                                    delta, chunk_usage = await chunks.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            usage = chunk_usage or usage
+                            if delta:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                parts.append(delta)
+                                yield delta
+                    except asyncio.TimeoutError:
+                        error = LLMError(f"no output for {self.timeout:g}s", retryable=True, status_code=504)
+                    except LLMError as e:
+                        error = e
+                    finally:
+                        await chunks.aclose()
+                    if error is None:
+                        break
+                    # Once the client has part of an answer a retry would send it twice
+                    if parts or not error.retryable or attempts > gateway.max_retries:
+                        await gateway._record(request, provider.name, self.tenant_id, self.user_id, attempts, started_at, queued_at, error=error)
+                        logger.error(f"LLM stream for {request.feature} failed after {attempts} attempt(s): {error}")
+                        raise HTTPException(status_code=error.status_code, detail=f"AI service error: {error}")
+                    await asyncio.sleep(gateway.backoff(attempts))
+            except (GeneratorExit, asyncio.CancelledError):
+                gateway._record_soon(request, provider.name, self.tenant_id, self.user_id, attempts, started_at, queued_at, cancelled=True)
+                raise
+
+        text = "".join(parts)
+        self.result = LLMResult(
+            text=text,
+            provider=provider.name,
+            model=request.model,
+            input_tokens=usage[0] if usage else estimate_tokens(request.system, request.prompt, *(m["content"] for m in request.history)),
+            output_tokens=usage[1] if usage else estimate_tokens(text),
+            estimated_usage=usage is None,
+            latency_ms=round((time.perf_counter() - started_at) * 1000, 1),
+            attempts=attempts,
+            first_token_ms=round((first_token_at - started_at) * 1000, 1) if first_token_at else None
+        )
+        await gateway._record(request, provider.name, self.tenant_id, self.user_id, attempts, started_at, queued_at, result=self.result)
+
+
+class TenantSlots:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        providers: Optional[Dict[str, Any]] = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tenant_concurrency: int = LLM_TENANT_CONCURRENCY,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        provider_override: Optional[str] = LLM_PROVIDER_OVERRIDE
+    ):
+        self.providers = providers or {"openai": OpenAIProvider(), "emergent": EmergentProvider(), "local": LocalProvider(), "fake": FakeProvider()}
+        self.tenant_concurrency = tenant_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.provider_override = provider_override
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._tenants: Dict[str, TenantSlots] = {}
+        self._pending: set = set()
+
+    async def close(self):
+        for provider in self.providers.values():
+            await provider.close()
+
+    async def _acquire(self, semaphore: asyncio.Semaphore, deadline: float):
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), max(remaining, 0.001))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="AI service is busy, please try again shortly")
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: Optional[str]):
+        """Hold a tenant slot and then a global one - tenants queue on their own limit before the shared one"""
+        deadline = asyncio.get_running_loop().time() + self.queue_timeout
+        tenant = None
+        if tenant_id:
+            tenant = self._tenants.setdefault(tenant_id, TenantSlots(self.tenant_concurrency))
+            tenant.users += 1
+        try:
+            if tenant:
+                await self._acquire(tenant.semaphore, deadline)
+            try:
+                await self._acquire(self._global, deadline)
+                try:
+                    yield
+                finally:
+                    self._global.release()
+            finally:
+                if tenant:
+                    tenant.semaphore.release()
+        finally:
+            if tenant:
+                tenant.users -= 1
+                if tenant.users == 0:
+                    self._tenants.pop(tenant_id, None)
+
+    def model_for(self, feature: str) -> str:
+        """"<provider>:<model>" a feature currently runs on - for cache keys and reporting"""
+        profile = LLM_PROFILES.get(feature, {})
+        return f"{self.provider_override or profile.get('provider')}:{profile.get('model')}"
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter - uniform over [0, base * 2^attempt], capped"""
+        return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+    def _request(
+        self,
+        feature: str,
+        prompt: str,
+        system: str,
+        history: Optional[List[Dict[str, str]]],
+        attachments: Optional[List[Attachment]],
+        overrides: Dict[str, Any]
+    ) -> Tuple[LLMRequest, Any]:
+        profile = {**LLM_PROFILES.get(feature, {}), **overrides}
+        request = LLMRequest(
+            feature=feature,
+            prompt=prompt,
+            system=system,
+            history=history or [],
+            attachments=attachments or [],
+            **profile
+        )
+        return request, self.providers[self.provider_override or request.provider]
+
+    def stream(
+        self,
+        feature: str,
+        prompt: str,
+        system: str = "",
+        history: Optional[List[Dict[str, str]]] = None,
+        tenant_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **overrides
+    ) -> LLMStream:
+        """Streamed call for a feature - same slots, retries and accounting as complete()"""
+        request, provider = self._request(feature, prompt, system, history, None, overrides)
+        return LLMStream(self, request, provider, tenant_id, user_id, timeout or self.timeout)
+
+    async def complete(
+        self,
+        feature: str,
+        prompt: str,
+        system: str = "",
+        history: Optional[List[Dict[str, str]]] = None,
+        attachments: Optional[List[Attachment]] = None,
+        tenant_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **overrides
+    ) -> LLMResult:
+        """Run one model call for a feature - provider errors surface as HTTPException"""
+        request, provider = self._request(feature, prompt, system, history, attachments, overrides)
+        (text, usage), attempts, started_at, queued_at = await self._call(
+            request, provider, tenant_id, user_id, timeout or self.timeout, lambda: provider.complete(request)
+        )
+
+        result = LLMResult(
+            text=text,
+            provider=provider.name,
+            model=request.model,
+            input_tokens=usage[0] if usage else estimate_tokens(request.system, request.prompt, *(m["content"] for m in request.history)),
+            output_tokens=usage[1] if usage else estimate_tokens(text),
+            estimated_usage=usage is None,
+            latency_ms=round((time.perf_counter() - started_at) * 1000, 1),
+            attempts=attempts
+        )
+        await self._record(request, provider.name, tenant_id, user_id, attempts, started_at, queued_at, result=result)
+        return result
+
+    async def embed(
+        self,
+        feature: str,
+        texts: List[str],
+        tenant_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **overrides
+    ) -> List[List[float]]:
+        """One vector per text from the feature's embedding model"""
+        request, provider = self._request(feature, "", "", None, None, overrides)
+        (vectors, input_tokens), attempts, started_at, queued_at = await self._call(
+            request, provider, tenant_id, user_id, timeout or self.timeout, lambda: provider.embed(request, texts)
+        )
+
+        result = LLMResult(
+            text="",
+            provider=provider.name,
+            model=request.model,
+            input_tokens=input_tokens if input_tokens is not None else estimate_tokens(*texts),
+            output_tokens=0,
+            estimated_usage=input_tokens is None,
+            latency_ms=round((time.perf_counter() - started_at) * 1000, 1),
+            attempts=attempts
+        )
+        await self._record(request, provider.name, tenant_id, user_id, attempts, started_at, queued_at, result=result)
+        return vectors
+
+    async def _call(
+        self,
+        request: LLMRequest,
+        provider,
+        tenant_id: Optional[str],
+        user_id: Optional[str],
+        timeout: float,
+        call: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, int, float, float]:
+        """call() in a slot with a timeout per attempt and retries - (its value, attempts, started_at, queued_at)"""
+        queued_at = time.perf_counter()
+        async with self.slot(tenant_id):
+            started_at = time.perf_counter()
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    return await asyncio.wait_for(call(), timeout), attempts, started_at, queued_at
+                except asyncio.TimeoutError:
+                    error = LLMError(f"timed out after {timeout:g}s", retryable=True, status_code=504)
+                except LLMError as e:
+                    error = e
+                if not error.retryable or attempts > self.max_retries:
+                    await self._record(request, provider.name, tenant_id, user_id, attempts, started_at, queued_at, error=error)
+                    logger.error(f"LLM call for {request.feature} failed after {attempts} attempt(s): {error}")
+                    raise HTTPException(status_code=error.status_code, detail=f"AI service error: {error}")
+                await asyncio.sleep(self.backoff(attempts))
+
+    async def _record(
+        self,
+        request: LLMRequest,
+        provider: str,
+        tenant_id: Optional[str],
+        user_id: Optional[str],
+        attempts: int,
+        started_at: float,
+        queued_at: float,
+        result: Optional[LLMResult] = None,
+        error: Optional[LLMError] = None,
+        cancelled: bool = False
+    ):
+        record = {
+            "id": str(uuid.uuid4()),
+            "feature": request.feature,
+            "provider": provider,
+            "model": request.model,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "status": "ok" if result else "cancelled" if cancelled else "error",
+            "error": str(error) if error else None,
+            "attempts": attempts,
+            "input_tokens": result.input_tokens if result else None,
+            "output_tokens": result.output_tokens if result else None,
+            "estimated_usage": result.estimated_usage if result else None,
+            "queue_ms": round((started_at - queued_at) * 1000, 1),
+            "latency_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            "first_token_ms": result.first_token_ms if result else None,
+            "created_at": datetime.now(timezone.utc)
+        }
+        try:
+            await db.llm_calls.insert_one(record)
+        except Exception as e:
+            # Accounting is best effort - never fail the user's request over it
+            logger.error(f"Failed to record LLM call: {e}")
+
+    def _record_soon(self, *args, **kwargs):
+        """_record from a caller that is being cancelled and can't await the write"""
+        task = asyncio.ensure_future(self._record(*args, **kwargs))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def chat_event_stream(stream: LLMStream, request, save: Callable[[LLMResult], Awaitable[dict]]) -> AsyncIterator[str]:
+    """
+    Server-sent events for a streamed reply: "token" per delta, then "done" with what save(result) returns, or
+    "error". Stops (and closes the upstream call) as soon as the client disconnects - nothing is saved then.
+    """
+    try:
+        async for delta in stream:
+            yield sse_event("token", {"text": delta})
+            if await request.is_disconnected():
+                return
+        yield sse_event("done", await save(stream.result))
+    except HTTPException as e:
+        yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+    finally:
+        await stream.aclose()
+
+
+# Shared gateway for the app
+llm = LLMGateway()
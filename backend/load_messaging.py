@@ -0,0 +1,180 @@
+"""
+Dispatch <-> driver load messaging - incremental history, unread counters and live delivery
+
+New messages and read receipts are pushed to every participant's user channel (WebSocket or SSE)
+through the connection manager, so apps don't poll. Driver unread counts are kept per load in
+message_unread_counts and adjusted as messages are sent and read, never recounted.
+"""
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from database import db
+from driver_assignments import MAX_ASSIGNMENTS
+from websocket_manager import manager
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_PAGE_SIZE = 500
+# Comment line sent on idle SSE streams so proxies and phones keep the connection open
+SSE_KEEPALIVE_SECONDS = 25
+
+
+async def load_participants(load_id: str) -> Tuple[List[str], List[str]]:
+    """(driver user ids, dispatch user ids) for a load - from the driver_assignments view"""
+    assignments = await db.driver_assignments.find(
+        {"load_ids": load_id},
+        {"_id": 0, "driver_user_id": 1, "load.assigned_by": 1, "load.dispatched_by": 1}
+    ).to_list(MAX_ASSIGNMENTS)
+
+    driver_ids = [a["driver_user_id"] for a in assignments]
+    dispatch_ids = set()
+    for assignment in assignments:
+        load = assignment.get("load") or {}
+        dispatch_ids.update(i for i in [load.get("assigned_by"), load.get("dispatched_by")] if i)
+    if driver_ids:
+        drivers = await db.users.find(
+            {"id": {"$in": driver_ids}},
+            {"_id": 0, "fleet_owner_id": 1}
+        ).to_list(len(driver_ids))
+        dispatch_ids.update(d["fleet_owner_id"] for d in drivers if d.get("fleet_owner_id"))
+    return driver_ids, sorted(dispatch_ids)
+
+
+async def publish(user_ids: List[str], event_type: str, payload: dict):
+    for user_id in dict.fromkeys(user_ids):
+        try:
+            await manager.send_to_user(user_id, {"type": event_type, "payload": payload})
+        except Exception as e:
+            # Delivery is best effort - the message is stored and clients catch up with after=
+            logger.error(f"Error publishing {event_type} to user {user_id}: {e}")
+
+
+async def list_messages(load_id: str, after: Optional[str] = None, limit: int = MESSAGE_PAGE_SIZE) -> List[dict]:
+    """
+    Messages for a load, oldest first. With after=<message id> only newer messages are returned;
+    an unknown id returns from the start so the client can resync.
+    """
+    query = {"load_id": load_id}
+    if after:
+        anchor = await db.load_messages.find_one({"id": after, "load_id": load_id}, {"_id": 0, "id": 1, "created_at": 1})
+        if anchor:
+            query["$or"] = [
+                {"created_at": {"$gt": anchor["created_at"]}},
+                {"created_at": anchor["created_at"], "id": {"$gt": anchor["id"]}}
+            ]
+    return await db.load_messages.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).to_list(limit)
+
+
+async def post_message(message: dict) -> dict:
+    """Store a message, bump the drivers' unread counters and deliver it to everyone on the load"""
+    await db.load_messages.insert_one(message)
+    message = {k: v for k, v in message.items() if k != "_id"}
+    load_id = message["load_id"]
+
+    driver_ids, dispatch_ids = await load_participants(load_id)
+    await publish(driver_ids + dispatch_ids + [message["sender_id"]], "load_message", message)
+
+    if message["sender_type"] == "dispatch":
+        for driver_id in driver_ids:
+            counter = await db.message_unread_counts.find_one_and_update(
+                {"user_id": driver_id, "load_id": load_id},
+                {"$inc": {"count": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            await publish([driver_id], "unread_count", {"load_id": load_id, "unread_count": counter["count"]})
+    return message
+
+
+async def mark_read_by_driver(load_id: str, driver_user_id: str) -> int:
+    """Mark dispatch messages read - a no-op unless the driver's counter says something is unread"""
+    counter_query = {"user_id": driver_user_id, "load_id": load_id}
+    if not await db.message_unread_counts.find_one({**counter_query, "count": {"$gt": 0}}, {"_id": 0, "count": 1}):
+        return 0
+
+    now = datetime.now(timezone.utc)
+    unread_query = {"load_id": load_id, "sender_type": "dispatch", "read_by_driver": False}
+    result = await db.load_messages.update_many(unread_query, {"$set": {"read_by_driver": True, "read_at": now}})
+    # Take off exactly what was marked - a message posted after the update keeps its increment
+    counter = await db.message_unread_counts.find_one_and_update(
+        counter_query,
+        {"$inc": {"count": -result.modified_count}, "$set": {"updated_at": now}},
+        projection={"_id": 0, "count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    unread = counter["count"] if counter else 0
+    if unread < 0 or (unread > 0 and not await db.load_messages.count_documents(unread_query, limit=1)):
+        # What is left was already read by another driver on the load - clear it unless a send got in meanwhile
+        reset = await db.message_unread_counts.update_one({**counter_query, "count": unread}, {"$set": {"count": 0}})
+        if reset.modified_count:
+            unread = 0
+        else:
+            unread = (await db.message_unread_counts.find_one(counter_query, {"_id": 0, "count": 1}))["count"]
+
+    driver_ids, dispatch_ids = await load_participants(load_id)
+    receipt = {"load_id": load_id, "reader_type": "driver", "reader_id": driver_user_id, "read_at": now}
+    await publish(dispatch_ids + [driver_user_id], "messages_read", receipt)
+    await publish([driver_user_id], "unread_count", {"load_id": load_id, "unread_count": unread})
+    return result.modified_count
+
+
+async def mark_read_by_dispatch(load_id: str, reader_id: str) -> int:
+    """Mark driver messages read and send the drivers a read receipt"""
+    now = datetime.now(timezone.utc)
+    result = await db.load_messages.update_many(
+        {"load_id": load_id, "sender_type": "driver", "read_by_dispatch": False},
+        {"$set": {"read_by_dispatch": True}}
+    )
+    if result.modified_count:
+        driver_ids, dispatch_ids = await load_participants(load_id)
+        receipt = {"load_id": load_id, "reader_type": "dispatch", "reader_id": reader_id, "read_at": now}
+        await publish(driver_ids + dispatch_ids, "messages_read", receipt)
+    return result.modified_count
+
+
+async def unread_counts(user_id: str, load_ids: List[str]) -> Dict[str, int]:
+    """Unread message count per load, from the counters"""
+    counters = await db.message_unread_counts.find(
+        {"user_id": user_id, "load_id": {"$in": load_ids}, "count": {"$gt": 0}},
+        {"_id": 0, "load_id": 1, "count": 1}
+    ).to_list(len(load_ids) or 1)
+    return {c["load_id"]: c["count"] for c in counters}
+
+
+async def user_event_stream(user_id: str) -> AsyncIterator[str]:
+    """Server-sent events for a user's channel - the same events the WebSocket delivers"""
+    queue = manager.subscribe_user(user_id)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            event_type = json.loads(message).get("type", "message")
+            yield f"event: {event_type}\ndata: {message}\n\n"
+    finally:
+        manager.unsubscribe_user(user_id, queue)
+
+
+async def rebuild_unread_counts() -> int:
+    """Recount unread dispatch messages into the counters - for the migration script"""
+    pipeline = [
+        {"$match": {"sender_type": "dispatch", "read_by_driver": False}},
+        {"$group": {"_id": "$load_id", "count": {"$sum": 1}}}
+    ]
+    count = 0
+    async for group in db.load_messages.aggregate(pipeline):
+        driver_ids, _ = await load_participants(group["_id"])
+        for driver_id in driver_ids:
+            await db.message_unread_counts.update_one(
+                {"user_id": driver_id, "load_id": group["_id"]},
+                {"$set": {"count": group["count"], "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+            count += 1
+    return count
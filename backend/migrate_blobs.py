@@ -0,0 +1,98 @@
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+import base64
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from blob_store import blob_store
+
+DATA_URL_PATTERN = re.compile(r"^data:([^;,]*);base64,(.*)$", re.DOTALL)
+
+async def migrate_load_documents(db):
+    # Move base64 file_data into the blob store, one document at a time to keep memory flat
+    cursor = db.load_documents.find(
+        {"file_data": {"$exists": True}},
+        {"_id": 0, "id": 1, "file_data": 1}
+    ).batch_size(10)
+
+    count = 0
+    async for doc in cursor:
+        blob = await blob_store.put_bytes(base64.b64decode(doc["file_data"] or ""))
+        await db.load_documents.update_one(
+            {"id": doc["id"]},
+            {"$set": {"blob_sha256": blob.sha256, "file_size": blob.size}, "$unset": {"file_data": ""}}
+        )
+        count += 1
+    print(f"✓ Moved {count} load documents to the blob store")
+
+async def migrate_receipt_images(db):
+    cursor = db.receipt_images.find(
+        {"image_base64": {"$exists": True}},
+        {"_id": 0, "id": 1, "image_base64": 1}
+    ).batch_size(10)
+
+    count = 0
+    async for receipt in cursor:
+        blob = await blob_store.put_bytes(base64.b64decode(receipt["image_base64"] or ""))
+        await db.receipt_images.update_one(
+            {"id": receipt["id"]},
+            {"$set": {"blob_sha256": blob.sha256, "file_size": blob.size}, "$unset": {"image_base64": ""}}
+        )
+        count += 1
+    print(f"✓ Moved {count} receipt images to the blob store")
+
+async def migrate_company_files(db):
+    # Logos and company documents were stored as data: URLs
+    from routes.company_routes import company_file_url
+
+    cursor = db.companies.find(
+        {"$or": [{"logo_url": {"$regex": "^data:"}}, {"company_documents": {"$exists": True}}]},
+        {"_id": 0, "id": 1, "logo_url": 1, "company_documents": 1}
+    ).batch_size(10)
+
+    count = 0
+    async for company in cursor:
+        update = {}
+
+        match = DATA_URL_PATTERN.match(company.get("logo_url") or "")
+        if match:
+            blob = await blob_store.put_bytes(base64.b64decode(match.group(2)))
+            update["logo_url"] = company_file_url(company["id"], blob.sha256)
+            update["logo_sha256"] = blob.sha256
+            update["logo_content_type"] = match.group(1) or "image/png"
+
+        documents = company.get("company_documents") or {}
+        changed = False
+        for versions in documents.values():
+            for version in versions:
+                match = DATA_URL_PATTERN.match(version.get("url") or "")
+                if not match:
+                    continue
+                blob = await blob_store.put_bytes(base64.b64decode(match.group(2)))
+                version["url"] = company_file_url(company["id"], blob.sha256)
+                version["blob_sha256"] = blob.sha256
+                version["content_type"] = match.group(1) or "application/octet-stream"
+                changed = True
+        if changed:
+            update["company_documents"] = documents
+
+        if update:
+            await db.companies.update_one({"id": company["id"]}, {"$set": update})
+            count += 1
+    print(f"✓ Moved files for {count} companies to the blob store")
+
+async def migrate_blobs():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    await migrate_load_documents(db)
+    await migrate_receipt_images(db)
+    await migrate_company_files(db)
+
+    client.close()
+    print('\n✓ Blob migration complete!')
+
+asyncio.run(migrate_blobs())
@@ -0,0 +1,19 @@
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import db, ensure_indexes
+from driver_assignments import rebuild_assignments
+
+async def migrate_driver_assignments():
+    # The view is keyed on (driver_user_id, key) - create the unique index before the backfill upserts
+    await ensure_indexes()
+
+    count = await rebuild_assignments()
+    print(f"✓ Synced {count} pushed loads, loads and bookings into driver_assignments")
+
+    total = await db.driver_assignments.count_documents({})
+    print(f"\n✓ Driver assignment migration complete! {total} assignments")
+
+asyncio.run(migrate_driver_assignments())
@@ -0,0 +1,57 @@
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+import os
+from dotenv import load_dotenv
+from geo import geo_point
+
+load_dotenv()
+
+async def backfill_equipment_positions(db):
+    # Build GeoJSON positions from the loose lat/lng fields for the 2dsphere index
+    cursor = db.equipment.find(
+        {"current_position": {"$exists": False}},
+        {"_id": 0, "id": 1, "current_latitude": 1, "current_longitude": 1, "location_lat": 1, "location_lng": 1}
+    )
+    
+    ops = []
+    async for equipment in cursor:
+        position = geo_point(
+            equipment.get("current_latitude") if equipment.get("current_latitude") is not None else equipment.get("location_lat"),
+            equipment.get("current_longitude") if equipment.get("current_longitude") is not None else equipment.get("location_lng")
+        )
+        if position:
+            ops.append(UpdateOne({"id": equipment["id"]}, {"$set": {"current_position": position}}))
+    
+    if ops:
+        await db.equipment.bulk_write(ops, ordered=False)
+    print(f"✓ Backfilled positions for {len(ops)} equipment")
+
+async def backfill_driver_positions(db):
+    # Drivers report pings as last_location_lat/last_location_lng on the users collection
+    cursor = db.users.find(
+        {"role": "driver", "current_position": {"$exists": False}, "last_location_lat": {"$ne": None}},
+        {"_id": 0, "id": 1, "last_location_lat": 1, "last_location_lng": 1}
+    )
+    
+    ops = []
+    async for user in cursor:
+        position = geo_point(user.get("last_location_lat"), user.get("last_location_lng"))
+        if position:
+            ops.append(UpdateOne({"id": user["id"]}, {"$set": {"current_position": position}}))
+    
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+    print(f"✓ Backfilled positions for {len(ops)} drivers")
+
+async def migrate_geo_positions():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    
+    await backfill_equipment_positions(db)
+    await backfill_driver_positions(db)
+    
+    client.close()
+    print('\n✓ Geo position migration complete!')
+
+asyncio.run(migrate_geo_positions())
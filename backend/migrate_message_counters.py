@@ -0,0 +1,18 @@
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import ensure_indexes
+from load_messaging import rebuild_unread_counts
+
+async def migrate_message_counters():
+    # Unread counts used to be recounted from load_messages on every poll - seed the counters once
+    await ensure_indexes()
+
+    count = await rebuild_unread_counts()
+    print(f"✓ Seeded {count} driver unread counters")
+
+    print('\n✓ Message counter migration complete!')
+
+asyncio.run(migrate_message_counters())
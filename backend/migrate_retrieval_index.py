@@ -0,0 +1,19 @@
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import db, ensure_indexes
+from retrieval import rebuild_index
+
+async def migrate_retrieval_index():
+    # Entries are keyed on "<collection>:<id>" - create the unique index before the backfill upserts
+    await ensure_indexes()
+
+    count = await rebuild_index()
+    print(f"✓ Embedded {count} new or changed bookings, accounting and CRM records")
+
+    total = await db.retrieval_index.count_documents({"deleted": False})
+    print(f"\n✓ Retrieval index migration complete! {total} records indexed")
+
+asyncio.run(migrate_retrieval_index())
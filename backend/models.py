@@ -271,6 +271,12 @@ class BookingBase(BaseModel):
     delivery_city: Optional[str] = None
     delivery_state: Optional[str] = None
     delivery_country: Optional[str] = "USA"
+    # Coordinates for geofenced arrival/departure detection
+    pickup_lat: Optional[float] = Field(None, ge=-90, le=90)
+    pickup_lng: Optional[float] = Field(None, ge=-180, le=180)
+    delivery_lat: Optional[float] = Field(None, ge=-90, le=90)
+    delivery_lng: Optional[float] = Field(None, ge=-180, le=180)
+    geofence_radius_m: Optional[float] = Field(None, gt=0, le=5000)
     # Cargo information
     commodity: Optional[str] = None
     weight: Optional[float] = None  # in lbs
@@ -291,6 +297,8 @@ class BookingBase(BaseModel):
     delivery_time_actual_out: Optional[datetime] = None
     # Carrier/Driver assignment (for dispatch)
     assigned_carrier: Optional[str] = None
+    carrier_dot_number: Optional[str] = None  # FMCSA identifiers - monitored while the load is active
+    carrier_mc_number: Optional[str] = None
     assigned_driver: Optional[str] = None
     # Rate information
     confirmed_rate: Optional[float] = None  # Rate WITHOUT margin (for Dispatch)
@@ -303,11 +311,18 @@ class BookingCreate(BookingBase):
 class DispatchUpdate(BaseModel):
     """Model for dispatch-specific updates"""
     assigned_carrier: Optional[str] = None
+    carrier_dot_number: Optional[str] = None
+    carrier_mc_number: Optional[str] = None
     assigned_driver: Optional[str] = None
     pickup_time_actual_in: Optional[datetime] = None
     pickup_time_actual_out: Optional[datetime] = None
     delivery_time_actual_in: Optional[datetime] = None
     delivery_time_actual_out: Optional[datetime] = None
+    pickup_lat: Optional[float] = Field(None, ge=-90, le=90)
+    pickup_lng: Optional[float] = Field(None, ge=-180, le=180)
+    delivery_lat: Optional[float] = Field(None, ge=-90, le=90)
+    delivery_lng: Optional[float] = Field(None, ge=-180, le=180)
+    geofence_radius_m: Optional[float] = Field(None, gt=0, le=5000)
 
 class Booking(BookingBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
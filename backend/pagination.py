@@ -0,0 +1,177 @@
+"""
+Keyset pagination for list endpoints
+
+Pages are fetched with a range query on the sort key plus _id instead of skip/limit, so page N costs
+the same as page 1 and rows inserted mid-scroll don't shift or repeat. The cursor is opaque to clients:
+base64 of the last row's sort values.
+
+Endpoints that returned a bare JSON array before pagination use list_page_params: without a limit or cursor
+they still return the whole list, so existing callers aren't silently cut off at DEFAULT_PAGE_SIZE.
+"""
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Tuple
+from bson import json_util
+from datetime import timezone
+import base64
+import binascii
+import os
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = 500
+# Filtered totals are counted up to this many documents - past it the number is only a floor
+TOTAL_COUNT_CAP = 10_000
+
+# Datetimes in cursors come back timezone-aware, like the rest of the API
+CURSOR_JSON_OPTIONS = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+# Insertion order - _id is always present, single-typed and indexed
+DEFAULT_SORT = [("_id", 1)]
+
+
+class PageParams(BaseModel):
+    cursor: Optional[str] = None
+    limit: Optional[int] = DEFAULT_PAGE_SIZE  # None - the whole list
+    include_total: bool = False
+
+
+class Page(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+def page_params(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = Query(False, description="Also return a total count (estimated for large filtered sets)")
+) -> PageParams:
+    """Query parameters shared by every paginated list endpoint"""
+    return PageParams(cursor=cursor, limit=limit, include_total=include_total)
+
+
+def list_page_params(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size - omit for the whole list"),
+    include_total: bool = Query(False, description="Also return a total count (estimated for large filtered sets)")
+) -> PageParams:
+    """page_params for bare-array endpoints - opt-in paging, the whole list when neither limit nor cursor is sent"""
+    if limit is None and cursor is not None:
+        limit = DEFAULT_PAGE_SIZE
+    return PageParams(cursor=cursor, limit=limit, include_total=include_total)
+
+
+def encode_cursor(state: dict) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(state).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode(), json_options=CURSOR_JSON_OPTIONS)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(state, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return state
+
+
+def with_tiebreaker(sort: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    """Sort keys ending in _id, so every row has a unique position"""
+    if sort[-1][0] == "_id":
+        return list(sort)
+    return list(sort) + [("_id", sort[-1][1])]
+
+
+def keyset_filter(sort: List[Tuple[str, int]], after: list) -> dict:
+    """Rows strictly after the given sort values - (a > x) or (a == x and b > y) ..."""
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {f: after[j] for j, (f, _) in enumerate(sort[:i])}
+        branch[field] = {"$gt" if direction == 1 else "$lt": after[i]}
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {"$or": branches}
+
+
+def _sort_value(doc: dict, field: str):
+    value = doc
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+async def fetch_page(
+    collection,
+    query: dict,
+    limit: Optional[int],
+    after: Optional[list] = None,
+    sort: List[Tuple[str, int]] = DEFAULT_SORT,
+    projection: Optional[dict] = None
+) -> Tuple[List[dict], Optional[list]]:
+    """
+    One page of rows and the sort values to continue after (None on the last page) - every row when limit is None.
+    sort fields must hold a single BSON type across the collection - range queries don't cross types.
+    """
+    sort = with_tiebreaker(sort)
+    if after is not None:
+        if len(after) != len(sort):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        range_filter = keyset_filter(sort, after)
+        query = {"$and": [query, range_filter]} if query else range_filter
+
+    # _id and the sort keys are needed for the cursor even when the caller projects them away
+    projection = dict(projection or {})
+    projection.pop("_id", None)
+    if any(projection.values()):
+        projection.update({field: 1 for field, _ in sort})
+
+    if limit is None:
+        docs = await collection.find(query, projection or None).sort(sort).to_list(None)
+    else:
+        docs = await collection.find(query, projection or None).sort(sort).limit(limit + 1).to_list(limit + 1)
+    next_after = None
+    if limit is not None and len(docs) > limit:
+        docs = docs[:limit]
+        next_after = [_sort_value(docs[-1], field) for field, _ in sort]
+    for doc in docs:
+        doc.pop("_id", None)
+    return docs, next_after
+
+
+async def count_total(collection, query: dict) -> int:
+    """Total for a list - metadata estimate when unfiltered, capped count otherwise"""
+    if not query:
+        return await collection.estimated_document_count()
+    return await collection.count_documents(query, limit=TOTAL_COUNT_CAP)
+
+
+async def paginate(
+    collection,
+    query: dict,
+    params: PageParams,
+    sort: List[Tuple[str, int]] = DEFAULT_SORT,
+    projection: Optional[dict] = None
+) -> Page:
+    """A page of a Mongo query with the cursor for the next one"""
+    signature = [field for field, _ in with_tiebreaker(sort)]
+    after = None
+    if params.cursor:
+        state = decode_cursor(params.cursor)
+        if state.get("s") != signature:
+            raise HTTPException(status_code=400, detail="Cursor belongs to a different listing")
+        after = state.get("k")
+
+    items, next_after = await fetch_page(collection, query, params.limit, after, sort, projection)
+    return Page(
+        items=items,
+        next_cursor=encode_cursor({"s": signature, "k": next_after}) if next_after is not None else None,
+        total=await count_total(collection, query) if params.include_total else None
+    )
+
+
+def set_page_headers(response: Response, page: Page):
+    """For endpoints that keep a bare JSON array body - paging info travels in headers"""
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
@@ -0,0 +1,494 @@
+"""
+Retrieval over tenant data for the TMS assistant - bookings, AR/AP, expenses and CRM records
+
+Each record is rendered to a short text, embedded once and kept in retrieval_index with the department it
+belongs to and the tenants that may see it. Writers call schedule_index() after changing a record, which
+re-embeds it in the background only if its text changed (deletes leave a tombstone). Every worker keeps a
+NumPy matrix per tenant built from retrieval_index and catches up incrementally on entries updated since its
+last sync, so a search is one small indexed read plus a matrix-vector product.
+
+Tenants are the owner ids the routes already filter on (requester/equipment owner on bookings, company_id on
+accounting) - a user searches their own id and their fleet owner's. CRM data is the platform's own and only
+platform admins see it. Callers pass the departments a user may search, from ROLE_DEPARTMENT_ACCESS. Drivers
+search their fleet but only get the bookings they are assigned to, and never see rates: sources with fields
+a role may not see also store a redacted text, returned in place of the full one.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
+from fastapi import HTTPException
+from database import db
+from llm_gateway import estimate_tokens, llm, llm_tenant
+import asyncio
+import hashlib
+import logging
+import numpy as np
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_FEATURE = "retrieval_embedding"
+
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 5))
+RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", 0.25))
+# Cap on the record text injected into one prompt
+RETRIEVAL_CONTEXT_TOKENS = int(os.environ.get("RETRIEVAL_CONTEXT_TOKENS", 800))
+# Tenant indexes kept in memory per worker, least recently searched dropped first
+RETRIEVAL_MAX_TENANTS = int(os.environ.get("RETRIEVAL_MAX_TENANTS", 200))
+# Searches within this many seconds of a sync reuse it; a full reload drops tombstones now and then
+RETRIEVAL_SYNC_INTERVAL_SECONDS = 1.0
+RETRIEVAL_RELOAD_SECONDS = 600
+# Re-read entries this far behind the last one seen, for writes that commit out of timestamp order
+RETRIEVAL_SYNC_OVERLAP = timedelta(seconds=5)
+RETRIEVAL_EMBED_BATCH = 64
+RECORD_TEXT_CHARS = 600
+
+PLATFORM_TENANT = "platform"
+
+# Roles limited to the records they are assigned to, shown without rates
+ASSIGNED_ONLY_ROLES = ["driver"]
+
+
+def _money(value) -> str:
+    try:
+        return f"${float(value):,.2f}"
+    except (TypeError, ValueError):
+        return "n/a"
+
+
+def _join(*parts) -> str:
+    return "; ".join(str(p) for p in parts if p not in (None, "", []))
+
+
+def _place(city, state) -> str:
+    return ", ".join(p for p in (city, state) if p)
+
+
+def booking_text(doc: dict, rates: bool = True) -> str:
+    pickup = _place(doc.get("pickup_city"), doc.get("pickup_state")) or doc.get("pickup_location")
+    delivery = _place(doc.get("delivery_city"), doc.get("delivery_state")) or doc.get("delivery_location")
+    return _join(
+        f"Load {doc.get('order_number') or doc.get('id')} ({doc.get('status', 'pending')})",
+        f"{pickup} to {delivery}",
+        doc.get("shipper_name") and f"shipper {doc['shipper_name']}",
+        doc.get("commodity") and f"commodity {doc['commodity']}",
+        doc.get("driver_name") and f"driver {doc['driver_name']}",
+        doc.get("pickup_time_planned") and f"pickup {doc['pickup_time_planned']}",
+        doc.get("delivery_time_planned") and f"delivery {doc['delivery_time_planned']}",
+        rates and (doc.get("customer_rate") or doc.get("confirmed_rate")) and f"rate {_money(doc.get('customer_rate') or doc.get('confirmed_rate'))}" or None,
+        doc.get("notes")
+    )
+
+
+def booking_text_without_rates(doc: dict) -> str:
+    return booking_text(doc, rates=False)
+
+
+def receivable_text(doc: dict) -> str:
+    return _join(
+        f"Invoice {doc.get('invoice_number')} to {doc.get('customer_name')} ({doc.get('status')})",
+        f"amount {_money(doc.get('amount'))}, paid {_money(doc.get('amount_paid'))}",
+        doc.get("due_date") and f"due {doc['due_date']}",
+        doc.get("load_reference") and f"load {doc['load_reference']}",
+        doc.get("description")
+    )
+
+
+def payable_text(doc: dict) -> str:
+    return _join(
+        f"Bill {doc.get('bill_number')} from {doc.get('vendor_name')} ({doc.get('status')})",
+        f"amount {_money(doc.get('amount'))}, paid {_money(doc.get('amount_paid'))}",
+        doc.get("due_date") and f"due {doc['due_date']}",
+        doc.get("category"),
+        doc.get("load_reference") and f"load {doc['load_reference']}",
+        doc.get("description")
+    )
+
+
+def expense_text(doc: dict) -> str:
+    return _join(
+        f"Expense at {doc.get('vendor_name')} on {doc.get('expense_date')} ({doc.get('status')})",
+        f"{doc.get('category')} {_money(doc.get('amount'))}",
+        doc.get("driver_name") and f"driver {doc['driver_name']}",
+        doc.get("vehicle_name") and f"vehicle {doc['vehicle_name']}",
+        doc.get("load_reference") and f"load {doc['load_reference']}",
+        doc.get("description")
+    )
+
+
+def contact_text(doc: dict) -> str:
+    return _join(
+        f"CRM contact {doc.get('first_name', '')} {doc.get('last_name', '')}".rstrip(),
+        doc.get("position") and doc.get("company") and f"{doc['position']} at {doc['company']}" or doc.get("company"),
+        doc.get("status"),
+        _place(doc.get("city"), doc.get("state")),
+        doc.get("notes")
+    )
+
+
+def deal_text(doc: dict) -> str:
+    return _join(
+        f"CRM deal {doc.get('name')} ({doc.get('stage')})",
+        f"value {_money(doc.get('value'))}, {doc.get('probability')}% likely",
+        doc.get("expected_close_date") and f"closes {doc['expected_close_date']}",
+        doc.get("description")
+    )
+
+
+def activity_text(doc: dict) -> str:
+    return _join(
+        f"CRM {doc.get('type', 'activity')}: {doc.get('subject')}",
+        "completed" if doc.get("completed") else doc.get("due_date") and f"due {doc['due_date']}",
+        doc.get("description")
+    )
+
+
+# Indexed collections - the department a record answers for, the fields naming the tenants that own it
+# (none: the platform's own data), how it reads in a prompt and, where it has rates, how it reads without them
+SOURCES: Dict[str, dict] = {
+    "bookings": {
+        "department": "dispatch", "tenant_fields": ["requester_id", "equipment_owner_id"],
+        "render": booking_text, "redact": booking_text_without_rates
+    },
+    "accounts_receivable": {"department": "accounting", "tenant_fields": ["company_id"], "render": receivable_text},
+    "accounts_payable": {"department": "accounting", "tenant_fields": ["company_id"], "render": payable_text},
+    "expenses": {"department": "accounting", "tenant_fields": ["company_id"], "render": expense_text},
+    "crm_contacts": {"department": "sales", "tenant_fields": [], "render": contact_text},
+    "crm_deals": {"department": "sales", "tenant_fields": [], "render": deal_text},
+    "crm_activities": {"department": "sales", "tenant_fields": [], "render": activity_text},
+}
+
+
+def record_tenants(source: str, doc: dict) -> List[str]:
+    fields = SOURCES[source]["tenant_fields"]
+    if not fields:
+        return [PLATFORM_TENANT]
+    return list(dict.fromkeys(doc[f] for f in fields if doc.get(f)))
+
+
+def user_tenants(user) -> List[str]:
+    """Tenants a user searches - the fleet owner first (the query embedding counts against it), their own, and CRM for platform admins"""
+    tenants = [llm_tenant(user), user.id]
+    if str(getattr(user.role, "value", user.role)).lower() == "platform_admin":
+        tenants.append(PLATFORM_TENANT)
+    return list(dict.fromkeys(tenants))
+
+
+def assigned_only(user) -> bool:
+    return str(getattr(user.role, "value", user.role)).lower() in ASSIGNED_ONLY_ROLES
+
+
+async def assigned_record_keys(user_id: str) -> Set[str]:
+    """Index keys of the bookings a driver is assigned to, from the driver_assignments view"""
+    assignments = await db.driver_assignments.find(
+        {"driver_user_id": user_id},
+        {"_id": 0, "booking_id": 1}
+    ).to_list(None)
+    return {f"bookings:{a['booking_id']}" for a in assignments if a.get("booking_id")}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def as_vector(values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+# ==================== INDEXING ====================
+
+async def index_documents(source: str, docs: List[dict]) -> int:
+    """Embed the records whose text, tenants or model changed since they were indexed - returns how many"""
+    config = SOURCES[source]
+    model = llm.model_for(EMBEDDING_FEATURE)
+    changed = []
+    for doc in docs:
+        tenants = record_tenants(source, doc)
+        text = config["render"](doc)[:RECORD_TEXT_CHARS]
+        redacted = config["redact"](doc)[:RECORD_TEXT_CHARS] if config.get("redact") else None
+        key = f"{source}:{doc['id']}"
+        existing = await db.retrieval_index.find_one(
+            {"key": key},
+            {"_id": 0, "text_hash": 1, "redacted_text": 1, "model": 1, "tenant_ids": 1, "deleted": 1}
+        )
+        if existing and not existing.get("deleted") and existing.get("text_hash") == text_hash(text) \
+                and existing.get("redacted_text") == redacted \
+                and existing.get("model") == model and existing.get("tenant_ids") == tenants:
+            continue
+        if tenants:
+            changed.append((key, doc["id"], tenants, text, redacted))
+
+    for start in range(0, len(changed), RETRIEVAL_EMBED_BATCH):
+        batch = changed[start:start + RETRIEVAL_EMBED_BATCH]
+        vectors = await llm.embed(EMBEDDING_FEATURE, [item[3] for item in batch], tenant_id=batch[0][2][0])
+        now = datetime.now(timezone.utc)
+        for (key, record_id, tenants, text, redacted), vector in zip(batch, vectors):
+            await db.retrieval_index.update_one(
+                {"key": key},
+                {"$set": {
+                    "source": source,
+                    "record_id": record_id,
+                    "department": config["department"],
+                    "tenant_ids": tenants,
+                    "text": text,
+                    "redacted_text": redacted,
+                    "text_hash": text_hash(text),
+                    "model": model,
+                    "vector": as_vector(vector).tobytes(),
+                    "deleted": False,
+                    "updated_at": now
+                }},
+                upsert=True
+            )
+    return len(changed)
+
+
+async def index_records(source: str, record_ids: List[str]):
+    """Bring records' entries up to date - records that no longer exist leave a tombstone"""
+    docs = await db[source].find({"id": {"$in": record_ids}}, {"_id": 0}).to_list(None)
+    await index_documents(source, docs)
+    found = {doc["id"] for doc in docs}
+    for record_id in record_ids:
+        if record_id in found:
+            continue
+        await db.retrieval_index.update_one(
+            {"key": f"{source}:{record_id}", "deleted": False},
+            {"$set": {"deleted": True, "vector": None, "updated_at": datetime.now(timezone.utc)}}
+        )
+
+
+_pending: set = set()
+
+
+async def _index_quietly(source: str, record_ids: List[str]):
+    try:
+        await index_records(source, record_ids)
+    except Exception as e:
+        # The entries stay stale until the records are written again or the backfill runs
+        logger.warning(f"Retrieval indexing failed for {source} {record_ids[:5]}: {e}")
+
+
+def schedule_index(source: str, *record_ids: str):
+    """Re-index records after a write without making the writer wait for the embedding call"""
+    record_ids = [r for r in dict.fromkeys(record_ids) if r]
+    if not record_ids:
+        return
+    task = asyncio.ensure_future(_index_quietly(source, record_ids))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def rebuild_index(sources: Optional[Iterable[str]] = None) -> int:
+    """Backfill every record of the indexed collections - for the migration script"""
+    count = 0
+    for source in sources or SOURCES:
+        batch = []
+        async for doc in db[source].find({}, {"_id": 0}).batch_size(RETRIEVAL_EMBED_BATCH):
+            batch.append(doc)
+            if len(batch) == RETRIEVAL_EMBED_BATCH:
+                count += await index_documents(source, batch)
+                batch = []
+        if batch:
+            count += await index_documents(source, batch)
+    return count
+
+
+# ==================== SEARCH ====================
+
+ENTRY_PROJECTION = {
+    "_id": 0, "key": 1, "source": 1, "record_id": 1, "department": 1, "text": 1, "redacted_text": 1,
+    "vector": 1, "deleted": 1, "updated_at": 1
+}
+
+
+class TenantIndex:
+    """One tenant's entries as a matrix of unit vectors - rows are replaced in place as entries change"""
+
+    def __init__(self, tenant_id: str, model: str):
+        self.tenant_id = tenant_id
+        self.model = model
+        self.lock = asyncio.Lock()
+        self.reset()
+
+    def reset(self):
+        self.rows: Dict[str, int] = {}
+        self.entries: List[Optional[dict]] = []
+        self.keys: List[str] = []
+        self.departments: List[str] = []
+        self.key_array = np.empty(0, dtype=object)
+        self.department_array = np.empty(0, dtype=object)
+        self.vectors: Optional[np.ndarray] = None
+        self.synced_through: Optional[datetime] = None
+        self.synced_at = None
+        self.loaded_at = None
+
+    def apply(self, changes: List[dict]):
+        """Add, replace or drop rows for changed entries - a dropped row keeps its slot as zeros"""
+        if not changes:
+            return
+        stored = 0 if self.vectors is None else len(self.vectors)
+        added: List[np.ndarray] = []
+        for entry in changes:
+            live = not entry.get("deleted") and entry.get("vector") is not None
+            vector = np.frombuffer(entry["vector"], dtype=np.float32) if live else None
+            row = self.rows.get(entry["key"])
+            if row is None:
+                if vector is None:
+                    continue
+                row = self.rows[entry["key"]] = len(self.entries)
+                self.entries.append(entry)
+                self.keys.append(entry["key"])
+                self.departments.append(entry["department"])
+                added.append(vector)
+            else:
+                self.entries[row] = entry if live else None
+                # Dropped rows match no department, so they never take a top-k slot
+                self.departments[row] = entry["department"] if live else None
+                if row < stored:
+                    self.vectors[row] = vector if live else 0
+                else:
+                    added[row - stored] = vector if live else np.zeros_like(added[row - stored])
+            if entry.get("updated_at") and (self.synced_through is None or entry["updated_at"] > self.synced_through):
+                self.synced_through = entry["updated_at"]
+        if added:
+            matrix = np.vstack(added)
+            self.vectors = matrix if self.vectors is None else np.vstack([self.vectors, matrix])
+        self.key_array = np.array(self.keys, dtype=object)
+        self.department_array = np.array(self.departments, dtype=object)
+
+    async def sync(self):
+        """Catch up on entries written since the last sync - or reload everything once it's old"""
+        async with self.lock:
+            now = time.monotonic()
+            if self.synced_at is not None and now - self.synced_at < RETRIEVAL_SYNC_INTERVAL_SECONDS:
+                return
+            query = {"tenant_ids": self.tenant_id, "model": self.model}
+            if self.loaded_at is None or now - self.loaded_at > RETRIEVAL_RELOAD_SECONDS:
+                self.reset()
+                self.loaded_at = now
+                query["deleted"] = False
+            elif self.synced_through is not None:
+                query["updated_at"] = {"$gte": self.synced_through - RETRIEVAL_SYNC_OVERLAP}
+            changes = await db.retrieval_index.find(query, ENTRY_PROJECTION).sort("updated_at", 1).to_list(None)
+            self.apply(changes)
+            self.synced_at = now
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        departments: List[str],
+        top_k: int,
+        allowed_keys: Optional[Set[str]] = None,
+        redact: bool = False
+    ) -> List[dict]:
+        """Best rows in the departments - only allowed_keys when given, redacted texts when redact is set"""
+        if self.vectors is None or not len(self.entries):
+            return []
+        scores = self.vectors @ query_vector
+        scores[~np.isin(self.department_array, departments)] = -np.inf
+        if allowed_keys is not None:
+            scores[~np.isin(self.key_array, list(allowed_keys))] = -np.inf
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        hits = []
+        for row in best[np.argsort(-scores[best])]:
+            entry = self.entries[row]
+            if entry is None or not np.isfinite(scores[row]):
+                continue
+            text = entry["text"]
+            if redact and SOURCES.get(entry["source"], {}).get("redact"):
+                # Entries indexed before redaction existed have none - leave them out until re-indexed
+                text = entry.get("redacted_text")
+                if not text:
+                    continue
+            hits.append({
+                "key": entry["key"],
+                "source": entry["source"],
+                "record_id": entry["record_id"],
+                "department": entry["department"],
+                "text": text,
+                "score": round(float(scores[row]), 4)
+            })
+        return hits
+
+
+class RetrievalIndex:
+    """Per-tenant indexes for this worker, least recently searched evicted past RETRIEVAL_MAX_TENANTS"""
+
+    def __init__(self, max_tenants: int = RETRIEVAL_MAX_TENANTS):
+        self.max_tenants = max_tenants
+        self._tenants: "OrderedDict[str, TenantIndex]" = OrderedDict()
+
+    def tenant(self, tenant_id: str, model: str) -> TenantIndex:
+        index = self._tenants.get(tenant_id)
+        if index is None or index.model != model:
+            index = self._tenants[tenant_id] = TenantIndex(tenant_id, model)
+        self._tenants.move_to_end(tenant_id)
+        while len(self._tenants) > self.max_tenants:
+            self._tenants.popitem(last=False)
+        return index
+
+    async def search(
+        self,
+        query: str,
+        tenant_ids: List[str],
+        departments: List[str],
+        top_k: int = RETRIEVAL_TOP_K,
+        min_score: float = RETRIEVAL_MIN_SCORE,
+        user_id: Optional[str] = None,
+        allowed_keys: Optional[Set[str]] = None,
+        redact: bool = False
+    ) -> List[dict]:
+        """Records most similar to the query that the tenants own, in the given departments, best first"""
+        if not tenant_ids or not departments or not query.strip() or allowed_keys == set():
+            return []
+        model = llm.model_for(EMBEDDING_FEATURE)
+        indexes = [self.tenant(tenant_id, model) for tenant_id in tenant_ids]
+        (vector,), _ = await asyncio.gather(
+            llm.embed(EMBEDDING_FEATURE, [query], tenant_id=tenant_ids[0], user_id=user_id),
+            asyncio.gather(*(index.sync() for index in indexes))
+        )
+        query_vector = as_vector(vector)
+
+        hits: Dict[str, dict] = {}
+        for index in indexes:
+            if index.vectors is not None and index.vectors.shape[1] != len(query_vector):
+                continue
+            for hit in index.search(query_vector, departments, top_k, allowed_keys, redact):
+                if hit["score"] >= min_score:
+                    hits.setdefault(hit["key"], hit)
+        return sorted(hits.values(), key=lambda hit: hit["score"], reverse=True)[:top_k]
+
+
+def records_context(hits: List[dict], budget: int = RETRIEVAL_CONTEXT_TOKENS) -> str:
+    """The hits as a prompt section, best first, within the token budget"""
+    lines = []
+    for hit in hits:
+        line = f"- [{hit['department']}] {hit['text']}"
+        if estimate_tokens(*lines, line) > budget:
+            break
+        lines.append(line)
+    if not lines:
+        return ""
+    return "RELEVANT RECORDS FROM THE COMPANY'S DATA (use them when they answer the question, cite the load/invoice numbers):\n" + "\n".join(lines)
+
+
+async def relevant_records(query: str, user, departments: List[str]) -> List[dict]:
+    """Search for a chat message - retrieval failing means no records, not a failed chat"""
+    try:
+        if assigned_only(user):
+            keys = await assigned_record_keys(user.id)
+            return await retrieval.search(query, user_tenants(user), departments, user_id=user.id, allowed_keys=keys, redact=True)
+        return await retrieval.search(query, user_tenants(user), departments, user_id=user.id)
+    except HTTPException as e:
+        logger.warning(f"Retrieval skipped: {e.detail}")
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+    return []
+
+
+# Shared index for the worker
+retrieval = RetrievalIndex()
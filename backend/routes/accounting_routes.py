@@ -1,19 +1,43 @@
 """
 Accounting Routes - Accounts Receivable and Accounts Payable
 """
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request, BackgroundTasks
 from models import User
 from auth import get_current_user
 from database import db
+from blob_store import blob_response
+from document_repository import receipt_images, stored_file_response
+from exports import export_format, export_response, iter_documents
+from http_middleware import http_cache
+from image_pipeline import store_upload_bytes, ensure_thumbnail
+from llm_gateway import Attachment, llm, llm_tenant
+from extraction_cache import MISS, extractions, prompt_version
+from extraction_jobs import JOB_RECEIPTS, create_extraction_job, run_extraction_job, store_batch
+from retrieval import schedule_index
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
 from pydantic import BaseModel
 import uuid
-import base64
+import json
 import os
+import re
 
 router = APIRouter(prefix="/accounting", tags=["Accounting"])
 
+# CSV export columns - payments stay in their own endpoints
+RECEIVABLE_EXPORT_COLUMNS = [
+    "id", "invoice_number", "customer_name", "customer_email", "amount", "amount_paid", "due_date",
+    "status", "description", "load_reference", "created_by", "created_at", "updated_at"
+]
+PAYABLE_EXPORT_COLUMNS = [
+    "id", "bill_number", "vendor_name", "vendor_email", "category", "amount", "amount_paid", "due_date",
+    "status", "description", "load_reference", "created_by", "created_at", "updated_at"
+]
+EXPENSE_EXPORT_COLUMNS = [
+    "id", "expense_date", "vendor_name", "category", "amount", "receipt_number", "description", "payment_method",
+    "load_reference", "driver_name", "vehicle_name", "status", "created_by", "created_at", "updated_at"
+]
+
 # Pydantic models
 class ReceivableCreate(BaseModel):
     customer_name: str
@@ -98,8 +122,12 @@ class ExpenseUpdate(BaseModel):
 # ==================== ACCOUNTS RECEIVABLE ====================
 
 @router.get("/receivables")
-async def get_receivables(current_user: User = Depends(get_current_user)):
+async def get_receivables(export: Optional[str] = Depends(export_format), current_user: User = Depends(get_current_user)):
     """Get all accounts receivable for the current user's company"""
+    if export:
+        docs = iter_documents(db.accounts_receivable, {"company_id": current_user.id}, {"_id": 0}, sort=[("created_at", -1)])
+        return export_response(docs, export, "receivables", columns=RECEIVABLE_EXPORT_COLUMNS)
+    
     receivables = await db.accounts_receivable.find(
         {"company_id": current_user.id},  # Use user ID as company identifier
         {"_id": 0}
@@ -139,6 +167,7 @@ async def create_receivable(
     }
     
     await db.accounts_receivable.insert_one(receivable)
+    schedule_index("accounts_receivable", receivable["id"])
     receivable.pop("_id", None)
     
     return {"message": "Invoice created successfully", "receivable": receivable}
@@ -200,6 +229,7 @@ async def record_ar_payment(
             "$push": {"payments": payment_entry}
         }
     )
+    schedule_index("accounts_receivable", receivable_id)
     
     return {
         "message": "Payment recorded successfully",
@@ -248,6 +278,7 @@ async def update_receivable(
             }
         }
     )
+    schedule_index("accounts_receivable", receivable_id)
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Receivable not found")
@@ -264,6 +295,7 @@ async def delete_receivable(
         "id": receivable_id,
         "company_id": current_user.id  # Use user ID as company identifier
     })
+    schedule_index("accounts_receivable", receivable_id)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Receivable not found")
@@ -273,8 +305,12 @@ async def delete_receivable(
 # ==================== ACCOUNTS PAYABLE ====================
 
 @router.get("/payables")
-async def get_payables(current_user: User = Depends(get_current_user)):
+async def get_payables(export: Optional[str] = Depends(export_format), current_user: User = Depends(get_current_user)):
     """Get all accounts payable for the current user's company"""
+    if export:
+        docs = iter_documents(db.accounts_payable, {"company_id": current_user.id}, {"_id": 0}, sort=[("created_at", -1)])
+        return export_response(docs, export, "payables", columns=PAYABLE_EXPORT_COLUMNS)
+    
     payables = await db.accounts_payable.find(
         {"company_id": current_user.id},  # Use user ID as company identifier
         {"_id": 0}
@@ -315,6 +351,7 @@ async def create_payable(
     }
     
     await db.accounts_payable.insert_one(payable)
+    schedule_index("accounts_payable", payable["id"])
     payable.pop("_id", None)
     
     return {"message": "Bill created successfully", "payable": payable}
@@ -370,6 +407,7 @@ async def record_ap_payment(
             "$push": {"payments": payment_entry}
         }
     )
+    schedule_index("accounts_payable", payable_id)
     
     return {
         "message": "Payment recorded successfully",
@@ -418,6 +456,7 @@ async def update_payable(
             }
         }
     )
+    schedule_index("accounts_payable", payable_id)
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Payable not found")
@@ -434,6 +473,7 @@ async def delete_payable(
         "id": payable_id,
         "company_id": current_user.id  # Use user ID as company identifier
     })
+    schedule_index("accounts_payable", payable_id)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Payable not found")
@@ -480,6 +520,7 @@ async def get_accounting_summary(current_user: User = Depends(get_current_user))
 @router.get("/income")
 async def get_income(
     status: Optional[str] = None,
+    export: Optional[str] = Depends(export_format),
     current_user: User = Depends(get_current_user)
 ):
     """Get income entries - AR payments that have been received (paid or partial)"""
@@ -498,6 +539,11 @@ async def get_income(
         elif status == "partial":
             query = {"company_id": current_user.id, "status": "partial"}
     
+    if export:
+        # Entries only - the summary totals are a separate read of the same query
+        docs = iter_documents(db.accounts_receivable, query, {"_id": 0}, sort=[("updated_at", -1)])
+        return export_response(docs, export, "income", columns=RECEIVABLE_EXPORT_COLUMNS)
+    
     income_entries = await db.accounts_receivable.find(
         query,
         {"_id": 0}
@@ -571,6 +617,7 @@ async def get_income_summary(
 async def get_expenses(
     status: Optional[str] = None,
     category: Optional[str] = None,
+    export: Optional[str] = Depends(export_format),
     current_user: User = Depends(get_current_user)
 ):
     """Get all expenses for the current user's company"""
@@ -581,6 +628,10 @@ async def get_expenses(
     if category:
         query["category"] = category
     
+    if export:
+        docs = iter_documents(db.expenses, query, {"_id": 0}, sort=[("created_at", -1)])
+        return export_response(docs, export, "expenses", columns=EXPENSE_EXPORT_COLUMNS)
+    
     expenses = await db.expenses.find(
         query,
         {"_id": 0}
@@ -631,6 +682,7 @@ async def create_expense(
     }
     
     await db.expenses.insert_one(expense)
+    schedule_index("expenses", expense["id"])
     expense.pop("_id", None)
     
     return {"message": "Expense created successfully", "expense": expense}
@@ -676,6 +728,7 @@ async def update_expense(
         {"id": expense_id, "company_id": current_user.id},
         {"$set": update_data}
     )
+    schedule_index("expenses", expense_id)
     
     updated_expense = await db.expenses.find_one(
         {"id": expense_id},
@@ -740,6 +793,7 @@ async def approve_expense(
     }
     
     await db.accounts_payable.insert_one(ap_entry)
+    schedule_index("accounts_payable", ap_entry["id"])
     
     # Update expense status
     await db.expenses.update_one(
@@ -754,6 +808,7 @@ async def approve_expense(
             }
         }
     )
+    schedule_index("expenses", expense_id)
     
     return {
         "message": "Expense approved and AP entry created",
@@ -794,6 +849,7 @@ async def reject_expense(
             }
         }
     )
+    schedule_index("expenses", expense_id)
     
     return {"message": "Expense rejected", "expense_id": expense_id}
 
@@ -815,10 +871,12 @@ async def delete_expense(
         raise HTTPException(status_code=400, detail="Can only delete pending expenses")
     
     await db.expenses.delete_one({"id": expense_id, "company_id": current_user.id})
+    schedule_index("expenses", expense_id)
     
     return {"message": "Expense deleted", "expense_id": expense_id}
 
 @router.get("/expense-categories")
+@http_cache(cache_control="private, max-age=3600")
 async def get_expense_categories():
     """Get list of available expense categories"""
     return {
@@ -848,44 +906,48 @@ async def get_expense_categories():
 
 # ==================== RECEIPT PARSING & AUTO-ENTRY ====================
 
-@router.post("/parse-and-create")
-async def parse_and_create_entry(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-):
-    """
-    Parse receipt image using AI, determine treatment (Expense vs AP), 
-    and automatically create the appropriate entry with receipt attached.
-    """
+def parse_receipt_json(response: str) -> dict:
+    """Model output as a dict - a surrounding markdown code block is removed"""
+    response_text = response.strip()
+    if response_text.startswith('```'):
+        response_text = re.sub(r'^```(?:json)?\s*', '', response_text)
+        response_text = re.sub(r'\s*```$', '', response_text)
+    return json.loads(response_text)
+
+
+async def extract_receipt(prompt: str, system_message: str, contents: bytes, content_type: str, filename: Optional[str], current_user: User):
+    """(parsed receipt fields, cache status) - a receipt already seen with this prompt and model isn't sent again"""
+    async def extract() -> dict:
+        result = await llm.complete(
+            "receipt_parse",
+            prompt,
+            system=system_message,
+            attachments=[Attachment(mime_type=content_type, data=contents, filename=filename)],
+            tenant_id=llm_tenant(current_user),
+            user_id=current_user.id
+        )
+        return parse_receipt_json(result.text)
+
+    return await extractions.get_or_extract(
+        "receipt_parse",
+        contents,
+        llm.model_for("receipt_parse"),
+        prompt_version(prompt, system_message),
+        extract
+    )
+
+
+async def create_entry_from_receipt(contents: bytes, content_type: str, filename: Optional[str], current_user: User) -> dict:
+    """Parse a receipt, decide Expense vs AP and create that entry with the receipt image attached"""
+    file_extension = filename.split('.')[-1] if filename else 'jpg'
+    
+    # Use OpenAI Vision API to parse the receipt with decision-making
     try:
-        # Read the file
-        contents = await file.read()
-        base64_image = base64.b64encode(contents).decode('utf-8')
-        
-        # Determine mime type
-        content_type = file.content_type or 'image/jpeg'
-        file_extension = file.filename.split('.')[-1] if file.filename else 'jpg'
-        
-        # Use OpenAI Vision API to parse the receipt with decision-making
-        try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
-            import os
-            import json
-            import re
-            
-            # Get the Emergent LLM key
-            emergent_key = os.environ.get('EMERGENT_LLM_KEY', 'sk-emergent-73b04E1E4779758EfC')
-            
-            # Initialize chat with GPT-4o for vision
-            chat = LlmChat(
-                api_key=emergent_key,
-                session_id=f"receipt-{str(uuid.uuid4())[:8]}",
-                system_message="""You are an expert accountant for a trucking/transport company. 
+        system_message = """You are an expert accountant for a trucking/transport company. 
                 Analyze receipts and invoices to extract financial data and determine the correct accounting treatment.
                 You must decide if this is an EXPENSE (already paid) or ACCOUNTS_PAYABLE (to be paid later)."""
-            ).with_model("openai", "gpt-4o")
-            
-            prompt = """Analyze this receipt/invoice image for a trucking/transport company.
+        
+        prompt = """Analyze this receipt/invoice image for a trucking/transport company.
             
             Extract information AND determine the accounting treatment:
             
@@ -919,147 +981,145 @@ async def parse_and_create_entry(
             6. If payment_method is credit/terms/invoice → "accounts_payable"
             
             Return ONLY valid JSON, no other text."""
-            
-            # Create image content
-            image_content = ImageContent(image_base64=base64_image)
-            
-            # Send message with image
-            user_message = UserMessage(
-                text=prompt,
-                file_contents=[image_content]
-            )
-            
-            response = await chat.send_message(user_message)
-            
-            # Parse the response
-            response_text = response.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = re.sub(r'^```(?:json)?\s*', '', response_text)
-                response_text = re.sub(r'\s*```$', '', response_text)
-            
-            parsed_data = json.loads(response_text)
-            
-            # Validate and normalize category
-            category = parsed_data.get('category', 'other')
-            if category not in EXPENSE_CATEGORIES:
-                category = 'other'
-            
-            # Determine treatment
-            treatment = parsed_data.get('treatment', 'expense').lower()
-            if treatment not in ['expense', 'accounts_payable']:
-                # Default based on payment method
-                payment_method = parsed_data.get('payment_method', '').lower()
-                if payment_method in ['cash', 'card', 'fleet_card', 'debit']:
-                    treatment = 'expense'
-                else:
-                    treatment = 'accounts_payable'
-            
-            # Store the receipt image
-            receipt_id = str(uuid.uuid4())
-            receipt_record = {
-                "id": receipt_id,
+        
+        # Send the receipt image through the shared gateway (vision model)
+        parsed_data, cache_status = await extract_receipt(prompt, system_message, contents, content_type, filename, current_user)
+        
+        # Validate and normalize category
+        category = parsed_data.get('category', 'other')
+        if category not in EXPENSE_CATEGORIES:
+            category = 'other'
+        
+        # Determine treatment
+        treatment = parsed_data.get('treatment', 'expense').lower()
+        if treatment not in ['expense', 'accounts_payable']:
+            # Default based on payment method
+            payment_method = parsed_data.get('payment_method', '').lower()
+            if payment_method in ['cash', 'card', 'fleet_card', 'debit']:
+                treatment = 'expense'
+            else:
+                treatment = 'accounts_payable'
+        
+        # Store the receipt image - normalized photo and thumbnail in the blob store, metadata in Mongo
+        receipt_id = str(uuid.uuid4())
+        stored = await store_upload_bytes(contents, content_type, filename or f"receipt_{receipt_id}.{file_extension}")
+        receipt_record = {
+            "id": receipt_id,
+            "company_id": current_user.id,
+            **stored,
+            "uploaded_at": datetime.now(timezone.utc).isoformat(),
+            "uploaded_by": current_user.id
+        }
+        await receipt_images.insert(receipt_record)
+        
+        # Create the appropriate entry based on AI decision
+        entry_created = None
+        entry_type = None
+        
+        if treatment == 'expense':
+            # Create Expense entry (for already paid items)
+            expense_entry = {
+                "id": str(uuid.uuid4()),
                 "company_id": current_user.id,
-                "filename": file.filename or f"receipt_{receipt_id}.{file_extension}",
-                "content_type": content_type,
-                "image_base64": base64_image,
-                "uploaded_at": datetime.now(timezone.utc).isoformat(),
-                "uploaded_by": current_user.id
+                "vendor_name": parsed_data.get('vendor_name') or 'Unknown Vendor',
+                "expense_date": parsed_data.get('expense_date') or datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+                "amount": parsed_data.get('amount') or 0,
+                "category": category,
+                "receipt_number": parsed_data.get('receipt_number'),
+                "description": parsed_data.get('description'),
+                "payment_method": parsed_data.get('payment_method'),
+                "driver_name": parsed_data.get('driver_name'),
+                "vehicle_name": parsed_data.get('vehicle_number'),
+                "line_items": parsed_data.get('line_items') or [],
+                "receipt_id": receipt_id,
+                "receipt_image_url": f"/api/accounting/receipts/{receipt_id}/image",
+                "status": "pending",  # Goes to expense ledger for approval
+                "ai_treatment": treatment,
+                "ai_treatment_reason": parsed_data.get('treatment_reason'),
+                "created_by": current_user.id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc).isoformat()
             }
-            await db.receipt_images.insert_one(receipt_record)
+            await db.expenses.insert_one(expense_entry)
+            schedule_index("expenses", expense_entry["id"])
+            entry_created = expense_entry
+            entry_type = "expense"
             
-            # Create the appropriate entry based on AI decision
-            entry_created = None
-            entry_type = None
-            
-            if treatment == 'expense':
-                # Create Expense entry (for already paid items)
-                expense_entry = {
-                    "id": str(uuid.uuid4()),
-                    "company_id": current_user.id,
-                    "vendor_name": parsed_data.get('vendor_name') or 'Unknown Vendor',
-                    "expense_date": parsed_data.get('expense_date') or datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-                    "amount": parsed_data.get('amount') or 0,
-                    "category": category,
-                    "receipt_number": parsed_data.get('receipt_number'),
-                    "description": parsed_data.get('description'),
-                    "payment_method": parsed_data.get('payment_method'),
-                    "driver_name": parsed_data.get('driver_name'),
-                    "vehicle_name": parsed_data.get('vehicle_number'),
-                    "line_items": parsed_data.get('line_items') or [],
-                    "receipt_id": receipt_id,
-                    "receipt_image_url": f"/api/accounting/receipts/{receipt_id}/image",
-                    "status": "pending",  # Goes to expense ledger for approval
-                    "ai_treatment": treatment,
-                    "ai_treatment_reason": parsed_data.get('treatment_reason'),
-                    "created_by": current_user.id,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-                await db.expenses.insert_one(expense_entry)
-                entry_created = expense_entry
-                entry_type = "expense"
-                
-            else:
-                # Create Accounts Payable entry (for unpaid invoices)
-                bill_number = f"BILL-{parsed_data.get('receipt_number') or str(uuid.uuid4())[:8].upper()}"
-                due_date = parsed_data.get('due_date') or (datetime.now(timezone.utc) + timedelta(days=30)).strftime("%Y-%m-%d")
-                
-                ap_entry = {
-                    "id": str(uuid.uuid4()),
-                    "company_id": current_user.id,
-                    "vendor_name": parsed_data.get('vendor_name') or 'Unknown Vendor',
-                    "vendor_email": "",
-                    "bill_number": bill_number,
-                    "amount": parsed_data.get('amount') or 0,
-                    "amount_paid": 0,
-                    "due_date": due_date,
-                    "description": parsed_data.get('description') or f"{category.replace('_', ' ').title()} - {parsed_data.get('vendor_name')}",
-                    "category": category,
-                    "receipt_id": receipt_id,
-                    "receipt_image_url": f"/api/accounting/receipts/{receipt_id}/image",
-                    "status": "pending",
-                    "ai_treatment": treatment,
-                    "ai_treatment_reason": parsed_data.get('treatment_reason'),
-                    "created_by": current_user.id,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat(),
-                    "auto_generated": True,
-                    "source": "receipt_ai"
-                }
-                await db.accounts_payable.insert_one(ap_entry)
-                entry_created = ap_entry
-                entry_type = "accounts_payable"
-            
-            # Remove _id from response
-            if entry_created:
-                entry_created.pop("_id", None)
+        else:
+            # Create Accounts Payable entry (for unpaid invoices)
+            bill_number = f"BILL-{parsed_data.get('receipt_number') or str(uuid.uuid4())[:8].upper()}"
+            due_date = parsed_data.get('due_date') or (datetime.now(timezone.utc) + timedelta(days=30)).strftime("%Y-%m-%d")
             
-            return {
-                "success": True,
-                "parsed_data": parsed_data,
-                "ai_decision": {
-                    "treatment": treatment,
-                    "reason": parsed_data.get('treatment_reason', 'Based on payment indicators on receipt'),
-                    "entry_type": entry_type
-                },
-                "entry_created": entry_created,
+            ap_entry = {
+                "id": str(uuid.uuid4()),
+                "company_id": current_user.id,
+                "vendor_name": parsed_data.get('vendor_name') or 'Unknown Vendor',
+                "vendor_email": "",
+                "bill_number": bill_number,
+                "amount": parsed_data.get('amount') or 0,
+                "amount_paid": 0,
+                "due_date": due_date,
+                "description": parsed_data.get('description') or f"{category.replace('_', ' ').title()} - {parsed_data.get('vendor_name')}",
+                "category": category,
                 "receipt_id": receipt_id,
-                "receipt_url": f"/api/accounting/receipts/{receipt_id}/image",
-                "message": f"Receipt processed and {'Expense' if treatment == 'expense' else 'AP Bill'} entry created successfully!"
+                "receipt_image_url": f"/api/accounting/receipts/{receipt_id}/image",
+                "status": "pending",
+                "ai_treatment": treatment,
+                "ai_treatment_reason": parsed_data.get('treatment_reason'),
+                "created_by": current_user.id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "auto_generated": True,
+                "source": "receipt_ai"
             }
-            
-        except ImportError as e:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"AI integration not configured: {str(e)}"
-            )
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to parse AI response: {str(e)}"
-            )
+            await db.accounts_payable.insert_one(ap_entry)
+            schedule_index("accounts_payable", ap_entry["id"])
+            entry_created = ap_entry
+            entry_type = "accounts_payable"
+        
+        # Remove _id from response
+        if entry_created:
+            entry_created.pop("_id", None)
+        
+        return {
+            "success": True,
+            "parsed_data": parsed_data,
+            "ai_decision": {
+                "treatment": treatment,
+                "reason": parsed_data.get('treatment_reason', 'Based on payment indicators on receipt'),
+                "entry_type": entry_type
+            },
+            "entry_created": entry_created,
+            "receipt_id": receipt_id,
+            "receipt_url": f"/api/accounting/receipts/{receipt_id}/image",
+            "cached": cache_status != MISS,
+            "message": f"Receipt processed and {'Expense' if treatment == 'expense' else 'AP Bill'} entry created successfully!"
+        }
+        
+    except json.JSONDecodeError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to parse AI response: {str(e)}"
+        )
+
+
+@router.post("/parse-and-create")
+async def parse_and_create_entry(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Parse receipt image using AI, determine treatment (Expense vs AP), 
+    and automatically create the appropriate entry with receipt attached.
+    """
+    try:
+        # Read the file
+        contents = await file.read()
+        
+        # Determine mime type
+        content_type = file.content_type or 'image/jpeg'
+        
+        return await create_entry_from_receipt(contents, content_type, file.filename, current_user)
             
     except HTTPException:
         raise
@@ -1067,26 +1127,55 @@ async def parse_and_create_entry(
         raise HTTPException(status_code=500, detail=f"Failed to process receipt: {str(e)}")
 
 
+@router.post("/parse-and-create/batch")
+async def parse_and_create_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Parse-and-create for a stack of receipts in the background - the request returns a job right away;
+    poll GET /extraction-jobs/{job_id} and read entries from /extraction-jobs/{job_id}/results as they land.
+    """
+    receipts = await store_batch(files, default_type='image/jpeg')
+    job = await create_extraction_job(current_user.id, JOB_RECEIPTS, receipts)
+    
+    async def process(receipt: Attachment) -> dict:
+        return await create_entry_from_receipt(receipt.data, receipt.mime_type, receipt.filename, current_user)
+    
+    background_tasks.add_task(run_extraction_job, job["id"], receipts, process)
+    return {"job_id": job["id"], "total": job["total"], "status": job["status"]}
+
+
 @router.get("/receipts/{receipt_id}/image")
 async def get_receipt_image(
     receipt_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Get receipt image by ID"""
-    from fastapi.responses import Response
-    
-    receipt = await db.receipt_images.find_one({
-        "id": receipt_id,
-        "company_id": current_user.id
-    })
-    
+    """Stream receipt image by ID - supports Range and If-None-Match"""
+    receipt = await receipt_images.get_for_company(receipt_id, current_user.id)
     if not receipt:
         raise HTTPException(status_code=404, detail="Receipt image not found")
     
-    image_data = base64.b64decode(receipt.get("image_base64", ""))
-    content_type = receipt.get("content_type", "image/jpeg")
+    return await stored_file_response(request, receipt, receipt_images, default_type="image/jpeg")
+
+
+@router.get("/receipts/{receipt_id}/thumbnail")
+async def get_receipt_thumbnail(
+    receipt_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Small JPEG preview of a receipt image"""
+    receipt = await receipt_images.get_for_company(receipt_id, current_user.id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt image not found")
     
-    return Response(content=image_data, media_type=content_type)
+    sha256 = await ensure_thumbnail(receipt, receipt_images)
+    if not sha256:
+        raise HTTPException(status_code=404, detail="No thumbnail for this receipt")
+    return await blob_response(request, sha256, "image/jpeg")
 
 
 @router.post("/parse-receipt")
@@ -1098,28 +1187,12 @@ async def parse_receipt(
     try:
         # Read the file
         contents = await file.read()
-        base64_image = base64.b64encode(contents).decode('utf-8')
         
         # Determine mime type
         content_type = file.content_type or 'image/jpeg'
         
         # Use OpenAI Vision API to parse the receipt
         try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
-            import os
-            import json
-            import re
-            
-            # Get the Emergent LLM key
-            emergent_key = os.environ.get('EMERGENT_LLM_KEY', 'sk-emergent-73b04E1E4779758EfC')
-            
-            # Initialize chat with GPT-4o for vision
-            chat = LlmChat(
-                api_key=emergent_key,
-                session_id=f"receipt-preview-{str(uuid.uuid4())[:8]}",
-                system_message="You are an expert at parsing trucking and transportation expense receipts."
-            ).with_model("openai", "gpt-4o")
-            
             prompt = """Analyze this receipt/invoice image for a trucking/transport company.
             Extract the following information in JSON format:
             {
@@ -1147,18 +1220,8 @@ async def parse_receipt(
             
             Return ONLY valid JSON."""
             
-            # Create image content and send
-            image_content = ImageContent(image_base64=base64_image)
-            user_message = UserMessage(text=prompt, file_contents=[image_content])
-            response = await chat.send_message(user_message)
-            
-            # Parse response
-            response_text = response.strip()
-            if response_text.startswith('```'):
-                response_text = re.sub(r'^```(?:json)?\s*', '', response_text)
-                response_text = re.sub(r'\s*```$', '', response_text)
-            
-            parsed_data = json.loads(response_text)
+            system_message = "You are an expert at parsing trucking and transportation expense receipts."
+            parsed_data, cache_status = await extract_receipt(prompt, system_message, contents, content_type, file.filename, current_user)
             
             # Validate category
             category = parsed_data.get('category', 'other')
@@ -1172,11 +1235,10 @@ async def parse_receipt(
                     "treatment": parsed_data.get('treatment', 'expense'),
                     "reason": parsed_data.get('treatment_reason', 'Based on receipt analysis')
                 },
+                "cached": cache_status != MISS,
                 "message": "Receipt parsed. Review and confirm to create entry."
             }
             
-        except ImportError as e:
-            raise HTTPException(status_code=500, detail=f"AI integration error: {str(e)}")
         except json.JSONDecodeError as e:
             raise HTTPException(status_code=500, detail=f"Failed to parse AI response: {str(e)}")
             
@@ -1257,6 +1319,7 @@ async def confirm_receipt_entry(
             }
             
             await db.expenses.insert_one(expense)
+            schedule_index("expenses", expense["id"])
             expense.pop("_id", None)
             
             return {
@@ -1311,6 +1374,7 @@ async def confirm_receipt_entry(
             }
             
             await db.accounts_payable.insert_one(payable)
+            schedule_index("accounts_payable", payable["id"])
             payable.pop("_id", None)
             
             return {
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from models import *
 from auth import get_current_user, require_platform_admin
 from database import db
+from pagination import PageParams, page_params, list_page_params, paginate, set_page_headers, count_total
+from exports import export_format, export_response, iter_documents
+from http_middleware import http_cache
+from extraction_cache import extraction_stats
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
 from pydantic import BaseModel
@@ -11,9 +15,8 @@ import uuid
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 @router.get('/tenants')
-async def list_tenants(current_user: User = Depends(get_current_user)):
+async def list_tenants(response: Response, page: PageParams = Depends(list_page_params), export: Optional[str] = Depends(export_format), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    tenants = await db.companies.find({}).to_list(length=None)
     
     def enrich_tenant(c):
         # Calculate total seats and storage across all subscriptions
@@ -65,7 +68,14 @@ async def list_tenants(current_user: User = Depends(get_current_user)):
             "feature_flags": c.get("feature_flags", {}),
             "created_at": c.get("created_at"),
         }
-    return [enrich_tenant(c) for c in tenants]
+    
+    if export:
+        docs = iter_documents(db.companies, {}, sort=[("_id", 1)], transform=enrich_tenant)
+        return export_response(docs, export, "tenants")
+    
+    result = await paginate(db.companies, {}, page)
+    set_page_headers(response, result)
+    return [enrich_tenant(c) for c in result.items]
 
 class TenantCreate(BaseModel):
     name: str
@@ -288,10 +298,18 @@ async def remove_product_subscription(
     return {"message": message, "tenant": tenant}
 
 @router.get('/plans')
+@http_cache(cache_control="private, max-age=3600")
 async def get_plans(current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
     return PLANS
 
+@router.get('/ai/extraction-cache')
+async def get_extraction_cache_stats(days: int = 7, current_user: User = Depends(get_current_user)):
+    """Document extraction cache hits/misses per feature over the last `days` days"""
+    require_platform_admin(current_user)
+    days = max(1, min(days, 90))
+    return {"days": days, "features": await extraction_stats(days)}
+
 @router.get('/analytics')
 async def get_sales_analytics(current_user: User = Depends(get_current_user)):
     """Get comprehensive sales analytics"""
@@ -762,8 +780,7 @@ async def list_all_users(
     role: Optional[str] = None,
     is_active: Optional[bool] = None,
     search: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 100,
+    page: PageParams = Depends(page_params),
     current_user: User = Depends(get_current_user)
 ):
     """List all users with filtering (Platform Admin only)"""
@@ -788,25 +805,28 @@ async def list_all_users(
             {"email": {"$regex": search, "$options": "i"}}
         ]
     
-    # Get users with pagination
-    users = await db.users.find(query, {"_id": 0, "password_hash": 0}).skip(skip).limit(limit).to_list(length=limit)
+    # Get users with keyset pagination - constant cost however deep the page
+    result = await paginate(db.users, query, page, projection={"_id": 0, "password_hash": 0})
+    users = result.items
     
-    # Enrich with company name
+    # Enrich with company name - one lookup for the whole page
+    company_ids = list({user["company_id"] for user in users if user.get("company_id")})
+    companies = await db.companies.find({"id": {"$in": company_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(company_ids) or 1)
+    company_names = {c["id"]: c.get("name") for c in companies}
     for user in users:
         if user.get("company_id"):
-            company = await db.companies.find_one({"id": user["company_id"]}, {"_id": 0, "name": 1})
-            user["company_name"] = company.get("name") if company else "Unknown"
+            user["company_name"] = company_names.get(user["company_id"], "Unknown")
         else:
             user["company_name"] = None
     
-    # Get total count
-    total_count = await db.users.count_documents(query)
+    # Get total count - capped for large filtered sets
+    total_count = result.total if result.total is not None else await count_total(db.users, query)
     
     return {
         "users": users,
         "total": total_count,
-        "skip": skip,
-        "limit": limit
+        "limit": page.limit,
+        "next_cursor": result.next_cursor
     }
 
 @router.post('/users', response_model=dict)
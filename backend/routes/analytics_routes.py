@@ -1,37 +1,11 @@
 from fastapi import APIRouter, Depends
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from bson import ObjectId
 from database import db
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
 
-def serialize_doc(doc):
-    """Convert MongoDB document to JSON-serializable dict"""
-    if doc is None:
-        return None
-    if isinstance(doc, list):
-        return [serialize_doc(d) for d in doc]
-    if isinstance(doc, dict):
-        result = {}
-        for key, value in doc.items():
-            if key == '_id':
-                result['id'] = str(value)
-            elif isinstance(value, ObjectId):
-                result[key] = str(value)
-            elif isinstance(value, datetime):
-                result[key] = value.isoformat()
-            elif isinstance(value, dict):
-                result[key] = serialize_doc(value)
-            elif isinstance(value, list):
-                result[key] = [serialize_doc(v) if isinstance(v, dict) else v for v in value]
-            else:
-                result[key] = value
-        return result
-    return doc
-
-
 @router.get("/dispatch/kpis")
 async def get_dispatch_kpis(company_id: Optional[str] = None):
     """Get dispatch KPIs including load counts, revenue, and delivery rates"""
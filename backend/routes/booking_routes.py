@@ -2,20 +2,29 @@ from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Backgro
 from models import User, Booking, BookingCreate, DispatchUpdate
 from auth import get_current_user
 from database import db
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from typing import List, Literal, Optional
 from email_service import send_booking_confirmation_emails
+from driver_assignments import refresh_assignments
+from load_accounting import create_ar_ap_for_load
+from retrieval import schedule_index
+from pagination import PageParams, list_page_params, paginate, set_page_headers
+from serialization import json_response, model_projection, model_views
+from llm_gateway import Attachment, llm, llm_tenant
+from extraction_cache import MISS, extractions, prompt_version
+from extraction_jobs import JOB_RATE_CONFIRMATIONS, create_extraction_job, run_extraction_job, store_batch
 from pydantic import BaseModel
 import base64
 import logging
 import traceback
-import os
 import json
 import uuid
 
 router = APIRouter(prefix="/bookings", tags=["Bookings"])
 logger = logging.getLogger(__name__)
 
+RATE_CONFIRMATION_TYPES = ['application/pdf', 'image/jpeg', 'image/png', 'image/jpg', 'image/webp']
+
 # Pydantic model for creating load from quote
 class LoadFromQuote(BaseModel):
     pickup_location: str = ""
@@ -78,6 +87,7 @@ async def create_load_from_quote(load_data: LoadFromQuote, current_user: User =
     }
     
     await db.bookings.insert_one(load_dict)
+    schedule_index("bookings", load_dict["id"])
     
     return {
         "message": "Load created successfully",
@@ -114,6 +124,9 @@ async def create_booking(booking_data: BookingCreate, background_tasks: Backgrou
     booking_obj = Booking(**booking_dict)
     
     await db.bookings.insert_one(booking_obj.dict())
+    schedule_index("bookings", booking_obj.id)
+    if booking_obj.driver_id:
+        await refresh_assignments("bookings", booking_obj.id)
     
     # Send booking confirmation emails
     booking_details = {
@@ -143,9 +156,11 @@ async def create_booking(booking_data: BookingCreate, background_tasks: Backgrou
     }
 
 @router.get("/my", response_model=List[Booking])
-async def get_my_bookings(current_user: User = Depends(get_current_user)):
-    bookings = await db.bookings.find({"requester_id": current_user.id}).to_list(length=None)
-    return [Booking(**booking) for booking in bookings]
+async def get_my_bookings(page: PageParams = Depends(list_page_params), current_user: User = Depends(get_current_user)):
+    result = await paginate(db.bookings, {"requester_id": current_user.id}, page, projection=model_projection(Booking))
+    response = json_response(model_views(Booking, result.items))
+    set_page_headers(response, result)
+    return response
 
 @router.get("/requests")
 async def get_booking_requests(current_user: User = Depends(get_current_user)):
@@ -180,12 +195,14 @@ async def update_booking_status(
         {"id": booking_id},
         {"$set": {"status": status}}
     )
+    await refresh_assignments("bookings", booking_id)
+    schedule_index("bookings", booking_id)
     
     # Auto-generate AR/AP entries when load is marked as "delivered"
     ar_created = False
     ap_created = False
     if status == "delivered" and old_status != "delivered":
-        ar_created, ap_created = await create_ar_ap_for_load(booking, current_user)
+        ar_created, ap_created = await create_ar_ap_for_load(booking, current_user.id, current_user.id)
     
     response = {"message": "Status updated successfully", "status": status}
     if ar_created or ap_created:
@@ -197,96 +214,6 @@ async def update_booking_status(
     return response
 
 
-async def create_ar_ap_for_load(booking: dict, current_user: User) -> tuple:
-    """
-    Auto-generate Accounts Receivable and Accounts Payable entries 
-    when a load is marked as delivered.
-    Returns: (ar_created: bool, ap_created: bool)
-    """
-    order_number = booking.get("order_number", "")
-    company_id = current_user.id
-    
-    ar_created = False
-    ap_created = False
-    
-    # Check if AR already exists for this load
-    existing_ar = await db.accounts_receivable.find_one({
-        "load_reference": order_number,
-        "company_id": company_id
-    })
-    
-    # Create Accounts Receivable (Invoice to Customer) if not exists
-    if not existing_ar:
-        customer_rate = booking.get("customer_rate") or booking.get("confirmed_rate") or booking.get("total_cost") or 0
-        if customer_rate > 0:
-            # Calculate due date (30 days from delivery)
-            due_date = (datetime.now(timezone.utc) + timedelta(days=30)).strftime("%Y-%m-%d")
-            
-            ar_entry = {
-                "id": str(uuid.uuid4()),
-                "company_id": company_id,
-                "customer_name": booking.get("shipper_name") or "Customer",
-                "customer_email": "",
-                "invoice_number": f"INV-{order_number}",
-                "amount": float(customer_rate),
-                "amount_paid": 0,
-                "due_date": due_date,
-                "description": f"Freight charges for load {order_number}",
-                "load_reference": order_number,
-                "booking_id": booking.get("id"),
-                "status": "pending",
-                "created_by": current_user.id,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "auto_generated": True
-            }
-            
-            await db.accounts_receivable.insert_one(ar_entry)
-            ar_created = True
-            logger.info(f"Auto-created AR entry for load {order_number}: ${customer_rate}")
-    
-    # Check if AP already exists for this load
-    existing_ap = await db.accounts_payable.find_one({
-        "load_reference": order_number,
-        "company_id": company_id
-    })
-    
-    # Create Accounts Payable (Bill to Carrier) if not exists and carrier is assigned
-    if not existing_ap:
-        carrier_rate = booking.get("confirmed_rate") or booking.get("total_cost") or 0
-        carrier_name = booking.get("assigned_carrier")
-        
-        if carrier_rate > 0 and carrier_name:
-            # Calculate due date (15 days from delivery for carrier payment)
-            due_date = (datetime.now(timezone.utc) + timedelta(days=15)).strftime("%Y-%m-%d")
-            
-            ap_entry = {
-                "id": str(uuid.uuid4()),
-                "company_id": company_id,
-                "vendor_name": carrier_name,
-                "vendor_email": "",
-                "bill_number": f"BILL-{order_number}",
-                "amount": float(carrier_rate),
-                "amount_paid": 0,
-                "due_date": due_date,
-                "description": f"Carrier payment for load {order_number}",
-                "load_reference": order_number,
-                "booking_id": booking.get("id"),
-                "category": "carrier_payment",
-                "status": "pending",
-                "created_by": current_user.id,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "auto_generated": True
-            }
-            
-            await db.accounts_payable.insert_one(ap_entry)
-            ap_created = True
-            logger.info(f"Auto-created AP entry for load {order_number}: ${carrier_rate}")
-    
-    return ar_created, ap_created
-
-
 @router.patch("/{booking_id}/dispatch", response_model=dict)
 async def update_dispatch_info(
     booking_id: str,
@@ -319,6 +246,8 @@ async def update_dispatch_info(
             {"id": booking_id},
             {"$set": update_data}
         )
+        await refresh_assignments("bookings", booking_id)
+        schedule_index("bookings", booking_id)
     
     return {"message": "Dispatch info updated successfully", "updated_fields": list(update_data.keys())}
 
@@ -379,6 +308,9 @@ async def push_load_to_driver(
     }
     
     await db.driver_loads.insert_one(driver_load)
+    # Materialize the push into the driver's assignment view (refreshes the booking's pushed records too)
+    await refresh_assignments("bookings", booking_id)
+    schedule_index("bookings", booking_id)
     
     # Update driver status to on_trip
     await db.drivers.update_one(
@@ -424,58 +356,17 @@ async def update_booking(
         {"id": booking_id},
         {"$set": update_data}
     )
+    await refresh_assignments("bookings", booking_id)
+    schedule_index("bookings", booking_id)
     
     # Get updated booking
     updated_booking = await db.bookings.find_one({"id": booking_id})
     return Booking(**updated_booking)
 
-@router.post("/parse-rate-confirmation", response_model=dict)
-async def parse_rate_confirmation(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-):
-    """
-    Parse a rate confirmation document using AI to extract order information
-    """
-    logger.info(f"Parsing rate confirmation: filename={file.filename}, content_type={file.content_type}")
-    
-    try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
-        import tempfile
-        import shutil
-        
-        # Validate file type
-        allowed_types = ['application/pdf', 'image/jpeg', 'image/png', 'image/jpg', 'image/webp']
-        if file.content_type not in allowed_types:
-            logger.error(f"Invalid file type: {file.content_type}")
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}. Only PDF and image files (JPEG, PNG) are supported.")
-        
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_file_path = temp_file.name
-        
-        try:
-            # Initialize AI chat with Gemini (supports file attachments)
-            # Note: File attachment processing requires Gemini provider
-            api_key = os.environ.get('EMERGENT_LLM_KEY')
-            if not api_key:
-                raise HTTPException(status_code=500, detail="AI service not configured")
-            
-            chat = LlmChat(
-                api_key=api_key,
-                session_id=f"rate-conf-{current_user.id}",
-                system_message="You are an AI assistant specialized in extracting structured data from shipping and logistics documents, including rate confirmations, bills of lading, and load tenders. Extract all relevant fields accurately and return data in valid JSON format."
-            ).with_model("gemini", "gemini-2.0-flash")
-            
-            # Prepare file for analysis
-            file_content = FileContentWithMimeType(
-                file_path=temp_file_path,
-                mime_type=file.content_type
-            )
-            
-            # Create detailed extraction prompt
-            extraction_prompt = """
+async def extract_rate_confirmation(document: Attachment, current_user: User) -> dict:
+    """Order fields from a rate confirmation - a document already extracted with this prompt/model isn't sent again"""
+    # Create detailed extraction prompt
+    extraction_prompt = """
 Analyze this rate confirmation or shipping document and extract the following information. 
 Return the data in JSON format with these exact field names:
 
@@ -518,44 +409,75 @@ Extract only the numeric value without dollar signs or commas.
 If a field is not found in the document, set it to null. 
 Return ONLY the JSON object, no additional text or explanation.
 """
-            
-            # Send message with file
-            user_message = UserMessage(
-                text=extraction_prompt,
-                file_contents=[file_content]
-            )
-            
-            response = await chat.send_message(user_message)
-            
-            logger.info(f"AI response received, length: {len(response)}")
-            
-            # Parse the AI response
-            response_text = response.strip()
-            
-            # Try to extract JSON from response
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                response_text = response_text.split('```')[1].split('```')[0].strip()
-            
-            try:
-                extracted_data = json.loads(response_text)
-                logger.info(f"Successfully extracted data: {list(extracted_data.keys())}")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parse error: {e}, response: {response_text[:500]}")
-                raise HTTPException(status_code=500, detail=f"Failed to parse AI response as JSON. AI returned: {response_text[:200]}")
-            
-            return {
-                "success": True,
-                "data": extracted_data,
-                "message": "Document parsed successfully"
-            }
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
+    
+    system_message = "You are an AI assistant specialized in extracting structured data from shipping and logistics documents, including rate confirmations, bills of lading, and load tenders. Extract all relevant fields accurately and return data in valid JSON format."
+    
+    async def extract() -> dict:
+        # Send message with file
+        result = await llm.complete(
+            "rate_confirmation",
+            extraction_prompt,
+            system=system_message,
+            attachments=[document],
+            tenant_id=llm_tenant(current_user),
+            user_id=current_user.id
+        )
+        response = result.text
+        
+        logger.info(f"AI response received, length: {len(response)}")
+        
+        # Parse the AI response
+        response_text = response.strip()
+        
+        # Try to extract JSON from response
+        if '```json' in response_text:
+            response_text = response_text.split('```json')[1].split('```')[0].strip()
+        elif '```' in response_text:
+            response_text = response_text.split('```')[1].split('```')[0].strip()
+        
+        try:
+            extracted_data = json.loads(response_text)
+            logger.info(f"Successfully extracted data: {list(extracted_data.keys())}")
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON parse error: {e}, response: {response_text[:500]}")
+            raise HTTPException(status_code=500, detail=f"Failed to parse AI response as JSON. AI returned: {response_text[:200]}")
+        return extracted_data
+    
+    # The same document (and prompt/model) is only ever extracted once
+    extracted_data, cache_status = await extractions.get_or_extract(
+        "rate_confirmation",
+        document.data,
+        llm.model_for("rate_confirmation"),
+        prompt_version(extraction_prompt, system_message),
+        extract
+    )
+    
+    return {
+        "success": True,
+        "data": extracted_data,
+        "cached": cache_status != MISS,
+        "message": "Document parsed successfully"
+    }
+
+@router.post("/parse-rate-confirmation", response_model=dict)
+async def parse_rate_confirmation(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Parse a rate confirmation document using AI to extract order information
+    """
+    logger.info(f"Parsing rate confirmation: filename={file.filename}, content_type={file.content_type}")
+    
+    # Validate file type
+    if file.content_type not in RATE_CONFIRMATION_TYPES:
+        logger.error(f"Invalid file type: {file.content_type}")
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}. Only PDF and image files (JPEG, PNG) are supported.")
+    
+    try:
+        document = Attachment(mime_type=file.content_type, data=await file.read(), filename=file.filename)
+        return await extract_rate_confirmation(document, current_user)
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -564,3 +486,23 @@ Return ONLY the JSON object, no additional text or explanation.
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error parsing document: {str(e)}")
 
+@router.post("/parse-rate-confirmation/batch")
+async def parse_rate_confirmation_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Parse many rate confirmations in the background - poll GET /extraction-jobs/{job_id} for progress"""
+    unsupported = [f.filename for f in files if f.content_type not in RATE_CONFIRMATION_TYPES]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type for: {', '.join(unsupported)}. Only PDF and image files (JPEG, PNG) are supported.")
+    
+    documents = await store_batch(files)
+    job = await create_extraction_job(current_user.id, JOB_RATE_CONFIRMATIONS, documents)
+    
+    async def process(document: Attachment) -> dict:
+        return await extract_rate_confirmation(document, current_user)
+    
+    background_tasks.add_task(run_extraction_job, job["id"], documents, process)
+    return {"job_id": job["id"], "total": job["total"], "status": job["status"]}
+
@@ -1,17 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, BackgroundTasks, Request
 from models import *
-from auth import get_current_user
+from auth import get_current_user, get_optional_user, is_platform_admin
 from database import db
 from datetime import datetime, timezone
 from email_service import send_company_verification_email
-import tempfile
-import shutil
-import base64
-import os
-from typing import Literal
+from blob_store import blob_store, upload_chunks, blob_response, BlobTooLarge
+from typing import Literal, Optional
 
 router = APIRouter(prefix="/companies", tags=["Companies"])
 
+# Logos and company documents are streamed into the blob store and cut off past this size (10MB)
+MAX_FILE_SIZE = 10 * 1024 * 1024
+
+def company_file_url(company_id: str, sha256: str) -> str:
+    """URL for a company logo/document - logos work directly in <img src>, documents need the bearer token"""
+    return f"/api/companies/{company_id}/files/{sha256}"
+
+async def user_in_company(user: User, company: dict) -> bool:
+    """Owner, a driver of the owner's fleet, or staff whose company_id is the company - as in /current"""
+    if user.id == company.get("owner_id"):
+        return True
+    user_record = await db.users.find_one({"id": user.id}, {"_id": 0, "fleet_owner_id": 1, "company_id": 1}) or {}
+    return (
+        bool(user_record.get("fleet_owner_id")) and user_record["fleet_owner_id"] == company.get("owner_id")
+    ) or user_record.get("company_id") == company["id"]
+
 @router.post("", response_model=dict)
 async def create_company(company_data: CompanyCreate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
     # Check if user's email is verified
@@ -134,32 +147,19 @@ async def upload_company_logo(
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Only image files (JPEG, PNG, WebP) are supported")
     
-    import tempfile
-    import shutil
-    import base64
+    try:
+        blob = await blob_store.put_stream(upload_chunks(file), max_bytes=MAX_FILE_SIZE)
+    except BlobTooLarge:
+        raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
+    logo_url = company_file_url(company["id"], blob.sha256)
     
-    # Save file temporarily and convert to base64 for storage
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_path = temp_file.name
+    # Update company with logo URL - the bytes live in the blob store
+    await db.companies.update_one(
+        {"id": company["id"]},
+        {"$set": {"logo_url": logo_url, "logo_sha256": blob.sha256, "logo_content_type": file.content_type}}
+    )
     
-    try:
-        # Read file and convert to base64
-        with open(temp_file_path, 'rb') as f:
-            file_data = f.read()
-            base64_data = base64.b64encode(file_data).decode('utf-8')
-            logo_url = f"data:{file.content_type};base64,{base64_data}"
-        
-        # Update company with logo URL
-        await db.companies.update_one(
-            {"id": company["id"]},
-            {"$set": {"logo_url": logo_url}}
-        )
-        
-        return {"message": "Logo uploaded successfully", "logo_url": logo_url}
-    finally:
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    return {"message": "Logo uploaded successfully", "logo_url": logo_url}
 
 @router.post("/my/upload-document")
 async def upload_company_document(
@@ -180,67 +180,83 @@ async def upload_company_document(
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Only PDF and image files are supported")
     
-    import tempfile
-    import shutil
-    import base64
+    # Check the file size limit while streaming into the blob store
+    try:
+        blob = await blob_store.put_stream(upload_chunks(file), max_bytes=MAX_FILE_SIZE)
+    except BlobTooLarge:
+        raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
     
-    # Read file content to check size
-    file_content = await file.read()
-    file_size = len(file_content)
+    # Create document version entry
+    document_version = {
+        "url": company_file_url(company["id"], blob.sha256),
+        "blob_sha256": blob.sha256,
+        "content_type": file.content_type,
+        "filename": file.filename,
+        "uploaded_at": datetime.now(timezone.utc).isoformat(),
+        "uploaded_by": current_user.id,
+        "file_size": blob.size
+    }
     
-    # Check file size limit (10MB = 10 * 1024 * 1024 bytes)
-    MAX_FILE_SIZE = 10 * 1024 * 1024
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail=f"File size exceeds 10MB limit. Current size: {file_size / (1024 * 1024):.2f}MB")
+    # Get current company documents or initialize
+    company_docs = company.get("company_documents", {
+        "mc_authority": [],
+        "insurance_certificate": [],
+        "w9": []
+    })
     
-    # Reset file pointer for reading
-    await file.seek(0)
+    # Add new version to document history
+    if document_type not in company_docs:
+        company_docs[document_type] = []
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_path = temp_file.name
+    company_docs[document_type].append(document_version)
     
-    try:
-        with open(temp_file_path, 'rb') as f:
-            file_data = f.read()
-            base64_data = base64.b64encode(file_data).decode('utf-8')
-            doc_url = f"data:{file.content_type};base64,{base64_data}"
-        
-        # Create document version entry
-        document_version = {
-            "url": doc_url,
-            "filename": file.filename,
-            "uploaded_at": datetime.now(timezone.utc).isoformat(),
-            "uploaded_by": current_user.id,
-            "file_size": file_size
-        }
-        
-        # Get current company documents or initialize
-        company_docs = company.get("company_documents", {
-            "mc_authority": [],
-            "insurance_certificate": [],
-            "w9": []
-        })
-        
-        # Add new version to document history
-        if document_type not in company_docs:
-            company_docs[document_type] = []
-        
-        company_docs[document_type].append(document_version)
-        
-        # Update company with new document version
-        await db.companies.update_one(
-            {"id": company["id"]},
-            {"$set": {"company_documents": company_docs}}
-        )
-        
-        return {
-            "message": f"{document_type.replace('_', ' ').title()} uploaded successfully",
-            "version": len(company_docs[document_type]),
-            "document": document_version
-        }
-    finally:
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    # Update company with new document version
+    await db.companies.update_one(
+        {"id": company["id"]},
+        {"$set": {"company_documents": company_docs}}
+    )
+    
+    return {
+        "message": f"{document_type.replace('_', ' ').title()} uploaded successfully",
+        "version": len(company_docs[document_type]),
+        "document": document_version
+    }
+
+@router.get("/{company_id}/files/{sha256}")
+async def get_company_file(
+    company_id: str,
+    sha256: str,
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Serve a company logo or document - only hashes the company actually references are served.
+    Logos are public (they load in <img src>), documents only to the company's users and platform admins.
+    """
+    company = await db.companies.find_one(
+        {"id": company_id},
+        {"_id": 0, "id": 1, "owner_id": 1, "logo_sha256": 1, "logo_content_type": 1, "company_documents": 1}
+    )
+    if not company:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if company.get("logo_sha256") == sha256:
+        return await blob_response(request, sha256, company.get("logo_content_type") or "image/png")
+    
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    if not is_platform_admin(current_user) and not await user_in_company(current_user, company):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    content_type = None
+    for versions in (company.get("company_documents") or {}).values():
+        for version in versions:
+            if version.get("blob_sha256") == sha256:
+                content_type = version.get("content_type") or "application/octet-stream"
+    
+    if not content_type:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    return await blob_response(request, sha256, content_type)
 
 # User Management Routes
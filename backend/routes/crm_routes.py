@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Response
 from models import *
 from auth import get_current_user, require_platform_admin
 from database import db
+from pagination import PageParams, list_page_params, paginate, set_page_headers
+from exports import export_format, export_response, iter_documents
+from retrieval import schedule_index
 from datetime import datetime, timezone
 import csv
 import io
@@ -30,10 +33,14 @@ async def log_crm_activity(user, action: str, entity_type: str, entity_id: str,
         print(f"Failed to log activity: {e}")
 
 @router.get('/contacts')
-async def get_crm_contacts(current_user: User = Depends(get_current_user)):
+async def get_crm_contacts(response: Response, page: PageParams = Depends(list_page_params), export: Optional[str] = Depends(export_format), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    contacts = await db.crm_contacts.find({}, {"_id": 0}).to_list(length=None)
-    return contacts
+    if export:
+        docs = iter_documents(db.crm_contacts, {}, {"_id": 0}, sort=[("_id", 1)])
+        return export_response(docs, export, "crm-contacts", columns=list(CRMContact.model_fields))
+    result = await paginate(db.crm_contacts, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/contacts')
 async def create_crm_contact(contact: CRMContact, current_user: User = Depends(get_current_user)):
@@ -43,6 +50,7 @@ async def create_crm_contact(contact: CRMContact, current_user: User = Depends(g
     contact_dict['created_at'] = contact_dict['created_at'].isoformat()
     contact_dict['updated_at'] = contact_dict['updated_at'].isoformat()
     await db.crm_contacts.insert_one(contact_dict)
+    schedule_index("crm_contacts", contact.id)
     
     # Log activity
     await log_crm_activity(
@@ -65,6 +73,7 @@ async def update_crm_contact(contact_id: str, contact: CRMContact, current_user:
     if 'created_at' in contact_dict and isinstance(contact_dict['created_at'], datetime):
         contact_dict['created_at'] = contact_dict['created_at'].isoformat()
     await db.crm_contacts.update_one({"id": contact_id}, {"$set": contact_dict})
+    schedule_index("crm_contacts", contact_id)
     
     # Log activity
     await log_crm_activity(
@@ -93,6 +102,7 @@ async def delete_crm_contact(contact_id: str, current_user: User = Depends(get_c
             {"company": contact.get('company'), "email": contact.get('email')}
         )
     await db.crm_contacts.delete_one({"id": contact_id})
+    schedule_index("crm_contacts", contact_id)
     return {"message": "Contact deleted"}
 
 @router.post('/contacts/upload')
@@ -109,6 +119,7 @@ async def upload_crm_contacts(file: UploadFile, current_user: User = Depends(get
         csv_reader = csv.DictReader(io.StringIO(decoded))
         
         contacts_created = 0
+        created_ids = []
         errors = []
         
         for row in csv_reader:
@@ -139,9 +150,11 @@ async def upload_crm_contacts(file: UploadFile, current_user: User = Depends(get
                     continue
                 
                 await db.crm_contacts.insert_one(contact)
+                created_ids.append(contact["id"])
                 contacts_created += 1
             except Exception as e:
                 errors.append(f"Error processing row: {str(e)}")
+        schedule_index("crm_contacts", *created_ids)
         
         return {
             "message": f"Successfully imported {contacts_created} contacts",
@@ -159,10 +172,11 @@ async def get_crm_activity_logs(current_user: User = Depends(get_current_user)):
     return logs
 
 @router.get('/deals')
-async def get_crm_deals(current_user: User = Depends(get_current_user)):
+async def get_crm_deals(response: Response, page: PageParams = Depends(list_page_params), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    deals = await db.crm_deals.find({}, {"_id": 0}).to_list(length=None)
-    return deals
+    result = await paginate(db.crm_deals, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/deals')
 async def create_crm_deal(deal: CRMDeal, current_user: User = Depends(get_current_user)):
@@ -174,6 +188,7 @@ async def create_crm_deal(deal: CRMDeal, current_user: User = Depends(get_curren
     if deal_dict.get('expected_close_date'):
         deal_dict['expected_close_date'] = deal_dict['expected_close_date'].isoformat()
     await db.crm_deals.insert_one(deal_dict)
+    schedule_index("crm_deals", deal.id)
     
     # Log activity
     await log_crm_activity(
@@ -198,12 +213,14 @@ async def update_crm_deal(deal_id: str, deal: CRMDeal, current_user: User = Depe
     if deal_dict.get('expected_close_date') and isinstance(deal_dict['expected_close_date'], datetime):
         deal_dict['expected_close_date'] = deal_dict['expected_close_date'].isoformat()
     await db.crm_deals.update_one({"id": deal_id}, {"$set": deal_dict})
+    schedule_index("crm_deals", deal_id)
     return deal
 
 @router.delete('/deals/{deal_id}')
 async def delete_crm_deal(deal_id: str, current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
     await db.crm_deals.delete_one({"id": deal_id})
+    schedule_index("crm_deals", deal_id)
     return {"message": "Deal deleted"}
 
 @router.get('/activities')
@@ -221,6 +238,7 @@ async def create_crm_activity(activity: CRMActivity, current_user: User = Depend
     if activity_dict.get('due_date'):
         activity_dict['due_date'] = activity_dict['due_date'].isoformat()
     await db.crm_activities.insert_one(activity_dict)
+    schedule_index("crm_activities", activity.id)
     return activity
 
 @router.get('/dashboard')
@@ -261,10 +279,14 @@ async def get_crm_dashboard(current_user: User = Depends(get_current_user)):
 
 # CRM Company Endpoints
 @router.get('/companies')
-async def get_crm_companies(current_user: User = Depends(get_current_user)):
+async def get_crm_companies(response: Response, page: PageParams = Depends(list_page_params), export: Optional[str] = Depends(export_format), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    companies = await db.crm_companies.find({}, {"_id": 0}).to_list(length=None)
-    return companies
+    if export:
+        docs = iter_documents(db.crm_companies, {}, {"_id": 0}, sort=[("_id", 1)])
+        return export_response(docs, export, "crm-companies", columns=list(CRMCompany.model_fields))
+    result = await paginate(db.crm_companies, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/companies')
 async def create_crm_company(company: CRMCompany, current_user: User = Depends(get_current_user)):
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from models import User, UserRole
 from auth import get_current_user
 from database import db
+from driver_context import driver_context
 from datetime import datetime, timezone
-from emergentintegrations.llm.chat import LlmChat, UserMessage
-import os
+from llm_gateway import LLMResult, chat_event_stream, llm, llm_tenant
 import uuid
 
 router = APIRouter(prefix="/driver-mobile/ai", tags=["Driver AI Assistant"])
@@ -12,26 +13,6 @@ router = APIRouter(prefix="/driver-mobile/ai", tags=["Driver AI Assistant"])
 # Store chat sessions in memory (for production, use Redis or DB)
 chat_sessions = {}
 
-def get_driver_context(loads: list) -> str:
-    """Build context string from driver's loads"""
-    if not loads:
-        return "You have no loads currently assigned."
-    
-    context = "Here are your current loads:\n\n"
-    for load in loads:
-        context += f"""
-Load {load.get('order_number', load.get('id', 'Unknown')[:8])}:
-- Status: {load.get('status', 'Unknown')}
-- Pickup: {load.get('pickup_city', 'N/A')}, {load.get('pickup_state', 'N/A')} - {load.get('pickup_location', 'N/A')}
-- Delivery: {load.get('delivery_city', 'N/A')}, {load.get('delivery_state', 'N/A')} - {load.get('delivery_location', 'N/A')}
-- Equipment: {load.get('equipment_type', 'N/A')}
-- Weight: {load.get('weight', 'N/A')} lbs
-- Commodity: {load.get('commodity', 'N/A')}
-- Pickup Time: {load.get('pickup_time_planned', 'TBD')}
-- Delivery Time: {load.get('delivery_time_planned', 'TBD')}
-"""
-    return context
-
 SYSTEM_PROMPT = """You are an AI Assistant for truck drivers using a TMS (Transportation Management System) mobile app. 
 
 Your role is to:
@@ -49,73 +30,90 @@ Keep responses SHORT and ACTIONABLE - drivers need quick answers.
 {driver_context}
 """
 
-@router.post("/chat")
-async def chat_with_assistant(
-    message_data: dict,
-    current_user: User = Depends(get_current_user)
-):
-    """Send a message to the AI Assistant"""
+def chat_message(current_user: User, message_data: dict) -> str:
     if current_user.role != UserRole.DRIVER:
         raise HTTPException(status_code=403, detail="Driver access only")
     
     user_message = message_data.get("message", "").strip()
     if not user_message:
         raise HTTPException(status_code=400, detail="Message is required")
-    
-    # Get driver's loads for context
-    loads = await db.loads.find(
-        {"assigned_driver_id": current_user.id},
-        {"_id": 0}
-    ).to_list(50)
-    
-    # Also check bookings
-    bookings = await db.bookings.find(
-        {"driver_id": current_user.id},
-        {"_id": 0}
-    ).to_list(50)
-    
-    all_loads = loads + bookings
-    driver_context = get_driver_context(all_loads)
-    
-    # Get or create chat session
-    session_id = f"driver_{current_user.id}"
+    return user_message
+
+async def driver_system_prompt(current_user: User) -> str:
+    # Driver's loads for context - cached until their assignments change
+    return SYSTEM_PROMPT.format(driver_context=await driver_context(current_user.id))
+
+async def save_chat(current_user: User, user_message: str, response: str) -> dict:
+    # Store in database for history
+    chat_record = {
+        "id": str(uuid.uuid4()),
+        "driver_id": current_user.id,
+        "session_id": f"driver_{current_user.id}",
+        "user_message": user_message,
+        "assistant_response": response,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.driver_ai_chats.insert_one(chat_record)
+    return chat_record
+
+@router.post("/chat")
+async def chat_with_assistant(
+    message_data: dict,
+    current_user: User = Depends(get_current_user)
+):
+    """Send a message to the AI Assistant"""
+    user_message = chat_message(current_user, message_data)
+    system_prompt = await driver_system_prompt(current_user)
     
     try:
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="LLM API key not configured")
-        
-        # Create chat instance
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=session_id,
-            system_message=SYSTEM_PROMPT.format(driver_context=driver_context)
-        ).with_model("openai", "gpt-5.2")
+        result = await llm.complete(
+            "driver_assistant",
+            user_message,
+            system=system_prompt,
+            tenant_id=llm_tenant(current_user),
+            user_id=current_user.id
+        )
+        response = result.text
         
-        # Send message
-        llm_message = UserMessage(text=user_message)
-        response = await chat.send_message(llm_message)
-        
-        # Store in database for history
-        chat_record = {
-            "id": str(uuid.uuid4()),
-            "driver_id": current_user.id,
-            "session_id": session_id,
-            "user_message": user_message,
-            "assistant_response": response,
-            "created_at": datetime.now(timezone.utc)
-        }
-        await db.driver_ai_chats.insert_one(chat_record)
+        chat_record = await save_chat(current_user, user_message, response)
         
         return {
             "response": response,
             "message_id": chat_record["id"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"AI Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI Assistant error: {str(e)}")
 
+@router.post("/chat/stream")
+async def stream_chat_with_assistant(
+    message_data: dict,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Server-sent events version of /chat - "token" events as the reply arrives, then "done" once saved"""
+    user_message = chat_message(current_user, message_data)
+    stream = llm.stream(
+        "driver_assistant",
+        user_message,
+        system=await driver_system_prompt(current_user),
+        tenant_id=llm_tenant(current_user),
+        user_id=current_user.id
+    )
+    
+    async def save(result: LLMResult) -> dict:
+        chat_record = await save_chat(current_user, user_message, result.text)
+        return {"response": result.text, "message_id": chat_record["id"]}
+    
+    return StreamingResponse(
+        chat_event_stream(stream, request, save),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history")
 async def get_chat_history(
     limit: int = 20,
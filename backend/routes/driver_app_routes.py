@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException, Depends
 from models import *
 from auth import get_current_user, hash_password
 from database import db
+from driver_assignments import refresh_assignments
+from retrieval import schedule_index
 from datetime import datetime, timezone
 from typing import List, Optional
 import uuid
@@ -145,6 +147,8 @@ async def accept_load(load_id: str, current_user: User = Depends(get_current_use
     
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Failed to accept load")
+    await refresh_assignments("bookings", load_id)
+    schedule_index("bookings", load_id)
     
     return {"message": "Load accepted successfully", "status": "planned"}
 
@@ -189,6 +193,8 @@ async def update_load_status(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=400, detail="Failed to update load status")
+    await refresh_assignments("bookings", load_id)
+    schedule_index("bookings", load_id)
     
     updated_load = await db.bookings.find_one({"id": load_id}, {"_id": 0})
     
@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Request
+from fastapi.responses import StreamingResponse
 from models import User, UserRole, UserLogin
 from auth import get_current_user, verify_password, create_access_token
 from database import db
+from geo import geo_point
+from geofence import geofence_engine
+from driver_assignments import list_driver_loads, get_assignment, assigned_load_ids, update_assigned_load, refresh_assignments
+from load_accounting import billing_company, create_ar_ap_for_load
+from load_messaging import MESSAGE_PAGE_SIZE, list_messages, post_message, mark_read_by_driver, unread_counts, user_event_stream
+from blob_store import blob_response
+from document_repository import LoadDocument, load_documents, stored_file_response
+from image_pipeline import store_upload, has_thumbnail, ensure_thumbnail
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
 import uuid
 import os
-import base64
 
 router = APIRouter(prefix="/driver-mobile", tags=["Driver Mobile App"])
 
@@ -60,75 +68,8 @@ async def get_driver_loads(current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.DRIVER:
         raise HTTPException(status_code=403, detail="Driver access only")
     
-    # First, find the driver record to get driver_id
-    driver = await db.drivers.find_one({
-        "$or": [
-            {"user_id": current_user.id},
-            {"email": current_user.email}
-        ]
-    })
-    
-    driver_id = driver.get("id") if driver else current_user.id
-    
-    all_loads = []
-    seen_booking_ids = set()
-    
-    # Check driver_loads collection (created when push-to-driver is used)
-    driver_loads = await db.driver_loads.find(
-        {"$or": [
-            {"driver_id": driver_id},
-            {"driver_user_id": current_user.id}
-        ]},
-        {"_id": 0}
-    ).sort("assigned_at", -1).to_list(100)
-    
-    for load in driver_loads:
-        booking_id = load.get("booking_id")
-        if booking_id and booking_id not in seen_booking_ids:
-            seen_booking_ids.add(booking_id)
-            all_loads.append({
-                **load,
-                "id": load.get("id"),
-                "pickup_city": load.get("pickup_location", "").split(",")[0] if load.get("pickup_location") else "",
-                "delivery_city": load.get("delivery_location", "").split(",")[0] if load.get("delivery_location") else ""
-            })
-    
-    # Check loads collection (skip if booking_id already seen)
-    loads = await db.loads.find(
-        {"$or": [
-            {"assigned_driver_id": current_user.id},
-            {"assigned_driver_id": driver_id}
-        ]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    for load in loads:
-        load_id = load.get("id")
-        if load_id and load_id not in seen_booking_ids:
-            seen_booking_ids.add(load_id)
-            all_loads.append(load)
-    
-    # Check bookings collection (skip if already seen)
-    bookings = await db.bookings.find(
-        {"$or": [
-            {"driver_id": current_user.id},
-            {"assigned_driver_id": current_user.id},
-            {"assigned_driver_id": driver_id}
-        ]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    for booking in bookings:
-        booking_id = booking.get("id")
-        if booking_id and booking_id not in seen_booking_ids:
-            seen_booking_ids.add(booking_id)
-            all_loads.append({
-                **booking,
-                "pickup_city": booking.get("pickup_location", "").split(",")[0] if booking.get("pickup_location") else "",
-                "delivery_city": booking.get("delivery_location", "").split(",")[0] if booking.get("delivery_location") else ""
-            })
-    
-    return all_loads
+    # Pushed, load and booking assignments are merged into the driver_assignments view on write
+    return await list_driver_loads(current_user.id)
 
 @router.get("/loads/{load_id}")
 async def get_load_detail(load_id: str, current_user: User = Depends(get_current_user)):
@@ -136,23 +77,11 @@ async def get_load_detail(load_id: str, current_user: User = Depends(get_current
     if current_user.role != UserRole.DRIVER:
         raise HTTPException(status_code=403, detail="Driver access only")
     
-    # Check loads collection
-    load = await db.loads.find_one(
-        {"id": load_id, "assigned_driver_id": current_user.id},
-        {"_id": 0}
-    )
-    
-    # Fallback to bookings
-    if not load:
-        load = await db.bookings.find_one(
-            {"id": load_id, "driver_id": current_user.id},
-            {"_id": 0}
-        )
-    
-    if not load:
+    assignment = await get_assignment(current_user.id, load_id)
+    if not assignment:
         raise HTTPException(status_code=404, detail="Load not found or not assigned to you")
     
-    return load
+    return assignment["load"]
 
 # ============== STATUS WORKFLOW ==============
 
@@ -200,17 +129,11 @@ async def update_load_status(
         raise HTTPException(status_code=400, detail="Note is required for problem status")
     
     # Get current load
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    collection = "loads"
-    
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-        collection = "bookings"
-    
-    if not load:
+    assignment = await get_assignment(current_user.id, load_id)
+    if not assignment:
         raise HTTPException(status_code=404, detail="Load not found")
     
-    current_status = load.get("status", "assigned")
+    current_status = assignment.get("status", "assigned")
     
     # Validate transition (drivers can only move forward, except for problem)
     if new_status != "problem" and current_status != "problem":
@@ -251,10 +174,13 @@ async def update_load_status(
     elif new_status == "delivered":
         update_data["actual_delivery_time"] = datetime.now(timezone.utc)
     
-    if collection == "loads":
-        await db.loads.update_one({"id": load_id}, {"$set": update_data})
-    else:
-        await db.bookings.update_one({"id": load_id}, {"$set": update_data})
+    result = await update_assigned_load(assignment, update_data)
+    geofence_engine.invalidate(current_user.id)
+    
+    # A pushed load delivered from the app is invoiced the same as one marked delivered by dispatch
+    booking = (result or {}).get("booking")
+    if new_status == "delivered" and booking and booking.get("status") != "delivered":
+        await create_ar_ap_for_load(booking, billing_company(booking), current_user.id)
     
     return {
         "message": "Status updated successfully",
@@ -278,28 +204,24 @@ async def get_status_history(load_id: str, current_user: User = Depends(get_curr
 # ============== MESSAGING ==============
 
 @router.get("/loads/{load_id}/messages")
-async def get_load_messages(load_id: str, current_user: User = Depends(get_current_user)):
-    """Get all messages for a load"""
+async def get_load_messages(
+    load_id: str,
+    after: Optional[str] = Query(None, description="Only messages newer than this message id"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MESSAGE_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """Get messages for a load - pass the last seen message id as after= to fetch only new ones"""
     if current_user.role != UserRole.DRIVER:
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Verify driver is assigned to this load
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-    if not load:
+    if not await get_assignment(current_user.id, load_id):
         raise HTTPException(status_code=404, detail="Load not found")
     
-    messages = await db.load_messages.find(
-        {"load_id": load_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(500)
+    messages = await list_messages(load_id, after=after, limit=limit)
     
-    # Mark messages as read by driver
-    await db.load_messages.update_many(
-        {"load_id": load_id, "sender_type": "dispatch", "read_by_driver": False},
-        {"$set": {"read_by_driver": True, "read_at": datetime.now(timezone.utc)}}
-    )
+    # Mark messages as read by driver - skipped when the unread counter is already zero
+    await mark_read_by_driver(load_id, current_user.id)
     
     return messages
 
@@ -314,10 +236,7 @@ async def send_message(
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Verify driver is assigned
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-    if not load:
+    if not await get_assignment(current_user.id, load_id):
         raise HTTPException(status_code=404, detail="Load not found")
     
     message = {
@@ -333,7 +252,8 @@ async def send_message(
         "created_at": datetime.now(timezone.utc)
     }
     
-    await db.load_messages.insert_one(message)
+    # Stored and pushed to dispatch over their message channel
+    message = await post_message(message)
     
     return {"message": "Message sent", "data": {**message, "_id": None}}
 
@@ -344,28 +264,35 @@ async def get_unread_count(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Get driver's load IDs
-    loads = await db.loads.find(
-        {"assigned_driver_id": current_user.id},
-        {"id": 1}
-    ).to_list(100)
-    load_ids = [l["id"] for l in loads]
+    load_ids = await assigned_load_ids(current_user.id)
     
-    bookings = await db.bookings.find(
-        {"driver_id": current_user.id},
-        {"id": 1}
-    ).to_list(100)
-    load_ids.extend([b["id"] for b in bookings])
-    
-    count = await db.load_messages.count_documents({
-        "load_id": {"$in": load_ids},
-        "sender_type": "dispatch",
-        "read_by_driver": False
-    })
+    # Counters are kept up to date as messages are sent and read
+    by_load = await unread_counts(current_user.id, load_ids)
+    
+    return {"unread_count": sum(by_load.values()), "by_load": by_load}
+
+@router.get("/messages/stream")
+async def stream_messages(current_user: User = Depends(get_current_user)):
+    """Server-sent events: new messages, read receipts and unread counts - for clients that can't use /ws/messages"""
+    if current_user.role != UserRole.DRIVER:
+        raise HTTPException(status_code=403, detail="Driver access only")
     
-    return {"unread_count": count}
+    return StreamingResponse(
+        user_event_stream(current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # ============== DOCUMENTS ==============
 
+def document_view(doc: LoadDocument) -> dict:
+    """Document metadata for the app - list views show thumbnails, full files come from download_url"""
+    return {
+        **doc.dict(exclude_unset=True),
+        "download_url": f"/api/driver-mobile/documents/{doc.id}/download",
+        "thumbnail_url": f"/api/driver-mobile/documents/{doc.id}/thumbnail" if has_thumbnail(doc) else None
+    }
+
 @router.get("/loads/{load_id}/documents")
 async def get_load_documents(load_id: str, current_user: User = Depends(get_current_user)):
     """Get all documents for a load"""
@@ -373,18 +300,11 @@ async def get_load_documents(load_id: str, current_user: User = Depends(get_curr
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Verify assignment
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-    if not load:
+    if not await get_assignment(current_user.id, load_id):
         raise HTTPException(status_code=404, detail="Load not found")
     
-    documents = await db.load_documents.find(
-        {"load_id": load_id},
-        {"_id": 0}
-    ).sort("uploaded_at", -1).to_list(100)
-    
-    return documents
+    documents = await load_documents.list_for_load(load_id)
+    return [document_view(doc) for doc in documents]
 
 @router.post("/loads/{load_id}/documents")
 async def upload_document(
@@ -399,70 +319,88 @@ async def upload_document(
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Verify assignment
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-    if not load:
+    if not await get_assignment(current_user.id, load_id):
         raise HTTPException(status_code=404, detail="Load not found")
     
     valid_doc_types = ["bol", "pod", "lumper", "scale_ticket", "other"]
     if doc_type.lower() not in valid_doc_types:
         raise HTTPException(status_code=400, detail=f"Invalid doc_type. Must be one of: {valid_doc_types}")
     
-    # Read file content
-    content = await file.read()
-    file_size = len(content)
-    
-    # Store as base64 for simplicity (can upgrade to cloud storage later)
-    file_base64 = base64.b64encode(content).decode('utf-8')
+    # Photos are normalized with a thumbnail, other files stream into the blob store as-is
+    try:
+        stored = await store_upload(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    document = {
+    document = await load_documents.insert({
         "id": str(uuid.uuid4()),
         "load_id": load_id,
         "stop_id": stop_id,
         "doc_type": doc_type.lower(),
-        "filename": file.filename,
-        "content_type": file.content_type,
-        "file_size": file_size,
-        "file_data": file_base64,
+        # stored carries the filename, renamed to .jpg when a photo was re-encoded
+        **stored,
         "uploaded_by": current_user.id,
         "uploader_name": current_user.full_name,
         "uploaded_at": datetime.now(timezone.utc)
-    }
-    
-    await db.load_documents.insert_one(document)
+    })
     
-    # Return without file_data
+    view = document_view(document)
     return {
         "message": "Document uploaded successfully",
         "document": {
-            "id": document["id"],
+            "id": document.id,
             "load_id": load_id,
             "doc_type": doc_type,
-            "filename": file.filename,
-            "uploaded_at": document["uploaded_at"]
+            "filename": document.filename,
+            "uploaded_at": document.uploaded_at,
+            "thumbnail_url": view["thumbnail_url"]
         }
     }
 
-@router.get("/documents/{doc_id}")
-async def get_document(doc_id: str, current_user: User = Depends(get_current_user)):
-    """Get a specific document with file data"""
+async def get_driver_document(doc_id: str, current_user: User) -> LoadDocument:
+    """Fetch a document the driver is assigned to - 404 if missing, 403 if another driver's load"""
     if current_user.role != UserRole.DRIVER:
         raise HTTPException(status_code=403, detail="Driver access only")
     
-    doc = await db.load_documents.find_one({"id": doc_id}, {"_id": 0})
+    doc = await load_documents.get(doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Verify driver has access to this load
-    load = await db.loads.find_one({"id": doc["load_id"], "assigned_driver_id": current_user.id})
-    if not load:
-        load = await db.bookings.find_one({"id": doc["load_id"], "driver_id": current_user.id})
-    if not load:
+    if not await get_assignment(current_user.id, doc.load_id):
         raise HTTPException(status_code=403, detail="Access denied")
     
     return doc
 
+@router.get("/documents/{doc_id}")
+async def get_document(
+    doc_id: str,
+    include_data: bool = Query(False, description="Inline base64 file_data - prefer download_url"),
+    current_user: User = Depends(get_current_user)
+):
+    """Get document metadata - the file itself streams from download_url"""
+    doc = await get_driver_document(doc_id, current_user)
+    view = document_view(doc)
+    
+    if include_data:
+        view["file_data"] = await load_documents.read_base64(doc)
+    return view
+
+@router.get("/documents/{doc_id}/download")
+async def download_document(doc_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Stream the document file - supports Range for resumable downloads and If-None-Match"""
+    doc = await get_driver_document(doc_id, current_user)
+    return await stored_file_response(request, doc, load_documents)
+
+@router.get("/documents/{doc_id}/thumbnail")
+async def get_document_thumbnail(doc_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Small JPEG preview of an image document"""
+    doc = await get_driver_document(doc_id, current_user)
+    sha256 = await ensure_thumbnail(doc, load_documents)
+    if not sha256:
+        raise HTTPException(status_code=404, detail="No thumbnail for this document")
+    return await blob_response(request, sha256, "image/jpeg")
+
 # ============== LOCATION TRACKING ==============
 
 @router.post("/location/ping")
@@ -489,18 +427,30 @@ async def ping_location(
     
     await db.driver_locations.insert_one(location)
     
-    # Update driver's last known location
+    # Update driver's last known location (GeoJSON position feeds the 2dsphere index)
+    last_location = {
+        "last_location_lat": location["lat"],
+        "last_location_lng": location["lng"],
+        "last_location_at": location["recorded_at"],
+        "last_accuracy_m": location["accuracy_m"]
+    }
+    position = geo_point(location["lat"], location["lng"])
+    if position:
+        last_location["current_position"] = position
+    
     await db.users.update_one(
         {"id": current_user.id},
-        {"$set": {
-            "last_location_lat": location["lat"],
-            "last_location_lng": location["lng"],
-            "last_location_at": location["recorded_at"],
-            "last_accuracy_m": location["accuracy_m"]
-        }}
+        {"$set": last_location}
     )
     
-    return {"message": "Location recorded", "id": location["id"]}
+    # Arrival/departure detection against this driver's pickup and delivery fences
+    events = await geofence_engine.process_ping(current_user.id, location["lat"], location["lng"], location["accuracy_m"])
+    
+    return {
+        "message": "Location recorded",
+        "id": location["id"],
+        "geofence_events": [{"load_id": e.fence.load_id, "fence": e.fence.kind, "event": e.event} for e in events]
+    }
 
 @router.get("/location/latest")
 async def get_my_latest_location(current_user: User = Depends(get_current_user)):
@@ -552,14 +502,8 @@ async def accept_load(
         raise HTTPException(status_code=403, detail="Driver access only")
     
     # Find load
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    collection = "loads"
-    
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-        collection = "bookings"
-    
-    if not load:
+    assignment = await get_assignment(current_user.id, load_id)
+    if not assignment:
         raise HTTPException(status_code=404, detail="Load not found")
     
     # Update status to accepted/en_route_pickup
@@ -569,10 +513,8 @@ async def accept_load(
         "accepted_by_driver": True
     }
     
-    if collection == "loads":
-        await db.loads.update_one({"id": load_id}, {"$set": update_data})
-    else:
-        await db.bookings.update_one({"id": load_id}, {"$set": update_data})
+    await update_assigned_load(assignment, update_data)
+    geofence_engine.invalidate(current_user.id)
     
     # Log event
     event = {
@@ -580,7 +522,7 @@ async def accept_load(
         "load_id": load_id,
         "driver_id": current_user.id,
         "event_type": "load_accepted",
-        "previous_status": load.get("status"),
+        "previous_status": assignment.get("status"),
         "new_status": "en_route_pickup",
         "created_at": datetime.now(timezone.utc)
     }
@@ -601,14 +543,8 @@ async def reject_load(
     reason = reject_data.get("reason", "Driver declined")
     
     # Find load
-    load = await db.loads.find_one({"id": load_id, "assigned_driver_id": current_user.id})
-    collection = "loads"
-    
-    if not load:
-        load = await db.bookings.find_one({"id": load_id, "driver_id": current_user.id})
-        collection = "bookings"
-    
-    if not load:
+    assignment = await get_assignment(current_user.id, load_id)
+    if not assignment:
         raise HTTPException(status_code=404, detail="Load not found")
     
     # Update - remove assignment or mark as rejected
@@ -619,10 +555,15 @@ async def reject_load(
         "assigned_driver_id": None
     }
     
-    if collection == "loads":
-        await db.loads.update_one({"id": load_id}, {"$set": update_data})
-    else:
-        await db.bookings.update_one({"id": load_id}, {"$set": update_data})
+    await update_assigned_load(assignment, update_data)
+    if assignment["source"] == "driver_loads" and assignment.get("booking_id"):
+        # A declined push hands the booking back to dispatch
+        await db.bookings.update_one(
+            {"id": assignment["booking_id"], "assigned_driver_id": assignment.get("driver_id")},
+            {"$set": {"assigned_driver_id": None}}
+        )
+        await refresh_assignments("bookings", assignment["booking_id"])
+    geofence_engine.invalidate(current_user.id)
     
     # Log event
     event = {
@@ -651,18 +592,7 @@ async def get_driver_analytics(current_user: User = Depends(get_current_user)):
     week_start = now - timedelta(days=now.weekday())  # Monday
     
     # Get completed loads
-    all_loads = await db.loads.find(
-        {"assigned_driver_id": current_user.id},
-        {"_id": 0}
-    ).to_list(500)
-    
-    # Also check bookings
-    bookings = await db.bookings.find(
-        {"driver_id": current_user.id},
-        {"_id": 0}
-    ).to_list(500)
-    
-    all_loads.extend(bookings)
+    all_loads = await list_driver_loads(current_user.id, limit=500)
     
     # Calculate metrics
     def calculate_metrics(loads, start_time=None):
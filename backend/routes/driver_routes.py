@@ -1,9 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from models import *
 from auth import get_current_user, hash_password
 from database import db
+from geo import METERS_PER_MILE, geo_near_stage
+from driver_assignments import list_driver_loads
+from pagination import PageParams, list_page_params, paginate, set_page_headers, fetch_page, encode_cursor, decode_cursor, count_total
+from exports import export_format, export_response, iter_documents, batches
+from serialization import json_response, model_projection, model_views
+from load_messaging import MESSAGE_PAGE_SIZE, list_messages, post_message, mark_read_by_dispatch, user_event_stream
+from blob_store import blob_response
+from document_repository import LoadDocument, load_documents, stored_file_response
+from image_pipeline import has_thumbnail, ensure_thumbnail, is_image, pdf_bundle_for_blobs
 from datetime import datetime, timezone, timedelta
-from typing import List
+from typing import List, Optional
 import uuid
 
 def require_platform_admin(current_user: User):
@@ -40,138 +50,187 @@ async def create_driver_account(driver_data: DriverCreate, current_user: User =
 
 @router.get("/my", response_model=List[User])
 async def get_my_drivers(current_user: User = Depends(get_current_user)):
-    drivers = await db.users.find({"fleet_owner_id": current_user.id, "role": UserRole.DRIVER}, {"_id": 0}).to_list(length=None)
-    return drivers
+    drivers = await db.users.find({"fleet_owner_id": current_user.id, "role": UserRole.DRIVER}, model_projection(User)).to_list(length=None)
+    return json_response(model_views(User, drivers))
+
+ALL_DRIVERS_QUERY = {"email": {"$nin": [None, ""]}}
+ALL_DRIVER_USERS_QUERY = {"role": UserRole.DRIVER, "email": {"$nin": [None, ""]}}
+DRIVER_EXPORT_COLUMNS = ["id", "user_id", "full_name", "email", "phone", "status", "license_type", "license_number", "created_at"]
+
+def driver_from_user(user: dict) -> dict:
+    """Map driver user fields to drivers collection fields"""
+    return {
+        'id': user.get('id'),
+        'user_id': user.get('id'),
+        'full_name': user.get('full_name'),
+        'email': user.get('email'),
+        'phone': user.get('phone', ''),
+        'status': user.get('driver_status', 'available'),
+        'license_type': user.get('license_type', 'CDL_A'),
+        'license_number': user.get('license_number', ''),
+        'created_at': user.get('created_at')
+    }
+
+async def emails_in_drivers_collection(emails: List[str]) -> set:
+    in_collection = await db.drivers.find({"email": {"$in": emails}}, {"_id": 0, "email": 1}).to_list(len(emails) or 1)
+    return {d['email'] for d in in_collection}
+
+async def iter_all_drivers():
+    """Every driver for export - the drivers collection, then driver users without a drivers record"""
+    async for driver in iter_documents(db.drivers, ALL_DRIVERS_QUERY, {"_id": 0}, sort=[("_id", 1)]):
+        yield driver
+    users = iter_documents(db.users, ALL_DRIVER_USERS_QUERY, {"_id": 0, "password_hash": 0}, sort=[("_id", 1)])
+    async for batch in batches(users):
+        # One lookup per batch keeps memory flat - no set of every email seen so far
+        in_collection = await emails_in_drivers_collection([u['email'] for u in batch])
+        for user in batch:
+            if user['email'] not in in_collection:
+                yield driver_from_user(user)
 
 @router.get("/all", response_model=list)
-async def get_all_drivers(current_user: User = Depends(get_current_user)):
+async def get_all_drivers(
+    response: Response,
+    page: PageParams = Depends(list_page_params),
+    export: Optional[str] = Depends(export_format),
+    current_user: User = Depends(get_current_user)
+):
     """Get all drivers from the drivers collection (for dispatch operations)"""
     if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN, UserRole.COMPANY_ADMIN]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get drivers from the drivers collection (created via User Management)
-    drivers_from_collection = await db.drivers.find({}, {"_id": 0}).to_list(length=None)
+    if export:
+        return export_response(iter_all_drivers(), export, "drivers", columns=DRIVER_EXPORT_COLUMNS)
     
-    # Also get drivers from users collection (legacy/direct creation)
-    drivers_from_users = await db.users.find({"role": UserRole.DRIVER}, {"_id": 0, "password_hash": 0}).to_list(length=None)
+    # One cursor walks the drivers collection (created via User Management) first, then driver users (legacy/direct creation)
+    state = decode_cursor(page.cursor) if page.cursor else {"source": "drivers", "k": None}
+    source, after = state.get("source"), state.get("k")
+    if source not in ["drivers", "users"]:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    # Combine both sources, avoiding duplicates by email
+    drivers_query = ALL_DRIVERS_QUERY
+    users_query = ALL_DRIVER_USERS_QUERY
     seen_emails = set()
     all_drivers = []
+    next_state = None
     
     # Add drivers from drivers collection first (preferred)
-    for driver in drivers_from_collection:
-        email = driver.get('email')
-        if email and email not in seen_emails:
-            seen_emails.add(email)
-            all_drivers.append(driver)
-    
-    # Add remaining drivers from users collection
-    for driver in drivers_from_users:
-        email = driver.get('email')
-        if email and email not in seen_emails:
-            seen_emails.add(email)
-            # Map user fields to driver fields
-            all_drivers.append({
-                'id': driver.get('id'),
-                'user_id': driver.get('id'),
-                'full_name': driver.get('full_name'),
-                'email': email,
-                'phone': driver.get('phone', ''),
-                'status': driver.get('driver_status', 'available'),
-                'license_type': driver.get('license_type', 'CDL_A'),
-                'license_number': driver.get('license_number', ''),
-                'created_at': driver.get('created_at')
-            })
+    if source == "drivers":
+        drivers_from_collection, after = await fetch_page(db.drivers, drivers_query, page.limit, after, projection={"_id": 0})
+        for driver in drivers_from_collection:
+            email = driver.get('email')
+            if email not in seen_emails:
+                seen_emails.add(email)
+                all_drivers.append(driver)
+        if after is not None:
+            next_state = {"source": "drivers", "k": after}
+        else:
+            source = "users"
+    
+    # Fill the rest of the page from the users collection once the drivers collection is exhausted
+    remaining = None if page.limit is None else page.limit - len(all_drivers)
+    if source == "users" and next_state is None and remaining == 0:
+        next_state = {"source": "users", "k": None}
+    elif source == "users" and next_state is None:
+        drivers_from_users, after = await fetch_page(db.users, users_query, remaining, after, projection={"_id": 0, "password_hash": 0})
+        # Skip users that also have a drivers record
+        seen_emails.update(await emails_in_drivers_collection([driver['email'] for driver in drivers_from_users]))
+        for driver in drivers_from_users:
+            email = driver.get('email')
+            if email not in seen_emails:
+                seen_emails.add(email)
+                all_drivers.append(driver_from_user(driver))
+        if after is not None:
+            next_state = {"source": "users", "k": after}
+    
+    if next_state:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_state)
+    if page.include_total:
+        # Upper bound - drivers present in both collections are counted twice
+        total = await count_total(db.drivers, drivers_query) + await count_total(db.users, users_query)
+        response.headers["X-Total-Count"] = str(total)
     
     return all_drivers
 
 @router.get("/my-loads", response_model=list)
 async def get_my_assigned_loads(current_user: User = Depends(get_current_user)):
     """Get loads assigned to the current driver (for driver mobile app)"""
-    # Find driver record by user_id or email
-    driver = await db.drivers.find_one({
-        "$or": [
-            {"user_id": current_user.id},
-            {"email": current_user.email}
-        ]
-    })
-    
-    if not driver:
-        # Check if user is a driver by role
-        if current_user.role != UserRole.DRIVER:
+    if current_user.role != UserRole.DRIVER:
+        # Fleet owners who also drive have a drivers record linked by user_id or email
+        driver = await db.drivers.find_one({
+            "$or": [
+                {"user_id": current_user.id},
+                {"email": current_user.email}
+            ]
+        }, {"_id": 1})
+        if not driver:
             raise HTTPException(status_code=403, detail="Only drivers can access this endpoint")
-        driver_id = current_user.id
-    else:
-        driver_id = driver.get("id")
     
-    # Get loads from driver_loads collection
-    driver_loads = await db.driver_loads.find(
-        {"driver_id": driver_id},
-        {"_id": 0}
-    ).to_list(length=100)
-    
-    # Also get bookings directly assigned to this driver
-    bookings = await db.bookings.find(
-        {"$or": [
-            {"assigned_driver_id": driver_id},
-            {"assigned_driver_id": current_user.id}
-        ]},
-        {"_id": 0}
-    ).to_list(length=100)
-    
-    # Combine and format loads for the mobile app
-    all_loads = []
-    seen_booking_ids = set()
-    
-    # Add loads from driver_loads collection
-    for load in driver_loads:
-        booking_id = load.get("booking_id")
-        if booking_id not in seen_booking_ids:
-            seen_booking_ids.add(booking_id)
-            all_loads.append({
-                "id": load.get("id"),
-                "booking_id": booking_id,
-                "order_number": load.get("order_number"),
-                "pickup_location": load.get("pickup_location"),
-                "delivery_location": load.get("delivery_location"),
-                "pickup_city": load.get("pickup_location", "").split(",")[0] if load.get("pickup_location") else "",
-                "pickup_state": load.get("pickup_location", "").split(",")[-1].strip() if load.get("pickup_location") else "",
-                "delivery_city": load.get("delivery_location", "").split(",")[0] if load.get("delivery_location") else "",
-                "delivery_state": load.get("delivery_location", "").split(",")[-1].strip() if load.get("delivery_location") else "",
-                "pickup_date": load.get("pickup_date"),
-                "delivery_date": load.get("delivery_date"),
-                "commodity": load.get("commodity"),
-                "weight": load.get("weight"),
-                "rate": load.get("rate"),
-                "status": load.get("status", "assigned"),
-                "assigned_at": load.get("assigned_at")
-            })
-    
-    # Add bookings that weren't in driver_loads
-    for booking in bookings:
-        if booking.get("id") not in seen_booking_ids:
-            seen_booking_ids.add(booking.get("id"))
-            all_loads.append({
-                "id": booking.get("id"),
-                "booking_id": booking.get("id"),
-                "order_number": booking.get("order_number"),
-                "pickup_location": booking.get("pickup_location"),
-                "delivery_location": booking.get("delivery_location"),
-                "pickup_city": booking.get("pickup_location", "").split(",")[0] if booking.get("pickup_location") else "",
-                "pickup_state": booking.get("pickup_location", "").split(",")[-1].strip() if booking.get("pickup_location") else "",
-                "delivery_city": booking.get("delivery_location", "").split(",")[0] if booking.get("delivery_location") else "",
-                "delivery_state": booking.get("delivery_location", "").split(",")[-1].strip() if booking.get("delivery_location") else "",
-                "pickup_date": booking.get("pickup_date"),
-                "delivery_date": booking.get("delivery_date"),
-                "commodity": booking.get("commodity"),
-                "weight": booking.get("weight"),
-                "rate": booking.get("rate"),
-                "status": booking.get("status", "assigned"),
-                "assigned_at": booking.get("dispatched_at")
-            })
-    
-    return all_loads
+    # Format loads for the mobile app - city/state are split once when the view is written
+    return [
+        {
+            "id": load.get("id"),
+            "booking_id": load.get("booking_id") or load.get("id"),
+            "order_number": load.get("order_number"),
+            "pickup_location": load.get("pickup_location"),
+            "delivery_location": load.get("delivery_location"),
+            "pickup_city": load.get("pickup_city", ""),
+            "pickup_state": load.get("pickup_state", ""),
+            "delivery_city": load.get("delivery_city", ""),
+            "delivery_state": load.get("delivery_state", ""),
+            "pickup_date": load.get("pickup_date"),
+            "delivery_date": load.get("delivery_date"),
+            "commodity": load.get("commodity"),
+            "weight": load.get("weight"),
+            "rate": load.get("rate"),
+            "status": load.get("status", "assigned"),
+            "assigned_at": load.get("assigned_at") or load.get("dispatched_at")
+        }
+        for load in await list_driver_loads(current_user.id)
+    ]
+
+@router.get("/nearby", response_model=list)
+async def get_nearby_drivers(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_miles: float = Query(50, gt=0, le=500),
+    status: Optional[str] = "available",
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """Drivers whose last ping is within radius_miles of a point (e.g. a pickup), nearest first"""
+    if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN, UserRole.COMPANY_ADMIN, UserRole.DISPATCHER]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    query = {"role": UserRole.DRIVER, "is_active": {"$ne": False}}
+    if status:
+        query["driver_status"] = status
+    if current_user.role != UserRole.PLATFORM_ADMIN:
+        query["fleet_owner_id"] = current_user.id
+    
+    pipeline = [
+        geo_near_stage(lat, lng, radius_miles, query),
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "full_name": 1,
+            "phone": 1,
+            "email": 1,
+            "driver_status": 1,
+            "license_type": 1,
+            "last_location_at": 1,
+            "current_position": 1,
+            "distance_meters": 1
+        }}
+    ]
+    drivers = await db.users.aggregate(pipeline).to_list(length=limit)
+    
+    for driver in drivers:
+        driver["latitude"] = driver["current_position"]["coordinates"][1]
+        driver["longitude"] = driver["current_position"]["coordinates"][0]
+        driver["distance_miles"] = round(driver.pop("distance_meters") / METERS_PER_MILE, 1)
+    
+    return drivers
 
 @router.put("/{driver_id}/status")
 async def update_driver_status(driver_id: str, status_data: dict, current_user: User = Depends(get_current_user)):
@@ -578,10 +637,11 @@ async def log_crm_activity(user, action: str, entity_type: str, entity_id: str,
 
 # CRM Endpoints
 @router.get('/admin/crm/contacts')
-async def get_crm_contacts(current_user: User = Depends(get_current_user)):
+async def get_crm_contacts(response: Response, page: PageParams = Depends(list_page_params), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    contacts = await db.crm_contacts.find({}, {"_id": 0}).to_list(length=None)
-    return contacts
+    result = await paginate(db.crm_contacts, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/admin/crm/contacts')
 async def create_crm_contact(contact: CRMContact, current_user: User = Depends(get_current_user)):
@@ -707,10 +767,11 @@ async def get_crm_activity_logs(current_user: User = Depends(get_current_user)):
     return logs
 
 @router.get('/admin/crm/deals')
-async def get_crm_deals(current_user: User = Depends(get_current_user)):
+async def get_crm_deals(response: Response, page: PageParams = Depends(list_page_params), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    deals = await db.crm_deals.find({}, {"_id": 0}).to_list(length=None)
-    return deals
+    result = await paginate(db.crm_deals, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/admin/crm/deals')
 async def create_crm_deal(deal: CRMDeal, current_user: User = Depends(get_current_user)):
@@ -809,10 +870,11 @@ async def get_crm_dashboard(current_user: User = Depends(get_current_user)):
 
 # CRM Company Endpoints
 @router.get('/admin/crm/companies')
-async def get_crm_companies(current_user: User = Depends(get_current_user)):
+async def get_crm_companies(response: Response, page: PageParams = Depends(list_page_params), current_user: User = Depends(get_current_user)):
     require_platform_admin(current_user)
-    companies = await db.crm_companies.find({}, {"_id": 0}).to_list(length=None)
-    return companies
+    result = await paginate(db.crm_companies, {}, page, projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
 
 @router.post('/admin/crm/companies')
 async def create_crm_company(company: CRMCompany, current_user: User = Depends(get_current_user)):
@@ -1080,24 +1142,35 @@ async def get_load_driver_location(load_id: str, current_user: User = Depends(ge
     return location or {}
 
 @router.get("/loads/{load_id}/messages")
-async def get_load_messages_dispatch(load_id: str, current_user: User = Depends(get_current_user)):
-    """Get all messages for a load - for dispatchers"""
+async def get_load_messages_dispatch(
+    load_id: str,
+    after: Optional[str] = Query(None, description="Only messages newer than this message id"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MESSAGE_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    """Get messages for a load - for dispatchers. Pass the last seen message id as after= to fetch only new ones"""
     if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    messages = await db.load_messages.find(
-        {"load_id": load_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(500)
+    messages = await list_messages(load_id, after=after, limit=limit)
     
-    # Mark as read by dispatch
-    await db.load_messages.update_many(
-        {"load_id": load_id, "sender_type": "driver", "read_by_dispatch": False},
-        {"$set": {"read_by_dispatch": True}}
-    )
+    # Mark as read by dispatch - drivers get a read receipt
+    await mark_read_by_dispatch(load_id, current_user.id)
     
     return messages
 
+@router.get("/messages/stream")
+async def stream_dispatch_messages(current_user: User = Depends(get_current_user)):
+    """Server-sent events: driver messages and read receipts for the current dispatcher"""
+    if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return StreamingResponse(
+        user_event_stream(current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/loads/{load_id}/messages")
 async def send_message_to_driver(
     load_id: str,
@@ -1120,9 +1193,26 @@ async def send_message_to_driver(
         "created_at": datetime.now(timezone.utc)
     }
     
-    await db.load_messages.insert_one(message)
+    # Stored, counted as unread for the driver and pushed to their message channel
+    message = await post_message(message)
     
-    return {"message": "Message sent", "data": {k: v for k, v in message.items() if k != "_id"}}
+    return {"message": "Message sent", "data": message}
+
+def dispatch_document_view(doc: LoadDocument) -> dict:
+    return {
+        **doc.dict(exclude_unset=True),
+        "download_url": f"/api/drivers/documents/{doc.id}/download",
+        "thumbnail_url": f"/api/drivers/documents/{doc.id}/thumbnail" if has_thumbnail(doc) else None
+    }
+
+async def get_dispatch_document(doc_id: str, current_user: User) -> LoadDocument:
+    if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    doc = await load_documents.get(doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
 
 @router.get("/loads/{load_id}/documents")
 async def get_load_documents_dispatch(load_id: str, current_user: User = Depends(get_current_user)):
@@ -1130,21 +1220,61 @@ async def get_load_documents_dispatch(load_id: str, current_user: User = Depends
     if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    documents = await db.load_documents.find(
-        {"load_id": load_id},
-        {"_id": 0, "file_data": 0}  # Exclude file data for list view
-    ).sort("uploaded_at", -1).to_list(100)
-    
-    return documents
+    documents = await load_documents.list_for_load(load_id)
+    return [dispatch_document_view(doc) for doc in documents]
 
-@router.get("/documents/{doc_id}")
-async def get_document_dispatch(doc_id: str, current_user: User = Depends(get_current_user)):
-    """Get a specific document with file data - for dispatchers"""
+@router.get("/loads/{load_id}/documents/bundle")
+async def get_load_documents_bundle(
+    load_id: str,
+    request: Request,
+    doc_type: Optional[str] = Query(None, description="Only include this document type, e.g. pod"),
+    current_user: User = Depends(get_current_user)
+):
+    """All image documents for a load as one multi-page PDF - for dispatchers"""
     if current_user.role not in [UserRole.FLEET_OWNER, UserRole.PLATFORM_ADMIN]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    doc = await db.load_documents.find_one({"id": doc_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
+    query = {"load_id": load_id, "blob_sha256": {"$exists": True}}
+    if doc_type:
+        query["doc_type"] = doc_type.lower()
+    documents = await load_documents.find(
+        query,
+        sort=[("uploaded_at", 1)],
+        fields=["load_id", "blob_sha256", "content_type"]
+    )
     
-    return doc
+    sha256s = [doc.blob_sha256 for doc in documents if is_image(doc.content_type)]
+    if not sha256s:
+        raise HTTPException(status_code=404, detail="No image documents to bundle")
+    
+    bundle = await pdf_bundle_for_blobs(sha256s)
+    return await blob_response(request, bundle["sha256"], "application/pdf", filename=f"load-{load_id}-documents.pdf")
+
+@router.get("/documents/{doc_id}")
+async def get_document_dispatch(
+    doc_id: str,
+    include_data: bool = Query(False, description="Inline base64 file_data - prefer download_url"),
+    current_user: User = Depends(get_current_user)
+):
+    """Get document metadata - for dispatchers; the file itself streams from download_url"""
+    doc = await get_dispatch_document(doc_id, current_user)
+    view = dispatch_document_view(doc)
+    
+    if include_data:
+        view["file_data"] = await load_documents.read_base64(doc)
+    return view
+
+@router.get("/documents/{doc_id}/download")
+async def download_document_dispatch(doc_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Stream the document file - for dispatchers; supports Range and If-None-Match"""
+    doc = await get_dispatch_document(doc_id, current_user)
+    return await stored_file_response(request, doc, load_documents)
+
+@router.get("/documents/{doc_id}/thumbnail")
+async def get_document_thumbnail_dispatch(doc_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Small JPEG preview of an image document - for dispatchers"""
+    doc = await get_dispatch_document(doc_id, current_user)
+    sha256 = await ensure_thumbnail(doc, load_documents)
+    if not sha256:
+        raise HTTPException(status_code=404, detail="No thumbnail for this document")
+    return await blob_response(request, sha256, "image/jpeg")
@@ -1,9 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from models import *
-from auth import get_current_user
+from auth import get_current_user, is_platform_admin
 from database import db
+from geo import (
+    BBox, COARSE_CELL_SLACK_MILES, METERS_PER_MILE, bbox_polygon, coarse_point, geo_near_stage, geo_point,
+    haversine_miles, parse_bbox
+)
+from serialization import json_response, model_projection, model_views
 from datetime import datetime, timezone
 from typing import List
+import hashlib
+import json
+
+# Live tracking fields only the owning fleet (and platform admins) see in /nearby results
+OWNER_ONLY_FIELDS = ["current_position", "current_driver_id", "last_location_update"]
 
 router = APIRouter(prefix="/equipment", tags=["Equipment"])
 
@@ -20,8 +30,12 @@ async def create_equipment(equipment_data: EquipmentCreate, current_user: User =
     equipment_dict["company_id"] = company["id"]
     equipment_obj = Equipment(**equipment_dict)
     
-    # Insert equipment
-    await db.equipment.insert_one(equipment_obj.dict())
+    # Insert equipment, with a GeoJSON position for the 2dsphere index when coordinates are known
+    equipment_doc = equipment_obj.dict()
+    position = geo_point(equipment_obj.location_lat, equipment_obj.location_lng)
+    if position:
+        equipment_doc["current_position"] = position
+    await db.equipment.insert_one(equipment_doc)
     
     return {"message": "Equipment added successfully", "equipment_id": equipment_obj.id}
 
@@ -31,64 +45,200 @@ async def get_equipment(skip: int = 0, limit: int = 50, equipment_type: Optional
     if equipment_type:
         query["equipment_type"] = equipment_type
     
-    equipment_list = await db.equipment.find(query).skip(skip).limit(limit).to_list(length=None)
-    return [Equipment(**equipment) for equipment in equipment_list]
+    equipment_list = await db.equipment.find(query, model_projection(Equipment)).skip(skip).limit(limit).to_list(length=None)
+    return json_response(model_views(Equipment, equipment_list))
 
 @router.get("/my", response_model=List[Equipment])
 async def get_my_equipment(current_user: User = Depends(get_current_user)):
-    equipment_list = await db.equipment.find({"owner_id": current_user.id}).to_list(length=None)
-    return [Equipment(**equipment) for equipment in equipment_list]
+    equipment_list = await db.equipment.find({"owner_id": current_user.id}, model_projection(Equipment)).to_list(length=None)
+    return json_response(model_views(Equipment, equipment_list))
+
+ACTIVE_LOAD_STATUSES = ["planned", "in_transit_pickup", "at_pickup", "in_transit_delivery", "at_delivery"]
+
+def fleet_snapshot_pipeline(owner_id: str, bbox: Optional[BBox] = None) -> list:
+    """
+    Equipment joined with its current driver and active load in one aggregation - the lookups use let/$expr
+    rather than localField plus pipeline, which needs MongoDB 5.0
+    """
+    match = {"owner_id": owner_id}
+    if bbox:
+        match["current_position"] = {"$geoWithin": {"$geometry": bbox_polygon(bbox)}}
+    
+    return [
+        {"$match": match},
+        {"$lookup": {
+            "from": "users",
+            "let": {"driver_id": "$current_driver_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$driver_id"]}}},
+                {"$project": {"_id": 0, "id": 1, "full_name": 1, "phone": 1}}
+            ],
+            "as": "driver"
+        }},
+        {"$lookup": {
+            "from": "bookings",
+            "let": {"equipment_id": "$id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$eq": ["$equipment_id", "$$equipment_id"]},
+                    "status": {"$in": ACTIVE_LOAD_STATUSES}
+                }},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "order_number": 1, "driver_name": 1, "driver_id": 1}}
+            ],
+            "as": "active_load"
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "name": 1,
+            "current_latitude": 1,
+            "current_longitude": 1,
+            "location_lat": 1,
+            "location_lng": 1,
+            "last_location_update": 1,
+            "is_available": 1,
+            "driver": {"$arrayElemAt": ["$driver", 0]},
+            "active_load": {"$arrayElemAt": ["$active_load", 0]}
+        }}
+    ]
+
+def vehicle_location_view(equipment: dict) -> dict:
+    """Shape an aggregated equipment document for the fleet tracking map"""
+    last_update = equipment.get("last_location_update")
+    vehicle_data = {
+        "vehicle_id": equipment["id"],
+        "name": equipment["name"],
+        "asset_number": equipment.get("id", "N/A"),
+        "latitude": equipment.get("current_latitude") or equipment.get("location_lat"),
+        "longitude": equipment.get("current_longitude") or equipment.get("location_lng"),
+        "last_update": last_update.isoformat() if isinstance(last_update, datetime) else last_update,
+        "status": "active" if equipment.get("is_available") else "idle",
+        "driver_id": None,
+        "driver_name": None,
+        "driver_phone": None,
+        "load_number": None
+    }
+    
+    driver = equipment.get("driver")
+    if driver:
+        vehicle_data["driver_id"] = driver.get("id", "N/A")
+        vehicle_data["driver_name"] = driver.get("full_name", "N/A")
+        vehicle_data["driver_phone"] = driver.get("phone", "N/A")
+    
+    active_booking = equipment.get("active_load")
+    if active_booking:
+        vehicle_data["load_number"] = active_booking.get("order_number", "N/A")
+        # If driver info is in booking, use it (override if available)
+        if active_booking.get("driver_name"):
+            vehicle_data["driver_name"] = active_booking.get("driver_name")
+        if active_booking.get("driver_id"):
+            vehicle_data["driver_id"] = active_booking.get("driver_id")
+    
+    return vehicle_data
+
+async def load_fleet_snapshot(owner_id: str, bbox: Optional[BBox] = None) -> List[dict]:
+    equipment_list = await db.equipment.aggregate(fleet_snapshot_pipeline(owner_id, bbox)).to_list(length=None)
+    return [vehicle_location_view(equipment) for equipment in equipment_list]
 
 @router.get("/my/locations", response_model=List[dict])
 async def get_my_equipment_locations(current_user: User = Depends(get_current_user)):
     """Get all equipment with their current locations and associated driver/load info for fleet tracking"""
-    equipment_list = await db.equipment.find({"owner_id": current_user.id}).to_list(length=None)
+    return await load_fleet_snapshot(current_user.id)
+
+@router.get("/my/fleet-snapshot")
+async def get_fleet_snapshot(
+    request: Request,
+    bbox: Optional[str] = Query(None, description="Viewport as min_lng,min_lat,max_lng,max_lat"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Fleet map snapshot in one round trip - every vehicle with driver and active load.
+    Supports a viewport filter and conditional GETs (If-None-Match -> 304).
+    """
+    parsed_bbox = None
+    if bbox:
+        try:
+            parsed_bbox = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid bbox: {str(e)}")
+    
+    vehicles = await load_fleet_snapshot(current_user.id, parsed_bbox)
+    
+    body = json.dumps({"vehicles": vehicles, "total": len(vehicles)}, default=str)
+    etag = f'W/"{hashlib.md5(body.encode()).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/nearby", response_model=List[dict])
+async def get_nearby_equipment(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_miles: float = Query(50, gt=0, le=500),
+    equipment_type: Optional[EquipmentType] = None,
+    available_only: bool = True,
+    mine_only: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Equipment within radius_miles of a point (e.g. a pickup), nearest first.
+    Other fleets' equipment comes with its listed address and a distance to its coarse grid cell, not its live
+    position or driver - both the distance and the radius cutoff use the cell, so repeated queries from different
+    points or radii can't narrow the position down any further.
+    """
+    query = {}
+    if available_only:
+        query["is_available"] = True
+    if equipment_type:
+        query["equipment_type"] = equipment_type
+    if mine_only:
+        query["owner_id"] = current_user.id
+    
+    pipeline = [
+        # Wide enough for equipment whose cell center is in range while its live position isn't
+        geo_near_stage(lat, lng, radius_miles + COARSE_CELL_SLACK_MILES, query),
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "name": 1,
+            "equipment_type": 1,
+            "owner_id": 1,
+            "company_id": 1,
+            "is_available": 1,
+            "current_driver_id": 1,
+            "location_address": 1,
+            "current_position": 1,
+            "last_location_update": 1,
+            "distance_meters": 1
+        }}
+    ]
+    results = await db.equipment.aggregate(pipeline).to_list(length=limit)
     
-    result = []
-    for equipment in equipment_list:
-        vehicle_data = {
-            "vehicle_id": equipment["id"],
-            "name": equipment["name"],
-
-# admin block moved below
-
-            "asset_number": equipment.get("id", "N/A"),
-            "latitude": equipment.get("current_latitude") or equipment.get("location_lat"),
-            "longitude": equipment.get("current_longitude") or equipment.get("location_lng"),
-            "last_update": equipment.get("last_location_update").isoformat() if equipment.get("last_location_update") else None,
-            "status": "active" if equipment.get("is_available") else "idle",
-            "driver_id": None,
-            "driver_name": None,
-            "driver_phone": None,
-            "load_number": None
-        }
-        
-        # Get current driver information if assigned
-        current_driver_id = equipment.get("current_driver_id")
-        if current_driver_id:
-            driver = await db.users.find_one({"id": current_driver_id})
-            if driver:
-                vehicle_data["driver_id"] = driver.get("id", "N/A")
-                vehicle_data["driver_name"] = driver.get("full_name", "N/A")
-                vehicle_data["driver_phone"] = driver.get("phone", "N/A")
-        
-        # Get current active load/booking for this equipment
-        active_booking = await db.bookings.find_one({
-            "equipment_id": equipment["id"],
-            "status": {"$in": ["planned", "in_transit_pickup", "at_pickup", "in_transit_delivery", "at_delivery"]}
-        })
-        
-        if active_booking:
-            vehicle_data["load_number"] = active_booking.get("order_number", "N/A")
-            # If driver info is in booking, use it (override if available)
-            if active_booking.get("driver_name"):
-                vehicle_data["driver_name"] = active_booking.get("driver_name")
-            if active_booking.get("driver_id"):
-                vehicle_data["driver_id"] = active_booking.get("driver_id")
-        
-        result.append(vehicle_data)
+    sees_all = is_platform_admin(current_user)
+    nearby = []
+    for equipment in results:
+        distance_miles = equipment.pop("distance_meters") / METERS_PER_MILE
+        equipment_lng, equipment_lat = equipment["current_position"]["coordinates"]
+        if sees_all or equipment.get("owner_id") == current_user.id:
+            equipment["latitude"] = equipment_lat
+            equipment["longitude"] = equipment_lng
+            equipment["distance_miles"] = round(distance_miles, 1)
+        else:
+            distance_miles = haversine_miles(lat, lng, *coarse_point(equipment_lat, equipment_lng))
+            equipment["distance_miles"] = round(distance_miles)
+            for field in OWNER_ONLY_FIELDS:
+                equipment.pop(field, None)
+        if distance_miles <= radius_miles:
+            nearby.append(equipment)
     
-    return result
+    nearby.sort(key=lambda e: e["distance_miles"])
+    return nearby
 
 @router.get("/{equipment_id}", response_model=Equipment)
 
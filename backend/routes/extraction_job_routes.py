@@ -0,0 +1,58 @@
+"""
+Batch extraction job progress - receipts (POST /accounting/parse-and-create/batch) and rate confirmations
+(POST /bookings/parse-rate-confirmation/batch)
+"""
+from fastapi import APIRouter, Depends, Query, Response
+from typing import Optional
+from datetime import datetime
+from models import User
+from auth import get_current_user
+from database import db
+from extraction_jobs import RESULT_STATUSES, get_extraction_job
+from pagination import PageParams, page_params, paginate, set_page_headers
+
+router = APIRouter(prefix="/extraction-jobs", tags=["Extraction Jobs"])
+
+
+@router.get("")
+async def list_extraction_jobs(
+    response: Response,
+    kind: Optional[str] = None,
+    page: PageParams = Depends(page_params),
+    current_user: User = Depends(get_current_user)
+):
+    """The user's batch jobs, newest first"""
+    query = {"owner_id": current_user.id}
+    if kind:
+        query["kind"] = kind
+    result = await paginate(db.extraction_jobs, query, page, sort=[("created_at", -1)], projection={"_id": 0, "files": 0})
+    set_page_headers(response, result)
+    return result.items
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Job progress - processed/total and succeeded/failed counts"""
+    return await get_extraction_job(job_id, current_user.id)
+
+
+@router.get("/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    response: Response,
+    status: Optional[str] = Query(None, description=f"One of {', '.join(RESULT_STATUSES)}"),
+    completed_after: Optional[datetime] = Query(None, description="Only results finished after this time - for polling a running job"),
+    page: PageParams = Depends(page_params),
+    current_user: User = Depends(get_current_user)
+):
+    """Per-file results in upload order - each one is available as soon as that file is done"""
+    await get_extraction_job(job_id, current_user.id)
+    query = {"job_id": job_id}
+    if status:
+        query["status"] = status
+    if completed_after:
+        query["completed_at"] = {"$gt": completed_after}
+
+    result = await paginate(db.extraction_results, query, page, sort=[("position", 1)], projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
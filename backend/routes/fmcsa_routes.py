@@ -3,231 +3,25 @@ FMCSA QCMobile API Integration
 Provides carrier data lookup by DOT#, MC#, or company name
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Response, UploadFile
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime, timezone
-import httpx
-import os
-from models import User
+from models import User, UserRole
 from auth import get_current_user
+from database import db
+from fmcsa_client import fmcsa, parse_carrier_basic, parse_carrier_full
+from carrier_vetting import RESULT_STATUSES, create_vetting_job, get_vetting_job, parse_identifiers, run_vetting_job
+from pagination import PageParams, page_params, paginate, set_page_headers
+from exports import export_format, export_response, iter_documents
 
 router = APIRouter(prefix="/fmcsa", tags=["FMCSA"])
 
-# FMCSA API Configuration
-FMCSA_BASE_URL = "https://mobile.fmcsa.dot.gov/qc/services"
-FMCSA_API_KEY = os.environ.get("FMCSA_API_KEY", "")
+VETTING_ROLES = [UserRole.PLATFORM_ADMIN, UserRole.COMPANY_ADMIN, UserRole.MANAGER, UserRole.DISPATCHER, UserRole.FLEET_OWNER]
+VETTING_EXPORT_COLUMNS = ["position", "identifier_type", "identifier", "status", "flags", "error", "carrier", "checked_at"]
 
-# Response Models
-class CarrierBasicInfo(BaseModel):
-    dot_number: Optional[str] = None
-    mc_number: Optional[str] = None
-    legal_name: Optional[str] = None
-    dba_name: Optional[str] = None
-    physical_address: Optional[str] = None
-    phone: Optional[str] = None
-    email: Optional[str] = None
-    allow_to_operate: Optional[str] = None
-    out_of_service: Optional[bool] = None
 
-class CarrierFullInfo(CarrierBasicInfo):
-    # Company Details
-    entity_type: Optional[str] = None
-    operating_status: Optional[str] = None
-    mcs150_form_date: Optional[str] = None
-    
-    # Fleet Information
-    total_drivers: Optional[int] = None
-    total_power_units: Optional[int] = None
-    
-    # Safety Data
-    safety_rating: Optional[str] = None
-    safety_rating_date: Optional[str] = None
-    
-    # BASIC Scores (0-100 percentile, higher = worse)
-    unsafe_driving_basic: Optional[str] = None
-    hours_of_service_basic: Optional[str] = None
-    driver_fitness_basic: Optional[str] = None
-    controlled_substances_basic: Optional[str] = None
-    vehicle_maintenance_basic: Optional[str] = None
-    hazmat_basic: Optional[str] = None
-    crash_indicator_basic: Optional[str] = None
-    
-    # Crash Data
-    fatal_crashes: Optional[int] = None
-    injury_crashes: Optional[int] = None
-    tow_crashes: Optional[int] = None
-    total_crashes: Optional[int] = None
-    
-    # Inspection Data
-    vehicle_inspections: Optional[int] = None
-    driver_inspections: Optional[int] = None
-    vehicle_oos_rate: Optional[float] = None
-    driver_oos_rate: Optional[float] = None
-    
-    # Authority/Insurance
-    common_authority: Optional[str] = None
-    contract_authority: Optional[str] = None
-    broker_authority: Optional[str] = None
-    insurance_bipd: Optional[str] = None
-    insurance_cargo: Optional[str] = None
-    insurance_bond: Optional[str] = None
-    
-    # Cargo Types
-    cargo_carried: Optional[List[str]] = None
-    
-    # Additional Info
-    complaint_count: Optional[int] = None
-    mailing_address: Optional[str] = None
-
-
-def parse_carrier_basic(data: dict) -> CarrierBasicInfo:
-    """Parse FMCSA response into basic carrier info"""
-    # Handle null content
-    if data is None:
-        return CarrierBasicInfo()
-    
-    content = data.get("content")
-    if content is None:
-        return CarrierBasicInfo()
-    
-    carrier = content.get("carrier", {}) if isinstance(content, dict) else {}
-    if not carrier:
-        return CarrierBasicInfo()
-    
-    # Build physical address
-    phy_address_parts = [
-        carrier.get("phyStreet", ""),
-        carrier.get("phyCity", ""),
-        carrier.get("phyState", ""),
-        carrier.get("phyZipcode", "")
-    ]
-    physical_address = ", ".join([p for p in phy_address_parts if p])
-    
-    return CarrierBasicInfo(
-        dot_number=str(carrier.get("dotNumber", "")) if carrier.get("dotNumber") else None,
-        mc_number=str(carrier.get("mcNumber", "")) if carrier.get("mcNumber") else None,
-        legal_name=carrier.get("legalName"),
-        dba_name=carrier.get("dbaName"),
-        physical_address=physical_address or None,
-        phone=carrier.get("telephone"),
-        email=carrier.get("emailAddress"),
-        allow_to_operate=carrier.get("allowedToOperate"),
-        out_of_service=carrier.get("oosDate") is not None or carrier.get("outOfServiceDate") is not None
-    )
-
-
-def parse_carrier_full(data: dict) -> CarrierFullInfo:
-    """Parse FMCSA response into full carrier info"""
-    # Handle null content
-    if data is None:
-        return CarrierFullInfo()
-    
-    content = data.get("content")
-    if content is None:
-        return CarrierFullInfo()
-    
-    carrier = content.get("carrier", {}) if isinstance(content, dict) else {}
-    if not carrier:
-        return CarrierFullInfo()
-    
-    # Build addresses
-    phy_address_parts = [
-        carrier.get("phyStreet", ""),
-        carrier.get("phyCity", ""),
-        carrier.get("phyState", ""),
-        carrier.get("phyZipcode", "")
-    ]
-    physical_address = ", ".join([p for p in phy_address_parts if p])
-    
-    mail_address_parts = [
-        carrier.get("mailingStreet", ""),
-        carrier.get("mailingCity", ""),
-        carrier.get("mailingState", ""),
-        carrier.get("mailingZipcode", "")
-    ]
-    mailing_address = ", ".join([p for p in mail_address_parts if p])
-    
-    # Parse cargo types
-    cargo_carried = []
-    for i in range(1, 20):
-        cargo = carrier.get(f"cargoCarried{i}Desc")
-        if cargo:
-            cargo_carried.append(cargo)
-    
-    # Calculate total crashes - crashTotal might be an int or a dict
-    crash_total = carrier.get("crashTotal", {})
-    if isinstance(crash_total, dict):
-        fatal = crash_total.get("fatalCrash", 0) or 0
-        injury = crash_total.get("injCrash", 0) or 0
-        tow = crash_total.get("towawayCrash", 0) or 0
-    else:
-        # crashTotal is just an integer
-        fatal = carrier.get("fatalCrash", 0) or 0
-        injury = carrier.get("injCrash", 0) or 0
-        tow = carrier.get("towawayCrash", 0) or 0
-    
-    return CarrierFullInfo(
-        # Basic Info
-        dot_number=str(carrier.get("dotNumber", "")) if carrier.get("dotNumber") else None,
-        mc_number=str(carrier.get("mcNumber", "")) if carrier.get("mcNumber") else None,
-        legal_name=carrier.get("legalName"),
-        dba_name=carrier.get("dbaName"),
-        physical_address=physical_address or None,
-        phone=carrier.get("telephone"),
-        email=carrier.get("emailAddress"),
-        allow_to_operate=carrier.get("allowedToOperate"),
-        out_of_service=carrier.get("oosDate") is not None,
-        
-        # Company Details
-        entity_type=carrier.get("carrierOperation", {}).get("carrierOperationDesc") if isinstance(carrier.get("carrierOperation"), dict) else carrier.get("carrierOperationDesc"),
-        operating_status=carrier.get("statusCode"),
-        mcs150_form_date=carrier.get("mcs150FormDate"),
-        
-        # Fleet Information
-        total_drivers=carrier.get("totalDrivers"),
-        total_power_units=carrier.get("totalPowerUnits"),
-        
-        # Safety Data
-        safety_rating=carrier.get("safetyRating"),
-        safety_rating_date=carrier.get("safetyRatingDate"),
-        
-        # BASIC Scores
-        unsafe_driving_basic=carrier.get("unsafeDrivingBasic"),
-        hours_of_service_basic=carrier.get("hosBasic"),
-        driver_fitness_basic=carrier.get("driverFitnessBasic"),
-        controlled_substances_basic=carrier.get("controlledSubstanceBasic"),
-        vehicle_maintenance_basic=carrier.get("vehicleMaintenanceBasic"),
-        hazmat_basic=carrier.get("hazmatBasic"),
-        crash_indicator_basic=carrier.get("crashIndicatorBasic"),
-        
-        # Crash Data
-        fatal_crashes=fatal,
-        injury_crashes=injury,
-        tow_crashes=tow,
-        total_crashes=fatal + injury + tow,
-        
-        # Inspection Data
-        vehicle_inspections=carrier.get("vehicleInsp"),
-        driver_inspections=carrier.get("driverInsp"),
-        vehicle_oos_rate=carrier.get("vehicleOosRate"),
-        driver_oos_rate=carrier.get("driverOosRate"),
-        
-        # Authority/Insurance
-        common_authority=carrier.get("commonAuthorityStatus"),
-        contract_authority=carrier.get("contractAuthorityStatus"),
-        broker_authority=carrier.get("brokerAuthorityStatus"),
-        insurance_bipd=carrier.get("bipdInsuranceOnFile"),
-        insurance_cargo=carrier.get("cargoInsuranceOnFile"),
-        insurance_bond=carrier.get("bondInsuranceOnFile"),
-        
-        # Cargo Types
-        cargo_carried=cargo_carried if cargo_carried else None,
-        
-        # Additional Info
-        complaint_count=carrier.get("complaintCount"),
-        mailing_address=mailing_address or None
-    )
+class VettingRequest(BaseModel):
+    carriers: List[str]
 
 
 @router.get("/carrier/dot/{dot_number}")
@@ -237,38 +31,17 @@ async def lookup_by_dot(
     current_user: User = Depends(get_current_user)
 ):
     """Lookup carrier by DOT number"""
-    if not FMCSA_API_KEY:
+    if not fmcsa.configured:
         raise HTTPException(status_code=500, detail="FMCSA API key not configured")
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{FMCSA_BASE_URL}/carriers/{dot_number}",
-                params={"webKey": FMCSA_API_KEY}
-            )
-            
-            if response.status_code == 404:
-                raise HTTPException(status_code=404, detail=f"No carrier found with DOT# {dot_number}")
-            elif response.status_code == 401:
-                raise HTTPException(status_code=401, detail="Invalid FMCSA API key")
-            elif response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="FMCSA API error")
-            
-            data = response.json()
-            
-            # Check if content is null (carrier not found)
-            if data.get("content") is None:
-                raise HTTPException(status_code=404, detail=f"No carrier found with DOT# {dot_number}")
-            
-            if full_details:
-                return {"carrier": parse_carrier_full(data).dict(exclude_none=True)}
-            else:
-                return {"carrier": parse_carrier_basic(data).dict(exclude_none=True)}
-                
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="FMCSA API timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Failed to connect to FMCSA API: {str(e)}")
+    data = await fmcsa.carrier_by_dot(dot_number)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No carrier found with DOT# {dot_number}")
+    
+    if full_details:
+        return {"carrier": parse_carrier_full(data).dict(exclude_none=True)}
+    else:
+        return {"carrier": parse_carrier_basic(data).dict(exclude_none=True)}
 
 
 @router.get("/carrier/mc/{mc_number}")
@@ -278,41 +51,17 @@ async def lookup_by_mc(
     current_user: User = Depends(get_current_user)
 ):
     """Lookup carrier by MC number (docket number)"""
-    if not FMCSA_API_KEY:
+    if not fmcsa.configured:
         raise HTTPException(status_code=500, detail="FMCSA API key not configured")
     
-    # Clean MC number (remove MC- prefix if present)
-    clean_mc = mc_number.replace("MC-", "").replace("MC", "").strip()
+    data = await fmcsa.carrier_by_mc(mc_number)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No carrier found with MC# {mc_number}")
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{FMCSA_BASE_URL}/carriers/docket-number/{clean_mc}",
-                params={"webKey": FMCSA_API_KEY}
-            )
-            
-            if response.status_code == 404:
-                raise HTTPException(status_code=404, detail=f"No carrier found with MC# {mc_number}")
-            elif response.status_code == 401:
-                raise HTTPException(status_code=401, detail="Invalid FMCSA API key")
-            elif response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="FMCSA API error")
-            
-            data = response.json()
-            
-            # Check if content is null (carrier not found)
-            if data.get("content") is None:
-                raise HTTPException(status_code=404, detail=f"No carrier found with MC# {mc_number}")
-            
-            if full_details:
-                return {"carrier": parse_carrier_full(data).dict(exclude_none=True)}
-            else:
-                return {"carrier": parse_carrier_basic(data).dict(exclude_none=True)}
-                
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="FMCSA API timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Failed to connect to FMCSA API: {str(e)}")
+    if full_details:
+        return {"carrier": parse_carrier_full(data).dict(exclude_none=True)}
+    else:
+        return {"carrier": parse_carrier_basic(data).dict(exclude_none=True)}
 
 
 @router.get("/carrier/search")
@@ -323,88 +72,64 @@ async def search_by_name(
     current_user: User = Depends(get_current_user)
 ):
     """Search carriers by company name"""
-    if not FMCSA_API_KEY:
+    if not fmcsa.configured:
         raise HTTPException(status_code=500, detail="FMCSA API key not configured")
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{FMCSA_BASE_URL}/carriers/name/{name}",
-                params={
-                    "webKey": FMCSA_API_KEY,
-                    "start": 0,
-                    "size": limit
-                }
-            )
-            
-            if response.status_code == 404:
-                return {"carriers": [], "total": 0}
-            elif response.status_code == 401:
-                raise HTTPException(status_code=401, detail="Invalid FMCSA API key")
-            elif response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="FMCSA API error")
-            
-            data = response.json()
-            content = data.get("content", [])
-            
-            if content is None:
-                return {"carriers": [], "total": 0}
-            
-            # Parse results - for search, each item has a 'carrier' key
-            carriers = []
-            for item in content:
-                if item is None:
-                    continue
-                # Each search result is wrapped in {"carrier": {...}}
-                carrier_info = item.get("carrier", {})
-                if not carrier_info:
-                    continue
-                    
-                # Build physical address
-                phy_address_parts = [
-                    carrier_info.get("phyStreet", ""),
-                    carrier_info.get("phyCity", ""),
-                    carrier_info.get("phyState", ""),
-                    carrier_info.get("phyZipcode", "")
-                ]
-                physical_address = ", ".join([p for p in phy_address_parts if p])
-                
-                carrier_result = {
-                    "dot_number": str(carrier_info.get("dotNumber", "")) if carrier_info.get("dotNumber") else None,
-                    "mc_number": str(carrier_info.get("mcNumber", "")) if carrier_info.get("mcNumber") else None,
-                    "legal_name": carrier_info.get("legalName"),
-                    "dba_name": carrier_info.get("dbaName"),
-                    "physical_address": physical_address or None,
-                    "phone": carrier_info.get("telephone"),
-                    "allow_to_operate": carrier_info.get("allowedToOperate"),
-                    "out_of_service": carrier_info.get("oosDate") is not None
-                }
-                
-                if full_details:
-                    carrier_result.update({
-                        "entity_type": carrier_info.get("carrierOperation", {}).get("carrierOperationDesc") if carrier_info.get("carrierOperation") else None,
-                        "operating_status": carrier_info.get("statusCode"),
-                        "total_drivers": carrier_info.get("totalDrivers"),
-                        "total_power_units": carrier_info.get("totalPowerUnits"),
-                        "fatal_crashes": carrier_info.get("fatalCrash"),
-                        "injury_crashes": carrier_info.get("injCrash"),
-                        "tow_crashes": carrier_info.get("towawayCrash"),
-                        "total_crashes": carrier_info.get("crashTotal"),
-                    })
-                
-                # Filter out None values
-                carrier_result = {k: v for k, v in carrier_result.items() if v is not None}
-                carriers.append(carrier_result)
+    data = await fmcsa.search_by_name(name, limit)
+    content = data.get("content") if data else None
+    if content is None:
+        return {"carriers": [], "total": 0}
+    
+    # Parse results - for search, each item has a 'carrier' key
+    carriers = []
+    for item in content:
+        if item is None:
+            continue
+        # Each search result is wrapped in {"carrier": {...}}
+        carrier_info = item.get("carrier", {})
+        if not carrier_info:
+            continue
             
-            return {
-                "carriers": carriers,
-                "total": len(carriers)
-            }
-                
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="FMCSA API timeout")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Failed to connect to FMCSA API: {str(e)}")
+        # Build physical address
+        phy_address_parts = [
+            carrier_info.get("phyStreet", ""),
+            carrier_info.get("phyCity", ""),
+            carrier_info.get("phyState", ""),
+            carrier_info.get("phyZipcode", "")
+        ]
+        physical_address = ", ".join([p for p in phy_address_parts if p])
+        
+        carrier_result = {
+            "dot_number": str(carrier_info.get("dotNumber", "")) if carrier_info.get("dotNumber") else None,
+            "mc_number": str(carrier_info.get("mcNumber", "")) if carrier_info.get("mcNumber") else None,
+            "legal_name": carrier_info.get("legalName"),
+            "dba_name": carrier_info.get("dbaName"),
+            "physical_address": physical_address or None,
+            "phone": carrier_info.get("telephone"),
+            "allow_to_operate": carrier_info.get("allowedToOperate"),
+            "out_of_service": carrier_info.get("oosDate") is not None
+        }
+        
+        if full_details:
+            carrier_result.update({
+                "entity_type": carrier_info.get("carrierOperation", {}).get("carrierOperationDesc") if carrier_info.get("carrierOperation") else None,
+                "operating_status": carrier_info.get("statusCode"),
+                "total_drivers": carrier_info.get("totalDrivers"),
+                "total_power_units": carrier_info.get("totalPowerUnits"),
+                "fatal_crashes": carrier_info.get("fatalCrash"),
+                "injury_crashes": carrier_info.get("injCrash"),
+                "tow_crashes": carrier_info.get("towawayCrash"),
+                "total_crashes": carrier_info.get("crashTotal"),
+            })
+        
+        # Filter out None values
+        carrier_result = {k: v for k, v in carrier_result.items() if v is not None}
+        carriers.append(carrier_result)
+    
+    return {
+        "carriers": carriers,
+        "total": len(carriers)
+    }
 
 
 @router.get("/carrier/lookup")
@@ -420,7 +145,7 @@ async def universal_lookup(
     - If query starts with MC or DOT, uses appropriate lookup
     - Otherwise, searches by company name
     """
-    if not FMCSA_API_KEY:
+    if not fmcsa.configured:
         raise HTTPException(status_code=500, detail="FMCSA API key not configured")
     
     query = query.strip()
@@ -444,3 +169,103 @@ async def universal_lookup(
         return await lookup_by_mc(query, full_details, current_user)
     else:
         return await search_by_name(query, full_details, 10, current_user)
+
+
+# ==================== BULK VETTING ====================
+
+async def start_vetting(raw: List[str], background_tasks: BackgroundTasks, current_user: User) -> dict:
+    if current_user.role not in VETTING_ROLES:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not fmcsa.configured:
+        raise HTTPException(status_code=500, detail="FMCSA API key not configured")
+    
+    identifiers = parse_identifiers(raw)
+    job = await create_vetting_job(current_user.id, identifiers)
+    background_tasks.add_task(run_vetting_job, job["id"], identifiers)
+    return {"job_id": job["id"], "total": job["total"], "status": job["status"]}
+
+
+@router.post("/vetting")
+async def create_vetting(
+    payload: VettingRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Vet a list of DOT/MC numbers in the background - poll GET /fmcsa/vetting/{job_id} for progress"""
+    return await start_vetting(payload.carriers, background_tasks, current_user)
+
+
+@router.post("/vetting/upload")
+async def upload_vetting(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Vet the DOT/MC numbers in an uploaded CSV or text file"""
+    content = (await file.read()).decode("utf-8-sig", errors="ignore")
+    return await start_vetting([content], background_tasks, current_user)
+
+
+@router.get("/vetting/{job_id}")
+async def get_vetting(job_id: str, current_user: User = Depends(get_current_user)):
+    """Job progress - processed/total and per-status counts"""
+    return await get_vetting_job(job_id, current_user.id)
+
+
+@router.get("/vetting/{job_id}/results")
+async def get_vetting_results(
+    job_id: str,
+    response: Response,
+    status: Optional[str] = Query(None, description=f"One of {', '.join(RESULT_STATUSES)}"),
+    page: PageParams = Depends(page_params),
+    export: Optional[str] = Depends(export_format),
+    current_user: User = Depends(get_current_user)
+):
+    """Vetting report rows in input order - paginated, or the whole report with ?format=csv|ndjson"""
+    await get_vetting_job(job_id, current_user.id)
+    query = {"job_id": job_id}
+    if status:
+        query["status"] = status
+    
+    if export:
+        docs = iter_documents(db.vetting_results, query, {"_id": 0}, sort=[("position", 1)])
+        return export_response(docs, export, f"vetting-{job_id}", columns=VETTING_EXPORT_COLUMNS)
+    
+    result = await paginate(db.vetting_results, query, page, sort=[("position", 1)], projection={"_id": 0})
+    set_page_headers(response, result)
+    return result.items
+
+
+# ==================== CARRIER MONITORING ====================
+
+def alert_scope(current_user: User) -> dict:
+    """Alerts go to the users on the affected bookings - platform admins see every alert"""
+    return {} if current_user.role == UserRole.PLATFORM_ADMIN else {"user_ids": current_user.id}
+
+
+@router.get("/monitor/alerts")
+async def get_carrier_alerts(
+    response: Response,
+    unacknowledged: bool = False,
+    page: PageParams = Depends(page_params),
+    current_user: User = Depends(get_current_user)
+):
+    """Authority/safety changes on carriers of the user's active bookings, newest first"""
+    query = alert_scope(current_user)
+    if unacknowledged:
+        query["acknowledged_by"] = {"$ne": current_user.id}
+    
+    result = await paginate(db.carrier_alerts, query, page, sort=[("created_at", -1)], projection={"_id": 0, "user_ids": 0})
+    set_page_headers(response, result)
+    return result.items
+
+
+@router.post("/monitor/alerts/{alert_id}/acknowledge")
+async def acknowledge_carrier_alert(alert_id: str, current_user: User = Depends(get_current_user)):
+    result = await db.carrier_alerts.update_one(
+        {"id": alert_id, **alert_scope(current_user)},
+        {"$addToSet": {"acknowledged_by": current_user.id}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return {"message": "Alert acknowledged"}
@@ -2,7 +2,10 @@ from fastapi import APIRouter, HTTPException, Depends
 from models import *
 from auth import get_current_user
 from database import db
+from websocket_manager import manager
+from geo import geo_point
 from datetime import datetime, timezone
+from serialization import json_response, model_projection, model_views
 from typing import List
 
 router = APIRouter(prefix="/locations", tags=["Locations"])
@@ -19,30 +22,30 @@ async def update_location(location_data: LocationUpdate, current_user: User = De
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Update equipment location
-    await db.equipment.update_one(
-        {"id": location_data.equipment_id},
-        {
-            "$set": {
-                "location_lat": location_data.latitude,
-                "location_lng": location_data.longitude,
-                "current_latitude": location_data.latitude,
-                "current_longitude": location_data.longitude,
-                "last_location_update": datetime.now(timezone.utc)
-            }
-        }
-    )
+    location_fields = {
+        "location_lat": location_data.latitude,
+        "location_lng": location_data.longitude,
+        "current_latitude": location_data.latitude,
+        "current_longitude": location_data.longitude,
+        "last_location_update": datetime.now(timezone.utc)
+    }
+    # Out-of-range coordinates keep the last good position rather than a null the 2dsphere index can't use
+    position = geo_point(location_data.latitude, location_data.longitude)
+    if position:
+        location_fields["current_position"] = position
+    await db.equipment.update_one({"id": location_data.equipment_id}, {"$set": location_fields})
     
     # Store location history
     await db.location_history.insert_one(location_data.dict())
     
-    # Broadcast location update to WebSocket clients
+    # Broadcast location update to the owning fleet's WebSocket clients
     broadcast_data = {
         "vehicle_id": location_data.equipment_id,
         "latitude": location_data.latitude,
         "longitude": location_data.longitude,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await manager.broadcast_location_update(broadcast_data)
+    await manager.broadcast_location_update(broadcast_data, equipment["owner_id"])
     
     return {"message": "Location updated successfully"}
 
@@ -56,7 +59,7 @@ async def get_equipment_locations(equipment_id: str, current_user: User = Depend
     if equipment["owner_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    locations = await db.location_history.find({"equipment_id": equipment_id}).sort("timestamp", -1).limit(100).to_list(length=None)
-    return [LocationUpdate(**location) for location in locations]
+    locations = await db.location_history.find({"equipment_id": equipment_id}, model_projection(LocationUpdate)).sort("timestamp", -1).limit(100).to_list(length=None)
+    return json_response(model_views(LocationUpdate, locations))
 
 # Booking Routes
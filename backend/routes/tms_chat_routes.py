@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
@@ -6,10 +6,10 @@ from models import User
 from auth import get_current_user
 from database import db
 from datetime import datetime, timezone
+from llm_gateway import LLMResult, chat_event_stream, llm, llm_tenant
+from chat_memory import chat_memory, clear_memory, compact_memory
+from retrieval import records_context, relevant_records
 import uuid
-import os
-import asyncio
-from openai import AsyncOpenAI
 
 router = APIRouter(prefix="/tms-chat", tags=["TMS Chat"])
 
@@ -107,102 +107,172 @@ You help with dispatch operations, accounting, sales, HR, fleet maintenance, and
 Provide helpful, accurate, and actionable advice for transportation and logistics operations."""
 }
 
+def department_access_error(user_role: str, context: Optional[str]) -> Optional[str]:
+    """Why a role may not use a department's assistant, or None when it may"""
+    # Platform admin and company admin have access to all departments
+    if user_role in ["platform_admin", "company_admin", "fleet_owner"]:
+        return None
+    allowed_departments = ROLE_DEPARTMENT_ACCESS.get(user_role, [])
+    if context in allowed_departments:
+        return None
+    return f"Access denied. Your role ({user_role}) does not have access to {context} department. You can only access: {', '.join(allowed_departments)}"
+
+def searchable_departments(user_role: str, context: Optional[str]) -> List[str]:
+    """Departments whose records a message may draw on - the chat's own, or all the role can access from "general" """
+    allowed = ROLE_DEPARTMENT_ACCESS["platform_admin"] if user_role in ["platform_admin", "company_admin", "fleet_owner"] else ROLE_DEPARTMENT_ACCESS.get(user_role, [])
+    if context in allowed:
+        return [context]
+    return allowed if context in (None, "general") else []
+
+async def chat_prompt(chat_request: ChatRequest, current_user: User, user_role: str):
+    """(session id, system message, recent history) for a user's message in a department"""
+    # Get or create session ID for this user
+    session_id = f"tms-chat-{current_user.id}-{chat_request.context}"
+    
+    # Get context-specific system message with role enforcement
+    system_message = CONTEXT_SYSTEM_MESSAGES.get(
+        chat_request.context, 
+        CONTEXT_SYSTEM_MESSAGES["general"]
+    )
+    
+    # Add role-specific instruction
+    role_instruction = f"\n\nCURRENT USER ROLE: {user_role.upper()}\n"
+    if user_role in ["dispatcher", "driver"]:
+        role_instruction += "This user has LIMITED access. Only answer questions relevant to their assigned department. Do not provide information from other departments."
+    elif user_role in ["company_admin", "fleet_owner", "platform_admin"]:
+        role_instruction += "This user has FULL access to all departments and can ask about any aspect of the business."
+    
+    system_message = system_message + role_instruction
+    
+    # The tenant's own records that match the question, limited to departments the role can see
+    records = await relevant_records(chat_request.message, current_user, searchable_departments(user_role, chat_request.context))
+    if records:
+        system_message += "\n\n" + records_context(records)
+    
+    # Earlier turns arrive as a summary, only the recent ones verbatim
+    summary, history = await chat_memory(current_user.id, session_id, chat_request.context)
+    if summary:
+        system_message += f"\n\nSUMMARY OF EARLIER CONVERSATION:\n{summary}"
+    
+    return session_id, system_message, history
+
+async def save_chat(
+    chat_request: ChatRequest,
+    current_user: User,
+    session_id: str,
+    response: str,
+    background_tasks: BackgroundTasks
+) -> dict:
+    chat_history_entry = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "session_id": session_id,
+        "context": chat_request.context,
+        "user_message": chat_request.message,
+        "assistant_response": response,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    
+    await db.tms_chat_history.insert_one(chat_history_entry)
+    # Fold turns that fell out of the budget into the summary once the reply is sent
+    background_tasks.add_task(compact_memory, current_user.id, session_id, chat_request.context, llm_tenant(current_user))
+    return chat_history_entry
+
 @router.post("/message")
 async def send_chat_message(
     chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user)
 ):
     """Send a message and get AI response with role-based access control"""
     try:
         # Check role-based access to department
         user_role = current_user.role.lower()
-        allowed_departments = ROLE_DEPARTMENT_ACCESS.get(user_role, [])
-        
-        # Platform admin and company admin have access to all departments
-        if user_role not in ["platform_admin", "company_admin", "fleet_owner"]:
-            if chat_request.context not in allowed_departments:
-                return {
-                    "success": False,
-                    "error": f"Access denied. Your role ({user_role}) does not have access to {chat_request.context} department. You can only access: {', '.join(allowed_departments)}"
-                }
+        access_error = department_access_error(user_role, chat_request.context)
+        if access_error:
+            return {
+                "success": False,
+                "error": access_error
+            }
         
-        # Lazy import to avoid issues if not installed
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
+        session_id, system_message, history = await chat_prompt(chat_request, current_user, user_role)
         
-        # Get or create session ID for this user
-        session_id = f"tms-chat-{current_user.id}-{chat_request.context}"
-        
-        # Get context-specific system message with role enforcement
-        system_message = CONTEXT_SYSTEM_MESSAGES.get(
-            chat_request.context, 
-            CONTEXT_SYSTEM_MESSAGES["general"]
+        result = await llm.complete(
+            "tms_chat",
+            chat_request.message,
+            system=system_message,
+            history=history,
+            tenant_id=llm_tenant(current_user),
+            user_id=current_user.id
         )
-        
-        # Add role-specific instruction
-        role_instruction = f"\n\nCURRENT USER ROLE: {user_role.upper()}\n"
-        if user_role in ["dispatcher", "driver"]:
-            role_instruction += "This user has LIMITED access. Only answer questions relevant to their assigned department. Do not provide information from other departments."
-        elif user_role in ["company_admin", "fleet_owner", "platform_admin"]:
-            role_instruction += "This user has FULL access to all departments and can ask about any aspect of the business."
-        
-        system_message = system_message + role_instruction
-        
-        # Get OpenAI API key from environment
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-        
-        # Initialize OpenAI client
-        client = AsyncOpenAI(api_key=openai_api_key)
-        
-        # Retrieve chat history for context
-        history_docs = await db.tms_chat_history.find(
-            {"user_id": current_user.id, "session_id": session_id},
-            {"_id": 0}
-        ).sort("timestamp", -1).limit(10).to_list(10)
-        
-        # Build messages array with history
-        messages = [{"role": "system", "content": system_message}]
-        
-        # Add recent history (reversed to chronological order)
-        for doc in reversed(history_docs):
-            messages.append({"role": "user", "content": doc["user_message"]})
-            messages.append({"role": "assistant", "content": doc["assistant_response"]})
-        
-        # Add current message
-        messages.append({"role": "user", "content": chat_request.message})
-        
-        # Call OpenAI API with GPT-4o
-        completion = await client.chat.completions.create(
-            model="gpt-4o",  # Using GPT-4o (latest available model)
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        response = completion.choices[0].message.content
+        response = result.text
         
         # Save to database
-        chat_history_entry = {
-            "id": str(uuid.uuid4()),
-            "user_id": current_user.id,
-            "session_id": session_id,
-            "context": chat_request.context,
-            "user_message": chat_request.message,
-            "assistant_response": response,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.tms_chat_history.insert_one(chat_history_entry)
+        await save_chat(chat_request, current_user, session_id, response, background_tasks)
         
         return {
             "success": True,
             "response": response,
             "context": chat_request.context
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
+@router.post("/message/stream")
+async def stream_chat_message(
+    chat_request: ChatRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Server-sent events version of /message - "token" events as the reply is generated, then "done" once it
+    is saved to the history. Disconnecting cancels the upstream call.
+    """
+    user_role = current_user.role.lower()
+    access_error = department_access_error(user_role, chat_request.context)
+    if access_error:
+        raise HTTPException(status_code=403, detail=access_error)
+    
+    session_id, system_message, history = await chat_prompt(chat_request, current_user, user_role)
+    stream = llm.stream(
+        "tms_chat",
+        chat_request.message,
+        system=system_message,
+        history=history,
+        tenant_id=llm_tenant(current_user),
+        user_id=current_user.id
+    )
+    
+    async def save(result: LLMResult) -> dict:
+        entry = await save_chat(chat_request, current_user, session_id, result.text, background_tasks)
+        return {"success": True, "response": result.text, "context": chat_request.context, "message_id": entry["id"]}
+    
+    return StreamingResponse(
+        chat_event_stream(stream, request, save),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks
+    )
+
+@router.get("/search")
+async def search_records(
+    q: str,
+    context: Optional[str] = "general",
+    current_user: User = Depends(get_current_user)
+):
+    """The records the assistant would be given for a message - for checking what it can see"""
+    user_role = current_user.role.lower()
+    if context != "general":
+        access_error = department_access_error(user_role, context)
+        if access_error:
+            raise HTTPException(status_code=403, detail=access_error)
+
+    records = await relevant_records(q, current_user, searchable_departments(user_role, context))
+    return {"records": records}
+
 @router.get("/history")
 async def get_chat_history(
     context: Optional[str] = None,
@@ -239,6 +309,7 @@ async def clear_chat_history(
             query["context"] = context
         
         result = await db.tms_chat_history.delete_many(query)
+        await clear_memory(current_user.id, context)
         
         return {
             "success": True,
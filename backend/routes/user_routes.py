@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from models import *
 from auth import get_current_user, hash_password
 from database import db
+from serialization import json_response, model_projection, model_views
 from typing import List
 
 router = APIRouter(prefix="/users", tags=["Users"])
@@ -14,8 +15,8 @@ async def get_company_users(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="No company found")
     
     # Get all users for this company (users who registered with this company)
-    users = await db.users.find({"company_id": company["id"]}).to_list(length=None)
-    return [User(**user) for user in users]
+    users = await db.users.find({"company_id": company["id"]}, model_projection(User)).to_list(length=None)
+    return json_response(model_views(User, users))
 
 @router.post("/users", response_model=dict)
 async def create_user(user_data: UserCreate, current_user: User = Depends(get_current_user)):
@@ -0,0 +1,78 @@
+"""
+Response serialization - orjson with BSON-aware defaults
+
+APIResponse is the app's default response class. orjson handles datetime, UUID, enums and dataclasses
+natively; bson_default covers the Mongo types it doesn't (ObjectId, Decimal128, Binary). Routes that
+return trusted DB reads can hand documents straight to json_response, which skips FastAPI's
+jsonable_encoder walk and response_model re-validation - the response_model stays for the OpenAPI schema.
+"""
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+from bson import Binary, Decimal128, ObjectId
+from decimal import Decimal
+from functools import lru_cache
+import base64
+import orjson
+
+# UTC as Z, like pydantic's own JSON; $group results can be keyed by ints or dates
+DUMPS_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def bson_default(value: Any):
+    """Types orjson doesn't serialize on its own"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (Binary, bytes)):
+        return base64.b64encode(value).decode()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=bson_default, option=DUMPS_OPTIONS)
+
+
+class APIResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> APIResponse:
+    """Serialize as-is - for trusted DB reads that don't need encoding or validation by FastAPI"""
+    return APIResponse(content, status_code=status_code, headers=headers)
+
+
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection for just the fields a model exposes"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+@lru_cache(maxsize=None)
+def _model_fields(model: Type[BaseModel]) -> Tuple[frozenset, Dict[str, Any], Dict[str, Callable[[], Any]]]:
+    """(field names, plain defaults, default factories) - looked up once per model"""
+    fields = model.model_fields
+    defaults = {name: f.default for name, f in fields.items() if not f.is_required() and f.default_factory is None}
+    factories = {name: f.default_factory for name, f in fields.items() if f.default_factory is not None}
+    return frozenset(fields), defaults, factories
+
+
+def model_view(model: Type[BaseModel], doc: dict) -> dict:
+    """A stored document in the model's shape - its fields only, defaults filled in - without validating"""
+    names, defaults, factories = _model_fields(model)
+    extra = doc.keys() - names
+    view = {**defaults, **({k: v for k, v in doc.items() if k not in extra} if extra else doc)}
+    for name in factories.keys() - doc.keys():
+        view[name] = factories[name]()
+    return view
+
+
+def model_views(model: Type[BaseModel], docs: Iterable[dict]) -> List[dict]:
+    return [model_view(model, doc) for doc in docs]
@@ -9,10 +9,17 @@ import logging
 from datetime import datetime, timezone
 
 # Import database connection
-from database import db, client
+from database import db, client, ensure_indexes
 
 # Import WebSocket manager
-from websocket_manager import ConnectionManager
+from websocket_manager import manager, fleet_tenant, FLEET_FRAME_INTERVAL_MS
+from auth import get_user_from_token
+from serialization import APIResponse
+from http_middleware import CompressionMiddleware, ConditionalGetMiddleware
+from fmcsa_client import fmcsa
+from carrier_monitor import CARRIER_MONITOR_ENABLED, carrier_monitor
+from llm_gateway import llm
+from job_runner import job_reaper
 
 # Import all route modules
 from routes import auth_routes
@@ -38,15 +45,13 @@ from routes import bundle_routes
 from routes import accounting_routes
 from routes import analytics_routes
 from routes import marketing_routes
+from routes import extraction_job_routes
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# WebSocket Manager
-manager = ConnectionManager()
-
 # Create the main app
-app = FastAPI(title="Fleet Marketplace API")
+app = FastAPI(title="Fleet Marketplace API", default_response_class=APIResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -75,6 +80,43 @@ api_router.include_router(bundle_routes.router)
 api_router.include_router(accounting_routes.router)
 api_router.include_router(analytics_routes.router)
 api_router.include_router(marketing_routes.router)
+api_router.include_router(extraction_job_routes.router)
+
+# WebSocket endpoint for fleet dashboards - receives the caller's fleet's location/status broadcasts from every
+# worker (every fleet for platform admins). The JWT comes as ?token=, like /ws/messages.
+# ?coalesce=true batches locations into one frame per interval_ms (latest position per vehicle),
+# encoding=msgpack sends binary frames and delta=true sends only fields that changed.
+@api_router.websocket("/ws/fleet-tracking")
+async def fleet_tracking_websocket_endpoint(
+    websocket: WebSocket,
+    token: str = "",
+    coalesce: bool = False,
+    interval_ms: int = FLEET_FRAME_INTERVAL_MS,
+    encoding: str = "json",
+    delta: bool = False
+):
+    user = await get_user_from_token(token)
+    if not user:
+        await websocket.close(code=1008)
+        return
+    
+    await manager.connect_fleet(
+        websocket,
+        fleet_tenant(user),
+        coalesce_interval_ms=interval_ms if coalesce else None,
+        encoding=encoding,
+        delta=delta
+    )
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+                
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect_fleet(websocket)
 
 # WebSocket endpoint for real-time vehicle tracking
 @api_router.websocket("/ws/vehicle/{vehicle_id}")
@@ -91,6 +133,31 @@ async def vehicle_websocket_endpoint(websocket: WebSocket, vehicle_id: str):
     finally:
         manager.disconnect_vehicle(websocket, vehicle_id)
 
+# WebSocket endpoint for a user's own channel - load messages, read receipts and unread counts.
+# Browsers can't set headers on WebSockets, so the JWT comes as ?token=
+@api_router.websocket("/ws/messages")
+async def user_messages_websocket_endpoint(websocket: WebSocket, token: str = ""):
+    user = await get_user_from_token(token)
+    if not user:
+        await websocket.close(code=1008)
+        return
+    
+    await manager.connect_user(websocket, user.id)
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if data.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+                
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect_user(websocket, user.id)
+
+# ETags are computed on the uncompressed body, so compression wraps the conditional GET middleware
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(CompressionMiddleware)
+
 # CORS Middleware - must be added before routes
 app.add_middleware(
     CORSMiddleware,
@@ -161,6 +228,50 @@ async def startup_seed_admin():
     except Exception as e:
         logging.error(f"⚠️ Failed to seed platform admin: {str(e)}")
 
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    """Create database indexes (no-op when they already exist)"""
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logging.error(f"⚠️ Failed to ensure indexes: {str(e)}")
+
+@app.on_event("startup")
+async def startup_websocket_backplane():
+    """Subscribe this worker to the WebSocket broadcast backplane"""
+    await manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_websocket_backplane():
+    await manager.stop()
+
+@app.on_event("startup")
+async def startup_carrier_monitor():
+    """Re-check carriers on active bookings against FMCSA in the background"""
+    if CARRIER_MONITOR_ENABLED and fmcsa.configured:
+        await carrier_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown_carrier_monitor():
+    await carrier_monitor.stop()
+
+@app.on_event("startup")
+async def startup_job_reaper():
+    """Fail batch jobs a restart left queued or running - now, and periodically for other instances"""
+    await job_reaper.start()
+
+@app.on_event("shutdown")
+async def shutdown_job_reaper():
+    await job_reaper.stop()
+
+@app.on_event("shutdown")
+async def shutdown_fmcsa_client():
+    await fmcsa.close()
+
+@app.on_event("shutdown")
+async def shutdown_llm_gateway():
+    await llm.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,325 @@
+"""
+Shared pytest setup - makes the backend modules importable for unit tests, plus shared fixtures and fakes
+
+FakeDB/FakeCollection/FakeCursor stand in for Motor with the subset of queries, updates and projections the
+backend uses; test modules import them with `from conftest import ...` and add fixture data per test.
+"""
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# database.py connects lazily, so unit tests only need the settings to exist
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+import msgpack
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from fmcsa_stub import StandInFMCSA
+from llm_gateway import FakeProvider, LLMGateway
+
+
+def field_value(doc, path):
+    for part in path.split("."):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def _has(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return isinstance(doc, dict) and last in doc
+
+
+def _compare(value, op, operand):
+    if value is None:
+        return False
+    return {"$gt": value > operand, "$gte": value >= operand, "$lt": value < operand, "$lte": value <= operand}[op]
+
+
+def matches(doc, query):
+    """Whether a document matches a Mongo filter - equality, array membership, $or/$and and the common operators"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        value = field_value(doc, key)
+        values = value if isinstance(value, list) else [value]
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$in" and not any(v in operand for v in values):
+                    return False
+                if op == "$nin" and any(v in operand for v in values):
+                    return False
+                if op == "$ne" and operand in values:
+                    return False
+                if op == "$exists" and _has(doc, key) != bool(operand):
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte") and not _compare(value, op, operand):
+                    return False
+        elif isinstance(value, list):
+            if condition not in value and condition != value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Apply an inclusion or exclusion projection, dotted paths included"""
+    doc = dict(doc)
+    projection = dict(projection or {})
+    if not projection.pop("_id", 1):
+        doc.pop("_id", None)
+    if not projection:
+        return doc
+    if any(projection.values()):
+        projected = {"_id": doc["_id"]} if "_id" in doc else {}
+        for field, on in projection.items():
+            if not on:
+                continue
+            parent, _, child = field.partition(".")
+            if child:
+                if isinstance(doc.get(parent), dict) and child in doc[parent]:
+                    projected.setdefault(parent, {})[child] = doc[parent][child]
+            elif field in doc:
+                projected[field] = doc[field]
+        return projected
+    for field in projection:
+        doc.pop(field, None)
+    return doc
+
+
+def _set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def apply_update(doc, update, inserting=False):
+    for path, value in update.get("$set", {}).items():
+        _set_path(doc, path, value)
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            _set_path(doc, path, value)
+    for path, amount in update.get("$inc", {}).items():
+        _set_path(doc, path, (field_value(doc, path) or 0) + amount)
+    for path, value in update.get("$addToSet", {}).items():
+        if value not in doc.setdefault(path, []):
+            doc[path].append(value)
+    for path in update.get("$unset", {}):
+        doc.pop(path, None)
+
+
+def _sort_key(doc, key):
+    value = field_value(doc, key)
+    return value is not None, value
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self.batch = None
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: _sort_key(d, field), reverse=order == -1)
+        return self
+
+    def skip(self, count):
+        self.docs = self.docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    def batch_size(self, size):
+        self.batch = size
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs if length is None else self.docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Just enough of a Motor collection - records the queries, projections and cursors it was given"""
+
+    def __init__(self, docs=None, unique=None):
+        self.docs = [dict(d) for d in docs or []]
+        # Field (or tuple of fields) with a unique index - inserts and upserts that collide raise DuplicateKeyError
+        self.unique = (unique,) if isinstance(unique, str) else unique
+        self.queries = []
+        self.projections = []
+        self.cursors = []
+        self.batches = []
+        self.update_many_calls = 0
+
+    def project(self, doc, projection):
+        return project(doc, projection)
+
+    def _first(self, query, sort=None):
+        found = [d for d in self.docs if matches(d, query)]
+        if sort:
+            found = FakeCursor(found).sort(sort).docs
+        return found[0] if found else None
+
+    def _check_unique(self, doc):
+        if self.unique and any(all(d.get(k) == doc.get(k) for k in self.unique) for d in self.docs):
+            raise DuplicateKeyError("duplicate key")
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        apply_update(doc, update, inserting=True)
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        self.queries.append(query)
+        self.projections.append(projection)
+        cursor = FakeCursor([self.project(d, projection) for d in self.docs if matches(d, query)])
+        self.cursors.append(cursor)
+        return cursor
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        doc = self._first(query or {}, sort)
+        return None if doc is None else self.project(doc, projection)
+
+    async def insert_one(self, doc):
+        self._check_unique(doc)
+        stored = {"_id": ObjectId(), **doc}
+        self.docs.append(stored)
+        return SimpleNamespace(inserted_id=stored["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        self.batches.append(len(docs))
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self._first(query)
+        if doc is None:
+            if upsert:
+                self._upsert(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+        apply_update(doc, update)
+        return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+
+    async def update_many(self, query, update):
+        self.update_many_calls += 1
+        matched = [d for d in self.docs if matches(d, query)]
+        for doc in matched:
+            apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False, return_document=False):
+        doc = self._first(query, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return self.project(doc, projection) if return_document else None
+        before = dict(doc)
+        apply_update(doc, update)
+        return self.project(doc if return_document else before, projection)
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            await self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    async def delete_one(self, query):
+        doc = self._first(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=int(doc is not None))
+
+    async def delete_many(self, query):
+        kept = [d for d in self.docs if not matches(d, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    async def distinct(self, field, query=None):
+        return list(dict.fromkeys(field_value(d, field) for d in self.docs if matches(d, query or {})))
+
+    async def count_documents(self, query, limit=0):
+        count = len([d for d in self.docs if matches(d, query)])
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+
+class FakeDB:
+    """Collections by attribute or key, created empty on first use - FakeDB(bookings=[...], users=FakeCollection(...))"""
+
+    def __init__(self, **collections):
+        for name, docs in collections.items():
+            setattr(self, name, docs if isinstance(docs, FakeCollection) else FakeCollection(docs))
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class FakeWebSocket:
+    """Records text frames (decoded JSON) and binary frames (decoded msgpack) sent to it"""
+
+    def __init__(self, fail=False):
+        self.sent = []
+        self.binary = []
+        self.fail = fail
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        self.sent.append(json.loads(message))
+
+    async def send_bytes(self, message):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        self.binary.append(msgpack.unpackb(message, raw=False))
+
+
+def make_gateway(fake=None, **options):
+    """(gateway, provider) with every feature routed to a FakeProvider"""
+    fake = fake or FakeProvider()
+    return LLMGateway(providers={"fake": fake}, provider_override="fake", **options), fake
+
+
+@pytest.fixture
+def fmcsa_server():
+    """Offline stand-in for the FMCSA QCMobile API"""
+    return StandInFMCSA()
+
@@ -0,0 +1,101 @@
+"""
+Stand-in FMCSA QCMobile server for offline tests
+
+Serves the carrier endpoints the client uses from an in-memory carrier table, counts every request,
+and can be switched into an outage or slowed down. Carrier records carry an ETag and answer a
+matching If-None-Match with 304. Wire it in with httpx.ASGITransport.
+"""
+import asyncio
+import hashlib
+import json
+from collections import Counter
+from typing import Dict, Optional
+
+import httpx
+from fastapi import FastAPI, Header, Response
+from fastapi.responses import JSONResponse
+
+API_KEY = "test-web-key"
+
+
+def carrier_record(dot_number: str, mc_number: Optional[str] = None, legal_name: str = "Test Freight LLC", **fields) -> dict:
+    record = {
+        "dotNumber": int(dot_number),
+        "legalName": legal_name,
+        "phyStreet": "1 Main St",
+        "phyCity": "Dallas",
+        "phyState": "TX",
+        "phyZipcode": "75201",
+        "telephone": "555-0100",
+        "allowedToOperate": "Y",
+        "statusCode": "A",
+        "totalDrivers": 10,
+        "totalPowerUnits": 8,
+    }
+    if mc_number:
+        record["mcNumber"] = mc_number
+    record.update(fields)
+    return record
+
+
+class StandInFMCSA:
+    def __init__(self):
+        self.carriers: Dict[str, dict] = {}
+        self.requests: Counter = Counter()
+        self.not_modified: Counter = Counter()
+        self.fail_with: Optional[int] = None
+        self.delay = 0.0
+        self.app = self._build_app()
+
+    def add_carrier(self, dot_number: str, mc_number: Optional[str] = None, **fields) -> dict:
+        record = carrier_record(dot_number, mc_number, **fields)
+        self.carriers[dot_number] = record
+        return record
+
+    def transport(self) -> httpx.ASGITransport:
+        return httpx.ASGITransport(app=self.app)
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        async def guard(path: str, web_key: Optional[str]):
+            self.requests[path] += 1
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.fail_with:
+                return JSONResponse({"error": "unavailable"}, status_code=self.fail_with)
+            if web_key != API_KEY:
+                return JSONResponse({"error": "bad key"}, status_code=401)
+            return None
+
+        @app.get("/carriers/docket-number/{mc_number}")
+        async def by_docket(mc_number: str, webKey: Optional[str] = None):
+            error = await guard(f"/carriers/docket-number/{mc_number}", webKey)
+            if error:
+                return error
+            record = next((c for c in self.carriers.values() if c.get("mcNumber") == mc_number), None)
+            return {"content": [{"carrier": record}] if record else None}
+
+        @app.get("/carriers/name/{name}")
+        async def by_name(name: str, webKey: Optional[str] = None, start: int = 0, size: int = 10):
+            error = await guard(f"/carriers/name/{name}", webKey)
+            if error:
+                return error
+            matches = [c for c in self.carriers.values() if name.lower() in c["legalName"].lower()]
+            return {"content": [{"carrier": c} for c in matches[start:start + size]]}
+
+        @app.get("/carriers/{dot_number}")
+        async def by_dot(dot_number: str, webKey: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+            error = await guard(f"/carriers/{dot_number}", webKey)
+            if error:
+                return error
+            record = self.carriers.get(dot_number)
+            if record is None:
+                return JSONResponse({"content": None}, status_code=404)
+            etag = '"' + hashlib.md5(json.dumps(record, sort_keys=True).encode()).hexdigest() + '"'
+            if if_none_match == etag:
+                self.not_modified[f"/carriers/{dot_number}"] += 1
+                return Response(status_code=304, headers={"ETag": etag})
+            return JSONResponse({"content": {"carrier": record}}, headers={"ETag": etag})
+
+        return app
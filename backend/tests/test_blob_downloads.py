@@ -0,0 +1,179 @@
+"""
+Blob Download Tests
+Streaming responses with ETag, Range and Cache-Control handling
+"""
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import blob_store as blob_store_module
+from auth import get_current_user, get_optional_user
+from blob_store import LocalBlobStore, blob_response, content_disposition, parse_range, BLOB_CACHE_CONTROL
+from models import User, UserRole
+from conftest import FakeDB
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def client(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    blob = asyncio.run(store.put_bytes(CONTENT))
+    app = FastAPI()
+
+    @app.get("/files/{sha256}")
+    async def download(sha256: str, request: Request, filename: str = "bol.pdf"):
+        return await blob_response(request, sha256, "application/pdf", filename=filename, store=store)
+
+    test_client = TestClient(app)
+    test_client.sha256 = blob.sha256
+    return test_client
+
+
+class TestParseRange:
+    """Range header parsing"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=900-5000", (900, 999)),
+        (None, None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+    ])
+    def test_parse(self, header, expected):
+        assert parse_range(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", ["bytes=1000-", "bytes=50-10"])
+    def test_unsatisfiable(self, header):
+        with pytest.raises(ValueError):
+            parse_range(header, 1000)
+
+
+class TestBlobResponse:
+    """End-to-end download behaviour"""
+
+    def test_full_download(self, client):
+        response = client.get(f"/files/{client.sha256}")
+        assert response.status_code == 200
+        assert response.content == CONTENT
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.headers["etag"] == f'"{client.sha256}"'
+        assert response.headers["cache-control"] == BLOB_CACHE_CONTROL
+        assert response.headers["accept-ranges"] == "bytes"
+        assert 'filename="bol.pdf"' in response.headers["content-disposition"]
+
+    def test_if_none_match(self, client):
+        response = client.get(f"/files/{client.sha256}", headers={"If-None-Match": f'"{client.sha256}"'})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_resume_with_range(self, client):
+        response = client.get(f"/files/{client.sha256}", headers={"Range": "bytes=10000-"})
+        assert response.status_code == 206
+        assert response.content == CONTENT[10000:]
+        assert response.headers["content-range"] == f"bytes 10000-10239/{len(CONTENT)}"
+
+    def test_stale_if_range_gets_full_body(self, client):
+        response = client.get(f"/files/{client.sha256}", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        assert response.status_code == 200
+        assert response.content == CONTENT
+
+    def test_unsatisfiable_range(self, client):
+        response = client.get(f"/files/{client.sha256}", headers={"Range": "bytes=999999-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    def test_missing_blob(self, client):
+        assert client.get(f"/files/{'0' * 64}").status_code == 404
+
+    def test_non_latin1_filename(self, client):
+        response = client.get(f"/files/{client.sha256}", params={"filename": "收据.jpg"})
+        assert response.status_code == 200
+        assert response.headers["content-disposition"] == "inline; filename=\"??.jpg\"; filename*=UTF-8''%E6%94%B6%E6%8D%AE.jpg"
+
+
+class TestContentDisposition:
+    def test_ascii_name_has_no_extended_parameter(self):
+        assert content_disposition("bol.pdf") == 'inline; filename="bol.pdf"'
+
+    def test_quotes_and_control_characters_are_dropped_from_the_fallback(self):
+        value = content_disposition('a"b\r\nc.pdf', "attachment")
+        assert value.startswith('attachment; filename="abc.pdf"; filename*=UTF-8\'\'a%22b%0D%0Ac.pdf')
+
+
+class TestCompanyFiles:
+    """Logos are public, company documents only reach the company's users and platform admins"""
+
+    @pytest.fixture
+    def company_client(self, tmp_path, monkeypatch):
+        from routes import company_routes
+
+        store = LocalBlobStore(str(tmp_path))
+        logo = asyncio.run(store.put_bytes(b"png-bytes"))
+        w9 = asyncio.run(store.put_bytes(b"%PDF-w9"))
+        monkeypatch.setattr(blob_store_module, "blob_store", store)
+        monkeypatch.setattr(company_routes, "blob_store", store)
+        monkeypatch.setattr(company_routes, "db", FakeDB(
+            companies=[{
+                "id": "co-1", "owner_id": "owner-1", "logo_sha256": logo.sha256, "logo_content_type": "image/png",
+                "company_documents": {"w9": [{"blob_sha256": w9.sha256, "content_type": "application/pdf"}]}
+            }],
+            users=[
+                {"id": "driver-1", "fleet_owner_id": "owner-1"},
+                {"id": "acct-1", "company_id": "co-1"},
+                {"id": "rival-1", "company_id": "co-2"},
+            ]
+        ))
+
+        app = FastAPI()
+        app.include_router(company_routes.router)
+        caller = {"user": None}
+        app.dependency_overrides[get_optional_user] = lambda: caller["user"]
+        app.dependency_overrides[get_current_user] = lambda: caller["user"]
+        test_client = TestClient(app)
+        test_client.caller, test_client.logo, test_client.w9 = caller, logo.sha256, w9.sha256
+        return test_client
+
+    def as_user(self, client, user_id, role=UserRole.DISPATCHER):
+        client.caller["user"] = User.model_construct(id=user_id, role=role, fleet_owner_id=None)
+
+    def test_logo_needs_no_token(self, company_client):
+        response = company_client.get(f"/companies/co-1/files/{company_client.logo}")
+        assert response.status_code == 200 and response.content == b"png-bytes"
+
+    def test_documents_need_a_token(self, company_client):
+        assert company_client.get(f"/companies/co-1/files/{company_client.w9}").status_code == 401
+
+    @pytest.mark.parametrize("user_id,role,status", [
+        ("owner-1", UserRole.FLEET_OWNER, 200),
+        ("driver-1", UserRole.DRIVER, 200),
+        ("acct-1", UserRole.ACCOUNTANT, 200),
+        ("admin-1", UserRole.PLATFORM_ADMIN, 200),
+        ("rival-1", UserRole.ACCOUNTANT, 403),
+    ])
+    def test_documents_only_reach_the_company(self, company_client, user_id, role, status):
+        self.as_user(company_client, user_id, role)
+        response = company_client.get(f"/companies/co-1/files/{company_client.w9}")
+        assert response.status_code == status
+        if status == 200:
+            assert response.content == b"%PDF-w9"
+
+    def test_logo_uploads_are_capped(self, company_client, tmp_path, monkeypatch):
+        from routes import company_routes
+
+        monkeypatch.setattr(company_routes, "MAX_FILE_SIZE", 16)
+        self.as_user(company_client, "owner-1", UserRole.FLEET_OWNER)
+        response = company_client.post("/companies/my/upload-logo", files={"file": ("logo.png", b"x" * 17, "image/png")})
+        assert response.status_code == 400
+        assert list((tmp_path / "tmp").iterdir()) == []
+
+        response = company_client.post("/companies/my/upload-logo", files={"file": ("logo.png", b"x" * 16, "image/png")})
+        assert response.status_code == 200
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,85 @@
+"""
+Blob Store Tests
+Content-addressed storage on the local filesystem backend
+"""
+import asyncio
+import hashlib
+
+import pytest
+
+from blob_store import LocalBlobStore, BlobNotFound, BlobTooLarge, create_blob_store
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def read_all(store, sha256, **kwargs):
+    async def scenario():
+        return b"".join([chunk async for chunk in store.open(sha256, **kwargs)])
+    return asyncio.run(scenario())
+
+
+class TestLocalBlobStore:
+    """Streaming writes, dedupe and ranged reads"""
+
+    def test_stream_is_addressed_by_sha256(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        blob = asyncio.run(store.put_stream(chunks(b"hello ", b"world")))
+        assert blob.sha256 == hashlib.sha256(b"hello world").hexdigest()
+        assert blob.size == 11
+        assert read_all(store, blob.sha256) == b"hello world"
+
+    def test_identical_uploads_are_stored_once(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        first = asyncio.run(store.put_bytes(b"same bytes"))
+        second = asyncio.run(store.put_stream(chunks(b"same ", b"bytes")))
+        assert first.sha256 == second.sha256
+        stored = [p for p in tmp_path.rglob("*") if p.is_file()]
+        assert len(stored) == 1
+
+    def test_ranged_read(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        blob = asyncio.run(store.put_bytes(b"0123456789"))
+        assert read_all(store, blob.sha256, start=2, length=5) == b"23456"
+        assert read_all(store, blob.sha256, start=7) == b"789"
+
+    def test_too_large_upload_leaves_nothing_behind(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        with pytest.raises(BlobTooLarge):
+            asyncio.run(store.put_stream(chunks(b"x" * 10, b"y" * 10), max_bytes=15))
+        assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+    def test_missing_blob(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        missing = "0" * 64
+        assert asyncio.run(store.size(missing)) is None
+        with pytest.raises(BlobNotFound):
+            read_all(store, missing)
+
+    def test_rejects_non_hash_names(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        assert asyncio.run(store.size("../../etc/passwd")) is None
+
+    def test_delete(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        blob = asyncio.run(store.put_bytes(b"gone soon"))
+        asyncio.run(store.delete(blob.sha256))
+        assert not asyncio.run(store.exists(blob.sha256))
+
+
+class TestCreateBlobStore:
+    """Backend selection from BLOB_STORE_URL"""
+
+    def test_file_url(self, tmp_path):
+        store = create_blob_store(f"file://{tmp_path}")
+        assert isinstance(store, LocalBlobStore)
+        assert store.root == tmp_path
+
+    def test_defaults_to_local(self):
+        assert isinstance(create_blob_store(None), LocalBlobStore)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,219 @@
+"""
+Carrier Monitor Tests
+Carriers on active bookings are re-checked on a schedule and alerts fire only when FMCSA data changes
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import carrier_monitor
+import carrier_vetting
+import fmcsa_client
+from auth import get_current_user
+from carrier_monitor import CarrierMonitor, claim_due, diff_snapshots, sync_watchlist
+from fmcsa_client import FMCSAClient
+from fmcsa_stub import API_KEY
+from models import User, UserRole
+from conftest import FakeDB
+
+PAST = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def booking(booking_id, status="in_transit_delivery", dot=None, mc=None, owner="dispatcher-1"):
+    return {
+        "id": booking_id,
+        "status": status,
+        "carrier_dot_number": dot,
+        "carrier_mc_number": mc,
+        "requester_id": owner,
+        "equipment_owner_id": "owner-1"
+    }
+
+
+@pytest.fixture
+def monitor(fmcsa_server, monkeypatch):
+    fake_db = FakeDB(bookings=[
+        booking("load-1", dot="1000001"),
+        booking("load-2", dot="USDOT 1000001", owner="dispatcher-2"),
+        booking("load-3", mc="MC-500002"),
+        booking("load-4", status="delivered", dot="1000009"),
+    ])
+    client = FMCSAClient(base_url="http://fmcsa.test", api_key=API_KEY, transport=fmcsa_server.transport())
+    published = []
+
+    async def publish(user_ids, event_type, payload):
+        published.append((user_ids, event_type, payload))
+
+    monkeypatch.setattr(fmcsa_client, "db", fake_db)
+    monkeypatch.setattr(carrier_monitor, "db", fake_db)
+    monkeypatch.setattr(carrier_vetting, "fmcsa", client)
+    monkeypatch.setattr(carrier_vetting, "RETRY_DELAYS", [0, 0])
+    monkeypatch.setattr(carrier_monitor, "publish", publish)
+    fmcsa_server.add_carrier("1000001", legal_name="Lone Star Hauling")
+    fmcsa_server.add_carrier("1000002", mc_number="500002", legal_name="Gulf Coast Freight")
+    return fake_db, client, published
+
+
+def watch(fake_db, key):
+    return next(d for d in fake_db.carrier_watch.docs if d["key"] == key)
+
+
+def make_due(fake_db):
+    for doc in fake_db.carrier_watch.docs:
+        doc["next_check_at"] = PAST
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+class TestWatchlist:
+    def test_active_bookings_are_registered_once_per_carrier(self, monitor):
+        fake_db, _, _ = monitor
+        assert run(sync_watchlist) == 2
+
+        dot = watch(fake_db, "dot:1000001")
+        assert dot["active"] and dot["snapshot"] is None
+        assert sorted(dot["booking_values"]["carrier_dot_number"]) == ["1000001", "USDOT 1000001"]
+        assert watch(fake_db, "mc:500002")["kind"] == "mc"
+
+    def test_carriers_no_longer_on_active_bookings_are_parked(self, monitor):
+        fake_db, _, _ = monitor
+        run(sync_watchlist)
+        fake_db.bookings.docs[2]["status"] = "delivered"
+        run(sync_watchlist)
+        assert watch(fake_db, "mc:500002")["active"] is False
+
+    def test_due_carriers_are_claimed_once(self, monitor):
+        fake_db, _, _ = monitor
+
+        async def scenario():
+            await sync_watchlist()
+            first = await claim_due(10)
+            second = await claim_due(10)
+            return first, second
+
+        first, second = run(scenario)
+        assert len(first) == 2
+        assert second == []
+
+
+class TestChecks:
+    def test_first_check_is_a_baseline_and_changes_raise_one_alert(self, fmcsa_server, monitor, monkeypatch):
+        fake_db, client, published = monitor
+        monkeypatch.setattr(carrier_monitor, "CARRIER_MONITOR_MAX_AGE_SECONDS", 0)
+
+        async def scenario():
+            scheduler = CarrierMonitor(concurrency=2)
+            baseline = await scheduler.run_once()
+            fmcsa_server.add_carrier("1000001", legal_name="Lone Star Hauling", allowedToOperate="N", oosDate="2025-01-02")
+            make_due(fake_db)
+            changed = await scheduler.run_once()
+            make_due(fake_db)
+            unchanged = await scheduler.run_once()
+            await client.close()
+            return baseline, changed, unchanged
+
+        baseline, changed, unchanged = run(scenario)
+        assert baseline == {"checked": 2, "alerts": 0}
+        assert changed == {"checked": 2, "alerts": 1}
+        assert unchanged == {"checked": 2, "alerts": 0}
+
+        alert = fake_db.carrier_alerts.docs[0]
+        assert alert["severity"] == "critical"
+        assert alert["legal_name"] == "Lone Star Hauling"
+        assert {c["field"]: (c["before"], c["after"]) for c in alert["changes"]} == {
+            "allow_to_operate": ("Y", "N"),
+            "out_of_service": (False, True)
+        }
+        assert sorted(alert["booking_ids"]) == ["load-1", "load-2"]
+        user_ids, event_type, _ = published[0]
+        assert event_type == "carrier_alert"
+        assert sorted(user_ids) == ["dispatcher-1", "dispatcher-2", "owner-1"]
+
+    def test_unchanged_carriers_are_revalidated_conditionally(self, fmcsa_server, monitor, monkeypatch):
+        fake_db, client, _ = monitor
+        monkeypatch.setattr(carrier_monitor, "CARRIER_MONITOR_MAX_AGE_SECONDS", 0)
+
+        async def scenario():
+            scheduler = CarrierMonitor()
+            await scheduler.run_once()
+            make_due(fake_db)
+            await scheduler.run_once()
+            await client.close()
+
+        run(scenario)
+        assert fmcsa_server.requests["/carriers/1000001"] == 2
+        assert fmcsa_server.not_modified["/carriers/1000001"] == 1
+        # The MC -> DOT mapping comes from the cache on the second pass
+        assert fmcsa_server.requests["/carriers/docket-number/500002"] == 1
+
+    def test_recent_cache_entries_count_as_a_check(self, fmcsa_server, monitor):
+        fake_db, client, _ = monitor
+
+        async def scenario():
+            scheduler = CarrierMonitor()
+            await scheduler.run_once()
+            make_due(fake_db)
+            await scheduler.run_once()
+            await client.close()
+
+        run(scenario)
+        assert fmcsa_server.requests["/carriers/1000001"] == 1
+
+    def test_lookup_errors_keep_the_last_snapshot(self, fmcsa_server, monitor, monkeypatch):
+        fake_db, client, _ = monitor
+        monkeypatch.setattr(carrier_monitor, "CARRIER_MONITOR_MAX_AGE_SECONDS", 0)
+
+        async def scenario():
+            scheduler = CarrierMonitor()
+            await scheduler.run_once()
+            fmcsa_server.fail_with = 503
+            make_due(fake_db)
+            stats = await scheduler.run_once()
+            await client.close()
+            return stats
+
+        assert run(scenario) == {"checked": 2, "alerts": 0}
+        dot = watch(fake_db, "dot:1000001")
+        assert dot["snapshot"]["legal_name"] == "Lone Star Hauling"
+        assert dot["last_error"] == "FMCSA API error"
+
+    def test_diff_only_reports_watched_fields(self):
+        before = {"found": True, "legal_name": "Old LLC", "total_drivers": 10, "common_authority": "A"}
+        after = {"found": True, "legal_name": "New LLC", "total_drivers": 12, "common_authority": "I"}
+        assert diff_snapshots(before, after) == [
+            {"field": "common_authority", "before": "A", "after": "I", "severity": "critical"}
+        ]
+        assert diff_snapshots(None, after) == []
+
+
+class TestRoutes:
+    def test_alerts_are_scoped_and_acknowledged_per_user(self, monitor, monkeypatch):
+        from routes import fmcsa_routes
+
+        fake_db, _, _ = monitor
+        monkeypatch.setattr(fmcsa_routes, "db", fake_db)
+        now = datetime.now(timezone.utc)
+        fake_db.carrier_alerts.docs.extend([
+            {"_id": 1, "id": "a1", "user_ids": ["dispatcher-1"], "acknowledged_by": [], "created_at": now - timedelta(hours=1)},
+            {"_id": 2, "id": "a2", "user_ids": ["dispatcher-1"], "acknowledged_by": [], "created_at": now},
+            {"_id": 3, "id": "a3", "user_ids": ["someone-else"], "acknowledged_by": [], "created_at": now},
+        ])
+
+        app = FastAPI()
+        app.include_router(fmcsa_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="dispatcher-1", role=UserRole.DISPATCHER)
+        http = TestClient(app)
+
+        assert [a["id"] for a in http.get("/fmcsa/monitor/alerts").json()] == ["a2", "a1"]
+        assert http.post("/fmcsa/monitor/alerts/a2/acknowledge").status_code == 200
+        assert [a["id"] for a in http.get("/fmcsa/monitor/alerts", params={"unacknowledged": True}).json()] == ["a1"]
+        assert http.post("/fmcsa/monitor/alerts/a3/acknowledge").status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
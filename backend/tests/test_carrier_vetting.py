@@ -0,0 +1,180 @@
+"""
+Carrier Vetting Tests
+Bulk DOT/MC lists are vetted by a bounded worker pool against a stand-in FMCSA server
+"""
+import asyncio
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import carrier_vetting
+import fmcsa_client
+import job_runner
+from auth import get_current_user
+from carrier_vetting import create_vetting_job, parse_identifiers, run_vetting_job, vetting_flags
+from fmcsa_client import FMCSAClient
+from fmcsa_stub import API_KEY
+from models import User, UserRole
+from conftest import FakeDB
+
+
+@pytest.fixture
+def vetting(fmcsa_server, monkeypatch):
+    fake_db = FakeDB()
+    client = FMCSAClient(base_url="http://fmcsa.test", api_key=API_KEY, transport=fmcsa_server.transport())
+    monkeypatch.setattr(fmcsa_client, "db", fake_db)
+    monkeypatch.setattr(carrier_vetting, "db", fake_db)
+    monkeypatch.setattr(job_runner, "db", fake_db)
+    monkeypatch.setattr(carrier_vetting, "fmcsa", client)
+    monkeypatch.setattr(carrier_vetting, "RETRY_DELAYS", [0, 0])
+    fmcsa_server.add_carrier("1000001", mc_number="500001", legal_name="Clean Lines LLC")
+    fmcsa_server.add_carrier("1000002", legal_name="Grounded Freight", allowedToOperate="N", oosDate="2024-05-01")
+    fmcsa_server.add_carrier("1000003", legal_name="Risky Roads", crashIndicatorBasic="72.5")
+    return fake_db, client
+
+
+def run_job(fake_db, raw, concurrency=4):
+    identifiers = parse_identifiers(raw)
+
+    async def scenario():
+        job = await create_vetting_job("owner-1", identifiers)
+        await run_vetting_job(job["id"], identifiers, concurrency=concurrency)
+        await carrier_vetting.fmcsa.close()
+        return job["id"]
+
+    job_id = asyncio.run(scenario())
+    job = next(d for d in fake_db.vetting_jobs.docs if d["id"] == job_id)
+    results = sorted((r for r in fake_db.vetting_results.docs if r["job_id"] == job_id), key=lambda r: r["position"])
+    return job, results
+
+
+class TestParsing:
+    def test_identifiers_are_normalized_and_deduplicated(self):
+        raw = ["MC-500001, DOT 1000002\n1000003", "USDOT#1000002; mc 500001", "n/a", ""]
+        assert parse_identifiers(raw) == [("mc", "500001"), ("dot", "1000002"), ("dot", "1000003")]
+
+    def test_flags(self):
+        assert vetting_flags({"allow_to_operate": "Y", "operating_status": "A"}) == []
+        flags = vetting_flags({"allow_to_operate": "N", "out_of_service": True, "vehicle_maintenance_basic": "85"})
+        assert flags == ["not_allowed_to_operate", "out_of_service", "basic_alert:vehicle_maintenance"]
+
+
+class TestVettingJob:
+    def test_job_vets_every_carrier_in_input_order(self, fmcsa_server, vetting):
+        fake_db, _ = vetting
+        job, results = run_job(fake_db, ["MC-500001", "1000002", "1000003", "4040404", "1000002"])
+
+        assert job["status"] == "completed"
+        assert job["processed"] == job["total"] == 4
+        assert job["counts"] == {"passed": 1, "flagged": 2, "not_found": 1, "error": 0}
+        assert [(r["identifier"], r["status"]) for r in results] == [
+            ("500001", "passed"), ("1000002", "flagged"), ("1000003", "flagged"), ("4040404", "not_found")
+        ]
+        assert results[0]["carrier"]["legal_name"] == "Clean Lines LLC"
+        assert "out_of_service" in results[1]["flags"]
+        assert results[2]["flags"] == ["basic_alert:crash_indicator"]
+        # The repeated DOT number was dropped before any lookup
+        assert fmcsa_server.requests["/carriers/1000002"] == 1
+
+    def test_results_are_written_in_batches(self, fmcsa_server, vetting, monkeypatch):
+        fake_db, _ = vetting
+        monkeypatch.setattr(carrier_vetting, "VETTING_FLUSH_SIZE", 2)
+        for i in range(7):
+            fmcsa_server.add_carrier(str(2000000 + i))
+        job, results = run_job(fake_db, [str(2000000 + i) for i in range(7)], concurrency=3)
+
+        assert job["processed"] == 7 and len(results) == 7
+        assert sum(fake_db.vetting_results.batches) == 7
+        assert len(fake_db.vetting_results.batches) >= 3
+
+    def test_outage_is_retried_then_reported(self, fmcsa_server, vetting):
+        fake_db, _ = vetting
+        fmcsa_server.fail_with = 503
+        job, results = run_job(fake_db, ["1000001"])
+
+        assert job["status"] == "completed"
+        assert job["counts"]["error"] == 1
+        assert results[0]["status"] == "error"
+        assert fmcsa_server.requests["/carriers/1000001"] == 3
+
+    def test_jobs_orphaned_by_a_restart_are_failed(self, vetting):
+        fake_db, _ = vetting
+
+        async def scenario():
+            orphaned = await create_vetting_job("owner-1", [("dot", "1000001")])
+            running = await create_vetting_job("owner-1", [("dot", "1000002")])
+            stale = datetime.now(timezone.utc) - timedelta(seconds=job_runner.JOB_STALE_SECONDS + 1)
+            await fake_db.vetting_jobs.update_one({"id": orphaned["id"]}, {"$set": {"status": "running", "heartbeat_at": stale}})
+            await fake_db.vetting_jobs.update_one({"id": running["id"]}, {"$set": {"status": "running"}})
+            return await job_runner.job_reaper.run_once(), orphaned["id"], running["id"]
+
+        failed, orphaned_id, running_id = asyncio.run(scenario())
+        jobs = {j["id"]: j for j in fake_db.vetting_jobs.docs}
+        assert failed == 1
+        assert jobs[orphaned_id]["status"] == "failed" and jobs[orphaned_id]["error"] == job_runner.INTERRUPTED_ERROR
+        # A job still heartbeating on another instance is left alone
+        assert jobs[running_id]["status"] == "running"
+
+    def test_empty_and_oversized_lists_are_rejected(self, vetting, monkeypatch):
+        from fastapi import HTTPException
+
+        monkeypatch.setattr(carrier_vetting, "VETTING_MAX_CARRIERS", 2)
+        for identifiers in [[], [("dot", "1"), ("dot", "2"), ("dot", "3")]]:
+            with pytest.raises(HTTPException) as exc:
+                asyncio.run(create_vetting_job("owner-1", identifiers))
+            assert exc.value.status_code == 400
+
+
+class TestRoutes:
+    def test_submit_poll_and_export(self, fmcsa_server, vetting, monkeypatch):
+        from routes import fmcsa_routes
+
+        fake_db, client = vetting
+        monkeypatch.setattr(fmcsa_routes, "db", fake_db)
+        monkeypatch.setattr(fmcsa_routes, "fmcsa", client)
+
+        app = FastAPI()
+        app.include_router(fmcsa_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="owner-1", role=UserRole.DISPATCHER)
+        http = TestClient(app)
+
+        created = http.post("/fmcsa/vetting", json={"carriers": ["1000001", "1000002", "MC 500001"]}).json()
+        assert created["total"] == 3
+
+        job = http.get(f"/fmcsa/vetting/{created['job_id']}").json()
+        assert job["status"] == "completed"
+        assert job["counts"]["flagged"] == 1
+
+        flagged = http.get(f"/fmcsa/vetting/{created['job_id']}/results", params={"status": "flagged"}).json()
+        assert [r["identifier"] for r in flagged] == ["1000002"]
+
+        report = http.get(f"/fmcsa/vetting/{created['job_id']}/results", params={"format": "csv"})
+        rows = list(csv.DictReader(io.StringIO(report.text)))
+        assert [r["identifier"] for r in rows] == ["1000001", "1000002", "500001"]
+
+        upload = http.post("/fmcsa/vetting/upload", files={"file": ("carriers.csv", b"dot_number\n1000003\n", "text/csv")})
+        assert upload.json()["total"] == 1
+
+    def test_jobs_are_private_to_their_owner(self, vetting, monkeypatch):
+        from routes import fmcsa_routes
+
+        fake_db, client = vetting
+        monkeypatch.setattr(fmcsa_routes, "fmcsa", client)
+        fake_db.vetting_jobs.docs.append({"id": "job-1", "owner_id": "someone-else"})
+
+        app = FastAPI()
+        app.include_router(fmcsa_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="owner-1", role=UserRole.DISPATCHER)
+        http = TestClient(app)
+
+        assert http.get("/fmcsa/vetting/job-1").status_code == 404
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="owner-1", role=UserRole.DRIVER)
+        assert http.post("/fmcsa/vetting", json={"carriers": ["1000001"]}).status_code == 403
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,174 @@
+"""
+Chat Memory Tests
+Long TMS chat sessions send a rolling summary plus only the recent turns that fit the department's budget
+"""
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import chat_memory
+import llm_gateway
+from auth import get_current_user
+from chat_memory import chat_memory as session_memory, compact_memory, split_turns, turn_tokens
+from llm_gateway import FakeProvider, LLMError, LLMGateway, estimate_tokens
+from models import User, UserRole
+from conftest import FakeCollection, FakeDB
+
+SESSION = "tms-chat-disp-1-dispatch"
+
+
+def turn(i, words=60):
+    return {
+        "id": f"turn-{i}", "user_id": "disp-1", "session_id": SESSION, "context": "dispatch",
+        "user_message": f"Question {i} about load ORD-{i}? " + "detail " * words,
+        "assistant_response": f"Answer {i}: load ORD-{i} is on schedule. " + "note " * words,
+        "timestamp": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}+00:00"
+    }
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    db = FakeDB(tms_chat_memory=FakeCollection(unique=("user_id", "session_id")))
+    db.tms_chat_history.docs = [turn(i) for i in range(40)]
+    provider = FakeProvider(handler=lambda request: "Dispatcher asked about loads ORD-0 onwards; all on schedule.")
+    monkeypatch.setattr(chat_memory, "db", db)
+    monkeypatch.setattr(llm_gateway, "db", db)
+    monkeypatch.setattr(chat_memory, "llm", LLMGateway(providers={"fake": provider}, provider_override="fake"))
+    monkeypatch.setitem(chat_memory.CHAT_MEMORY_BUDGETS, "dispatch", 1000)
+    return db, provider
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def history_tokens(history):
+    return estimate_tokens(*(m["content"] for m in history))
+
+
+class TestSplit:
+    def test_newest_turns_that_fit(self):
+        turns = [turn(i) for i in range(10)]
+        older, recent = split_turns(turns, turn_tokens(turns[0]) * 3)
+        assert [t["id"] for t in recent] == ["turn-7", "turn-8", "turn-9"]
+        assert len(older) == 7
+
+    def test_last_turn_always_kept(self):
+        older, recent = split_turns([turn(0), turn(1, words=2000)], 10)
+        assert [t["id"] for t in recent] == ["turn-1"]
+
+
+class TestCompaction:
+    def test_long_sessions_send_a_summary_and_recent_turns(self, fake):
+        db, provider = fake
+
+        async def scenario():
+            before = await session_memory("disp-1", SESSION, "dispatch")
+            updated = await compact_memory("disp-1", SESSION, "dispatch", tenant_id="fleet-1")
+            after = await session_memory("disp-1", SESSION, "dispatch")
+            return before, updated, after
+
+        (_, before), updated, (summary, history) = run(scenario)
+        assert updated
+        memory = db.tms_chat_memory.docs[0]
+        assert summary == memory["summary"] == "Dispatcher asked about loads ORD-0 onwards; all on schedule."
+        assert memory["summarized_through"] == db.tms_chat_history.docs[memory["turns_summarized"] - 1]["timestamp"]
+        assert history[-1]["content"].startswith("Answer 39")
+        assert estimate_tokens(summary) + history_tokens(history) <= 1000
+
+        # The summary call saw the folded turns, not the ones still sent verbatim
+        request = provider.calls[0]
+        assert request.feature == "chat_summary"
+        assert "Question 0 about" in request.prompt and "Question 39 about" not in request.prompt
+        assert db.llm_calls.docs[0]["tenant_id"] == "fleet-1"
+
+        # Materially smaller than the last 10 full pairs
+        last_ten = [m for t in db.tms_chat_history.docs[-10:] for m in (t["user_message"], t["assistant_response"])]
+        assert estimate_tokens(summary) + history_tokens(history) < estimate_tokens(*last_ten) / 2
+
+    def test_later_compactions_only_fold_new_turns(self, fake):
+        db, provider = fake
+
+        async def scenario():
+            await compact_memory("disp-1", SESSION, "dispatch")
+            db.tms_chat_history.docs += [turn(i) for i in range(40, 50)]
+            await compact_memory("disp-1", SESSION, "dispatch")
+
+        run(scenario)
+        first, second = provider.calls
+        assert "Question 0 about" not in second.prompt
+        assert "Dispatcher asked about loads" in second.prompt
+        assert db.tms_chat_memory.docs[0]["turns_summarized"] > 40 - 10
+        assert len(db.tms_chat_memory.docs) == 1
+
+    def test_budget_is_per_department(self, fake, monkeypatch):
+        monkeypatch.setitem(chat_memory.CHAT_MEMORY_BUDGETS, "accounting", 3000)
+        _, dispatch = run(lambda: session_memory("disp-1", SESSION, "dispatch"))
+        _, accounting = run(lambda: session_memory("disp-1", SESSION, "accounting"))
+        assert len(accounting) > len(dispatch)
+        assert history_tokens(accounting) <= 3000
+
+    def test_short_sessions_are_left_alone(self, fake):
+        db, provider = fake
+        db.tms_chat_history.docs = db.tms_chat_history.docs[:2]
+        assert run(lambda: compact_memory("disp-1", SESSION, "dispatch")) is False
+        assert provider.calls == [] and db.tms_chat_memory.docs == []
+
+    def test_a_racing_compaction_keeps_the_first_summary(self, fake):
+        db, provider = fake
+        original_find = db.tms_chat_history.find
+
+        def find_then_compact(query, projection=None):
+            cursor = original_find(query, projection)
+            db.tms_chat_memory.docs.append({"user_id": "disp-1", "session_id": SESSION, "summary": "first", "summarized_through": "x"})
+            return cursor
+
+        db.tms_chat_history.find = find_then_compact
+        assert run(lambda: compact_memory("disp-1", SESSION, "dispatch")) is False
+        assert [m["summary"] for m in db.tms_chat_memory.docs] == ["first"]
+
+    def test_failed_summaries_are_retried_later(self, fake):
+        db, provider = fake
+        provider.failures = [LLMError("invalid api key", status_code=500)]
+        assert run(lambda: compact_memory("disp-1", SESSION, "dispatch")) is False
+        assert db.tms_chat_memory.docs == []
+        assert run(lambda: compact_memory("disp-1", SESSION, "dispatch")) is True
+
+
+async def no_records(query, user, departments):
+    return []
+
+
+class TestRoutes:
+    def test_chat_uses_the_summary_and_compacts_after_replying(self, fake, monkeypatch):
+        from routes import tms_chat_routes
+
+        db, provider = fake
+        chat = FakeProvider(responses=["Load 41 is loading now"] * 2)
+        monkeypatch.setattr(tms_chat_routes, "llm", LLMGateway(providers={"fake": chat}, provider_override="fake"))
+        monkeypatch.setattr(tms_chat_routes, "db", db)
+        monkeypatch.setattr(tms_chat_routes, "relevant_records", no_records)
+
+        app = FastAPI()
+        app.include_router(tms_chat_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="disp-1", role=UserRole.DISPATCHER, fleet_owner_id="fleet-1")
+        client = TestClient(app)
+
+        assert client.post("/tms-chat/message", json={"message": "Load 41?", "context": "dispatch"}).json()["success"]
+        assert "SUMMARY OF EARLIER CONVERSATION" not in chat.calls[0].system
+        assert len(provider.calls) == 1 and len(db.tms_chat_memory.docs) == 1
+
+        client.post("/tms-chat/message", json={"message": "And load 42?", "context": "dispatch"})
+        second = chat.calls[1]
+        assert "SUMMARY OF EARLIER CONVERSATION:\nDispatcher asked about loads" in second.system
+        assert history_tokens(second.history) <= 1000
+        assert second.history[-1]["content"] == "Load 41 is loading now"
+
+        assert client.delete("/tms-chat/history", params={"context": "dispatch"}).json()["success"]
+        assert db.tms_chat_memory.docs == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
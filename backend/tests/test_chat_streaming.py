@@ -0,0 +1,227 @@
+"""
+Chat Streaming Tests
+Replies stream as server-sent events, are saved once complete, and a client that goes away stops the upstream call
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import chat_memory
+import llm_gateway
+from auth import get_current_user
+from llm_gateway import FakeProvider, LLMError, LLMGateway, OpenAIProvider, chat_event_stream
+from models import User, UserRole
+from conftest import FakeDB, make_gateway
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(llm_gateway, "db", db)
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_BASE_SECONDS", 0)
+    return db
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def sse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestGatewayStream:
+    def test_deltas_then_result(self, fake_db):
+        gateway, fake = make_gateway(FakeProvider(responses=["Load 42 is on schedule"]))
+
+        async def scenario():
+            stream = gateway.stream("tms_chat", "Where is load 42?", tenant_id="fleet-1")
+            deltas = [delta async for delta in stream]
+            return deltas, stream.result
+
+        deltas, result = run(scenario)
+        assert deltas == ["Load", " 42", " is", " on", " schedule"]
+        assert result.text == "Load 42 is on schedule"
+        assert result.first_token_ms is not None and result.first_token_ms <= result.latency_ms
+        record = fake_db.llm_calls.docs[0]
+        assert record["status"] == "ok"
+        assert record["first_token_ms"] == result.first_token_ms
+
+    def test_closing_early_aborts_the_call(self, fake_db):
+        gateway, fake = make_gateway(FakeProvider(responses=["one two three four"], chunk_delay=0.01), tenant_concurrency=1)
+
+        async def scenario():
+            stream = gateway.stream("tms_chat", "hi", tenant_id="fleet-1")
+            async for _ in stream:
+                break
+            await stream.aclose()
+            await asyncio.sleep(0)
+            # The slot is free again
+            return await gateway.complete("tms_chat", "again", tenant_id="fleet-1", timeout=1)
+
+        run(scenario)
+        assert fake.aborted == 1
+        assert [r["status"] for r in fake_db.llm_calls.docs] == ["cancelled", "ok"]
+
+    def test_failures_before_the_first_token_are_retried(self, fake_db):
+        gateway, fake = make_gateway(FakeProvider(responses=["done"]))
+        fake.failures = [LLMError("503", retryable=True)]
+
+        async def scenario():
+            stream = gateway.stream("driver_assistant", "hi")
+            return [d async for d in stream], stream.result
+
+        deltas, result = run(scenario)
+        assert deltas == ["done"]
+        assert result.attempts == 2
+
+    def test_stalled_streams_time_out(self, fake_db):
+        gateway, _ = make_gateway(FakeProvider(responses=["slow"] * 2, chunk_delay=0.2), timeout=0.02, max_retries=1)
+
+        async def scenario():
+            return [d async for d in gateway.stream("tms_chat", "hi")]
+
+        with pytest.raises(HTTPException) as exc:
+            run(scenario)
+        assert exc.value.status_code == 504
+        assert fake_db.llm_calls.docs[0]["status"] == "error"
+
+    def test_openai_stream_forwards_deltas_and_usage(self, fake_db):
+        sent = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            sent.append(json.loads(request.content))
+            chunks = [
+                {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "On"}}]},
+                {"choices": [{"index": 0, "delta": {"content": " time"}}]},
+                {"choices": [], "usage": {"prompt_tokens": 30, "completion_tokens": 2, "total_tokens": 32}},
+            ]
+            body = "".join(
+                f"data: {json.dumps({'id': 'c1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'gpt-4o', **c})}\n\n"
+                for c in chunks
+            ) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+        provider = OpenAIProvider(api_key="test-key", base_url="http://llm.test/v1", transport=httpx.MockTransport(handler))
+        gateway = LLMGateway(providers={"openai": provider}, provider_override=None)
+
+        async def scenario():
+            stream = gateway.stream("tms_chat", "Status?")
+            deltas = [d async for d in stream]
+            await gateway.close()
+            return deltas, stream.result
+
+        deltas, result = run(scenario)
+        assert deltas == ["On", " time"]
+        assert sent[0]["stream"] is True and sent[0]["stream_options"] == {"include_usage": True}
+        assert (result.input_tokens, result.output_tokens, result.estimated_usage) == (30, 2, False)
+
+
+class DisconnectingRequest:
+    def __init__(self, after: int):
+        self.checks = 0
+        self.after = after
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.checks >= self.after
+
+
+class TestEventStream:
+    def test_disconnect_stops_the_stream_without_saving(self, fake_db):
+        gateway, fake = make_gateway(FakeProvider(responses=["a b c d e"]))
+        saved = []
+
+        async def save(result):
+            saved.append(result)
+            return {}
+
+        async def scenario():
+            stream = gateway.stream("tms_chat", "hi")
+            events = [e async for e in chat_event_stream(stream, DisconnectingRequest(after=2), save)]
+            await asyncio.sleep(0)
+            return events
+
+        events = run(scenario)
+        assert len(events) == 2
+        assert saved == []
+        assert fake.aborted == 1
+        assert fake_db.llm_calls.docs[0]["status"] == "cancelled"
+
+
+async def no_records(query, user, departments):
+    return []
+
+
+class TestRoutes:
+    def test_tms_chat_stream_saves_the_reply(self, fake_db, monkeypatch):
+        from routes import tms_chat_routes
+
+        gateway, fake = make_gateway(FakeProvider(responses=["Check the reefer temp"]))
+        monkeypatch.setattr(tms_chat_routes, "llm", gateway)
+        monkeypatch.setattr(tms_chat_routes, "db", fake_db)
+        monkeypatch.setattr(tms_chat_routes, "relevant_records", no_records)
+        monkeypatch.setattr(chat_memory, "db", fake_db)
+        monkeypatch.setattr(chat_memory, "llm", gateway)
+        fake_db.tms_chat_history.docs.append({
+            "user_id": "disp-1", "session_id": "tms-chat-disp-1-dispatch", "user_message": "hi",
+            "assistant_response": "hello", "timestamp": "2026-01-01T00:00:00"
+        })
+
+        app = FastAPI()
+        app.include_router(tms_chat_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="disp-1", role=UserRole.DISPATCHER, fleet_owner_id="fleet-1")
+        client = TestClient(app)
+
+        response = client.post("/tms-chat/message/stream", json={"message": "Load 7 is warm", "context": "dispatch"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = sse_events(response.text)
+        assert "".join(data["text"] for event, data in events if event == "token") == "Check the reefer temp"
+        event, done = events[-1]
+        assert event == "done" and done["response"] == "Check the reefer temp"
+
+        saved = fake_db.tms_chat_history.docs[-1]
+        assert saved["id"] == done["message_id"]
+        assert saved["assistant_response"] == "Check the reefer temp"
+        assert fake.calls[0].history == [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        assert fake_db.llm_calls.docs[0]["tenant_id"] == "fleet-1"
+
+        assert client.post("/tms-chat/message/stream", json={"message": "x", "context": "accounting"}).status_code == 403
+
+    def test_driver_stream_reports_errors_as_events(self, fake_db, monkeypatch):
+        from routes import driver_ai_routes
+
+        gateway, fake = make_gateway(FakeProvider(responses=["Pickup at 9am"]))
+        fake.failures = [LLMError("invalid api key", status_code=500)]
+
+        async def no_loads(driver_user_id):
+            return "You have no loads currently assigned."
+
+        monkeypatch.setattr(driver_ai_routes, "llm", gateway)
+        monkeypatch.setattr(driver_ai_routes, "db", fake_db)
+        monkeypatch.setattr(driver_ai_routes, "driver_context", no_loads)
+
+        app = FastAPI()
+        app.include_router(driver_ai_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="driver-1", role=UserRole.DRIVER, fleet_owner_id="fleet-1")
+        client = TestClient(app)
+
+        failed = sse_events(client.post("/driver-mobile/ai/chat/stream", json={"message": "When is pickup?"}).text)
+        assert failed == [("error", {"status_code": 500, "detail": "AI service error: invalid api key"})]
+        assert fake_db.driver_ai_chats.docs == []
+
+        events = sse_events(client.post("/driver-mobile/ai/chat/stream", json={"message": "When is pickup?"}).text)
+        assert events[-1][0] == "done"
+        assert fake_db.driver_ai_chats.docs[0]["assistant_response"] == "Pickup at 9am"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
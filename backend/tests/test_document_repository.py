@@ -0,0 +1,155 @@
+"""
+Document Repository Tests
+List and lookup paths must never pull file payloads out of Mongo or the blob store
+"""
+import asyncio
+import base64
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import document_repository
+from auth import get_current_user
+from document_repository import LoadDocumentRepository, ReceiptImageRepository, LoadDocument
+from models import User, UserRole
+from conftest import FakeCollection, FakeDB
+
+PAYLOAD = b"%PDF-1.4 pretend this is a 20MB scan"
+
+
+class PayloadCollection(FakeCollection):
+    """Counts every document handed back with a payload field in it"""
+
+    def __init__(self, docs=None, payload_fields=()):
+        super().__init__(docs)
+        self.payload_fields = set(payload_fields)
+        self.payload_reads = 0
+
+    def project(self, doc, projection):
+        result = super().project(doc, projection)
+        if self.payload_fields & result.keys():
+            self.payload_reads += 1
+        return result
+
+
+class ExplodingBlobStore:
+    """Any read of file content fails the test"""
+
+    async def size(self, sha256):
+        return len(PAYLOAD)
+
+    def open(self, sha256, start=0, length=None):
+        raise AssertionError("blob bytes were read")
+
+
+def legacy_and_blob_documents():
+    return [
+        {"id": "doc-legacy", "load_id": "load-1", "doc_type": "bol", "filename": "bol.pdf",
+         "content_type": "application/pdf", "file_data": base64.b64encode(PAYLOAD).decode()},
+        {"id": "doc-blob", "load_id": "load-1", "doc_type": "pod", "filename": "pod.jpg",
+         "content_type": "image/jpeg", "blob_sha256": "a" * 64, "thumbnail_sha256": "b" * 64},
+    ]
+
+
+class TestRepositoryProjection:
+    """Projections built by the repository"""
+
+    def test_default_projection_excludes_payload(self):
+        repo = LoadDocumentRepository(FakeCollection())
+        assert repo.projection() == {"file_data": 0, "_id": 0}
+
+    def test_requested_fields_cannot_include_payload(self):
+        repo = ReceiptImageRepository(FakeCollection())
+        assert repo.projection(["image_base64", "content_type"]) == {"content_type": 1, "id": 1, "_id": 0}
+
+    def test_list_and_get_return_metadata_only(self):
+        collection = PayloadCollection(legacy_and_blob_documents(), payload_fields=["file_data"])
+        repo = LoadDocumentRepository(collection)
+
+        async def scenario():
+            listed = await repo.list_for_load("load-1")
+            fetched = await repo.get("doc-legacy")
+            return listed, fetched
+
+        listed, fetched = asyncio.run(scenario())
+        assert [d.id for d in listed] == ["doc-legacy", "doc-blob"]
+        assert all(isinstance(d, LoadDocument) for d in listed)
+        assert "file_data" not in fetched.dict()
+        assert collection.payload_reads == 0
+
+    def test_open_stream_reads_legacy_payload_explicitly(self):
+        collection = PayloadCollection(legacy_and_blob_documents(), payload_fields=["file_data"])
+        repo = LoadDocumentRepository(collection)
+
+        async def scenario():
+            doc = await repo.get("doc-legacy")
+            return b"".join([chunk async for chunk in repo.open_stream(doc)])
+
+        assert asyncio.run(scenario()) == PAYLOAD
+        assert collection.payload_reads == 1
+
+
+@pytest.fixture
+def app_client(monkeypatch):
+    import driver_assignments
+    from routes import driver_mobile_routes, driver_routes
+
+    collection = PayloadCollection(legacy_and_blob_documents(), payload_fields=["file_data"])
+    monkeypatch.setattr(document_repository.load_documents, "collection", collection)
+    monkeypatch.setattr(document_repository, "blob_store", ExplodingBlobStore())
+
+    # Route-level lookups (load assignment checks) hit this fake database
+    fake_db = FakeDB(driver_assignments=[{"driver_user_id": "driver-1", "load_id": "load-1", "load_ids": ["load-1"]}])
+    monkeypatch.setattr(driver_mobile_routes, "db", fake_db)
+    monkeypatch.setattr(driver_assignments, "db", fake_db)
+
+    app = FastAPI()
+    app.include_router(driver_mobile_routes.router)
+    app.include_router(driver_routes.router)
+    client = TestClient(app)
+    client.collection = collection
+
+    def login(role, user_id):
+        app.dependency_overrides[get_current_user] = lambda: User(
+            id=user_id, email="user@example.com", full_name="Test User", phone="555", role=role
+        )
+    client.login = login
+    return client
+
+
+class TestListEndpointsNeverReadBlobs:
+    """Every document list/metadata endpoint stays metadata-only"""
+
+    @pytest.mark.parametrize("role,user_id,path", [
+        (UserRole.DRIVER, "driver-1", "/driver-mobile/loads/load-1/documents"),
+        (UserRole.DRIVER, "driver-1", "/driver-mobile/documents/doc-legacy"),
+        (UserRole.DRIVER, "driver-1", "/driver-mobile/documents/doc-blob"),
+        (UserRole.FLEET_OWNER, "owner-1", "/drivers/loads/load-1/documents"),
+        (UserRole.FLEET_OWNER, "owner-1", "/drivers/documents/doc-legacy"),
+        (UserRole.FLEET_OWNER, "owner-1", "/drivers/documents/doc-blob"),
+    ])
+    def test_no_payload_read(self, app_client, role, user_id, path):
+        app_client.login(role, user_id)
+        response = app_client.get(path)
+        assert response.status_code == 200
+        assert "file_data" not in response.text
+        assert app_client.collection.payload_reads == 0
+
+    def test_list_returns_urls(self, app_client):
+        app_client.login(UserRole.DRIVER, "driver-1")
+        documents = app_client.get("/driver-mobile/loads/load-1/documents").json()
+        by_id = {d["id"]: d for d in documents}
+        assert by_id["doc-blob"]["thumbnail_url"] == "/api/driver-mobile/documents/doc-blob/thumbnail"
+        assert by_id["doc-legacy"]["thumbnail_url"] is None
+        assert by_id["doc-legacy"]["download_url"] == "/api/driver-mobile/documents/doc-legacy/download"
+
+    def test_include_data_is_the_explicit_opt_in(self, app_client):
+        app_client.login(UserRole.FLEET_OWNER, "owner-1")
+        response = app_client.get("/drivers/documents/doc-legacy", params={"include_data": True})
+        assert base64.b64decode(response.json()["file_data"]) == PAYLOAD
+        assert app_client.collection.payload_reads == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
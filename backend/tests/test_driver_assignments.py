@@ -0,0 +1,234 @@
+"""
+Driver Assignments View Tests
+Pushed loads, loads and bookings all materialize into one driver_assignments document per driver/load
+"""
+import asyncio
+
+import pytest
+
+import driver_assignments
+import driver_context
+import geofence
+import load_accounting
+from driver_assignments import (
+    refresh_assignments, list_driver_loads, get_assignment, assigned_load_ids,
+    update_assigned_load, rebuild_assignments, split_location
+)
+from conftest import FakeDB
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDB(
+        users=[
+            {"id": "user-1", "email": "dana@example.com", "role": "driver"},
+            {"id": "user-2", "email": "lee@example.com", "role": "driver"}
+        ],
+        # Drivers records link to users by user_id, or only by email for older records
+        drivers=[
+            {"id": "drv-1", "user_id": "user-1", "email": "dana@example.com"},
+            {"id": "drv-2", "email": "lee@example.com"}
+        ],
+        bookings=[
+            {"id": "bk-1", "order_number": "ORD-1", "pickup_location": "Dallas, TX", "delivery_location": "Tulsa, OK",
+             "pickup_lat": 32.78, "pickup_lng": -96.8, "status": "pending", "created_at": "2026-01-01T00:00:00+00:00"},
+            {"id": "bk-2", "order_number": "ORD-2", "pickup_location": "Austin, TX", "delivery_location": "Waco, TX",
+             "driver_id": "user-1", "status": "assigned", "created_at": "2026-01-02T00:00:00+00:00"}
+        ],
+        loads=[
+            {"id": "ld-1", "assigned_driver_id": "user-2", "pickup_city": "Reno", "status": "assigned", "created_at": "2026-01-03T00:00:00+00:00"}
+        ]
+    )
+    monkeypatch.setattr(driver_assignments, "db", db)
+    monkeypatch.setattr(driver_context, "db", db)
+    monkeypatch.setattr(geofence, "db", db)
+    monkeypatch.setattr(load_accounting, "db", db)
+    return db
+
+
+def push(db, booking_id, driver_id, driver_user_id=None, load_id="dl-1"):
+    """What push-to-driver writes"""
+    db.bookings.docs[[b["id"] for b in db.bookings.docs].index(booking_id)]["assigned_driver_id"] = driver_id
+    db.driver_loads.docs.append({
+        "id": load_id, "booking_id": booking_id, "driver_id": driver_id, "driver_user_id": driver_user_id,
+        "order_number": "ORD-1", "pickup_location": "Dallas, TX", "delivery_location": "Tulsa, OK",
+        "status": "assigned", "assigned_at": "2026-01-05T00:00:00+00:00"
+    })
+    return refresh_assignments("bookings", booking_id)
+
+
+class TestSplitLocation:
+    def test_city_and_state(self):
+        assert split_location("Dallas, TX") == ("Dallas", "TX")
+
+    def test_missing(self):
+        assert split_location(None) == ("", "")
+
+
+class TestSync:
+    def test_booking_assigned_by_user_id(self, fake_db):
+        async def scenario():
+            await refresh_assignments("bookings", "bk-2")
+            return await list_driver_loads("user-1")
+
+        loads = asyncio.run(scenario())
+        assert [l["id"] for l in loads] == ["bk-2"]
+        assert loads[0]["pickup_city"] == "Austin"
+        assert loads[0]["delivery_state"] == "TX"
+
+    def test_push_and_booking_are_one_assignment(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            return await list_driver_loads("user-1")
+
+        loads = asyncio.run(scenario())
+        assert len(loads) == 1
+        # Pushed record wins, layered over its booking so coordinates come along
+        assert loads[0]["id"] == "dl-1"
+        assert loads[0]["booking_id"] == "bk-1"
+        assert loads[0]["pickup_lat"] == 32.78
+        assert len(fake_db.driver_assignments.docs) == 1
+
+    def test_drivers_record_without_user_id_resolves_by_email(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-2")
+            return await list_driver_loads("user-2")
+
+        assert [l["id"] for l in asyncio.run(scenario())] == ["dl-1"]
+
+    def test_lookup_by_pushed_or_booking_id(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            return (
+                await get_assignment("user-1", "dl-1"),
+                await get_assignment("user-1", "bk-1"),
+                await get_assignment("user-2", "bk-1"),
+                await assigned_load_ids("user-1")
+            )
+
+        by_push, by_booking, other_driver, load_ids = asyncio.run(scenario())
+        assert by_push["load_id"] == by_booking["load_id"] == "dl-1"
+        assert other_driver is None
+        assert set(load_ids) == {"dl-1", "bk-1"}
+
+    def test_reassignment_drops_previous_driver(self, fake_db):
+        async def scenario():
+            await refresh_assignments("bookings", "bk-2")
+            fake_db.bookings.docs[1]["driver_id"] = "user-2"
+            await refresh_assignments("bookings", "bk-2")
+            return await list_driver_loads("user-1"), await list_driver_loads("user-2")
+
+        first, second = asyncio.run(scenario())
+        assert first == []
+        assert [l["id"] for l in second] == ["bk-2"]
+
+    def test_booking_changes_reach_pushed_snapshot(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            fake_db.bookings.docs[0]["delivery_lat"] = 36.15
+            await refresh_assignments("bookings", "bk-1")
+            return await list_driver_loads("user-1")
+
+        assert asyncio.run(scenario())[0]["delivery_lat"] == 36.15
+
+    def test_newest_assignment_first(self, fake_db):
+        async def scenario():
+            fake_db.loads.docs[0]["assigned_driver_id"] = "user-1"
+            await rebuild_assignments()
+            return await list_driver_loads("user-1")
+
+        assert [l["id"] for l in asyncio.run(scenario())] == ["ld-1", "bk-2"]
+
+
+class TestDriverUpdates:
+    def test_status_update_writes_source_and_view(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            assignment = await get_assignment("user-1", "dl-1")
+            before = await update_assigned_load(assignment, {"status": "en_route_pickup"})
+            return before, await get_assignment("user-1", "dl-1")
+
+        before, after = asyncio.run(scenario())
+        assert before["status"] == "assigned"
+        assert after["status"] == "en_route_pickup"
+        assert fake_db.driver_loads.docs[0]["status"] == "en_route_pickup"
+        # Dispatch sees the progress on the booking, in its own vocabulary
+        assert fake_db.bookings.docs[0]["status"] == "in_transit_pickup"
+        assert before["booking"]["status"] == "pending"
+
+    def test_pushed_load_progress_reaches_the_booking(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            assignment = await get_assignment("user-1", "dl-1")
+            await update_assigned_load(assignment, {"status": "arrived_pickup", "actual_pickup_arrival": "t1"})
+            # Loaded has no booking status of its own - only the departure time goes across
+            await update_assigned_load(assignment, {"status": "loaded", "actual_pickup_departure": "t2"})
+            return await update_assigned_load(assignment, {"status": "delivered", "actual_delivery_time": "t3"})
+
+        delivered = asyncio.run(scenario())
+        booking = fake_db.bookings.docs[0]
+        assert booking["status"] == "delivered"
+        assert (booking["pickup_time_actual_in"], booking["pickup_time_actual_out"], booking["delivery_time_actual_out"]) == ("t1", "t2", "t3")
+        assert delivered["booking"]["status"] == "at_pickup"
+        # The booking-sourced view follows too
+        assert fake_db.driver_assignments.docs and all(
+            a["status"] == "delivered" for a in fake_db.driver_assignments.docs if a["load_id"] == "dl-1"
+        )
+
+    def test_bookings_need_no_write_through(self, fake_db):
+        async def scenario():
+            await refresh_assignments("bookings", "bk-2")
+            assignment = await get_assignment("user-1", "bk-2")
+            return await update_assigned_load(assignment, {"status": "en_route_pickup"})
+
+        assert asyncio.run(scenario())["booking"] is None
+        assert fake_db.bookings.docs[1]["status"] == "en_route_pickup"
+
+    def test_driver_delivery_invoices_the_dispatching_party_once(self, fake_db):
+        booking = {
+            "id": "bk-1", "order_number": "ORD-1", "requester_id": "broker-1", "equipment_owner_id": "fleet-1",
+            "dispatched_by": "broker-1", "customer_rate": 2400, "confirmed_rate": 1800, "assigned_carrier": "Haul Co"
+        }
+        assert load_accounting.billing_company(booking) == "broker-1"
+        assert load_accounting.billing_company({**booking, "dispatched_by": "staff-9"}) == "broker-1"
+
+        async def scenario():
+            first = await load_accounting.create_ar_ap_for_load(booking, "broker-1", "user-1")
+            second = await load_accounting.create_ar_ap_for_load(booking, "broker-1", "user-1")
+            return first, second
+
+        assert asyncio.run(scenario()) == ((True, True), (False, False))
+        ar, = fake_db.accounts_receivable.docs
+        assert (ar["company_id"], ar["created_by"], ar["amount"]) == ("broker-1", "user-1", 2400.0)
+        assert fake_db.accounts_payable.docs[0]["vendor_name"] == "Haul Co"
+
+    def test_conditional_update_misses(self, fake_db):
+        async def scenario():
+            await refresh_assignments("bookings", "bk-2")
+            assignment = await get_assignment("user-1", "bk-2")
+            return await update_assigned_load(assignment, {"status": "loaded"}, from_statuses=["arrived_pickup"])
+
+        assert asyncio.run(scenario()) is None
+
+    def test_rejected_load_leaves_the_view(self, fake_db):
+        async def scenario():
+            await refresh_assignments("bookings", "bk-2")
+            assignment = await get_assignment("user-1", "bk-2")
+            await update_assigned_load(assignment, {"status": "rejected", "assigned_driver_id": None})
+            return await list_driver_loads("user-1")
+
+        assert asyncio.run(scenario()) == []
+
+
+class TestGeofenceFences:
+    def test_fences_come_from_the_view(self, fake_db):
+        async def scenario():
+            await push(fake_db, "bk-1", "drv-1", "user-1")
+            return await geofence.load_driver_fences("user-1")
+
+        fences = asyncio.run(scenario())
+        assert [(f.collection, f.load_id, f.kind) for f in fences] == [("driver_loads", "dl-1", "pickup")]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
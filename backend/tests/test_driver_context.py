@@ -0,0 +1,122 @@
+"""
+Driver Context Tests
+The assistant's load context is read with a narrow projection, fits a token budget and is cached until assignments change
+"""
+import asyncio
+
+import pytest
+
+import driver_assignments
+import driver_context
+from driver_assignments import refresh_assignments
+from driver_context import CONTEXT_PROJECTION, driver_context as cached_context, invalidate_driver_context, render_driver_context
+from llm_gateway import estimate_tokens
+from conftest import FakeCollection, FakeDB
+
+
+def load(number, status="assigned", **fields):
+    return {
+        "id": f"load-{number:04d}-uuid", "order_number": f"ORD-{number}", "status": status,
+        "pickup_city": "Dallas", "pickup_state": "TX", "pickup_location": "100 Main St",
+        "delivery_city": "Tulsa", "delivery_state": "OK", "delivery_location": "9 Elm Ave",
+        "equipment_type": "reefer", "weight": 40000, "commodity": "Produce",
+        "pickup_time_planned": "2026-01-05T08:00:00", "delivery_time_planned": "2026-01-06T08:00:00",
+        "rate_confirmation_text": "x" * 5000, "documents": [{"id": "doc"}] * 20,
+        **fields
+    }
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDB(
+        users=[{"id": "user-1", "email": "dana@example.com", "role": "driver"}],
+        drivers=[{"id": "drv-1", "user_id": "user-1", "email": "dana@example.com"}],
+        driver_assignments=[
+            {"driver_user_id": "user-1", "key": "bk-1", "source": "bookings", "load_id": "bk-1",
+             "assigned_at": "2026-01-02", "load": load(1)},
+            {"driver_user_id": "user-1", "key": "bk-2", "source": "bookings", "load_id": "bk-2",
+             "assigned_at": "2026-01-01", "load": load(2, status="delivered")},
+        ],
+        bookings=[{"id": "bk-1", "order_number": "ORD-1", "driver_id": "user-1", "status": "in_transit_delivery"}],
+        driver_contexts=FakeCollection(unique="driver_user_id")
+    )
+    monkeypatch.setattr(driver_context, "db", db)
+    monkeypatch.setattr(driver_assignments, "db", db)
+    return db
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+class TestRendering:
+    def test_active_loads_in_full_and_finished_ones_in_a_line(self):
+        text = render_driver_context([load(1), load(2, status="delivered")])
+        assert "Load ORD-1:\n- Status: assigned" in text
+        assert "- Commodity: Produce" in text
+        assert "- Load ORD-2: delivered, Dallas, TX to Tulsa, OK" in text
+        assert "rate_confirmation_text" not in text and "xxxx" not in text
+
+    def test_long_histories_stay_within_the_budget(self):
+        loads = [load(i) for i in range(5)] + [load(100 + i, status="paid") for i in range(200)]
+        text = render_driver_context(loads, budget=600)
+        assert estimate_tokens(text) <= 600
+        assert text.count("- Status:") >= 1
+        assert "older loads not shown" in text
+
+    def test_no_loads(self):
+        assert render_driver_context([]) == "You have no loads currently assigned."
+
+
+class TestCache:
+    def test_rendered_once_and_projected(self, fake_db):
+        async def scenario():
+            first = await cached_context("user-1")
+            second = await cached_context("user-1")
+            return first, second
+
+        first, second = run(scenario)
+        assert first == second
+        assert fake_db.driver_assignments.projections == [CONTEXT_PROJECTION]
+
+    def test_assignment_changes_invalidate(self, fake_db):
+        async def scenario():
+            before = await cached_context("user-1")
+            fake_db.bookings.docs[0]["commodity"] = "Frozen fish"
+            await refresh_assignments("bookings", "bk-1")
+            after = await cached_context("user-1")
+            return before, after
+
+        before, after = run(scenario)
+        assert "Frozen fish" not in before
+        assert "Frozen fish" in after
+
+    def test_a_render_racing_an_invalidation_is_not_saved(self, fake_db):
+        original_find = fake_db.driver_assignments.find
+
+        def find_then_invalidate(query, projection=None):
+            cursor = original_find(query, projection)
+            # An assignment write lands between the read and the save
+            fake_db.driver_contexts.docs.append({"driver_user_id": "user-1", "version": 1, "context": None})
+            return cursor
+
+        fake_db.driver_assignments.find = find_then_invalidate
+
+        async def scenario():
+            await cached_context("user-1")
+            return await fake_db.driver_contexts.find_one({"driver_user_id": "user-1"})
+
+        assert run(scenario)["context"] is None
+
+    def test_invalidation_bumps_the_version(self, fake_db):
+        async def scenario():
+            await cached_context("user-1")
+            await invalidate_driver_context(["user-1", "user-1"])
+            return await fake_db.driver_contexts.find_one({"driver_user_id": "user-1"})
+
+        doc = run(scenario)
+        assert doc["version"] == 1 and doc["context"] is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
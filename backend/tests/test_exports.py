@@ -0,0 +1,127 @@
+"""
+Streaming Export Tests
+?format=ndjson|csv streams every matching row in bounded batches instead of materializing the list
+"""
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import get_current_user
+from exports import iter_documents, ndjson_chunks, csv_chunks
+from models import User, UserRole
+from conftest import FakeCollection, FakeDB
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def client_for(router, role=UserRole.PLATFORM_ADMIN):
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_user] = lambda: User(
+        id="admin-1", email="admin@example.com", full_name="Admin", phone="555", role=role
+    )
+    return TestClient(app)
+
+
+class TestChunking:
+    def test_ndjson_is_written_in_bounded_chunks(self):
+        collection = FakeCollection([{"_id": ObjectId(), "id": f"r{i}", "at": T0} for i in range(5)])
+
+        chunks = asyncio.run(collect(ndjson_chunks(iter_documents(collection, {}, batch_size=2), batch_size=2)))
+        assert len(chunks) == 3
+        rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+        assert [r["id"] for r in rows] == ["r0", "r1", "r2", "r3", "r4"]
+        assert rows[0] == {"id": "r0", "at": "2026-01-01T00:00:00Z"}
+        assert collection.cursors[0].batch == 2
+
+    def test_csv_has_one_header_and_flattens_nested_values(self):
+        docs = [{"id": "a", "tags": ["x", "y"], "note": None}, {"id": "b", "extra": "ignored"}]
+
+        async def stream():
+            for doc in docs:
+                yield doc
+
+        body = b"".join(asyncio.run(collect(csv_chunks(stream(), columns=["id", "tags", "note"], batch_size=1)))).decode()
+        rows = list(csv.reader(io.StringIO(body)))
+        assert rows == [["id", "tags", "note"], ["a", '["x","y"]', ""], ["b", "", ""]]
+
+    def test_empty_csv_still_has_a_header(self):
+        async def stream():
+            return
+            yield
+
+        body = b"".join(asyncio.run(collect(csv_chunks(stream(), columns=["id", "name"])))).decode()
+        assert body.strip() == "id,name"
+
+
+class TestExportEndpoints:
+    def test_crm_contacts_csv_export(self, monkeypatch):
+        from routes import crm_routes
+
+        fake_db = FakeDB(crm_contacts=[
+            {"_id": ObjectId(), "id": f"c{i}", "first_name": f"First{i}", "last_name": "Last", "email": f"c{i}@example.com"}
+            for i in range(3)
+        ])
+        monkeypatch.setattr(crm_routes, "db", fake_db)
+
+        response = client_for(crm_routes.router).get("/admin/crm/contacts", params={"format": "csv"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert 'filename="crm-contacts.csv"' in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [r["id"] for r in rows] == ["c0", "c1", "c2"]
+        assert rows[0]["first_name"] == "First0"
+
+    def test_unknown_format_is_rejected(self, monkeypatch):
+        from routes import crm_routes
+
+        monkeypatch.setattr(crm_routes, "db", FakeDB())
+        assert client_for(crm_routes.router).get("/admin/crm/contacts", params={"format": "xml"}).status_code == 422
+
+    def test_receivables_ndjson_is_scoped_to_the_company(self, monkeypatch):
+        from routes import accounting_routes
+
+        fake_db = FakeDB(accounts_receivable=[
+            {"id": "ar-1", "company_id": "admin-1", "invoice_number": "INV-1", "amount": 100.0, "created_at": "2026-01-02"},
+            {"id": "ar-2", "company_id": "other", "invoice_number": "INV-2", "amount": 50.0, "created_at": "2026-01-03"},
+            {"id": "ar-3", "company_id": "admin-1", "invoice_number": "INV-3", "amount": 75.0, "created_at": "2026-01-04"},
+        ])
+        monkeypatch.setattr(accounting_routes, "db", fake_db)
+
+        response = client_for(accounting_routes.router).get("/accounting/receivables", params={"format": "ndjson"})
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["id"] for r in rows] == ["ar-3", "ar-1"]
+
+    def test_all_drivers_export_skips_users_with_a_drivers_record(self, monkeypatch):
+        from routes import driver_routes
+
+        fake_db = FakeDB(
+            drivers=[{"_id": ObjectId(), "id": "d1", "email": "one@example.com", "full_name": "One"}],
+            users=[
+                {"_id": ObjectId(), "id": "u1", "email": "one@example.com", "role": UserRole.DRIVER, "full_name": "One"},
+                {"_id": ObjectId(), "id": "u2", "email": "two@example.com", "role": UserRole.DRIVER, "full_name": "Two",
+                 "password_hash": "secret"},
+            ]
+        )
+        monkeypatch.setattr(driver_routes, "db", fake_db)
+
+        response = client_for(driver_routes.router).get("/drivers/all", params={"format": "ndjson"})
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["id"] for r in rows] == ["d1", "u2"]
+        assert "password_hash" not in rows[1]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
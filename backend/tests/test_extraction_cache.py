@@ -0,0 +1,171 @@
+"""
+Extraction Cache Tests
+Identical documents are extracted once per prompt/model, concurrent uploads share one call, and failures aren't cached
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import extraction_cache
+import llm_gateway
+from auth import get_current_user
+from extraction_cache import HIT, JOINED, MISS, ExtractionCache, extraction_stats, prompt_version
+from llm_gateway import FakeProvider, LLMGateway
+from models import User, UserRole
+from conftest import FakeDB
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(extraction_cache, "db", db)
+    monkeypatch.setattr(llm_gateway, "db", db)
+    return db
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def counting_extract(calls, result=None, delay=0):
+    async def extract():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return dict(result or {"amount": 10})
+    return extract
+
+
+class TestCache:
+    def test_second_lookup_is_a_hit(self, fake_db):
+        cache = ExtractionCache()
+        calls = []
+
+        async def scenario():
+            first = await cache.get_or_extract("receipt_parse", b"receipt", "openai:gpt-4o", "v1", counting_extract(calls))
+            second = await cache.get_or_extract("receipt_parse", b"receipt", "openai:gpt-4o", "v1", counting_extract(calls))
+            return first, second
+
+        first, second = run(scenario)
+        assert first == ({"amount": 10}, MISS)
+        assert second == ({"amount": 10}, HIT)
+        assert len(calls) == 1
+        entry = fake_db.extraction_cache.docs[0]
+        assert entry["feature"] == "receipt_parse"
+        assert entry["expires_at"] > entry["created_at"]
+
+    def test_prompt_model_or_content_changes_miss(self, fake_db):
+        cache = ExtractionCache()
+        calls = []
+
+        async def scenario():
+            await cache.get_or_extract("receipt_parse", b"receipt", "openai:gpt-4o", prompt_version("old prompt"), counting_extract(calls))
+            await cache.get_or_extract("receipt_parse", b"receipt", "openai:gpt-4o", prompt_version("new prompt"), counting_extract(calls))
+            await cache.get_or_extract("receipt_parse", b"receipt", "openai:gpt-4o-mini", prompt_version("new prompt"), counting_extract(calls))
+            await cache.get_or_extract("receipt_parse", b"other receipt", "openai:gpt-4o-mini", prompt_version("new prompt"), counting_extract(calls))
+
+        run(scenario)
+        assert len(calls) == 4
+        assert prompt_version("a", "b") != prompt_version("ab")
+
+    def test_concurrent_identical_uploads_share_one_extraction(self, fake_db):
+        cache = ExtractionCache()
+        calls = []
+
+        async def scenario():
+            return await asyncio.gather(*[
+                cache.get_or_extract("rate_confirmation", b"%PDF", "m", "v1", counting_extract(calls, delay=0.02))
+                for _ in range(5)
+            ])
+
+        results = run(scenario)
+        assert len(calls) == 1
+        assert sorted(status for _, status in results) == [JOINED] * 4 + [MISS]
+        # Waiters get their own copy to edit
+        assert len({id(result) for result, _ in results}) == 5
+        assert cache._in_flight == {}
+
+    def test_failures_reach_waiters_and_are_not_cached(self, fake_db):
+        cache = ExtractionCache()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise HTTPException(status_code=502, detail="AI service error")
+
+        async def scenario():
+            outcomes = await asyncio.gather(
+                *[cache.get_or_extract("receipt_parse", b"r", "m", "v1", failing) for _ in range(3)],
+                return_exceptions=True
+            )
+            retry = await cache.get_or_extract("receipt_parse", b"r", "m", "v1", counting_extract(calls))
+            return outcomes, retry
+
+        outcomes, retry = run(scenario)
+        assert all(isinstance(o, HTTPException) and o.status_code == 502 for o in outcomes)
+        assert retry == ({"amount": 10}, MISS)
+        assert len(calls) == 2
+
+
+class TestStats:
+    def test_hit_rate_per_feature(self, fake_db):
+        cache = ExtractionCache()
+        calls = []
+
+        async def scenario():
+            for _ in range(3):
+                await cache.get_or_extract("receipt_parse", b"r", "m", "v1", counting_extract(calls))
+            await cache.get_or_extract("rate_confirmation", b"pdf", "m", "v1", counting_extract(calls))
+            fake_db.extraction_cache_stats.docs.append({"feature": "receipt_parse", "day": "2000-01-01", "miss": 50})
+            return await extraction_stats(7)
+
+        stats = run(scenario)
+        assert stats["receipt_parse"] == {"hit": 2, "miss": 1, "joined": 0, "lookups": 3, "hit_rate": 0.6667}
+        assert stats["rate_confirmation"]["hit_rate"] == 0.0
+
+    def test_admin_route_is_platform_admin_only(self, fake_db):
+        from routes import admin_routes
+
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        fake_db.extraction_cache_stats.docs.append({"feature": "receipt_parse", "day": today, "hit": 3, "miss": 1})
+        app = FastAPI()
+        app.include_router(admin_routes.router)
+        user = {"role": UserRole.PLATFORM_ADMIN}
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="admin-1", **user)
+        client = TestClient(app)
+
+        body = client.get("/admin/ai/extraction-cache").json()
+        assert body["features"]["receipt_parse"]["hit_rate"] == 0.75
+        user["role"] = UserRole.DISPATCHER
+        assert client.get("/admin/ai/extraction-cache").status_code == 403
+
+
+class TestRoutes:
+    def test_repeat_rate_confirmation_upload_skips_the_model(self, fake_db, monkeypatch):
+        from routes import booking_routes
+
+        fake = FakeProvider(responses=['```json\n{"shipper_name": "Acme", "confirmed_rate": 2400}\n```'])
+        gateway = LLMGateway(providers={"fake": fake}, provider_override="fake")
+        monkeypatch.setattr(booking_routes, "llm", gateway)
+        monkeypatch.setattr(booking_routes, "extractions", ExtractionCache())
+
+        app = FastAPI()
+        app.include_router(booking_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="fleet-1", role=UserRole.FLEET_OWNER, fleet_owner_id=None)
+        client = TestClient(app)
+
+        upload = {"file": ("rc.pdf", b"%PDF-1.4 rate con", "application/pdf")}
+        first = client.post("/bookings/parse-rate-confirmation", files=upload).json()
+        second = client.post("/bookings/parse-rate-confirmation", files=upload).json()
+
+        assert first["data"]["shipper_name"] == "Acme" and first["cached"] is False
+        assert second["data"] == first["data"] and second["cached"] is True
+        assert len(fake.calls) == 1
+        assert fake_db.extraction_cache.docs[0]["model"] == "fake:gemini/gemini-2.0-flash"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
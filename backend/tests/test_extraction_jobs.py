@@ -0,0 +1,222 @@
+"""
+Batch Extraction Job Tests
+Uploads return a job immediately; files are processed by a bounded worker pool and results saved as they finish
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import extraction_cache
+import extraction_jobs
+import job_runner
+import llm_gateway
+from auth import get_current_user
+from blob_store import LocalBlobStore
+from extraction_jobs import JOB_RECEIPTS, create_extraction_job, run_extraction_job, store_batch
+from job_runner import INTERRUPTED_ERROR, job_reaper
+from llm_gateway import FakeProvider, LLMGateway
+from models import User, UserRole
+from conftest import FakeDB
+
+class Upload:
+    """Just enough of UploadFile for upload_chunks"""
+
+    def __init__(self, filename, data, content_type="image/jpeg"):
+        self.filename, self.content_type, self.data = filename, content_type, data
+
+    async def read(self, size=-1):
+        chunk, self.data = (self.data, b"") if size < 0 else (self.data[:size], self.data[size:])
+        return chunk
+
+
+@pytest.fixture
+def fake_db(monkeypatch, tmp_path):
+    db = FakeDB()
+    for module in (extraction_jobs, extraction_cache, llm_gateway, job_runner):
+        monkeypatch.setattr(module, "db", db)
+    monkeypatch.setattr(extraction_jobs, "blob_store", LocalBlobStore(str(tmp_path)))
+    return db
+
+
+def files(count):
+    return [Upload(f"r{i}.jpg", f"receipt {i}".encode()) for i in range(count)]
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+class TestJobs:
+    def test_results_and_progress_are_saved_per_file(self, fake_db):
+        in_flight = {"now": 0, "max": 0}
+
+        async def process(upload):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            if upload.filename == "r3.jpg":
+                raise HTTPException(status_code=500, detail="Failed to parse AI response")
+            return {"vendor_name": upload.filename, "text": upload.data.decode()}
+
+        async def scenario():
+            stored = await store_batch(files(10))
+            job = await create_extraction_job("fleet-1", JOB_RECEIPTS, stored)
+            await run_extraction_job(job["id"], stored, process, concurrency=3)
+            return job
+
+        job = run(scenario)
+        assert in_flight["max"] == 3
+        stored = fake_db.extraction_jobs.docs[0]
+        assert stored["status"] == "completed"
+        assert stored["processed"] == 10
+        assert stored["counts"] == {"succeeded": 9, "failed": 1}
+
+        results = {r["position"]: r for r in fake_db.extraction_results.docs}
+        assert len(results) == 10 and all(r["job_id"] == job["id"] for r in results.values())
+        assert results[3]["status"] == "failed" and results[3]["error"] == "Failed to parse AI response"
+        assert results[0]["result"] == {"vendor_name": "r0.jpg", "text": "receipt 0"}
+        # The job only references the stored blobs
+        assert [f["content_type"] for f in stored["files"]] == ["image/jpeg"] * 10
+        assert all(set(f) == {"filename", "content_type", "sha256", "size"} for f in stored["files"])
+
+    def test_batches_are_validated_up_front(self, fake_db, monkeypatch):
+        monkeypatch.setattr(extraction_jobs, "EXTRACTION_JOB_MAX_FILES", 3)
+        with pytest.raises(HTTPException) as exc:
+            run(lambda: create_extraction_job("fleet-1", JOB_RECEIPTS, files(4)))
+        assert exc.value.status_code == 400
+        with pytest.raises(HTTPException):
+            run(lambda: create_extraction_job("fleet-1", JOB_RECEIPTS, []))
+        assert fake_db.extraction_jobs.docs == []
+
+    def test_oversized_files_are_rejected_while_streaming(self, fake_db, monkeypatch):
+        monkeypatch.setattr(extraction_jobs, "EXTRACTION_JOB_MAX_FILE_BYTES", 10)
+        store = extraction_jobs.blob_store
+        kept = run(lambda: store.put_bytes(b"already"))
+        batch = [Upload("small.jpg", b"ok"), Upload("again.jpg", b"already"), Upload("big.jpg", b"x" * 11)]
+        with pytest.raises(HTTPException) as exc:
+            run(lambda: store_batch(batch))
+        assert exc.value.status_code == 413 and "big.jpg" in exc.value.detail
+        # The batch's new blob is gone, content other records already had is not
+        assert run(lambda: store.exists(hashlib.sha256(b"ok").hexdigest())) is False
+        assert run(lambda: store.exists(kept.sha256)) is True
+
+    def test_known_sizes_are_checked_before_writing(self, fake_db, monkeypatch):
+        monkeypatch.setattr(extraction_jobs, "EXTRACTION_JOB_MAX_FILE_BYTES", 10)
+        small, big = Upload("small.jpg", b"ok"), Upload("big.jpg", b"x" * 11)
+        small.size, big.size = 2, 11
+        with pytest.raises(HTTPException) as exc:
+            run(lambda: store_batch([small, big]))
+        assert exc.value.status_code == 413 and "big.jpg" in exc.value.detail
+        assert small.data == b"ok"
+
+    def test_a_failing_handler_stops_the_other_workers(self, fake_db):
+        finished = []
+
+        async def handle(item):
+            if item == 0:
+                raise RuntimeError("boom")
+            await asyncio.sleep(0.05)
+            finished.append(item)
+            return {"status": "done"}
+
+        async def scenario():
+            job = await job_runner.create_job(fake_db.extraction_jobs, "fleet-1", 4, ["done"])
+            await job_runner.run_job(fake_db.extraction_jobs, fake_db.extraction_results, job["id"], list(range(4)), handle, 4)
+            # Nothing is still running to write results after the job was marked failed
+            await asyncio.sleep(0.1)
+            return job
+
+        job = run(scenario)
+        stored = fake_db.extraction_jobs.docs[0]
+        assert stored["id"] == job["id"] and stored["status"] == "failed" and stored["error"] == "boom"
+        assert finished == [] and fake_db.extraction_results.docs == []
+
+    def test_a_failed_heartbeat_is_logged_and_retried(self, fake_db, monkeypatch, caplog):
+        monkeypatch.setattr(job_runner, "JOB_HEARTBEAT_SECONDS", 0.01)
+        jobs = fake_db.extraction_jobs
+        update_one, beats = jobs.update_one, []
+
+        async def flaky_update_one(query, update, **kwargs):
+            if list(update["$set"]) == ["heartbeat_at"]:
+                beats.append(update)
+                if len(beats) == 1:
+                    raise ConnectionError("primary stepped down")
+            return await update_one(query, update, **kwargs)
+
+        monkeypatch.setattr(jobs, "update_one", flaky_update_one)
+
+        async def handle(item):
+            await asyncio.sleep(0.1)
+            return {"status": "done"}
+
+        async def scenario():
+            job = await job_runner.create_job(jobs, "fleet-1", 1, ["done"])
+            await job_runner.run_job(jobs, fake_db.extraction_results, job["id"], [1], handle, 1)
+
+        run(scenario)
+        assert len(beats) >= 2 and jobs.docs[0]["status"] == "completed"
+        assert "primary stepped down" in caplog.text
+
+    def test_jobs_stranded_by_a_restart_are_failed(self, fake_db):
+        async def scenario():
+            stored = await store_batch(files(2))
+            stranded = await create_extraction_job("fleet-1", JOB_RECEIPTS, stored)
+            live = await create_extraction_job("fleet-1", JOB_RECEIPTS, stored)
+            done = await create_extraction_job("fleet-1", JOB_RECEIPTS, stored)
+            old = datetime.now(timezone.utc) - timedelta(seconds=job_runner.JOB_STALE_SECONDS + 1)
+            await fake_db.extraction_jobs.update_one({"id": stranded["id"]}, {"$set": {"status": "running", "heartbeat_at": old}})
+            await fake_db.extraction_jobs.update_one({"id": done["id"]}, {"$set": {"status": "completed", "heartbeat_at": old}})
+            return await job_reaper.run_once(), stranded, live, done
+
+        failed, stranded, live, done = run(scenario)
+        statuses = {d["id"]: d for d in fake_db.extraction_jobs.docs}
+        assert failed == 1
+        assert statuses[stranded["id"]]["status"] == "failed" and statuses[stranded["id"]]["error"] == INTERRUPTED_ERROR
+        assert statuses[live["id"]]["status"] == "queued"
+        assert statuses[done["id"]]["status"] == "completed"
+
+
+class TestRoutes:
+    def test_rate_confirmation_batch(self, fake_db, monkeypatch):
+        from routes import booking_routes, extraction_job_routes
+
+        fake = FakeProvider(handler=lambda request: '{"shipper_name": "%s"}' % request.attachments[0].filename)
+        monkeypatch.setattr(booking_routes, "llm", LLMGateway(providers={"fake": fake}, provider_override="fake"))
+        monkeypatch.setattr(booking_routes, "extractions", extraction_cache.ExtractionCache())
+        monkeypatch.setattr(extraction_job_routes, "db", fake_db)
+
+        app = FastAPI()
+        app.include_router(booking_routes.router)
+        app.include_router(extraction_job_routes.router)
+        user = {"id": "fleet-1"}
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(role=UserRole.FLEET_OWNER, fleet_owner_id=None, **user)
+        client = TestClient(app)
+
+        uploads = [("files", (f"rc{i}.pdf", f"%PDF {i}".encode(), "application/pdf")) for i in range(5)]
+        created = client.post("/bookings/parse-rate-confirmation/batch", files=uploads).json()
+        assert created["total"] == 5
+
+        job = client.get(f"/extraction-jobs/{created['job_id']}").json()
+        assert job["status"] == "completed"
+        assert job["counts"] == {"succeeded": 5, "failed": 0}
+
+        results = client.get(f"/extraction-jobs/{created['job_id']}/results", params={"limit": 2})
+        assert [r["position"] for r in results.json()] == [0, 1]
+        assert results.json()[1]["result"]["data"] == {"shipper_name": "rc1.pdf"}
+        assert "X-Next-Cursor" in results.headers
+        assert [j["id"] for j in client.get("/extraction-jobs").json()] == [created["job_id"]]
+
+        bad = client.post("/bookings/parse-rate-confirmation/batch", files=[("files", ("notes.txt", b"hi", "text/plain"))])
+        assert bad.status_code == 400
+
+        user["id"] = "someone-else"
+        assert client.get(f"/extraction-jobs/{created['job_id']}").status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
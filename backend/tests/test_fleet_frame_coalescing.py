@@ -0,0 +1,114 @@
+"""
+Fleet Frame Coalescing Tests
+Coalescing dashboards get one batched frame per interval with the latest position per vehicle
+"""
+import asyncio
+
+import pytest
+
+from backplane import InMemoryBackplane
+from websocket_manager import ConnectionManager, LocationFrameCoalescer, MIN_FRAME_INTERVAL_MS
+from conftest import FakeWebSocket
+
+
+class TestLocationFrameCoalescer:
+    """Frame building without the background flush loop"""
+
+    def test_latest_position_per_vehicle_wins(self):
+        coalescer = LocationFrameCoalescer()
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.0, "longitude": 1.0})
+        coalescer.offer({"vehicle_id": "truck-2", "latitude": 5.0, "longitude": 5.0})
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 2.0, "longitude": 2.0})
+
+        frame = coalescer.build_frame()
+        assert sorted(frame, key=lambda u: u["vehicle_id"]) == [
+            {"vehicle_id": "truck-1", "latitude": 2.0, "longitude": 2.0},
+            {"vehicle_id": "truck-2", "latitude": 5.0, "longitude": 5.0},
+        ]
+        assert coalescer.build_frame() == []
+
+    def test_delta_sends_only_changed_fields(self):
+        coalescer = LocationFrameCoalescer(delta=True)
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.0, "longitude": 1.0, "speed": 20})
+        assert coalescer.build_frame() == [{"vehicle_id": "truck-1", "latitude": 1.0, "longitude": 1.0, "speed": 20}]
+
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.5, "longitude": 1.0, "speed": 20})
+        assert coalescer.build_frame() == [{"vehicle_id": "truck-1", "latitude": 1.5}]
+
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.5, "longitude": 1.0, "speed": 20})
+        assert coalescer.build_frame() == []
+
+    def test_delta_nulls_removed_fields(self):
+        coalescer = LocationFrameCoalescer(delta=True)
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.0, "load_id": "load-1"})
+        coalescer.build_frame()
+
+        coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.0})
+        assert coalescer.build_frame() == [{"vehicle_id": "truck-1", "load_id": None}]
+
+    def test_joining_dashboard_alone_gets_the_snapshot(self):
+        async def scenario():
+            coalescer = LocationFrameCoalescer(delta=True)
+            watching, joining = FakeWebSocket(), FakeWebSocket()
+            await coalescer.add(watching)
+            coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.0, "longitude": 1.0})
+            await coalescer.flush()
+
+            await coalescer.add(joining)
+            coalescer.offer({"vehicle_id": "truck-1", "latitude": 1.5, "longitude": 1.0})
+            await coalescer.flush()
+            coalescer.remove(watching)
+            coalescer.remove(joining)
+            return watching, joining
+
+        watching, joining = asyncio.run(scenario())
+        full = {"type": "location_batch", "payload": [{"vehicle_id": "truck-1", "latitude": 1.0, "longitude": 1.0}]}
+        delta = {"type": "location_batch", "payload": [{"latitude": 1.5, "vehicle_id": "truck-1"}]}
+        assert watching.sent == [full, delta]
+        assert joining.sent == [full, delta]
+
+    def test_updates_without_vehicle_id_are_ignored(self):
+        coalescer = LocationFrameCoalescer()
+        coalescer.offer({"latitude": 1.0})
+        assert coalescer.build_frame() == []
+
+
+class TestCoalescedFleetSocket:
+    """End-to-end through ConnectionManager with an in-process backplane"""
+
+    def test_burst_becomes_one_msgpack_frame(self):
+        async def scenario():
+            manager = ConnectionManager(InMemoryBackplane())
+            await manager.start()
+            immediate = FakeWebSocket()
+            coalesced = FakeWebSocket()
+            await manager.connect_fleet(immediate, "fleet-1")
+            await manager.connect_fleet(coalesced, "fleet-1", coalesce_interval_ms=MIN_FRAME_INTERVAL_MS, encoding="msgpack")
+
+            for i in range(20):
+                await manager.broadcast_location_update({"vehicle_id": "truck-1", "latitude": float(i)}, "fleet-1")
+            await asyncio.sleep(MIN_FRAME_INTERVAL_MS / 1000 * 3)
+            manager.disconnect_fleet(coalesced)
+            return immediate, coalesced, manager
+
+        immediate, coalesced, manager = asyncio.run(scenario())
+        assert len(immediate.sent) == 20
+        assert coalesced.binary == [{"type": "location_batch", "payload": [{"vehicle_id": "truck-1", "latitude": 19.0}]}]
+        assert manager.coalescers == {}
+
+    def test_status_updates_are_not_delayed(self):
+        async def scenario():
+            manager = ConnectionManager(InMemoryBackplane())
+            await manager.start()
+            coalesced = FakeWebSocket()
+            await manager.connect_fleet(coalesced, "fleet-1", coalesce_interval_ms=1000)
+            await manager.broadcast_status_update({"vehicle_id": "truck-1", "status": "idle"}, "fleet-1")
+            manager.disconnect_fleet(coalesced)
+            return coalesced
+
+        coalesced = asyncio.run(scenario())
+        assert coalesced.sent == [{"type": "status_update", "payload": {"vehicle_id": "truck-1", "status": "idle"}}]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,188 @@
+"""
+FMCSA Client Tests
+Carrier lookups share one pooled client and are cached in memory and Mongo, against a stand-in FMCSA server
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import fmcsa_client
+from auth import get_current_user
+from fmcsa_client import FMCSAClient, RateLimiter
+from fmcsa_stub import API_KEY
+from models import User, UserRole
+from conftest import FakeDB
+
+
+@pytest.fixture
+def cache_db(monkeypatch):
+    fake_db = FakeDB()
+    monkeypatch.setattr(fmcsa_client, "db", fake_db)
+    return fake_db
+
+
+def make_client(server):
+    return FMCSAClient(base_url="http://fmcsa.test", api_key=API_KEY, transport=server.transport())
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+class TestCarrierCache:
+    def test_repeat_lookups_hit_fmcsa_once(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567", legal_name="Lone Star Hauling")
+
+        async def scenario():
+            client = make_client(fmcsa_server)
+            first = await client.carrier_by_dot("1234567")
+            second = await client.carrier_by_dot("1234567")
+            await client.close()
+            return first, second
+
+        first, second = run(scenario)
+        assert first["content"]["carrier"]["legalName"] == "Lone Star Hauling"
+        assert second == first
+        assert fmcsa_server.requests["/carriers/1234567"] == 1
+
+    def test_mongo_cache_is_shared_across_workers(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567")
+
+        async def scenario():
+            # Two clients stand in for two workers - separate LRUs, one cache collection
+            for client in [make_client(fmcsa_server), make_client(fmcsa_server)]:
+                await client.carrier_by_dot("1234567")
+                await client.close()
+
+        run(scenario)
+        assert fmcsa_server.requests["/carriers/1234567"] == 1
+
+    def test_not_found_is_cached_briefly(self, fmcsa_server, cache_db):
+        async def scenario():
+            client = make_client(fmcsa_server)
+            results = [await client.carrier_by_dot("999"), await client.carrier_by_dot("999")]
+            await client.close()
+            return results
+
+        assert run(scenario) == [None, None]
+        assert fmcsa_server.requests["/carriers/999"] == 1
+        entry = cache_db.fmcsa_cache.docs[0]
+        assert entry["status"] == "not_found"
+        assert entry["expires_at"] - entry["fetched_at"] == timedelta(seconds=fmcsa_client.FMCSA_NEGATIVE_TTL_SECONDS)
+
+    def test_stale_entry_is_served_while_it_refreshes(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567", legal_name="Old Name LLC")
+
+        async def scenario():
+            client = make_client(fmcsa_server)
+            await client.carrier_by_dot("1234567")
+            fmcsa_server.add_carrier("1234567", legal_name="New Name LLC")
+            client.cache.entries["dot:1234567"].fresh_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+            stale = await client.carrier_by_dot("1234567")
+            await asyncio.gather(*client._refreshes.values())
+            fresh = await client.carrier_by_dot("1234567")
+            await client.close()
+            return stale, fresh
+
+        stale, fresh = run(scenario)
+        assert stale["content"]["carrier"]["legalName"] == "Old Name LLC"
+        assert fresh["content"]["carrier"]["legalName"] == "New Name LLC"
+        assert fmcsa_server.requests["/carriers/1234567"] == 2
+
+    def test_failed_refresh_keeps_the_stale_copy(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567", legal_name="Lone Star Hauling")
+
+        async def scenario():
+            client = make_client(fmcsa_server)
+            await client.carrier_by_dot("1234567")
+            client.cache.entries["dot:1234567"].fresh_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+            fmcsa_server.fail_with = 503
+
+            stale = await client.carrier_by_dot("1234567")
+            await asyncio.gather(*client._refreshes.values())
+            again = await client.carrier_by_dot("1234567")
+            await client.close()
+            return stale, again
+
+        stale, again = run(scenario)
+        assert stale["content"]["carrier"]["legalName"] == "Lone Star Hauling"
+        assert again == stale
+
+    def test_concurrent_lookups_share_one_request(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567")
+        fmcsa_server.delay = 0.05
+
+        async def scenario():
+            client = make_client(fmcsa_server)
+            results = await asyncio.gather(*[client.carrier_by_dot("1234567") for _ in range(5)])
+            await client.close()
+            return results
+
+        results = run(scenario)
+        assert len(results) == 5 and all(r == results[0] for r in results)
+        assert fmcsa_server.requests["/carriers/1234567"] == 1
+
+    def test_errors_are_not_cached(self, fmcsa_server, cache_db):
+        fmcsa_server.add_carrier("1234567")
+        fmcsa_server.fail_with = 401
+
+        async def scenario():
+            client = make_client(fmcsa_server)
+            with pytest.raises(HTTPException) as exc:
+                await client.carrier_by_dot("1234567")
+            fmcsa_server.fail_with = None
+            carrier = await client.carrier_by_dot("1234567")
+            await client.close()
+            return exc.value.status_code, carrier
+
+        status, carrier = run(scenario)
+        assert status == 401
+        assert carrier is not None
+        assert fmcsa_server.requests["/carriers/1234567"] == 2
+
+
+class TestRateLimiter:
+    def test_bursts_then_paces(self):
+        async def scenario():
+            limiter = RateLimiter(rate=50, burst=5)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await asyncio.gather(*[limiter.acquire() for _ in range(5)])
+            burst = loop.time() - start
+            await asyncio.gather(*[limiter.acquire() for _ in range(5)])
+            return burst, loop.time() - start
+
+        burst, total = run(scenario)
+        assert burst < 0.05
+        # Five more tokens at 50/s take ~0.1s to refill
+        assert total >= 0.09
+
+
+class TestRoutes:
+    def test_dot_lookup_route_uses_the_shared_client(self, fmcsa_server, cache_db, monkeypatch):
+        from routes import fmcsa_routes
+
+        fmcsa_server.add_carrier("1234567", mc_number="765432", legal_name="Lone Star Hauling")
+        monkeypatch.setattr(fmcsa_routes, "fmcsa", make_client(fmcsa_server))
+
+        app = FastAPI()
+        app.include_router(fmcsa_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="user-1", role=UserRole.FLEET_OWNER)
+        client = TestClient(app)
+
+        for _ in range(3):
+            response = client.get("/fmcsa/carrier/dot/1234567")
+            assert response.json()["carrier"]["legal_name"] == "Lone Star Hauling"
+        assert fmcsa_server.requests["/carriers/1234567"] == 1
+
+        assert client.get("/fmcsa/carrier/dot/42").status_code == 404
+        search = client.get("/fmcsa/carrier/search", params={"name": "lone star"}).json()
+        assert search["total"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
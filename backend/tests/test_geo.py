@@ -0,0 +1,217 @@
+"""
+Geo Helper Tests
+GeoJSON points and bounding boxes used by the fleet snapshot and proximity queries
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import get_current_user
+from geo import METERS_PER_MILE, bbox_polygon, coarse_point, geo_near_stage, geo_point, haversine_miles, parse_bbox
+from models import User, UserRole
+from conftest import FakeCollection, FakeCursor, FakeDB, matches
+
+PICKUP = (41.8781, -87.6298)  # Chicago
+
+
+class TestGeoPoint:
+    def test_point_is_lng_lat(self):
+        assert geo_point(41.88, -87.63) == {"type": "Point", "coordinates": [-87.63, 41.88]}
+
+    @pytest.mark.parametrize("lat,lng", [(None, 1.0), (1.0, None), ("abc", 1.0), (91.0, 0.0), (0.0, 181.0)])
+    def test_invalid_coordinates_give_none(self, lat, lng):
+        assert geo_point(lat, lng) is None
+
+
+class TestBBox:
+    def test_parse_and_polygon_ring_is_closed(self):
+        bbox = parse_bbox("-88,41,-87,42")
+        ring = bbox_polygon(bbox)["coordinates"][0]
+        assert ring[0] == ring[-1] == [-88.0, 41.0]
+        assert len(ring) == 5
+
+    @pytest.mark.parametrize("value", ["1,2,3", "a,b,c,d", "-87,41,-88,42", "0,95,1,96"])
+    def test_malformed_bbox_rejected(self, value):
+        with pytest.raises(ValueError):
+            parse_bbox(value)
+
+
+class TestHaversine:
+    def test_chicago_to_milwaukee(self):
+        assert 75 < haversine_miles(41.8781, -87.6298, 43.0389, -87.9065) < 85
+
+
+class TestGeoNearStage:
+    def test_stage_shape(self):
+        stage = geo_near_stage(41.88, -87.63, 10, {"is_available": True})["$geoNear"]
+        assert stage["near"] == {"type": "Point", "coordinates": [-87.63, 41.88]}
+        assert stage["key"] == "current_position"
+        assert stage["maxDistance"] == pytest.approx(10 * METERS_PER_MILE)
+        assert stage["spherical"] and stage["distanceField"] == "distance_meters"
+        assert stage["query"] == {"is_available": True}
+
+    def test_no_filter_is_an_empty_query(self):
+        assert geo_near_stage(0, 0, 1)["$geoNear"]["query"] == {}
+
+
+class FakeGeoCollection(FakeCollection):
+    """Runs the $geoNear / $limit / $project pipelines the nearby endpoints build"""
+
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        near = pipeline[0]["$geoNear"]
+        lng, lat = near["near"]["coordinates"]
+        rows = []
+        for doc in self.docs:
+            if not matches(doc, near["query"]):
+                continue
+            doc_lng, doc_lat = doc[near["key"]]["coordinates"]
+            distance = haversine_miles(lat, lng, doc_lat, doc_lng) * METERS_PER_MILE
+            if distance <= near["maxDistance"]:
+                rows.append({**doc, near["distanceField"]: distance})
+        rows.sort(key=lambda row: row[near["distanceField"]])
+        for stage in pipeline[1:]:
+            if "$limit" in stage:
+                rows = rows[:stage["$limit"]]
+            elif "$project" in stage:
+                keep = [k for k, v in stage["$project"].items() if v]
+                rows = [{k: row[k] for k in keep if k in row} for row in rows]
+        return FakeCursor(rows)
+
+
+def positioned(lat, lng, **fields):
+    return {"current_position": geo_point(lat, lng), **fields}
+
+
+def nearby_client(monkeypatch, module, collection_name, docs):
+    collection = FakeGeoCollection(docs)
+    monkeypatch.setattr(module, "db", FakeDB(**{collection_name: collection}))
+    app = FastAPI()
+    app.include_router(module.router)
+    caller = {}
+    app.dependency_overrides[get_current_user] = lambda: caller["user"]
+    client = TestClient(app)
+    client.caller, client.collection = caller, collection
+    return client
+
+
+def as_user(client, user_id, role):
+    client.caller["user"] = User.model_construct(id=user_id, role=role, fleet_owner_id=None)
+
+
+class TestNearbyEquipment:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from routes import equipment_routes
+
+        return nearby_client(monkeypatch, equipment_routes, "equipment", [
+            positioned(41.88, -87.63, id="own", owner_id="fleet-1", is_available=True, equipment_type="dry_van",
+                       current_driver_id="driver-1", last_location_update="2026-01-01T00:00:00Z", location_address="Chicago, IL"),
+            positioned(41.90, -87.65, id="rival", owner_id="fleet-2", is_available=True, equipment_type="reefer",
+                       current_driver_id="driver-9", last_location_update="2026-01-01T00:00:00Z", location_address="Chicago, IL"),
+            positioned(41.89, -87.64, id="busy", owner_id="fleet-2", is_available=False, equipment_type="reefer"),
+            positioned(39.77, -86.16, id="far", owner_id="fleet-1", is_available=True, equipment_type="dry_van"),
+        ])
+
+    def test_filters_reach_the_geo_near_query(self, client):
+        as_user(client, "fleet-1", UserRole.FLEET_OWNER)
+        params = {"lat": PICKUP[0], "lng": PICKUP[1], "radius_miles": 25, "equipment_type": "reefer", "mine_only": True}
+        client.get("/equipment/nearby", params=params)
+        query = client.collection.pipelines[-1][0]["$geoNear"]["query"]
+        assert query == {"is_available": True, "equipment_type": "reefer", "owner_id": "fleet-1"}
+
+        client.get("/equipment/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1], "available_only": False})
+        assert client.collection.pipelines[-1][0]["$geoNear"]["query"] == {}
+
+    def test_nearest_first_within_radius(self, client):
+        as_user(client, "fleet-1", UserRole.FLEET_OWNER)
+        results = client.get("/equipment/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1], "radius_miles": 25}).json()
+        assert [e["id"] for e in results] == ["own", "rival"]
+        assert results[0]["distance_miles"] < results[1]["distance_miles"] < 25
+
+    def test_other_fleets_positions_are_not_returned(self, client):
+        as_user(client, "fleet-1", UserRole.FLEET_OWNER)
+        own, rival = client.get("/equipment/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1]}).json()
+        assert own["current_driver_id"] == "driver-1" and own["latitude"] == 41.88
+        assert rival["location_address"] == "Chicago, IL" and "distance_miles" in rival
+        for field in ["current_position", "current_driver_id", "last_location_update", "latitude", "longitude"]:
+            assert field not in rival
+
+        as_user(client, "admin-1", UserRole.PLATFORM_ADMIN)
+        _, rival = client.get("/equipment/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1]}).json()
+        assert rival["current_driver_id"] == "driver-9" and rival["latitude"] == 41.90
+
+    def test_other_fleets_distance_is_to_a_coarse_cell(self, client):
+        as_user(client, "fleet-1", UserRole.FLEET_OWNER)
+        docs = client.collection.docs
+        rival = next(d for d in docs if d["id"] == "rival")
+
+        def distances(rival_lat, rival_lng, **params):
+            rival["current_position"] = geo_point(rival_lat, rival_lng)
+            results = client.get("/equipment/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1], **params}).json()
+            return {e["id"]: e["distance_miles"] for e in results}
+
+        # Moving within a grid cell changes nothing the rival fleet's caller can see - distance or radius cutoff
+        first, second = distances(41.901, -87.651), distances(41.949, -87.699)
+        assert first["rival"] == second["rival"] == round(haversine_miles(*PICKUP, *coarse_point(41.901, -87.651)))
+        cutoff = haversine_miles(*PICKUP, *coarse_point(41.901, -87.651))
+        for radius in (cutoff - 0.5, cutoff + 0.5):
+            assert ("rival" in distances(41.901, -87.651, radius_miles=radius)) == ("rival" in distances(41.949, -87.699, radius_miles=radius))
+
+        # The owner still gets the exact figure
+        rival["owner_id"] = "fleet-1"
+        assert distances(41.901, -87.651)["rival"] != distances(41.949, -87.699)["rival"]
+
+
+class TestFleetSnapshotPipeline:
+    def test_lookups_use_let_and_expr(self):
+        from routes.equipment_routes import fleet_snapshot_pipeline
+
+        lookups = [stage["$lookup"] for stage in fleet_snapshot_pipeline("fleet-1") if "$lookup" in stage]
+        assert [lookup["from"] for lookup in lookups] == ["users", "bookings"]
+        for lookup in lookups:
+            # localField/foreignField alongside a pipeline needs MongoDB 5.0+
+            assert "localField" not in lookup and "foreignField" not in lookup
+            assert "$expr" in lookup["pipeline"][0]["$match"]
+        assert lookups[1]["let"] == {"equipment_id": "$id"}
+
+
+class TestNearbyDrivers:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        from routes import driver_routes
+
+        return nearby_client(monkeypatch, driver_routes, "users", [
+            positioned(41.88, -87.63, id="d1", role=UserRole.DRIVER, fleet_owner_id="fleet-1", driver_status="available"),
+            positioned(41.89, -87.64, id="d2", role=UserRole.DRIVER, fleet_owner_id="fleet-2", driver_status="available"),
+            positioned(41.88, -87.63, id="d3", role=UserRole.DRIVER, fleet_owner_id="fleet-1", driver_status="on_route"),
+            positioned(41.88, -87.63, id="d4", role=UserRole.DRIVER, fleet_owner_id="fleet-1", driver_status="available", is_active=False),
+        ])
+
+    def test_fleet_owner_sees_own_available_drivers(self, client):
+        as_user(client, "fleet-1", UserRole.FLEET_OWNER)
+        drivers = client.get("/drivers/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1]}).json()
+        assert [d["id"] for d in drivers] == ["d1"]
+        assert drivers[0]["latitude"] == 41.88
+        query = client.collection.pipelines[-1][0]["$geoNear"]["query"]
+        assert query["fleet_owner_id"] == "fleet-1" and query["driver_status"] == "available"
+
+    def test_platform_admin_sees_every_fleet(self, client):
+        as_user(client, "admin-1", UserRole.PLATFORM_ADMIN)
+        drivers = client.get("/drivers/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1], "status": ""}).json()
+        assert {d["id"] for d in drivers} == {"d1", "d2", "d3"}
+        assert "fleet_owner_id" not in client.collection.pipelines[-1][0]["$geoNear"]["query"]
+
+    @pytest.mark.parametrize("role", [UserRole.DRIVER, UserRole.ACCOUNTANT])
+    def test_other_roles_are_refused(self, client, role):
+        as_user(client, "someone", role)
+        assert client.get("/drivers/nearby", params={"lat": PICKUP[0], "lng": PICKUP[1]}).status_code == 403
+        assert client.collection.pipelines == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
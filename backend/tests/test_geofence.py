@@ -0,0 +1,238 @@
+"""
+Geofence Engine Tests
+Arrival/departure detection against a driver's pickup and delivery fences
+"""
+import asyncio
+
+import pytest
+
+import driver_assignments
+import driver_context
+import geofence
+from geofence import Fence, GeofenceEngine, apply_geofence_event, fences_for_load, load_driver_fences, GEOFENCE_RADIUS_METERS
+from conftest import FakeDB
+
+PICKUP = (41.8781, -87.6298)
+DELIVERY = (39.7684, -86.1581)
+
+
+def make_engine(fences_by_driver):
+    events = []
+    loads = []
+
+    async def load_fences(driver_id):
+        loads.append(driver_id)
+        return fences_by_driver.get(driver_id, [])
+
+    async def on_event(event):
+        events.append((event.fence.kind, event.event))
+
+    return GeofenceEngine(load_fences, on_event), events, loads
+
+
+def load_fences_for(load_id="load-1"):
+    return fences_for_load({
+        "id": load_id,
+        "pickup_lat": PICKUP[0], "pickup_lng": PICKUP[1],
+        "delivery_lat": DELIVERY[0], "delivery_lng": DELIVERY[1]
+    }, "loads")
+
+
+def run_pings(engine, driver_id, pings):
+    async def scenario():
+        for lat, lng in pings:
+            await engine.process_ping(driver_id, lat, lng)
+    asyncio.run(scenario())
+
+
+class TestFencesForLoad:
+    """Fence construction from load documents"""
+
+    def test_builds_pickup_and_delivery(self):
+        fences = load_fences_for()
+        assert [f.kind for f in fences] == ["pickup", "delivery"]
+        assert fences[0].radius_m == GEOFENCE_RADIUS_METERS
+
+    def test_skips_missing_coordinates(self):
+        assert fences_for_load({"id": "load-1", "pickup_lat": 41.0}, "loads") == []
+
+    def test_per_load_radius(self):
+        fences = fences_for_load({"id": "load-1", "pickup_lat": 41.0, "pickup_lng": -87.0, "geofence_radius_m": 800}, "bookings")
+        assert fences[0].radius_m == 800
+        assert fences[0].collection == "bookings"
+
+
+class TestGeofenceEngine:
+    """Crossing detection with hysteresis"""
+
+    def test_arrival_then_departure(self):
+        engine, events, _ = make_engine({"driver-1": load_fences_for()})
+        run_pings(engine, "driver-1", [
+            (41.90, -87.63),      # ~2.5km out
+            (41.8785, -87.6300),  # at the dock
+            (41.8786, -87.6301),  # still there - no repeat arrival
+            (41.95, -87.63),      # gone
+        ])
+        assert events == [("pickup", "arrival"), ("pickup", "departure")]
+
+    def test_jitter_at_the_edge_does_not_flap(self):
+        fence = Fence(load_id="load-1", kind="pickup", lat=PICKUP[0], lng=PICKUP[1], radius_m=300)
+        engine, events, _ = make_engine({"driver-1": [fence]})
+        # ~270m (inside), ~360m (past radius but inside the exit ring), ~270m again
+        run_pings(engine, "driver-1", [(41.8805, -87.6298), (41.8813, -87.6298), (41.8805, -87.6298)])
+        assert events == [("pickup", "arrival")]
+
+    def test_other_drivers_fences_are_ignored(self):
+        engine, events, _ = make_engine({"driver-1": load_fences_for()})
+        run_pings(engine, "driver-2", [PICKUP])
+        assert events == []
+
+    def test_inaccurate_ping_is_ignored(self):
+        engine, events, _ = make_engine({"driver-1": load_fences_for()})
+        asyncio.run(engine.process_ping("driver-1", PICKUP[0], PICKUP[1], accuracy_m=5000))
+        assert events == []
+
+    def test_fences_are_cached_between_pings(self):
+        engine, _, loads = make_engine({"driver-1": load_fences_for()})
+        run_pings(engine, "driver-1", [PICKUP, PICKUP, DELIVERY])
+        assert loads == ["driver-1"]
+
+    def test_invalidate_reloads_without_replaying_arrival(self):
+        engine, events, loads = make_engine({"driver-1": load_fences_for()})
+        run_pings(engine, "driver-1", [PICKUP])
+        engine.invalidate("driver-1")
+        run_pings(engine, "driver-1", [PICKUP])
+        assert loads == ["driver-1", "driver-1"]
+        assert events == [("pickup", "arrival")]
+
+    def test_handler_errors_do_not_break_ping(self):
+        async def load_fences(driver_id):
+            return load_fences_for()
+
+        async def on_event(event):
+            raise RuntimeError("db down")
+
+        engine = GeofenceEngine(load_fences, on_event)
+        events = asyncio.run(engine.process_ping("driver-1", PICKUP[0], PICKUP[1]))
+        assert [e.event for e in events] == ["arrival"]
+
+
+class RecordingManager:
+    def __init__(self):
+        self.broadcasts = []
+
+    async def broadcast_status_update(self, payload, tenant_id):
+        self.broadcasts.append((tenant_id, payload))
+
+
+class TestApplyGeofenceEvent:
+    """Crossings are claimed on the assignment in Mongo, so workers and restarts don't repeat them"""
+
+    @pytest.fixture
+    def fake(self, monkeypatch):
+        load = {
+            "id": "load-1", "status": "en_route_pickup",
+            "pickup_lat": PICKUP[0], "pickup_lng": PICKUP[1], "delivery_lat": DELIVERY[0], "delivery_lng": DELIVERY[1]
+        }
+        db = FakeDB(
+            loads=[load],
+            driver_assignments=[{"driver_user_id": "driver-1", "source": "loads", "load_id": "load-1", "status": "en_route_pickup", "load": dict(load)}],
+            users=[{"id": "driver-1", "fleet_owner_id": "fleet-1"}],
+        )
+        manager = RecordingManager()
+
+        async def refresh(collection, load_id):
+            pass
+
+        monkeypatch.setattr(geofence, "db", db)
+        monkeypatch.setattr(geofence, "manager", manager)
+        monkeypatch.setattr(geofence, "refresh_assignments", refresh)
+        return db, manager
+
+    def worker(self):
+        return GeofenceEngine(load_driver_fences, apply_geofence_event)
+
+    def test_two_workers_record_an_arrival_once(self, fake):
+        db, manager = fake
+
+        async def scenario():
+            for engine in (self.worker(), self.worker()):
+                await engine.process_ping("driver-1", *PICKUP)
+
+        asyncio.run(scenario())
+        assert [e["event_type"] for e in db.load_status_events.docs] == ["geofence_pickup_arrival"]
+        assert [(tenant, b["status"]) for tenant, b in manager.broadcasts] == [("fleet-1", "arrived_pickup")]
+        assert db.loads.docs[0]["status"] == "arrived_pickup"
+        assert db.driver_assignments.docs[0]["geofence_inside"] == {"pickup": True}
+
+    def test_restarted_worker_does_not_replay_the_arrival(self, fake):
+        db, _ = fake
+        asyncio.run(self.worker().process_ping("driver-1", *PICKUP))
+
+        # A fresh engine loads the stored state - staying at the dock is not a new arrival, leaving is a departure
+        restarted = self.worker()
+        events = asyncio.run(restarted.process_ping("driver-1", *PICKUP))
+        assert events == []
+        events = asyncio.run(restarted.process_ping("driver-1", 41.95, -87.63))
+        assert [e.event for e in events] == ["departure"]
+        assert [e["event_type"] for e in db.load_status_events.docs] == ["geofence_pickup_arrival", "geofence_pickup_departure"]
+
+    def test_pickup_departure_keeps_the_loaded_timestamp(self, fake):
+        db, _ = fake
+        loaded_at = "2026-01-01T10:00:00+00:00"
+        db.loads.docs[0].update(status="loaded", actual_pickup_departure=loaded_at)
+        db.driver_assignments.docs[0]["geofence_inside"] = {"pickup": True}
+
+        events = asyncio.run(self.worker().process_ping("driver-1", 41.95, -87.63))
+        assert [e.event for e in events] == ["departure"]
+        assert db.loads.docs[0]["status"] == "en_route_delivery"
+        assert db.loads.docs[0]["actual_pickup_departure"] == loaded_at
+
+
+class TestBookedLoads:
+    """A booking assigned straight to a driver is fenced from its own coordinates and moves through booking statuses"""
+
+    @pytest.fixture
+    def fake(self, monkeypatch):
+        db = FakeDB(
+            users=[{"id": "driver-1", "email": "dana@example.com", "fleet_owner_id": "fleet-1"}],
+            drivers=[{"id": "drv-1", "user_id": "driver-1"}],
+            bookings=[{
+                "id": "bk-1", "order_number": "ORD-1", "pickup_location": "Chicago, IL", "delivery_location": "Indianapolis, IN",
+                "driver_id": "drv-1", "status": "planned",
+                "pickup_lat": PICKUP[0], "pickup_lng": PICKUP[1], "delivery_lat": DELIVERY[0], "delivery_lng": DELIVERY[1]
+            }],
+        )
+        for module in (geofence, driver_assignments, driver_context):
+            monkeypatch.setattr(module, "db", db)
+        for module in (geofence, driver_assignments):
+            monkeypatch.setattr(module, "schedule_index", lambda *args: None)
+        monkeypatch.setattr(geofence, "manager", RecordingManager())
+        asyncio.run(driver_assignments.refresh_assignments("bookings", "bk-1"))
+        return db
+
+    def test_booking_fences_and_transitions(self, fake):
+        fences = asyncio.run(load_driver_fences("driver-1"))
+        assert [(f.collection, f.load_id, f.kind) for f in fences] == [("bookings", "bk-1", "pickup"), ("bookings", "bk-1", "delivery")]
+
+        engine = GeofenceEngine(load_driver_fences, apply_geofence_event)
+        booking = fake.bookings.docs[0]
+        asyncio.run(engine.process_ping("driver-1", *PICKUP))
+        assert booking["status"] == "at_pickup" and booking["pickup_time_actual_in"]
+
+        asyncio.run(engine.process_ping("driver-1", 41.95, -87.63))
+        assert booking["status"] == "in_transit_delivery" and booking["pickup_time_actual_out"]
+
+        engine.invalidate("driver-1")
+        asyncio.run(engine.process_ping("driver-1", *DELIVERY))
+        assert booking["status"] == "at_delivery" and booking["delivery_time_actual_in"]
+        assert fake.driver_assignments.docs[0]["status"] == "at_delivery"
+
+    def test_delivered_bookings_get_no_fences(self, fake):
+        fake.bookings.docs[0]["status"] = "delivered"
+        asyncio.run(driver_assignments.refresh_assignments("bookings", "bk-1"))
+        assert asyncio.run(load_driver_fences("driver-1")) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,135 @@
+"""
+HTTP Middleware Tests
+Large responses are compressed, unchanged GETs come back as 304, and routes can opt out
+"""
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import http_middleware
+from http_middleware import CompressionMiddleware, ConditionalGetMiddleware, accepted_encoding, http_cache, weak_etag_matches
+from serialization import APIResponse
+
+ROWS = [{"id": f"booking-{i}", "status": "in_transit_delivery", "pickup_location": "Dallas, TX"} for i in range(200)]
+
+
+def make_client():
+    app = FastAPI(default_response_class=APIResponse)
+    app.add_middleware(ConditionalGetMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    state = {"rows": list(ROWS)}
+
+    @app.get("/bookings")
+    async def bookings():
+        return state["rows"]
+
+    @app.get("/tiny")
+    async def tiny():
+        return {"ok": True}
+
+    @app.get("/live")
+    @http_cache(etag=False, compress=False)
+    async def live():
+        return state["rows"]
+
+    @app.get("/categories")
+    @http_cache(cache_control="private, max-age=3600")
+    async def categories():
+        return ["fuel", "tolls"]
+
+    @app.get("/export")
+    async def export():
+        async def lines():
+            for row in ROWS:
+                yield (json.dumps(row) + "\n").encode()
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/events")
+    async def events():
+        async def stream():
+            yield ": connected\n\n" * 200
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/bookings")
+    async def create():
+        state["rows"].append({"id": "new"})
+        return state["rows"]
+
+    return TestClient(app), state
+
+
+class TestCompression:
+    def test_large_json_is_gzipped(self):
+        client, _ = make_client()
+        response = client.get("/bookings", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.json() == ROWS
+        assert int(response.headers["content-length"]) < len(json.dumps(ROWS)) / 5
+
+    def test_small_responses_and_no_accept_encoding_are_untouched(self):
+        client, _ = make_client()
+        assert "content-encoding" not in client.get("/tiny", headers={"Accept-Encoding": "gzip"}).headers
+        assert "content-encoding" not in client.get("/bookings", headers={"Accept-Encoding": "identity"}).headers
+
+    def test_streamed_export_is_compressed_incrementally(self):
+        client, _ = make_client()
+        response = client.get("/export", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert [json.loads(line) for line in response.text.splitlines()] == ROWS
+
+    def test_event_streams_are_not_compressed(self):
+        client, _ = make_client()
+        assert "content-encoding" not in client.get("/events", headers={"Accept-Encoding": "gzip"}).headers
+
+    def test_encoding_negotiation(self, monkeypatch):
+        monkeypatch.setattr(http_middleware, "brotli", None)
+        assert accepted_encoding("gzip, deflate, br") == "gzip"
+        assert accepted_encoding("gzip;q=0, deflate") is None
+        monkeypatch.setattr(http_middleware, "brotli", object())
+        assert accepted_encoding("gzip, br;q=1.0") == "br"
+
+
+class TestConditionalGet:
+    def test_unchanged_response_is_304_and_changed_is_200(self):
+        client, _ = make_client()
+        first = client.get("/bookings")
+        etag = first.headers["etag"]
+        assert etag.startswith('W/"')
+        assert first.headers["cache-control"] == "private, no-cache"
+
+        again = client.get("/bookings", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["etag"] == etag
+
+        client.post("/bookings")
+        changed = client.get("/bookings", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+
+    def test_etag_is_the_same_whether_or_not_compressed(self):
+        client, _ = make_client()
+        plain = client.get("/bookings", headers={"Accept-Encoding": "identity"})
+        gzipped = client.get("/bookings", headers={"Accept-Encoding": "gzip"})
+        assert plain.headers["etag"] == gzipped.headers["etag"]
+
+    def test_route_opt_out_and_cache_control(self):
+        client, _ = make_client()
+        live = client.get("/live", headers={"Accept-Encoding": "gzip"})
+        assert "etag" not in live.headers
+        assert "content-encoding" not in live.headers
+        assert client.get("/categories").headers["cache-control"] == "private, max-age=3600"
+
+    def test_weak_comparison(self):
+        assert weak_etag_matches('"abc"', 'W/"abc"')
+        assert weak_etag_matches('W/"x", W/"abc"', 'W/"abc"')
+        assert not weak_etag_matches('W/"other"', 'W/"abc"')
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
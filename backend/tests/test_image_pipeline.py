@@ -0,0 +1,153 @@
+"""
+Image Pipeline Tests
+Normalization, thumbnails and PDF bundling of uploaded photos
+"""
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+import image_pipeline
+from blob_store import LocalBlobStore
+from document_repository import StoredFile
+from image_pipeline import (
+    normalize_image, make_thumbnail, bundle_pdf, is_image, has_thumbnail, pdf_bundle_for_blobs,
+    store_upload_bytes, stored_filename, ImageTooLarge, THUMBNAIL_SIZE
+)
+from conftest import FakeDB
+
+ORIENTATION_TAG = 0x0112
+GPS_TAG = 0x8825
+
+
+def photo(width=400, height=200, orientation=None, mode="RGB", fmt="JPEG"):
+    image = Image.new(mode, (width, height), "white")
+    out = io.BytesIO()
+    if fmt == "JPEG":
+        exif = Image.Exif()
+        exif[0x010F] = "PhoneMaker"
+        if orientation:
+            exif[ORIENTATION_TAG] = orientation
+        image.save(out, format=fmt, exif=exif.tobytes())
+    else:
+        image.save(out, format=fmt)
+    return out.getvalue()
+
+
+def open_result(data):
+    return Image.open(io.BytesIO(data))
+
+
+class TestNormalizeImage:
+    """Orientation, metadata stripping and downscaling"""
+
+    def test_applies_exif_rotation(self):
+        # Orientation 6 = rotate 90 degrees clockwise - a landscape sensor image shown as portrait
+        result = open_result(normalize_image(photo(400, 200, orientation=6)))
+        assert result.size == (200, 400)
+
+    def test_strips_exif(self):
+        result = open_result(normalize_image(photo(orientation=6)))
+        assert dict(result.getexif()) == {}
+
+    def test_downscales_long_edge(self):
+        result = open_result(normalize_image(photo(3000, 1500), max_dimension=1200))
+        assert result.size == (1200, 600)
+
+    def test_converts_png_with_alpha_to_jpeg(self):
+        result = open_result(normalize_image(photo(mode="RGBA", fmt="PNG")))
+        assert result.format == "JPEG"
+        assert result.mode == "RGB"
+
+    def test_rejects_non_images(self):
+        with pytest.raises(Exception):
+            normalize_image(b"%PDF-1.4 not an image")
+
+    def test_rejects_oversized_images_before_decoding(self, monkeypatch):
+        monkeypatch.setattr(image_pipeline, "MAX_IMAGE_PIXELS", 100 * 100)
+        with pytest.raises(ImageTooLarge):
+            normalize_image(photo(200, 100))
+        # Pillow's own process-wide limit is left alone
+        assert Image.MAX_IMAGE_PIXELS != 100 * 100
+
+
+class TestThumbnailsAndBundles:
+    """Derived outputs"""
+
+    def test_thumbnail_fits_box(self):
+        result = open_result(make_thumbnail(photo(1600, 800)))
+        assert max(result.size) == THUMBNAIL_SIZE
+
+    def test_pdf_bundle_has_page_per_image(self):
+        data = bundle_pdf([photo(), photo(200, 400), photo()])
+        assert data.startswith(b"%PDF")
+        assert b"/Count 3" in data
+
+    def test_bundle_pages_are_decoded_at_reduced_scale(self, monkeypatch):
+        from PIL import JpegImagePlugin
+
+        decoded = []
+        draft = JpegImagePlugin.JpegImageFile.draft
+
+        def recording_draft(image, mode, size):
+            result = draft(image, mode, size)
+            decoded.append(image.size)
+            return result
+
+        monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", recording_draft)
+        data = bundle_pdf([photo(4000, 2000)], max_dimension=500)
+        assert decoded == [(1000, 500)]
+        assert b"/Width 500" in data and b"/Height 250" in data
+
+    def test_bundles_are_capped_in_pages_and_bytes(self, tmp_path, monkeypatch):
+        store = LocalBlobStore(str(tmp_path))
+        monkeypatch.setattr(image_pipeline, "blob_store", store)
+        monkeypatch.setattr(image_pipeline, "db", FakeDB())
+        monkeypatch.setattr(image_pipeline, "MAX_BUNDLE_PAGES", 2)
+        sha256s = [asyncio.run(store.put_bytes(photo(400 + i, 200))).sha256 for i in range(3)]
+
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(pdf_bundle_for_blobs(sha256s))
+        assert exc.value.status_code == 413
+
+        monkeypatch.setattr(image_pipeline, "MAX_BUNDLE_BYTES", 10)
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(pdf_bundle_for_blobs(sha256s[:2]))
+        assert exc.value.status_code == 413
+
+
+class TestHelpers:
+    """Content-type checks used by the routes"""
+
+    def test_is_image(self):
+        assert is_image("image/jpeg")
+        assert is_image("IMAGE/PNG")
+        assert not is_image("application/pdf")
+        assert not is_image(None)
+
+    def test_stored_filename_follows_the_content_type(self):
+        assert stored_filename("bol.png", "image/jpeg") == "bol.jpg"
+        assert stored_filename("bol.JPEG", "image/jpeg") == "bol.JPEG"
+        assert stored_filename("receipt", "image/jpeg") == "receipt.jpg"
+        assert stored_filename(None, "image/jpeg") is None
+
+    def test_reencoded_uploads_are_renamed(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(image_pipeline, "blob_store", LocalBlobStore(str(tmp_path)))
+        monkeypatch.setattr(image_pipeline, "db", FakeDB())
+        stored = asyncio.run(store_upload_bytes(photo(fmt="PNG"), "image/png", "pod.png"))
+        assert stored["content_type"] == "image/jpeg" and stored["filename"] == "pod.jpg"
+
+        # Files kept as-is keep their name
+        stored = asyncio.run(store_upload_bytes(b"%PDF-1.4", "application/pdf", "pod.pdf"))
+        assert stored["filename"] == "pod.pdf"
+
+    def test_has_thumbnail(self):
+        assert has_thumbnail(StoredFile(id="1", thumbnail_sha256="abc"))
+        assert has_thumbnail(StoredFile(id="1", blob_sha256="abc", content_type="image/png"))
+        assert not has_thumbnail(StoredFile(id="1", blob_sha256="abc", content_type="application/pdf"))
+        assert not has_thumbnail(StoredFile(id="1", content_type="image/png"))
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,190 @@
+"""
+Load Messaging Tests
+Messages and read receipts reach participants' user channels, history is incremental and unread counts are counters
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import load_messaging
+from backplane import InMemoryBackplane
+from load_messaging import list_messages, post_message, mark_read_by_driver, mark_read_by_dispatch, unread_counts
+from websocket_manager import ConnectionManager
+from conftest import FakeDB, FakeWebSocket
+
+T0 = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    db = FakeDB(
+        driver_assignments=[{"driver_user_id": "driver-1", "load_id": "load-1", "load_ids": ["load-1", "bk-1"],
+                             "load": {"assigned_by": "dispatcher-1"}}],
+        users=[{"id": "driver-1", "fleet_owner_id": "owner-1"}]
+    )
+    manager = ConnectionManager(InMemoryBackplane())
+    monkeypatch.setattr(load_messaging, "db", db)
+    monkeypatch.setattr(load_messaging, "manager", manager)
+    return db, manager
+
+
+def message(message_id, sender_type, minutes=0, load_id="load-1"):
+    return {
+        "id": message_id,
+        "load_id": load_id,
+        "sender_id": "driver-1" if sender_type == "driver" else "dispatcher-1",
+        "sender_type": sender_type,
+        "content": f"message {message_id}",
+        "read_by_driver": sender_type == "driver",
+        "read_by_dispatch": sender_type == "dispatch",
+        "created_at": T0 + timedelta(minutes=minutes)
+    }
+
+
+class TestIncrementalHistory:
+    def test_after_returns_only_newer_messages(self, setup):
+        db, _ = setup
+        db.load_messages.docs = [message("m1", "dispatch", 0), message("m2", "driver", 1), message("m3", "dispatch", 2)]
+
+        newer = asyncio.run(list_messages("load-1", after="m1"))
+        assert [m["id"] for m in newer] == ["m2", "m3"]
+
+    def test_same_timestamp_is_ordered_by_id(self, setup):
+        db, _ = setup
+        db.load_messages.docs = [message("m2", "driver", 0), message("m1", "dispatch", 0), message("m3", "driver", 0)]
+
+        assert [m["id"] for m in asyncio.run(list_messages("load-1", after="m1"))] == ["m2", "m3"]
+
+    def test_unknown_cursor_returns_full_history(self, setup):
+        db, _ = setup
+        db.load_messages.docs = [message("m1", "dispatch", 0)]
+
+        assert [m["id"] for m in asyncio.run(list_messages("load-1", after="gone"))] == ["m1"]
+
+
+class TestLiveDelivery:
+    def test_dispatch_message_reaches_driver_channel_with_unread_count(self, setup):
+        db, manager = setup
+
+        async def scenario():
+            await manager.start()
+            phone = FakeWebSocket()
+            await manager.connect_user(phone, "driver-1")
+            await post_message(message("m1", "dispatch"))
+            return phone.sent
+
+        sent = asyncio.run(scenario())
+        assert [e["type"] for e in sent] == ["load_message", "unread_count"]
+        assert sent[0]["payload"]["id"] == "m1"
+        assert sent[1]["payload"] == {"load_id": "load-1", "unread_count": 1}
+
+    def test_driver_message_reaches_dispatch_and_fleet_owner(self, setup):
+        db, manager = setup
+
+        async def scenario():
+            await manager.start()
+            dispatcher, owner = FakeWebSocket(), FakeWebSocket()
+            await manager.connect_user(dispatcher, "dispatcher-1")
+            await manager.connect_user(owner, "owner-1")
+            await post_message(message("m1", "driver"))
+            return dispatcher.sent, owner.sent
+
+        dispatcher, owner = asyncio.run(scenario())
+        assert [e["payload"]["id"] for e in dispatcher] == ["m1"]
+        assert [e["payload"]["id"] for e in owner] == ["m1"]
+        # Driver messages don't count as unread for the driver
+        assert setup[0].message_unread_counts.docs == []
+
+    def test_sse_stream_receives_channel_events(self, setup):
+        db, manager = setup
+
+        async def scenario():
+            await manager.start()
+            stream = load_messaging.user_event_stream("driver-1")
+            assert await stream.__anext__() == ": connected\n\n"
+            await post_message(message("m1", "dispatch"))
+            event = await stream.__anext__()
+            await stream.aclose()
+            return event, manager.user_streams
+
+        event, streams = asyncio.run(scenario())
+        assert event.startswith("event: load_message\ndata: ")
+        assert streams == {}
+
+
+class TestUnreadCounters:
+    def test_counters_track_sends_and_reads(self, setup):
+        db, _ = setup
+
+        async def scenario():
+            await post_message(message("m1", "dispatch", 0))
+            await post_message(message("m2", "dispatch", 1))
+            before = await unread_counts("driver-1", ["load-1", "bk-1"])
+            marked = await mark_read_by_driver("load-1", "driver-1")
+            after = await unread_counts("driver-1", ["load-1", "bk-1"])
+            return before, marked, after
+
+        before, marked, after = asyncio.run(scenario())
+        assert before == {"load-1": 2}
+        assert marked == 2
+        assert after == {}
+        assert all(m["read_by_driver"] for m in db.load_messages.docs)
+
+    def test_message_posted_while_reading_stays_unread(self, setup):
+        db, manager = setup
+        update_many = db.load_messages.update_many
+
+        async def update_then_post(query, update):
+            result = await update_many(query, update)
+            # Dispatch sends the next message between the update and the counter adjustment
+            await post_message(message("m2", "dispatch", 1))
+            return result
+
+        async def scenario():
+            await manager.start()
+            phone = FakeWebSocket()
+            await manager.connect_user(phone, "driver-1")
+            await post_message(message("m1", "dispatch", 0))
+            db.load_messages.update_many = update_then_post
+            await mark_read_by_driver("load-1", "driver-1")
+            return phone.sent, await unread_counts("driver-1", ["load-1"])
+
+        sent, counts = asyncio.run(scenario())
+        assert counts == {"load-1": 1}
+        assert [m["payload"]["unread_count"] for m in sent if m["type"] == "unread_count"][-1] == 1
+        assert [m["read_by_driver"] for m in db.load_messages.docs] == [True, False]
+
+    def test_counter_left_by_another_drivers_read_is_cleared(self, setup):
+        db, _ = setup
+        db.load_messages.docs = [{**message("m1", "dispatch"), "read_by_driver": True}]
+        db.message_unread_counts.docs = [{"user_id": "driver-1", "load_id": "load-1", "count": 1}]
+
+        assert asyncio.run(mark_read_by_driver("load-1", "driver-1")) == 0
+        assert asyncio.run(unread_counts("driver-1", ["load-1"])) == {}
+
+    def test_reading_with_nothing_unread_skips_the_update(self, setup):
+        db, _ = setup
+        db.load_messages.docs = [message("m1", "driver")]
+
+        assert asyncio.run(mark_read_by_driver("load-1", "driver-1")) == 0
+        assert db.load_messages.update_many_calls == 0
+
+    def test_dispatch_read_sends_receipt_to_driver(self, setup):
+        db, manager = setup
+        db.load_messages.docs = [message("m1", "driver")]
+
+        async def scenario():
+            await manager.start()
+            phone = FakeWebSocket()
+            await manager.connect_user(phone, "driver-1")
+            await mark_read_by_dispatch("load-1", "dispatcher-1")
+            return phone.sent
+
+        sent = asyncio.run(scenario())
+        assert sent[0]["type"] == "messages_read"
+        assert sent[0]["payload"]["reader_type"] == "dispatch"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
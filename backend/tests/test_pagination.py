@@ -0,0 +1,157 @@
+"""
+Keyset Pagination Tests
+Cursors walk a listing once with no gaps or repeats, whatever happens to the collection mid-scroll
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import pagination
+from auth import get_current_user
+from models import User, UserRole
+from pagination import PageParams, paginate, encode_cursor, decode_cursor, keyset_filter
+from conftest import FakeCollection
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def contacts(count, same_timestamp=False):
+    return [
+        {"_id": ObjectId(), "id": f"c{i}", "created_at": T0 if same_timestamp else T0 + timedelta(minutes=i), "owner": "a" if i % 2 else "b"}
+        for i in range(count)
+    ]
+
+
+def walk(collection, query=None, limit=3, sort=pagination.DEFAULT_SORT):
+    async def scenario():
+        ids, cursor = [], None
+        while True:
+            page = await paginate(collection, query or {}, PageParams(cursor=cursor, limit=limit), sort=sort)
+            ids.extend(item["id"] for item in page.items)
+            if not page.next_cursor:
+                return ids
+            cursor = page.next_cursor
+    return asyncio.run(scenario())
+
+
+class TestCursor:
+    def test_round_trip_keeps_bson_types(self):
+        oid = ObjectId()
+        state = decode_cursor(encode_cursor({"s": ["created_at", "_id"], "k": [T0, oid]}))
+        assert state["k"][0] == T0
+        assert state["k"][1] == oid
+
+    def test_garbage_cursor_is_a_400(self):
+        with pytest.raises(HTTPException) as exc:
+            decode_cursor("not-a-cursor!!")
+        assert exc.value.status_code == 400
+
+    def test_keyset_filter_breaks_ties_on_later_keys(self):
+        assert keyset_filter([("created_at", -1), ("_id", -1)], [T0, "x"]) == {"$or": [
+            {"created_at": {"$lt": T0}},
+            {"created_at": T0, "_id": {"$lt": "x"}}
+        ]}
+
+
+class TestPaginate:
+    def test_walks_every_row_once(self):
+        collection = FakeCollection(contacts(10))
+        assert walk(collection) == [f"c{i}" for i in range(10)]
+
+    def test_descending_sort_key_with_ties(self):
+        collection = FakeCollection(contacts(7, same_timestamp=True))
+        ids = walk(collection, sort=[("created_at", -1)])
+        assert sorted(ids) == sorted(f"c{i}" for i in range(7))
+        assert len(ids) == 7
+
+    def test_filter_is_kept_across_pages(self):
+        collection = FakeCollection(contacts(10))
+        assert walk(collection, {"owner": "a"}) == ["c1", "c3", "c5", "c7", "c9"]
+
+    def test_rows_inserted_mid_scroll_do_not_shift_pages(self):
+        collection = FakeCollection(contacts(6))
+
+        async def scenario():
+            first = await paginate(collection, {}, PageParams(limit=3))
+            # A row inserted before the cursor position must not push c2 onto page two
+            collection.docs.insert(0, {"_id": ObjectId("000000000000000000000001"), "id": "early"})
+            second = await paginate(collection, {}, PageParams(cursor=first.next_cursor, limit=3))
+            return [i["id"] for i in first.items], [i["id"] for i in second.items]
+
+        first, second = asyncio.run(scenario())
+        assert first == ["c0", "c1", "c2"]
+        assert second == ["c3", "c4", "c5"]
+
+    def test_last_page_has_no_cursor_and_no_ids(self):
+        collection = FakeCollection(contacts(2))
+        page = asyncio.run(paginate(collection, {}, PageParams(limit=5)))
+        assert page.next_cursor is None
+        assert all("_id" not in item for item in page.items)
+
+    def test_total_only_when_asked(self):
+        collection = FakeCollection(contacts(4))
+        assert asyncio.run(paginate(collection, {}, PageParams(limit=2))).total is None
+        assert asyncio.run(paginate(collection, {}, PageParams(limit=2, include_total=True))).total == 4
+
+    def test_cursor_from_another_sort_is_rejected(self):
+        collection = FakeCollection(contacts(4))
+        page = asyncio.run(paginate(collection, {}, PageParams(limit=2)))
+        with pytest.raises(HTTPException):
+            asyncio.run(paginate(collection, {}, PageParams(cursor=page.next_cursor, limit=2), sort=[("created_at", 1)]))
+
+
+class TestListEndpoint:
+    def test_crm_contacts_pages_through_headers(self, monkeypatch):
+        from routes import crm_routes
+
+        collection = FakeCollection(contacts(5))
+        fake_db = type("FakeDB", (), {"crm_contacts": collection})()
+        monkeypatch.setattr(crm_routes, "db", fake_db)
+
+        app = FastAPI()
+        app.include_router(crm_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User(
+            id="admin-1", email="admin@example.com", full_name="Admin", phone="555", role=UserRole.PLATFORM_ADMIN
+        )
+        client = TestClient(app)
+
+        first = client.get("/admin/crm/contacts", params={"limit": 3, "include_total": True})
+        assert [c["id"] for c in first.json()] == ["c0", "c1", "c2"]
+        assert first.headers["X-Total-Count"] == "5"
+
+        second = client.get("/admin/crm/contacts", params={"limit": 3, "cursor": first.headers["X-Next-Cursor"]})
+        assert [c["id"] for c in second.json()] == ["c3", "c4"]
+        assert "X-Next-Cursor" not in second.headers
+
+        assert client.get("/admin/crm/contacts", params={"limit": 1000}).status_code == 422
+
+    def test_bare_array_without_limit_is_the_whole_list(self, monkeypatch):
+        from routes import crm_routes
+
+        collection = FakeCollection(contacts(pagination.DEFAULT_PAGE_SIZE + 5))
+        monkeypatch.setattr(crm_routes, "db", type("FakeDB", (), {"crm_contacts": collection})())
+
+        app = FastAPI()
+        app.include_router(crm_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User(
+            id="admin-1", email="admin@example.com", full_name="Admin", phone="555", role=UserRole.PLATFORM_ADMIN
+        )
+        client = TestClient(app)
+
+        everything = client.get("/admin/crm/contacts")
+        assert len(everything.json()) == pagination.DEFAULT_PAGE_SIZE + 5
+        assert "X-Next-Cursor" not in everything.headers
+
+        # A cursor without a limit continues in default-sized pages
+        first = client.get("/admin/crm/contacts", params={"limit": 2})
+        rest = client.get("/admin/crm/contacts", params={"cursor": first.headers["X-Next-Cursor"]})
+        assert len(rest.json()) == pagination.DEFAULT_PAGE_SIZE
+        assert rest.json()[0]["id"] == "c2"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
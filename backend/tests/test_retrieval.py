@@ -0,0 +1,184 @@
+"""
+Retrieval Tests
+Tenant records are embedded once, searched from an in-memory index that catches up on writes, and only the
+departments and tenants a user may see reach the assistant's prompt
+"""
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import llm_gateway
+import retrieval
+from auth import get_current_user
+from llm_gateway import FakeProvider, LLMError, LLMGateway
+from models import User, UserRole
+from retrieval import RetrievalIndex, index_records, rebuild_index, records_context, relevant_records, user_tenants
+from conftest import FakeDB
+
+
+def booking(number, owner, **fields):
+    return {
+        "id": f"bk-{number}", "order_number": f"ORD-{number}", "requester_id": owner, "equipment_owner_id": owner,
+        "status": "in_transit_delivery", "pickup_city": "Dallas", "pickup_state": "TX", **fields
+    }
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    db = FakeDB(
+        bookings=[
+            booking(1, "fleet-1", delivery_city="Tulsa", delivery_state="OK", commodity="frozen chicken", shipper_name="Acme Foods", customer_rate=2400),
+            booking(2, "fleet-1", delivery_city="Denver", delivery_state="CO", commodity="lumber", shipper_name="Pine Co", customer_rate=1800),
+            booking(3, "fleet-2", delivery_city="Tulsa", delivery_state="OK", commodity="frozen chicken", shipper_name="Rival Freight"),
+        ],
+        accounts_receivable=[{
+            "id": "ar-1", "company_id": "fleet-1", "invoice_number": "INV-77", "customer_name": "Acme Foods",
+            "amount": 2400, "amount_paid": 0, "status": "overdue", "load_reference": "ORD-1"
+        }],
+        crm_deals=[{"id": "deal-1", "name": "Acme Foods reefer lane", "stage": "proposal", "value": 50000, "probability": 60}],
+        driver_assignments=[{"driver_user_id": "driver-1", "source": "bookings", "load_id": "bk-2", "booking_id": "bk-2"}],
+    )
+    provider = FakeProvider()
+    monkeypatch.setattr(retrieval, "db", db)
+    monkeypatch.setattr(llm_gateway, "db", db)
+    monkeypatch.setattr(retrieval, "llm", LLMGateway(providers={"fake": provider}, provider_override="fake"))
+    monkeypatch.setattr(retrieval, "retrieval", RetrievalIndex())
+    monkeypatch.setattr(retrieval, "RETRIEVAL_SYNC_INTERVAL_SECONDS", 0)
+    return db, provider
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def dispatcher(**fields):
+    return User.model_construct(id="disp-1", role=UserRole.DISPATCHER, fleet_owner_id="fleet-1", **fields)
+
+
+class TestIndexing:
+    def test_only_changed_records_are_embedded(self, fake):
+        db, provider = fake
+        assert run(rebuild_index) == 5
+        assert run(rebuild_index) == 0
+        assert len(provider.embedded) == 5
+
+        db.bookings.docs[1]["status"] = "delivered"
+        run(lambda: index_records("bookings", ["bk-2"]))
+        assert provider.embedded[-1].startswith("Load ORD-2 (delivered)")
+        assert len(provider.embedded) == 6
+
+        entry = next(e for e in db.retrieval_index.docs if e["key"] == "crm_deals:deal-1")
+        assert entry["tenant_ids"] == ["platform"] and entry["department"] == "sales"
+        assert len(np.frombuffer(entry["vector"], dtype=np.float32)) == llm_gateway.LOCAL_EMBEDDING_DIMENSIONS
+
+    def test_user_tenants(self):
+        assert user_tenants(dispatcher()) == ["fleet-1", "disp-1"]
+        admin = User.model_construct(id="admin-1", role=UserRole.PLATFORM_ADMIN, fleet_owner_id=None)
+        assert user_tenants(admin) == ["admin-1", "platform"]
+
+
+class TestSearch:
+    def test_scoped_to_tenant_and_department(self, fake):
+        run(rebuild_index)
+        hits = run(lambda: retrieval.retrieval.search("frozen chicken to Tulsa", ["disp-1", "fleet-1"], ["dispatch"]))
+        assert hits[0]["record_id"] == "bk-1"
+        assert {h["record_id"] for h in hits} <= {"bk-1", "bk-2"}
+
+        accounting = run(lambda: retrieval.retrieval.search("Acme Foods invoice", ["fleet-1"], ["accounting"]))
+        assert [h["record_id"] for h in accounting] == ["ar-1"]
+
+    def test_writes_reach_a_loaded_index_incrementally(self, fake):
+        db, _ = fake
+        run(rebuild_index)
+        index = retrieval.retrieval
+
+        async def scenario():
+            before = await index.search("hazmat drums to Memphis", ["fleet-1"], ["dispatch"])
+            db.bookings.docs.append(booking(4, "fleet-1", delivery_city="Memphis", delivery_state="TN", commodity="hazmat drums"))
+            await index_records("bookings", ["bk-4"])
+            after = await index.search("hazmat drums to Memphis", ["fleet-1"], ["dispatch"])
+            db.bookings.docs = [d for d in db.bookings.docs if d["id"] != "bk-4"]
+            await index_records("bookings", ["bk-4"])
+            deleted = await index.search("hazmat drums to Memphis", ["fleet-1"], ["dispatch"])
+            return before, after, deleted
+
+        before, after, deleted = run(scenario)
+        assert "bk-4" not in [h["record_id"] for h in before]
+        assert after[0]["record_id"] == "bk-4"
+        assert "bk-4" not in [h["record_id"] for h in deleted]
+        # One full load, then only entries updated since
+        syncs = [q for q in db.retrieval_index.queries if "tenant_ids" in q]
+        assert "updated_at" not in syncs[0] and all("updated_at" in q for q in syncs[1:])
+
+    def test_drivers_only_get_their_own_loads_without_rates(self, fake):
+        run(rebuild_index)
+        driver = User.model_construct(id="driver-1", role=UserRole.DRIVER, fleet_owner_id="fleet-1")
+        hits = run(lambda: relevant_records("Pine Co lumber load to Denver", driver, ["dispatch", "safety"]))
+        assert [h["record_id"] for h in hits] == ["bk-2"]
+        assert "Pine Co" in hits[0]["text"] and "rate" not in hits[0]["text"]
+        assert run(lambda: relevant_records("frozen chicken to Tulsa", driver, ["dispatch"])) == []
+
+        # Dispatchers still see the whole fleet, rates included
+        hits = run(lambda: relevant_records("frozen chicken to Tulsa", dispatcher(), ["dispatch"]))
+        assert hits[0]["record_id"] == "bk-1" and "rate $2,400.00" in hits[0]["text"]
+
+        unassigned = User.model_construct(id="driver-2", role=UserRole.DRIVER, fleet_owner_id="fleet-1")
+        assert run(lambda: relevant_records("frozen chicken", unassigned, ["dispatch"])) == []
+
+    def test_failed_embedding_means_no_records(self, fake):
+        _, provider = fake
+        run(rebuild_index)
+        provider.failures = [LLMError("invalid api key", status_code=500)]
+        assert run(lambda: relevant_records("frozen chicken", dispatcher(), ["dispatch"])) == []
+
+    def test_context_fits_the_budget(self):
+        hits = [{"department": "dispatch", "text": "Load ORD-%d " % i + "x" * 200} for i in range(20)]
+        text = records_context(hits, budget=200)
+        assert text.count("- [dispatch]") == 3
+        assert records_context([]) == ""
+
+
+class TestRoutes:
+    def test_chat_prompt_gets_the_records_the_role_may_see(self, fake, monkeypatch):
+        from routes import tms_chat_routes
+
+        db, _ = fake
+        run(rebuild_index)
+        chat = FakeProvider(default="ORD-1 is delivering to Tulsa")
+
+        async def no_memory(user_id, session_id, context, tenant_id=None):
+            return "", []
+
+        monkeypatch.setattr(tms_chat_routes, "llm", LLMGateway(providers={"fake": chat}, provider_override="fake"))
+        monkeypatch.setattr(tms_chat_routes, "db", db)
+        monkeypatch.setattr(tms_chat_routes, "chat_memory", no_memory)
+        monkeypatch.setattr(tms_chat_routes, "compact_memory", no_memory)
+
+        app = FastAPI()
+        app.include_router(tms_chat_routes.router)
+        user = {"current": dispatcher()}
+        app.dependency_overrides[get_current_user] = lambda: user["current"]
+        client = TestClient(app)
+
+        question = {"message": "Where is the Acme Foods chicken load?", "context": "dispatch"}
+        assert client.post("/tms-chat/message", json=question).json()["success"]
+        system = chat.calls[0].system
+        assert "RELEVANT RECORDS" in system and "Load ORD-1" in system
+        assert "INV-77" not in system and "Rival Freight" not in system and "reefer lane" not in system
+
+        records = client.get("/tms-chat/search", params={"q": "Acme Foods", "context": "dispatch"}).json()["records"]
+        assert records and all(r["department"] == "dispatch" for r in records)
+        assert client.get("/tms-chat/search", params={"q": "Acme Foods", "context": "accounting"}).status_code == 403
+
+        # The general assistant draws on every department the role has - CRM stays with platform admins
+        user["current"] = User.model_construct(id="fleet-1", role=UserRole.FLEET_OWNER, fleet_owner_id=None)
+        client.post("/tms-chat/message", json={**question, "context": "general"})
+        system = chat.calls[1].system
+        assert "INV-77" in system and "Load ORD-1" in system and "reefer lane" not in system
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,98 @@
+"""
+Serialization Tests
+orjson responses handle BSON types, and trusted reads are shaped like their response_model without re-validation
+"""
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from bson import Decimal128, ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import get_current_user
+from models import Booking, User, UserRole, RegistrationStatus
+from serialization import APIResponse, dumps, model_projection, model_view
+from conftest import FakeCollection
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def booking(i):
+    return {
+        "_id": ObjectId(),
+        "id": f"b{i}",
+        "equipment_id": "eq-1",
+        "requester_id": "user-1",
+        "equipment_owner_id": "owner-1",
+        "start_date": T0,
+        "end_date": T0,
+        "pickup_location": "Dallas, TX",
+        "delivery_location": "Houston, TX",
+        "total_cost": 100.0,
+        "created_at": T0,
+        "internal_notes": "not in the model"
+    }
+
+
+class TestDumps:
+    def test_bson_and_native_types(self):
+        oid = ObjectId()
+        payload = {"_id": oid, "at": T0, "amount": Decimal128("12.50"), "fee": Decimal("1.5"), "status": RegistrationStatus.VERIFIED}
+        assert json.loads(dumps(payload)) == {
+            "_id": str(oid), "at": "2026-01-01T00:00:00Z", "amount": 12.5, "fee": 1.5, "status": "verified"
+        }
+
+    def test_unknown_types_still_fail_loudly(self):
+        with pytest.raises(TypeError):
+            dumps({"value": object()})
+
+    def test_response_class_renders_with_orjson(self):
+        assert APIResponse({"id": ObjectId("000000000000000000000001")}).body == b'{"id":"000000000000000000000001"}'
+
+
+class TestModelView:
+    def test_drops_extra_fields_and_fills_defaults(self):
+        view = model_view(Booking, booking(1))
+        assert "_id" not in view and "internal_notes" not in view
+        assert view["status"] == "pending"
+        assert view["pickup_country"] == "USA"
+        assert view["order_number"].startswith("ORD-")
+
+    def test_matches_the_validated_model(self):
+        doc = booking(1)
+        validated = json.loads(Booking(**doc).model_dump_json())
+        view = json.loads(dumps(model_view(Booking, doc)))
+        # order_number is generated when missing, so it differs between the two
+        validated.pop("order_number"), view.pop("order_number")
+        assert view == validated
+
+    def test_projection_covers_model_fields_only(self):
+        projection = model_projection(User)
+        assert projection["_id"] == 0
+        assert set(projection) - {"_id"} == set(User.model_fields)
+
+
+class TestTrustedListEndpoint:
+    def test_my_bookings_skips_revalidation_but_keeps_paging_headers(self, monkeypatch):
+        from routes import booking_routes
+
+        collection = FakeCollection([booking(i) for i in range(3)])
+        monkeypatch.setattr(booking_routes, "db", type("FakeDB", (), {"bookings": collection})())
+        monkeypatch.setattr(Booking, "__init__", lambda *a, **k: pytest.fail("bookings were re-validated"))
+
+        app = FastAPI()
+        app.include_router(booking_routes.router)
+        app.dependency_overrides[get_current_user] = lambda: User.model_construct(id="user-1", role=UserRole.FLEET_OWNER)
+        client = TestClient(app)
+
+        response = client.get("/bookings/my", params={"limit": 2})
+        assert response.status_code == 200
+        assert [b["id"] for b in response.json()] == ["b0", "b1"]
+        assert "X-Next-Cursor" in response.headers
+        assert collection.projections[0]["total_cost"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
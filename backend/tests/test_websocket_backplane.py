@@ -0,0 +1,232 @@
+"""
+WebSocket Backplane Tests
+Broadcasts published on one worker must reach sockets connected to every other worker
+"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from backplane import InMemoryBroker, InMemoryBackplane, RedisBackplane, create_backplane
+from models import User, UserRole
+from websocket_manager import ALL_TENANTS, ConnectionManager, fleet_tenant
+from conftest import FakeWebSocket
+
+
+def make_workers(count):
+    broker = InMemoryBroker()
+    return [ConnectionManager(InMemoryBackplane(broker)) for _ in range(count)]
+
+
+class TestBackplaneFanOut:
+    """Cross-worker delivery through a shared in-memory broker"""
+
+    def test_location_update_reaches_dashboard_on_other_worker(self):
+        async def scenario():
+            worker_a, worker_b = make_workers(2)
+            await worker_a.start()
+            await worker_b.start()
+
+            dashboard = FakeWebSocket()
+            await worker_b.connect_fleet(dashboard, "fleet-1")
+
+            await worker_a.broadcast_location_update({"vehicle_id": "truck-1", "latitude": 41.8, "longitude": -87.6}, "fleet-1")
+            return dashboard.sent
+
+        sent = asyncio.run(scenario())
+        assert sent == [{"type": "location_update", "payload": {"vehicle_id": "truck-1", "latitude": 41.8, "longitude": -87.6}}]
+
+    def test_status_update_reaches_every_worker(self):
+        async def scenario():
+            workers = make_workers(3)
+            dashboards = []
+            for worker in workers:
+                await worker.start()
+                dashboard = FakeWebSocket()
+                await worker.connect_fleet(dashboard, "fleet-1")
+                dashboards.append(dashboard)
+
+            await workers[0].broadcast_status_update({"vehicle_id": "truck-1", "status": "idle"}, "fleet-1")
+            return dashboards
+
+        dashboards = asyncio.run(scenario())
+        for dashboard in dashboards:
+            assert [m["type"] for m in dashboard.sent] == ["status_update"]
+
+    def test_vehicle_channel_only_reaches_that_vehicle(self):
+        async def scenario():
+            worker_a, worker_b = make_workers(2)
+            await worker_a.start()
+            await worker_b.start()
+
+            tracker_1 = FakeWebSocket()
+            tracker_2 = FakeWebSocket()
+            await worker_b.connect_vehicle(tracker_1, "truck-1")
+            await worker_b.connect_vehicle(tracker_2, "truck-2")
+
+            await worker_a.broadcast_to_vehicle("truck-1", {"type": "ping"})
+            return tracker_1.sent, tracker_2.sent
+
+        sent_1, sent_2 = asyncio.run(scenario())
+        assert sent_1 == [{"type": "ping"}]
+        assert sent_2 == []
+
+    def test_dead_sockets_are_dropped(self):
+        async def scenario():
+            (worker,) = make_workers(1)
+            await worker.start()
+            dead = FakeWebSocket(fail=True)
+            await worker.connect_fleet(dead, "fleet-1")
+            await worker.broadcast_location_update({"vehicle_id": "truck-1"}, "fleet-1")
+            return worker
+
+        worker = asyncio.run(scenario())
+        assert worker.fleet_connections == {}
+
+    def test_connects_during_a_broadcast_do_not_abort_it(self):
+        class ConnectingWebSocket(FakeWebSocket):
+            """Another dashboard connects while this one is being sent to"""
+
+            def __init__(self, worker):
+                super().__init__()
+                self.worker = worker
+
+            async def send_text(self, message):
+                await super().send_text(message)
+                await self.worker.connect_fleet(FakeWebSocket(), "fleet-1")
+
+        async def scenario():
+            (worker,) = make_workers(1)
+            await worker.start()
+            dashboards = [ConnectingWebSocket(worker) for _ in range(3)]
+            for dashboard in dashboards:
+                await worker.connect_fleet(dashboard, "fleet-1")
+            await worker.broadcast_location_update({"vehicle_id": "truck-1"}, "fleet-1")
+            return dashboards
+
+        for dashboard in asyncio.run(scenario()):
+            assert [m["type"] for m in dashboard.sent] == ["location_update"]
+
+    def test_stopped_worker_receives_nothing(self):
+        async def scenario():
+            worker_a, worker_b = make_workers(2)
+            await worker_a.start()
+            await worker_b.start()
+            dashboard = FakeWebSocket()
+            await worker_b.connect_fleet(dashboard, "fleet-1")
+            await worker_b.stop()
+            await worker_a.broadcast_location_update({"vehicle_id": "truck-1"}, "fleet-1")
+            return dashboard.sent
+
+        assert asyncio.run(scenario()) == []
+
+
+class TestFleetTenancy:
+    """Fleet dashboards only receive their own tenant's updates"""
+
+    def test_updates_stay_with_their_fleet(self):
+        async def scenario():
+            worker_a, worker_b = make_workers(2)
+            await worker_a.start()
+            await worker_b.start()
+
+            own, rival, admin = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+            await worker_b.connect_fleet(own, "fleet-1")
+            await worker_b.connect_fleet(rival, "fleet-2")
+            await worker_b.connect_fleet(admin, ALL_TENANTS)
+
+            await worker_a.broadcast_location_update({"vehicle_id": "truck-1"}, "fleet-1")
+            await worker_a.broadcast_status_update({"vehicle_id": "truck-9", "status": "idle"}, "fleet-2")
+            return own.sent, rival.sent, admin.sent
+
+        own, rival, admin = asyncio.run(scenario())
+        assert [m["payload"]["vehicle_id"] for m in own] == ["truck-1"]
+        assert [m["payload"]["vehicle_id"] for m in rival] == ["truck-9"]
+        assert len(admin) == 2
+
+    def test_fleet_tenant(self):
+        driver = User.model_construct(id="driver-1", role=UserRole.DRIVER, fleet_owner_id="fleet-1")
+        owner = User.model_construct(id="fleet-1", role=UserRole.FLEET_OWNER, fleet_owner_id=None)
+        admin = User.model_construct(id="admin-1", role=UserRole.PLATFORM_ADMIN, fleet_owner_id=None)
+        assert fleet_tenant(driver) == fleet_tenant(owner) == "fleet-1"
+        assert fleet_tenant(admin) == ALL_TENANTS
+
+
+class TestFleetTrackingEndpoint:
+    """/ws/fleet-tracking authenticates the ?token= JWT like /ws/messages"""
+
+    def test_requires_a_valid_token(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from starlette.websockets import WebSocketDisconnect
+        import server
+
+        async def get_user(token):
+            if token == "good":
+                return User.model_construct(id="disp-1", role=UserRole.DISPATCHER, fleet_owner_id="fleet-1")
+            return None
+
+        (manager,) = make_workers(1)
+        monkeypatch.setattr(server, "get_user_from_token", get_user)
+        monkeypatch.setattr(server, "manager", manager)
+        client = TestClient(server.app)
+
+        for url in ["/api/ws/fleet-tracking", "/api/ws/fleet-tracking?token=forged"]:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                with client.websocket_connect(url) as websocket:
+                    websocket.receive_text()
+            assert closed.value.code == 1008
+
+        with client.websocket_connect("/api/ws/fleet-tracking?token=good") as websocket:
+            websocket.send_json({"type": "ping"})
+            assert websocket.receive_json() == {"type": "pong"}
+            assert set(manager.fleet_connections) == {"fleet-1"}
+
+
+class TestRedisBackplane:
+    """Cross-instance delivery through Redis pub/sub (fakeredis standing in for the server)"""
+
+    def test_location_update_reaches_dashboard_on_other_instance(self, monkeypatch):
+        import redis.asyncio as aioredis
+
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(aioredis, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs))
+
+        async def scenario():
+            instance_a = ConnectionManager(create_backplane("redis://fleet-redis:6379"))
+            instance_b = ConnectionManager(create_backplane("redis://fleet-redis:6379"))
+            assert isinstance(instance_a.backplane, RedisBackplane)
+            await instance_a.start()
+            await instance_b.start()
+            dashboard, rival = FakeWebSocket(), FakeWebSocket()
+            await instance_b.connect_fleet(dashboard, "fleet-1")
+            await instance_b.connect_fleet(rival, "fleet-2")
+
+            # Both instances hold their pattern subscription before anything is published
+            probe = fakeredis.FakeAsyncRedis(server=server)
+            while await probe.publish("fleet-ws:ready", "") < 2:
+                await asyncio.sleep(0.01)
+
+            await instance_a.broadcast_location_update({"vehicle_id": "truck-1", "latitude": 41.8, "longitude": -87.6}, "fleet-1")
+            for _ in range(100):
+                if dashboard.sent:
+                    break
+                await asyncio.sleep(0.01)
+            await instance_a.stop()
+            await instance_b.stop()
+            return dashboard.sent, rival.sent
+
+        sent, rival_sent = asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+        assert sent == [{"type": "location_update", "payload": {"vehicle_id": "truck-1", "latitude": 41.8, "longitude": -87.6}}]
+        assert rival_sent == []
+
+
+class TestCreateBackplane:
+    """Backplane selection from WEBSOCKET_BACKPLANE_URL"""
+
+    @pytest.mark.parametrize("url", [None, "", "memory://"])
+    def test_defaults_to_in_memory(self, url):
+        assert isinstance(create_backplane(url), InMemoryBackplane)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
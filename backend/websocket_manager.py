@@ -2,97 +2,357 @@
 WebSocket connection manager for real-time fleet tracking
 """
 from fastapi import WebSocket
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
+from backplane import Backplane, create_backplane
+import asyncio
 import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Backplane channels - every worker subscribes and delivers to its own sockets
+FLEET_CHANNEL_PREFIX = "fleet:"
+VEHICLE_CHANNEL_PREFIX = "vehicle:"
+USER_CHANNEL_PREFIX = "user:"
+# Events buffered per SSE stream before the oldest are dropped - a stalled client can't grow memory
+USER_STREAM_QUEUE_SIZE = 100
+
+# Coalesced fleet frames - default interval and the range a dashboard may request
+FLEET_FRAME_INTERVAL_MS = int(os.environ.get("FLEET_FRAME_INTERVAL_MS", 250))
+MIN_FRAME_INTERVAL_MS = 50
+MAX_FRAME_INTERVAL_MS = 5000
+FRAME_ENCODINGS = ["json", "msgpack"]
+
+# Tenant key for platform admin dashboards - they receive every fleet's updates
+ALL_TENANTS = "*"
+
+
+def fleet_tenant(user) -> str:
+    """Fleet whose updates a user's dashboard receives - drivers and staff see their fleet owner's"""
+    if getattr(user.role, "value", user.role) == "platform_admin":
+        return ALL_TENANTS
+    return getattr(user, "fleet_owner_id", None) or user.id
+
+
+class LocationFrameCoalescer:
+    """
+    Batches location updates for a group of dashboards sharing the same frame settings.
+    Only the latest position per vehicle is kept, and each frame is serialized once for the whole group.
+    """
+
+    def __init__(self, interval_ms: int = FLEET_FRAME_INTERVAL_MS, encoding: str = "json", delta: bool = False):
+        self.interval_ms = interval_ms
+        self.encoding = encoding
+        self.delta = delta
+        self.connections: Set[WebSocket] = set()
+        self.pending: Dict[str, dict] = {}
+        self.last_sent: Dict[str, dict] = {}
+        # Held while a frame goes out or a dashboard joins, so a joiner's baseline can't miss a delta
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, websocket: WebSocket):
+        async with self._lock:
+            # Deltas build on last_sent - only the new dashboard gets it in full, the rest of the group is left alone
+            if self.delta and self.last_sent:
+                try:
+                    await self._send_to(websocket, self.encode({"type": "location_batch", "payload": list(self.last_sent.values())}))
+                except Exception as e:
+                    logger.error(f"Error sending location snapshot: {e}")
+                    return
+            self.connections.add(websocket)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, websocket: WebSocket):
+        self.connections.discard(websocket)
+        if not self.connections and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def offer(self, location_data: dict):
+        """Queue a location update, replacing any earlier update for the same vehicle in this frame"""
+        vehicle_id = location_data.get("vehicle_id")
+        if vehicle_id is not None:
+            self.pending[vehicle_id] = location_data
+
+    def build_frame(self) -> List[dict]:
+        """
+        Drain pending updates - with delta on, only fields that changed since the last frame are kept,
+        and fields the new record no longer has are sent as null
+        """
+        pending, self.pending = self.pending, {}
+        if not self.delta:
+            return list(pending.values())
+
+        updates = []
+        for vehicle_id, payload in pending.items():
+            previous = self.last_sent.get(vehicle_id, {})
+            changed = {k: v for k, v in payload.items() if previous.get(k) != v}
+            changed.update({k: None for k in previous if k not in payload and previous[k] is not None})
+            self.last_sent[vehicle_id] = payload
+            if changed:
+                changed["vehicle_id"] = vehicle_id
+                updates.append(changed)
+        return updates
+
+    def encode(self, message: dict) -> Union[str, bytes]:
+        if self.encoding == "msgpack":
+            import msgpack
+            return msgpack.packb(message, use_bin_type=True)
+        return json.dumps(message)
+
+    async def send(self, message: dict):
+        """Encode once and send to every dashboard in the group"""
+        data = self.encode(message)
+        disconnected = set()
+        for connection in list(self.connections):
+            try:
+                await self._send_to(connection, data)
+            except Exception as e:
+                logger.error(f"Error sending coalesced frame: {e}")
+                disconnected.add(connection)
+
+        for connection in disconnected:
+            self.connections.discard(connection)
+
+    @staticmethod
+    async def _send_to(connection: WebSocket, data: Union[str, bytes]):
+        if isinstance(data, bytes):
+            await connection.send_bytes(data)
+        else:
+            await connection.send_text(data)
+
+    async def flush(self):
+        async with self._lock:
+            updates = self.build_frame()
+            if updates:
+                await self.send({"type": "location_batch", "payload": updates})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing coalesced frame: {e}")
+
 
 class ConnectionManager:
     """Manages WebSocket connections for fleet tracking"""
-    
-    def __init__(self):
-        # Fleet managers/dashboard connections
-        self.fleet_connections: Set[WebSocket] = set()
-        
+
+    def __init__(self, backplane: Optional[Backplane] = None):
+        # Fleet managers/dashboard connections by tenant
+        self.fleet_connections: Dict[str, Set[WebSocket]] = {}
+
+        # Dashboards in coalescing mode, grouped by (tenant, interval_ms, encoding, delta)
+        self.coalescers: Dict[Tuple[str, int, str, bool], LocationFrameCoalescer] = {}
+
         # Vehicle/driver connections mapped by vehicle_id
-        self.vehicle_connections: Dict[str, WebSocket] = {}
-    
-    async def connect_fleet(self, websocket: WebSocket):
-        """Connect a fleet manager/dashboard"""
+        self.vehicle_connections: Dict[str, Set[WebSocket]] = {}
+
+        # Per-user channels (load messages, read receipts) - WebSockets and SSE stream queues by user_id
+        self.user_connections: Dict[str, Set[WebSocket]] = {}
+        self.user_streams: Dict[str, Set[asyncio.Queue]] = {}
+
+        # Broadcasts are published here and delivered locally by _on_backplane_message
+        self.backplane = backplane or create_backplane()
+
+    async def start(self):
+        """Subscribe this worker to the backplane"""
+        await self.backplane.start(self._on_backplane_message)
+
+    async def stop(self):
+        """Unsubscribe this worker from the backplane"""
+        await self.backplane.stop()
+
+    async def connect_fleet(
+        self,
+        websocket: WebSocket,
+        tenant_id: str,
+        coalesce_interval_ms: Optional[int] = None,
+        encoding: str = "json",
+        delta: bool = False
+    ):
+        """
+        Connect a fleet manager/dashboard to its tenant's updates (ALL_TENANTS for platform admins) -
+        pass coalesce_interval_ms to receive batched location frames
+        """
         await websocket.accept()
-        self.fleet_connections.add(websocket)
-        logger.info(f"Fleet manager connected. Total fleet connections: {len(self.fleet_connections)}")
-    
+        if coalesce_interval_ms is None:
+            self.fleet_connections.setdefault(tenant_id, set()).add(websocket)
+        else:
+            interval_ms = max(MIN_FRAME_INTERVAL_MS, min(MAX_FRAME_INTERVAL_MS, coalesce_interval_ms))
+            if encoding not in FRAME_ENCODINGS:
+                encoding = "json"
+            key = (tenant_id, interval_ms, encoding, delta)
+            if key not in self.coalescers:
+                self.coalescers[key] = LocationFrameCoalescer(interval_ms, encoding, delta)
+            await self.coalescers[key].add(websocket)
+        logger.info(f"Fleet manager connected. Total fleet connections: {self.fleet_connection_count()}")
+
     def disconnect_fleet(self, websocket: WebSocket):
         """Disconnect a fleet manager/dashboard"""
-        self.fleet_connections.discard(websocket)
-        logger.info(f"Fleet manager disconnected. Total fleet connections: {len(self.fleet_connections)}")
-    
+        for tenant_id, connections in list(self.fleet_connections.items()):
+            connections.discard(websocket)
+            if not connections:
+                del self.fleet_connections[tenant_id]
+        for key, coalescer in list(self.coalescers.items()):
+            coalescer.remove(websocket)
+            if not coalescer.connections:
+                del self.coalescers[key]
+        logger.info(f"Fleet manager disconnected. Total fleet connections: {self.fleet_connection_count()}")
+
+    def fleet_connection_count(self) -> int:
+        return sum(len(c) for c in self.fleet_connections.values()) + sum(len(c.connections) for c in self.coalescers.values())
+
     async def connect_vehicle(self, websocket: WebSocket, vehicle_id: str):
         """Connect a vehicle/driver"""
         await websocket.accept()
-        self.vehicle_connections[vehicle_id] = websocket
+        self.vehicle_connections.setdefault(vehicle_id, set()).add(websocket)
         logger.info(f"Vehicle {vehicle_id} connected. Total vehicles: {len(self.vehicle_connections)}")
-    
+
     def disconnect_vehicle(self, websocket: WebSocket, vehicle_id: str):
         """Disconnect a vehicle/driver"""
-        if vehicle_id in self.vehicle_connections:
-            del self.vehicle_connections[vehicle_id]
+        connections = self.vehicle_connections.get(vehicle_id)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
+                del self.vehicle_connections[vehicle_id]
         logger.info(f"Vehicle {vehicle_id} disconnected. Total vehicles: {len(self.vehicle_connections)}")
-    
-    async def broadcast_location_update(self, location_data: dict):
-        """Broadcast location update to all fleet managers"""
+
+    async def connect_user(self, websocket: WebSocket, user_id: str):
+        """Connect a user's app to their personal channel"""
+        await websocket.accept()
+        self.user_connections.setdefault(user_id, set()).add(websocket)
+        logger.info(f"User {user_id} connected. Total users: {len(self.user_connections)}")
+
+    def disconnect_user(self, websocket: WebSocket, user_id: str):
+        connections = self.user_connections.get(user_id)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
+                del self.user_connections[user_id]
+        logger.info(f"User {user_id} disconnected. Total users: {len(self.user_connections)}")
+
+    def subscribe_user(self, user_id: str) -> asyncio.Queue:
+        """Queue receiving a user's channel messages - for SSE streams"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=USER_STREAM_QUEUE_SIZE)
+        self.user_streams.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe_user(self, user_id: str, queue: asyncio.Queue):
+        queues = self.user_streams.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.user_streams[user_id]
+
+    async def send_to_user(self, user_id: str, message: dict):
+        """Send a message to every app the user has connected, on every worker"""
+        await self.backplane.publish(f"{USER_CHANNEL_PREFIX}{user_id}", json.dumps(message, default=str))
+
+    async def broadcast_location_update(self, location_data: dict, tenant_id: str):
+        """Broadcast location update to the tenant's fleet managers (and platform admins) on every worker"""
         message = json.dumps({
             "type": "location_update",
             "payload": location_data
         })
-        
-        disconnected = set()
-        for connection in self.fleet_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to fleet connection: {e}")
-                disconnected.add(connection)
-        
-        # Clean up disconnected clients
-        for connection in disconnected:
-            self.fleet_connections.discard(connection)
-    
-    async def broadcast_status_update(self, status_data: dict):
-        """Broadcast status update to all fleet managers"""
+        await self.backplane.publish(f"{FLEET_CHANNEL_PREFIX}{tenant_id}", message)
+
+    async def broadcast_status_update(self, status_data: dict, tenant_id: str):
+        """Broadcast status update to the tenant's fleet managers (and platform admins) on every worker"""
         message = json.dumps({
             "type": "status_update",
             "payload": status_data
         })
-        
+        await self.backplane.publish(f"{FLEET_CHANNEL_PREFIX}{tenant_id}", message)
+
+    async def broadcast_to_vehicle(self, vehicle_id: str, message: dict):
+        """Send a message to every client tracking a vehicle, on every worker"""
+        await self.backplane.publish(f"{VEHICLE_CHANNEL_PREFIX}{vehicle_id}", json.dumps(message))
+
+    async def send_to_vehicle(self, vehicle_id: str, message: dict):
+        """Send a message to a specific vehicle"""
+        await self.broadcast_to_vehicle(vehicle_id, message)
+
+    async def _on_backplane_message(self, channel: str, message: str):
+        """Deliver a backplane message to the sockets connected to this worker"""
+        if channel.startswith(FLEET_CHANNEL_PREFIX):
+            await self._send_to_fleet(channel[len(FLEET_CHANNEL_PREFIX):], message)
+        elif channel.startswith(VEHICLE_CHANNEL_PREFIX):
+            await self._send_to_vehicle_connections(channel[len(VEHICLE_CHANNEL_PREFIX):], message)
+        elif channel.startswith(USER_CHANNEL_PREFIX):
+            await self._send_to_user_connections(channel[len(USER_CHANNEL_PREFIX):], message)
+
+    async def _send_to_fleet(self, tenant_id: str, message: str):
+        # Only the tenant's own dashboards, plus platform admins watching every fleet
+        audience = (tenant_id, ALL_TENANTS)
+        disconnected = set()
+        for key in audience:
+            for connection in list(self.fleet_connections.get(key, ())):
+                try:
+                    await connection.send_text(message)
+                except Exception as e:
+                    logger.error(f"Error broadcasting to fleet connection: {e}")
+                    disconnected.add(connection)
+
+        # Clean up disconnected clients
+        for connection in disconnected:
+            self.disconnect_fleet(connection)
+
+        coalescers = [c for key, c in self.coalescers.items() if key[0] in audience]
+        if not coalescers:
+            return
+
+        # Coalescing dashboards get locations in the next frame, everything else right away
+        data = json.loads(message)
+        for coalescer in coalescers:
+            if data.get("type") == "location_update":
+                coalescer.offer(data.get("payload") or {})
+            else:
+                await coalescer.send(data)
+
+    async def _send_to_vehicle_connections(self, vehicle_id: str, message: str):
         disconnected = set()
-        for connection in self.fleet_connections:
+        for connection in list(self.vehicle_connections.get(vehicle_id, ())):
             try:
                 await connection.send_text(message)
             except Exception as e:
-                logger.error(f"Error broadcasting status: {e}")
+                logger.error(f"Error sending to vehicle {vehicle_id}: {e}")
                 disconnected.add(connection)
-        
+
         # Clean up disconnected clients
         for connection in disconnected:
-            self.fleet_connections.discard(connection)
-    
-    async def send_to_vehicle(self, vehicle_id: str, message: dict):
-        """Send a message to a specific vehicle"""
-        if vehicle_id in self.vehicle_connections:
+            self.disconnect_vehicle(connection, vehicle_id)
+
+    async def _send_to_user_connections(self, user_id: str, message: str):
+        disconnected = set()
+        for connection in list(self.user_connections.get(user_id, ())):
             try:
-                await self.vehicle_connections[vehicle_id].send_text(json.dumps(message))
+                await connection.send_text(message)
             except Exception as e:
-                logger.error(f"Error sending to vehicle {vehicle_id}: {e}")
-                del self.vehicle_connections[vehicle_id]
-    
+                logger.error(f"Error sending to user {user_id}: {e}")
+                disconnected.add(connection)
+
+        for connection in disconnected:
+            self.disconnect_user(connection, user_id)
+
+        for queue in list(self.user_streams.get(user_id, ())):
+            if queue.full():
+                # Slow stream - drop the oldest event rather than block delivery to everyone else
+                queue.get_nowait()
+            queue.put_nowait(message)
+
     def get_connected_vehicles(self) -> List[str]:
-        """Get list of currently connected vehicle IDs"""
+        """Get list of vehicle IDs connected to this worker"""
         return list(self.vehicle_connections.keys())
-    
+
     def is_vehicle_connected(self, vehicle_id: str) -> bool:
-        """Check if a vehicle is currently connected"""
+        """Check if a vehicle is connected to this worker"""
         return vehicle_id in self.vehicle_connections
+
+
+# Shared manager for the app - set WEBSOCKET_BACKPLANE_URL=redis://... when running several workers
+manager = ConnectionManager(create_backplane(os.environ.get("WEBSOCKET_BACKPLANE_URL")))
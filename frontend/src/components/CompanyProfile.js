@@ -39,6 +39,21 @@ const CompanyProfileInner = () => {
   const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
   const isAdmin = user?.role === 'fleet_owner';
 
+  // Company documents need the bearer token, so they're fetched and opened as a blob rather than linked
+  const openDocument = async (doc) => {
+    try {
+      const url = doc.url.startsWith('/') ? `${BACKEND_URL}${doc.url}` : doc.url;
+      const response = await fetchWithAuth(url);
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      const blobUrl = URL.createObjectURL(await response.blob());
+      window.open(blobUrl, '_blank');
+      setTimeout(() => URL.revokeObjectURL(blobUrl), 60000);
+    } catch (error) {
+      console.error('Error opening document:', error);
+      toast.error('Could not open document');
+    }
+  };
+
   useEffect(() => {
     loadCompanyProfile();
     loadCompanyUsers();
@@ -1068,7 +1083,7 @@ const CompanyProfileInner = () => {
                               Uploaded: {formatDate(doc.uploaded_at)} | Size: {formatFileSize(doc.file_size)}
                             </p>
                           </div>
-                          <Button size="sm" variant="outline" onClick={() => window.open(doc.url, '_blank')}>
+                          <Button size="sm" variant="outline" onClick={() => openDocument(doc)}>
                             <i className="fas fa-download"></i>
                           </Button>
                         </div>
@@ -1117,7 +1132,7 @@ const CompanyProfileInner = () => {
                               Uploaded: {formatDate(doc.uploaded_at)} | Size: {formatFileSize(doc.file_size)}
                             </p>
                           </div>
-                          <Button size="sm" variant="outline" onClick={() => window.open(doc.url, '_blank')}>
+                          <Button size="sm" variant="outline" onClick={() => openDocument(doc)}>
                             <i className="fas fa-download"></i>
                           </Button>
                         </div>
@@ -1166,7 +1181,7 @@ const CompanyProfileInner = () => {
                               Uploaded: {formatDate(doc.uploaded_at)} | Size: {formatFileSize(doc.file_size)}
                             </p>
                           </div>
-                          <Button size="sm" variant="outline" onClick={() => window.open(doc.url, '_blank')}>
+                          <Button size="sm" variant="outline" onClick={() => openDocument(doc)}>
                             <i className="fas fa-download"></i>
                           </Button>
                         </div>
@@ -93,7 +93,10 @@ const LiveTrackingMap = () => {
     const backendUrl = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
     const wsProtocol = backendUrl.startsWith('https') ? 'wss' : 'ws';
     const wsUrl = backendUrl.replace(/^https?:\/\//, '');
-    return `${wsProtocol}://${wsUrl}/ws/fleet-tracking`;
+    // WebSockets can't send headers - the server authenticates the JWT from ?token=
+    const token = localStorage.getItem('auth_token') || '';
+    // Coalesced delta frames: one location_batch per interval, only the fields that changed
+    return `${wsProtocol}://${wsUrl}/api/ws/fleet-tracking?token=${encodeURIComponent(token)}&coalesce=true&delta=true`;
   };
 
   const wsDisabled = flags && flags.live_tracking === false;
@@ -117,6 +120,23 @@ const LiveTrackingMap = () => {
     reconnectInterval: 3000,
   });
 
+  // Merge location updates into the vehicle list - batch entries may only carry the fields that changed
+  const applyLocations = (payloads) => {
+    setVehicles(prev => {
+      const updated = [...prev];
+      payloads.forEach(payload => {
+        const { vehicle_id, ...fields } = payload;
+        const existingIndex = updated.findIndex(v => v.vehicle_id === vehicle_id);
+        if (existingIndex >= 0) {
+          updated[existingIndex] = { ...updated[existingIndex], ...fields };
+        } else {
+          updated.push({ vehicle_id, ...fields, name: `Vehicle ${vehicle_id.substring(0, 8)}` });
+        }
+      });
+      return updated;
+    });
+  };
+
   // Handle incoming WebSocket messages
   useEffect(() => {
     if (lastMessage !== null) {
@@ -125,35 +145,9 @@ const LiveTrackingMap = () => {
         console.log('Received message:', data);
 
         if (data.type === 'location_update') {
-          const payload = data.payload;
-          setVehicles(prev => {
-            const existingIndex = prev.findIndex(v => v.vehicle_id === payload.vehicle_id);
-            
-            if (existingIndex >= 0) {
-              // Update existing vehicle
-              const updated = [...prev];
-              updated[existingIndex] = {
-                ...updated[existingIndex],
-                latitude: payload.latitude,
-                longitude: payload.longitude,
-                speed: payload.speed,
-                heading: payload.heading,
-                timestamp: payload.timestamp,
-              };
-              return updated;
-            } else {
-              // Add new vehicle
-              return [...prev, {
-                vehicle_id: payload.vehicle_id,
-                latitude: payload.latitude,
-                longitude: payload.longitude,
-                speed: payload.speed,
-                heading: payload.heading,
-                timestamp: payload.timestamp,
-                name: `Vehicle ${payload.vehicle_id.substring(0, 8)}`,
-              }];
-            }
-          });
+          applyLocations([data.payload]);
+        } else if (data.type === 'location_batch') {
+          applyLocations(data.payload);
         } else if (data.type === 'fleet_status') {
           // Handle fleet status updates
           const statusVehicles = data.payload.map(v => ({